@@ -0,0 +1,201 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import grpc
+
+from ..common.compression import CompressionAlgorithm, grpc_compression, parse_compression
+from ..common.config import ConnectionSettings, keepalive_options
+from ..common.message_batch import messages_from_response
+from ..common.sharding import HashRing
+from ..common.user import Message
+from ..proto import chat_pb2, chat_pb2_grpc
+
+RESUBSCRIBE_DELAY = 1  # seconds
+# Calls that only read, so sending one again can't do anything twice. They're retried and hedged
+IDEMPOTENT_METHODS = ["GetNumberOfUnreadMessages", "GetNumberOfReadMessages", "GetReadMessages", "ListUsers",
+                      "SearchMessages", "GetConversation", "GetUnreadCounts"]
+# gRPC never sends a retry whose random wait comes to less than a millisecond, so backoffs are kept above that
+MIN_RETRY_BACKOFF = 0.01  # seconds
+
+
+def retry_options(config: ConnectionSettings) -> List[Tuple[str, Any]]:
+    """
+    gRPC channel options to retry reads that fail because the server is unavailable. gRPC waits a random time up
+    to the backoff before each retry, so clients that failed together don't all come back at once.
+    """
+    if config.retry_attempts <= 1:
+        return [("grpc.enable_retries", 0)]
+    service_config = {"methodConfig": [{
+        "name": [{"service": "chat.ChatService", "method": method} for method in IDEMPOTENT_METHODS],
+        "retryPolicy": {
+            "maxAttempts": config.retry_attempts,  # gRPC makes no more than 5
+            "initialBackoff": f"{max(config.retry_backoff, MIN_RETRY_BACKOFF)}s",
+            "maxBackoff": f"{max(config.retry_max_backoff, MIN_RETRY_BACKOFF)}s",
+            "backoffMultiplier": 2,
+            "retryableStatusCodes": ["UNAVAILABLE"],
+        },
+    }]}
+    return [("grpc.enable_retries", 1), ("grpc.service_config", json.dumps(service_config))]
+
+
+class ChatError(Exception):
+    """An error the server answered a request with, such as a wrong password."""
+
+
+class AsyncChatClient:
+    """
+    The chat service for asyncio code, with no GUI. Any number of requests can be in flight at once on the one
+    connection, so a bot or benchmark can send a batch of them with asyncio.gather and wait once for all.
+    Errors the server answers with are raised as ChatError, and failed calls as grpc.RpcError.
+
+    Every call has a deadline. Reads are retried while the server is unavailable and, with a hedge delay, sent a
+    second time if the first hasn't been answered by then, whichever answer comes first being used. Both go over
+    the one connection, since the session is the connection's: a pool of them would each need logging in.
+    """
+
+    def __init__(self, config: ConnectionSettings = ConnectionSettings()):
+        self.address = f'{config.host}:{config.port}'
+        self.compression = parse_compression(config.compression)
+        self.compression_threshold = config.compression_threshold
+        # Sessions belong to a connection, so clients in one process mustn't share theirs
+        self.channel_options = keepalive_options(config) + retry_options(config) + \
+            [("grpc.use_local_subchannel_pool", 1)]
+        self.timeout = config.rpc_timeout
+        self.timeouts = config.rpc_timeouts  # method -> timeout
+        self.hedge_delay = config.hedge_delay
+        self.stats = dict.fromkeys(["calls", "hedged", "hedges_won"], 0)
+        # When users are sharded, each user's requests go to the server that owns them
+        self.ring = HashRing(config.shards) if config.shards else None
+        self.channels: Dict[str, grpc.aio.Channel] = {}
+        self.stub: Optional[chat_pb2_grpc.ChatServiceStub] = None
+
+    async def connect(self):
+        """Open the connection. Has to be called on the loop the client is then used from."""
+        self.stub = self._stub_for(self.address)
+
+    async def close(self):
+        for channel in self.channels.values():
+            await channel.close()
+        self.channels.clear()
+
+    def _stub_for(self, address: str) -> chat_pb2_grpc.ChatServiceStub:
+        if address not in self.channels:
+            self.channels[address] = grpc.aio.insecure_channel(address, options=self.channel_options)
+        return chat_pb2_grpc.ChatServiceStub(self.channels[address])
+
+    def _stub_for_user(self, username: str) -> chat_pb2_grpc.ChatServiceStub:
+        """Stub for the server that owns a user's account."""
+        if self.ring is None:
+            return self.stub
+        return self._stub_for(self.ring.shard_for(username))
+
+    def _compression_for(self, request) -> grpc.Compression:
+        """Only compress requests that are large enough to benefit."""
+        if self.compression != CompressionAlgorithm.NONE and request.ByteSize() >= self.compression_threshold:
+            return grpc_compression(self.compression)
+        return grpc.Compression.NoCompression
+
+    async def _call(self, method: str, request, stub: Optional[chat_pb2_grpc.ChatServiceStub] = None, **kwargs):
+        """Make a unary call with its deadline, hedged if it's a read and hedging is on."""
+        call = getattr(stub or self.stub, method)
+        timeout = self.timeouts.get(method, self.timeout) or None
+        self.stats["calls"] += 1
+        if self.hedge_delay <= 0 or method not in IDEMPOTENT_METHODS:
+            return await call(request, timeout=timeout, **kwargs)
+
+        first = call(request, timeout=timeout, **kwargs)
+        attempts = {asyncio.ensure_future(first): first}
+        done, _ = await asyncio.wait(attempts, timeout=self.hedge_delay)
+        if not done:
+            self.stats["hedged"] += 1
+            second = call(request, timeout=timeout, **kwargs)
+            attempts[asyncio.ensure_future(second)] = second
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                for other in pending:
+                    attempts[other].cancel()
+                if attempts[task] is not first:
+                    self.stats["hedges_won"] += 1
+                return task.result()
+        raise error
+
+    async def create_account(self, username: str, password: str):
+        response = await self._call("CreateAccount", chat_pb2.CreateAccountRequest(username=username,
+                                                                                   password=password),
+                                    self._stub_for_user(username))
+        if response.error:
+            raise ChatError(response.error)
+
+    async def login(self, username: str, password: str):
+        stub = self._stub_for_user(username)
+        response = await self._call("Login", chat_pb2.LoginRequest(username=username, password=password), stub)
+        if response.error:
+            raise ChatError(response.error)
+        # The rest of the session happens on this user's shard
+        self.stub = stub
+
+    async def logout(self):
+        await self._call("Logout", chat_pb2.LogoutRequest())
+
+    async def delete_account(self):
+        await self._call("DeleteAccount", chat_pb2.DeleteAccountRequest())
+
+    async def list_accounts(self, pattern: str, offset: int, limit: int) -> List[str]:
+        response = await self._call("ListUsers", chat_pb2.ListUsersRequest(pattern=pattern, offset=offset,
+                                                                           limit=limit))
+        return list(response.usernames)
+
+    async def send_message(self, recipient_username: str, content: str):
+        request = chat_pb2.SendMessageRequest(receiver=recipient_username, content=content)
+        await self._call("SendMessage", request, compression=self._compression_for(request))
+
+    async def get_counts(self) -> Tuple[int, int]:
+        """The number of unread and of read messages, asked for together."""
+        unread, read = await asyncio.gather(
+            self._call("GetNumberOfUnreadMessages", chat_pb2.GetNumberOfUnreadMessagesRequest()),
+            self._call("GetNumberOfReadMessages", chat_pb2.GetNumberOfReadMessagesRequest()))
+        return unread.count, read.count
+
+    async def pop_unread_messages(self, count: int) -> List[Message]:
+        response = await self._call("PopUnreadMessages", chat_pb2.PopUnreadMessagesRequest(num_messages=count,
+                                                                                            compact=True))
+        return messages_from_response(response)
+
+    async def get_read_messages(self, offset: int, limit: int) -> List[Message]:
+        response = await self._call("GetReadMessages", chat_pb2.GetReadMessagesRequest(offset=offset,
+                                                                                        num_messages=limit,
+                                                                                        compact=True))
+        return messages_from_response(response)
+
+    async def delete_messages(self, message_ids: List[int]):
+        request = chat_pb2.DeleteMessagesRequest(message_ids=message_ids)
+        await self._call("DeleteMessages", request, compression=self._compression_for(request))
+
+    async def notifications(self) -> AsyncIterator[chat_pb2.MessageNotification]:
+        """
+        Notifications of new messages, for as long as the caller keeps asking. If the stream ends or drops, it's
+        opened again after the last message received, and the server replays what was missed.
+        """
+        last_seen_id = None
+        while True:
+            try:
+                call = self.stub.SubscribeToMessages(chat_pb2.SubscribeRequest(last_seen_id=last_seen_id))
+                async for notification in call:
+                    if notification.heartbeat:
+                        continue
+                    # Channel messages wait in the channel until read, they're never replayed
+                    if not notification.channel:
+                        last_seen_id = notification.message.id
+                    yield notification
+            except grpc.RpcError as e:
+                if e.code() != grpc.StatusCode.UNAVAILABLE:
+                    raise
+                # Dropped connection
+                await asyncio.sleep(RESUBSCRIBE_DELAY)
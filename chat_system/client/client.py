@@ -1,18 +1,28 @@
+import concurrent.futures
 import grpc
 import threading
-from typing import Any, List, Optional
+from collections import Counter
+from typing import Any, Callable, Coroutine, Hashable, List, Optional
 from ..common.config import ConnectionSettings
-from ..proto import chat_pb2, chat_pb2_grpc
+from .async_client import AsyncChatClient, ChatError
+from .event_loop import EventLoopThread
 from .gui import ChatGUI
 
 class ChatClient:
-    def __init__(self, config: ConnectionSettings = ConnectionSettings()):
-        self.host = config.host
-        self.port = config.port
-        self.channel = None
-        self.stub = None
-
-        self.gui = ChatGUI(
+    """
+    The GUI's side of the chat service. Requests run on an asyncio loop on another thread, so the GUI never
+    waits for the server, and their results are handed back to the GUI's thread to show.
+    """
+
+    def __init__(self, config: ConnectionSettings = ConnectionSettings(), gui_class=ChatGUI):
+        self.client = AsyncChatClient(config)
+        self.loop = EventLoopThread()
+        self.subscription: Optional[concurrent.futures.Future] = None
+        # Senders of messages that arrived since the last notice, shown as one notice however many there were
+        self.new_messages: Counter = Counter()
+        self.new_messages_lock = threading.Lock()
+
+        self.gui = gui_class(
             on_login=self.login,
             on_logout=self.logout,
             on_create_account=self.create_account,
@@ -27,152 +37,137 @@ class ChatClient:
     def connect(self) -> bool:
         """Connect to the server."""
         try:
-            self.channel = grpc.insecure_channel(f'{self.host}:{self.port}')
-            self.stub = chat_pb2_grpc.ChatServiceStub(self.channel)
-
-            # Start message subscription thread
-            thread = threading.Thread(target=self._receive_messages)
-            thread.daemon = True
-            thread.start()
+            self.loop.start()
+            self.loop.run(self.client.connect())
+            # Sessions belong to a connection, so with shards we subscribe on the user's shard once logged in
+            if self.client.ring is None:
+                self._start_subscription()
             return True
         except Exception as e:
             self.gui.display_message(f"Connection failed: {e}")
             return False
 
+    def _start_subscription(self):
+        """Start receiving messages, unless already doing so on this connection."""
+        if self.subscription is None or self.subscription.done():
+            self.subscription = self.loop.submit(self._receive_messages())
+
+    def _in_gui(self, key: Optional[Hashable], fn: Callable, *args):
+        """
+        Call fn on the GUI's thread, which is the only one allowed to touch its widgets. It replaces any call with
+        the same key that hasn't happened yet, a key of None is always called.
+        """
+        self.gui.updates.put(key, fn, *args)
+
+    def _request(self, coroutine: Coroutine, failure: str, on_result: Callable[[Any], None] = None,
+                 key: Optional[Hashable] = None):
+        """Start a request on the loop, and show its result with on_result once it's back, or its error."""
+        def done(future):
+            try:
+                result = future.result()
+            except concurrent.futures.CancelledError:
+                return  # The client is closing
+            except ChatError as e:
+                self._in_gui(None, self.gui.display_message, str(e))
+            except grpc.RpcError as e:
+                self._in_gui(None, self.gui.display_message, f"{failure}: {e.details()}")
+            else:
+                if on_result is not None:
+                    self._in_gui(key, on_result, result)
+        self.loop.submit(coroutine).add_done_callback(done)
+
     def start(self):
         """Start the client."""
         if self.connect():
             self.gui.start()
+            self.loop.run(self.client.close())
+            self.loop.stop()
 
     def create_account(self, username: str, password: str):
         """Send create account request."""
-        try:
-            response = self.stub.CreateAccount(
-                chat_pb2.CreateAccountRequest(username=username, password=password)
-            )
-            if response.error:
-                self.gui.display_message(response.error)
-            else:
-                self.gui.display_message("Account created successfully, please log in")
-        except grpc.RpcError as e:
-            self.gui.display_message(f"Failed to create account: {e.details()}")
+        self._request(self.client.create_account(username, password), "Failed to create account",
+                      lambda _: self.gui.display_message("Account created successfully, please log in"))
 
     def login(self, username: str, password: str):
         """Send login request."""
-        try:
-            response = self.stub.Login(
-                chat_pb2.LoginRequest(username=username, password=password)
-            )
-            if response.error:
-                self.gui.display_message(response.error)
-            else:
-                self.gui.show_main_widgets()
-                self._send_initial_requests()
-        except grpc.RpcError as e:
-            self.gui.display_message(f"Failed to login: {e.details()}")
+        def logged_in(_):
+            if self.client.ring is not None:
+                self._start_subscription()
+            self.gui.show_main_widgets()
+            self._send_initial_requests()
+        self._request(self.client.login(username, password), "Failed to login", logged_in)
 
     def _send_initial_requests(self):
-        """Send initial requests after login."""
-        try:
-            # Call asynchronously since they don't block each other
-            unread = self.stub.GetNumberOfUnreadMessages.future(
-                chat_pb2.GetNumberOfUnreadMessagesRequest()
-            )
-            read = self.stub.GetNumberOfReadMessages.future(
-                chat_pb2.GetNumberOfReadMessagesRequest()
-            )
-            self.gui.update_unread_count(unread.result().count)
-            self.gui.update_read_count(read.result().count)
+        """Refresh the message counts and the page of read messages."""
+        def show_counts(counts):
+            unread, read = counts
+            self.gui.update_unread_count(unread)
+            self.gui.update_read_count(read)
             self.gui.update_messages_view()
-        except grpc.RpcError as e:
-            self.gui.display_message(f"Failed to get message counts: {e.details()}")
+        # Only the newest counts are worth showing
+        self._request(self.client.get_counts(), "Failed to get message counts", show_counts, key="counts")
 
     def logout(self):
         """Send logout request."""
-        try:
-            self.stub.Logout(chat_pb2.LogoutRequest())
-        except grpc.RpcError as e:
-            self.gui.display_message(f"Failed to logout: {e.details()}")
+        self._request(self.client.logout(), "Failed to logout")
 
     def list_accounts(self, pattern: str, offset: int, limit: int):
         """Send list accounts request."""
-        try:
-            response = self.stub.ListUsers(
-                chat_pb2.ListUsersRequest(
-                    pattern=pattern,
-                    offset=offset,
-                    limit=limit
-                )
-            )
-            self.gui.display_users(response.usernames)
-        except grpc.RpcError as e:
-            self.gui.display_message(f"Failed to list accounts: {e.details()}")
+        self._request(self.client.list_accounts(pattern, offset, limit), "Failed to list accounts",
+                      self.gui.display_users)
 
     def send_message(self, recipient_username: str, content: str):
         """Send a message to another user."""
-        try:
-            self.stub.SendMessage(
-                chat_pb2.SendMessageRequest(
-                    receiver=recipient_username,
-                    content=content
-                )
-            )
-        except grpc.RpcError as e:
-            self.gui.display_message(f"Failed to send message: {e.details()}")
+        self._request(self.client.send_message(recipient_username, content), "Failed to send message")
 
     def pop_unread_messages(self, count: int):
         """Pop unread messages."""
-        try:
-            response = self.stub.PopUnreadMessages(
-                chat_pb2.PopUnreadMessagesRequest(num_messages=count)
-            )
-            self.gui.display_messages(response.messages)
+        def show(_):
+            # They're read now, so they're the newest in the message list
+            self.gui.show_newest()
             self._send_initial_requests()
-        except grpc.RpcError as e:
-            self.gui.display_message(f"Failed to pop messages: {e.details()}")
+        self._request(self.client.pop_unread_messages(count), "Failed to pop messages", show)
 
     def get_read_messages(self, offset: int, limit: int):
-        """Get read messages."""
-        try:
-            response = self.stub.GetReadMessages(
-                chat_pb2.GetReadMessagesRequest(
-                    offset=offset,
-                    num_messages=limit
-                )
-            )
-            self.gui.display_messages(response.messages)
-        except grpc.RpcError as e:
-            self.gui.display_message(f"Failed to get messages: {e.details()}")
+        """Get read messages for the message list."""
+        # Different chunks of the list are all needed, only the same one asked for twice is coalesced
+        self._request(self.client.get_read_messages(offset, limit), "Failed to get messages",
+                      lambda messages: self.gui.store_messages(offset, limit, messages),
+                      key=("messages", offset, limit))
 
     def delete_messages(self, message_ids: List[int]):
         """Delete messages."""
-        try:
-            self.stub.DeleteMessages(
-                chat_pb2.DeleteMessagesRequest(message_ids=message_ids)
-            )
+        def deleted(_):
+            self.gui.reload_messages()
             self._send_initial_requests()
-            self.gui.update_messages_view()
-        except grpc.RpcError as e:
-            self.gui.display_message(f"Failed to delete messages: {e.details()}")
+        self._request(self.client.delete_messages(message_ids), "Failed to delete messages", deleted)
 
     def delete_account(self):
         """Delete account."""
+        self._request(self.client.delete_account(), "Failed to delete account")
+
+    async def _receive_messages(self):
+        """Show new messages as they arrive, a frame's worth at a time."""
         try:
-            self.stub.DeleteAccount(chat_pb2.DeleteAccountRequest())
+            async for notification in self.client.notifications():
+                msg = notification.message
+                if notification.channel:
+                    self._in_gui(None, self.gui.display_message,
+                                 f"New message from {msg.sender} in {notification.channel}")
+                    continue
+                with self.new_messages_lock:
+                    self.new_messages[msg.sender] += 1
+                self._in_gui("new messages", self._show_new_messages)
         except grpc.RpcError as e:
-            self.gui.display_message(f"Failed to delete account: {e.details()}")
-
-    def _receive_messages(self):
-        """Receive messages from the server."""
-        while True:
-            try:
-                for notification in self.stub.SubscribeToMessages(chat_pb2.SubscribeRequest()):
-                    msg = notification.message
-                    self.gui.display_message(f"New message from {msg.sender}")
-                    self._send_initial_requests()
-                    self.gui.update_messages_view()
-            except grpc.RpcError as e:
-                if e.code() == grpc.StatusCode.CANCELLED:
-                    break
-                self.gui.display_message(f"Connection error: {e.details()}")
-                break
+            if e.code() != grpc.StatusCode.CANCELLED:
+                self._in_gui(None, self.gui.display_message, f"Connection error: {e.details()}")
+
+    def _show_new_messages(self):
+        with self.new_messages_lock:
+            senders, self.new_messages = self.new_messages, Counter()
+        count = sum(senders.values())
+        if count == 1:
+            self.gui.display_message(f"New message from {next(iter(senders))}")
+        else:
+            self.gui.display_message(f"{count} new messages from {', '.join(senders)}")
+        self._send_initial_requests()
@@ -0,0 +1,87 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import deque
+from typing import Any, Coroutine, Deque, Dict
+
+from ..common.stats import percentile
+
+LAG_INTERVAL = 0.05  # seconds between lag samples
+LAG_SAMPLES = 1000  # Most recent samples kept
+
+
+class LagMonitor:
+    """
+    How responsive an event loop is: a callback is asked for every interval seconds, and each sample is how much
+    later than that it ran, which is how long the loop was busy with something else. Works with asyncio and Tk.
+    """
+
+    def __init__(self, interval: float = LAG_INTERVAL, samples: int = LAG_SAMPLES):
+        self.interval = interval
+        self.samples: Deque[float] = deque(maxlen=samples)
+
+    def record(self, lag: float):
+        self.samples.append(max(0.0, lag))
+
+    def stats(self) -> Dict[str, float]:
+        """The median, 99th percentile and worst lag in milliseconds, over the samples kept."""
+        samples = sorted(self.samples)
+        return {"samples": len(samples), "p50_ms": percentile(samples, 50) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000, "max_ms": samples[-1] * 1000 if samples else 0.0}
+
+    async def watch(self):
+        """Sample the running asyncio loop until cancelled."""
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.record(time.monotonic() - start - self.interval)
+
+    def watch_tk(self, root):
+        """Sample a Tk main loop for as long as root exists."""
+        interval_ms = int(self.interval * 1000)
+        def sample(scheduled: float):
+            self.record(time.monotonic() - scheduled - interval_ms / 1000)
+            root.after(interval_ms, sample, time.monotonic())
+        root.after(interval_ms, sample, time.monotonic())
+
+
+class EventLoopThread:
+    """
+    An asyncio event loop on a thread of its own, so code that isn't async, like the GUI, can start coroutines
+    without waiting for them. The loop's own lag is sampled while it runs.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.lag = LagMonitor()
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.create_task(self.lag.watch())
+        self.loop.run_forever()
+
+    def submit(self, coroutine: Coroutine) -> concurrent.futures.Future:
+        """Start a coroutine on the loop. Its result, or exception, is set on the returned future."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine: Coroutine, timeout: float = None) -> Any:
+        """Run a coroutine on the loop and wait for its result. Not to be called from the loop itself."""
+        return self.submit(coroutine).result(timeout)
+
+    def stop(self):
+        """Cancel whatever is still running on the loop, then stop it."""
+        async def cancel_all():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if self.thread.is_alive():
+            self.run(cancel_all())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        self.loop.close()
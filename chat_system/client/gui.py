@@ -1,8 +1,11 @@
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
-from typing import Callable, List
+from typing import Callable, List, Optional
 
 from chat_system.common.user import Message
+from .event_loop import LagMonitor
+from .gui_updates import GuiUpdateQueue
+from .message_list import MailboxModel, VirtualList
 
 
 class ChatGUI:
@@ -33,16 +36,26 @@ class ChatGUI:
         self.on_pop_messages = on_pop_messages
 
         # State variables
-        self.current_page = 0
-        self.page_size = 10
-        self.total_messages = 0
-        self.selected_messages = set()
+        self.page_size = 20  # Rows of messages on screen
+        self.selected_messages = set()  # Ids of the messages selected, on screen or not
+        self.user_page = 0
+        # Only the rows on screen exist, and only the messages on and near them are fetched
+        self.mailbox = MailboxModel()
+        self.message_list: Optional[VirtualList] = None
+
+        # How long the window goes without responding, such as while a callback waits on something
+        self.lag = LagMonitor()
+        self.lag.watch_tk(self.root)
+        # Other threads change the window through this
+        self.updates = GuiUpdateQueue()
+        self.updates.pump(self.root)
 
         self.show_login_widgets()
 
     def show_login_widgets(self):
         # Clear current window
         self.root_frame.destroy()
+        self.message_list = None
         self.root_frame = ttk.Frame(self.root)
 
         self.login_frame = ttk.LabelFrame(self.root_frame, text="Login/Create Account")
@@ -85,14 +98,27 @@ class ChatGUI:
         self.message_frame = ttk.LabelFrame(self.root_frame, text="Messages")
         self.message_frame.pack(padx=10, pady=5, fill=tk.BOTH, expand=True)
 
-        # Treeview for messages
+        # Treeview for messages, with a row for each message on screen that's reused as the list is scrolled
+        self.message_view = ttk.Frame(self.message_frame)
+        self.message_view.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         columns = ("id", "sender", "content")
-        self.message_tree = ttk.Treeview(self.message_frame, columns=columns, show="headings")
+        self.message_tree = ttk.Treeview(self.message_view, columns=columns, show="headings",
+                                         height=self.page_size, selectmode="extended")
         self.message_tree.heading("id", text="ID")
         self.message_tree.heading("sender", text="From")
         self.message_tree.heading("content", text="Message")
-        self.message_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        for row in range(self.page_size):
+            self.message_tree.insert("", tk.END, iid=str(row), values=())
+        self.message_scrollbar = ttk.Scrollbar(self.message_view, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.message_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.message_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.message_tree.bind("<<TreeviewSelect>>", self._on_message_select)
+        self.message_tree.bind("<MouseWheel>", lambda event: self._scroll(-1 if event.delta > 0 else 1))
+        self.message_tree.bind("<Button-4>", lambda event: self._scroll(-1))
+        self.message_tree.bind("<Button-5>", lambda event: self._scroll(1))
+        self.mailbox = MailboxModel()
+        self.selected_messages = set()
+        self.message_list = VirtualList(self.mailbox, self.page_size, self._draw_row, self.get_read_messages)
 
         # Message controls
         self.message_controls = ttk.Frame(self.message_frame)
@@ -103,7 +129,7 @@ class ChatGUI:
 
         ttk.Button(self.message_controls, text=">", width=3,
                    command=self._handle_view_page_right).pack(side=tk.RIGHT, padx=5)
-        self.read_label = ttk.Label(self.message_controls, text=self._get_view_history_text())
+        self.read_label = ttk.Label(self.message_controls, text="")
         self.read_label.pack(side=tk.RIGHT, padx=5, pady=5)
         ttk.Button(self.message_controls, text="<", width=3,
                    command=self._handle_view_page_left).pack(side=tk.RIGHT, padx=5)
@@ -132,8 +158,12 @@ class ChatGUI:
         self.pattern_entry = ttk.Entry(self.user_frame)
         self.pattern_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
 
+        ttk.Button(self.user_frame, text=">", width=3,
+                   command=self._handle_user_page_right).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(self.user_frame, text="<", width=3,
+                   command=self._handle_user_page_left).pack(side=tk.RIGHT, padx=5)
         ttk.Button(self.user_frame, text="Search",
-                  command=self._handle_list_users).pack(side=tk.RIGHT, padx=5)
+                  command=self._handle_search_users).pack(side=tk.RIGHT, padx=5)
 
         # Account management
         self.account_frame = ttk.Frame(self.root_frame)
@@ -171,22 +201,46 @@ class ChatGUI:
             self.on_send_message(recipient, message)
             self.message_entry.delete(0, tk.END)
 
+    def _handle_search_users(self):
+        self.user_page = 0
+        self._handle_list_users()
+
+    def _handle_user_page_left(self):
+        self.user_page = max(0, self.user_page - 1)
+        self._handle_list_users()
+
+    def _handle_user_page_right(self):
+        self.user_page += 1
+        self._handle_list_users()
+
     def _handle_list_users(self):
         pattern = self.pattern_entry.get() or "*"
-        self.on_list_accounts(pattern, self.current_page * self.page_size, self.page_size)
+        self.on_list_accounts(pattern, self.user_page * self.page_size, self.page_size)
 
     def _handle_delete_messages(self):
         if self.selected_messages:
             self.on_delete_messages(list(self.selected_messages))
             self.selected_messages.clear()
+            self._show_selection()
 
     def _handle_view_page_left(self):
-        self.current_page = max(0, self.current_page - 1)
-        self.update_messages_view()
+        self._scroll(-self.page_size)
 
     def _handle_view_page_right(self):
-        self.current_page = min(self.total_messages // self.page_size, self.current_page + 1)
-        self.update_messages_view()
+        self._scroll(self.page_size)
+
+    def _scroll(self, rows: int):
+        """Scroll the message list down towards older messages, or up with a negative number of rows."""
+        if self.message_list is not None:
+            self.message_list.scroll(rows)
+            self._show_position()
+
+    def _on_scrollbar(self, action: str, amount: str, unit: str = "units"):
+        if action == "moveto":
+            self.message_list.scroll_to(int(float(amount) * self.mailbox.total))
+            self._show_position()
+        else:
+            self._scroll(int(amount) * (self.page_size if unit == "pages" else 1))
 
     def _handle_delete_account(self):
         if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete your account?"):
@@ -201,14 +255,30 @@ class ChatGUI:
             messagebox.showerror("Error", "Please enter a valid number")
 
     def _on_message_select(self, event):
-        selection = self.message_tree.selection()
-        self.selected_messages = {int(self.message_tree.item(item)["values"][0]) for item in selection}
-
-    def _get_view_history_text(self):
-        start = self.current_page * self.page_size
-        end = min(self.total_messages, start + self.page_size)
-        print(f"Viewing {start} - {end} of {self.total_messages}")
-        return f"Viewing {start} - {end} of {self.total_messages}"
+        rows = [int(row) for row in self.message_tree.selection()]
+        self.selected_messages = self.message_list.select(self.selected_messages, rows)
+
+    def _show_selection(self):
+        """Select the rows showing the selected messages, which change as the rows are reused."""
+        shown = self.message_list.ids_shown()
+        self.message_tree.selection_set([str(shown[message_id]) for message_id in self.selected_messages if message_id in shown])
+
+    def _draw_row(self, row: int, values: tuple):
+        self.message_tree.item(str(row), values=values)
+
+    def _show_position(self):
+        """Move the scrollbar, label and selection to where the list is."""
+        total = self.mailbox.total
+        start = self.message_list.first
+        end = min(total, start + self.page_size)
+        self.message_scrollbar.set(start / total if total else 0.0, end / total if total else 1.0)
+        self.read_label.config(text=f"Viewing {start} - {end} of {total}")
+        self._show_selection()
+
+    def _refresh_messages(self):
+        if self.message_list is not None:
+            self.message_list.render()
+            self._show_position()
 
     def display_message(self, message: str):
         """Display a system message."""
@@ -219,26 +289,34 @@ class ChatGUI:
         self.unread_label.config(text=f"Unread messages: {count}")
 
     def update_read_count(self, count: int):
-        """Update the unread message count display."""
-        self.total_messages = count
-        self.read_label.config(text=self._get_view_history_text())
+        """Update the read message count, which the message list is scrolled through."""
+        self.mailbox.resize(count)
+        self._refresh_messages()
 
     def update_messages_view(self):
-        self.read_label.config(text=self._get_view_history_text())
-        self.get_read_messages(self.current_page * self.page_size, self.page_size)
+        """Show the messages on screen, fetching any that are missing."""
+        self._refresh_messages()
+
+    def reload_messages(self):
+        """Fetch the messages shown again, after some were deleted."""
+        self.mailbox.clear()
+        self._refresh_messages()
+
+    def show_newest(self):
+        """Scroll the message list to the top, where the newest messages are."""
+        if self.message_list is not None:
+            self.message_list.scroll_to(0)
+            self._show_position()
 
-    def display_messages(self, messages: List[Message]):
-        """Display messages in the message tree."""
-        self.message_tree.delete(*self.message_tree.get_children())
-        # Sort messages by decreasing id
-        messages.sort(key=lambda x: x.id, reverse=True)
-        for msg in messages:
-            self.message_tree.insert("", tk.END, values=(msg.id, msg.sender, msg.content))
+    def store_messages(self, offset: int, limit: int, messages: List[Message]):
+        """Take in messages fetched for the message list, and show them if they're on screen."""
+        if self.mailbox.store(offset, limit, messages):
+            self._refresh_messages()
 
     def display_users(self, users: List[str]):
         """Display the list of users in a popup window."""
         dialog = tk.Toplevel(self.root)
-        dialog.title("User List")
+        dialog.title(f"User List, page {self.user_page + 1}")
 
         tree = ttk.Treeview(dialog, columns="name", show="headings")
         tree.heading("name", text="Username")
@@ -0,0 +1,41 @@
+import threading
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+FRAME_MS = 16  # How often queued updates are applied, about 60 times a second
+
+
+class GuiUpdateQueue:
+    """
+    Changes to make to the GUI, from any thread. Tk may only be used from its own thread, so other threads queue
+    updates here, and the GUI's thread applies them once a frame. An update with a key replaces any update with
+    the same key that's still waiting, so a burst of new counts or pages only ends up drawing the last one.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending: Dict[Hashable, Tuple[Callable, tuple]] = {}  # In the order first queued
+        self.stats = dict.fromkeys(["queued", "applied", "frames"], 0)
+
+    def put(self, key: Optional[Hashable], fn: Callable, *args):
+        """Queue fn(*args). With a key of None, it's applied whatever else is queued."""
+        with self.lock:
+            self.stats["queued"] += 1
+            self.pending[object() if key is None else key] = (fn, args)
+
+    def drain(self):
+        """Apply what's queued. Only to be called on the GUI's thread."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        self.stats["frames"] += 1
+        for fn, args in pending.values():
+            self.stats["applied"] += 1
+            fn(*args)
+
+    def pump(self, root, frame_ms: int = FRAME_MS):
+        """Drain the queue every frame for as long as root exists."""
+        def frame():
+            if self.pending:
+                self.drain()
+            root.after(frame_ms, frame)
+        root.after(frame_ms, frame)
+
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from ..common.user import Message
+
+CHUNK_SIZE = 200  # Messages fetched at a time
+MAX_CHUNKS = 50  # Chunks kept, the ones used least recently are dropped
+LOADING = ("", "", "Loading...")
+
+
+class MailboxModel:
+    """
+    The client's copy of the read mailbox, fetched a chunk at a time as it's scrolled to. Positions count from the
+    oldest message, so messages that arrive don't move the ones already fetched. Only the chunks used most recently
+    are kept, so memory doesn't grow with the mailbox.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE, max_chunks: int = MAX_CHUNKS):
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.total = 0
+        self.chunks: OrderedDict = OrderedDict()  # chunk number -> messages, least recently used first
+        self.pending: Dict[Tuple[int, int], int] = {}  # (offset, limit) asked for -> chunk number
+
+    def resize(self, total: int):
+        """Take in a new count of read messages."""
+        if total == self.total:
+            return
+        if total < self.total:
+            # Messages were deleted, which moves the ones after them
+            self.chunks.clear()
+        else:
+            # The last chunk may have been partly filled
+            self.chunks.pop((self.total - 1) // self.chunk_size, None)
+        self.total = total
+        # Asked for by their distance from the newest, which has just changed
+        self.pending.clear()
+
+    def clear(self):
+        self.chunks.clear()
+        self.pending.clear()
+
+    def get(self, position: int) -> Optional[Message]:
+        """The message at a position from the oldest, if it's been fetched."""
+        chunk = position // self.chunk_size
+        messages = self.chunks.get(chunk)
+        if messages is None:
+            return None
+        self.chunks.move_to_end(chunk)
+        return messages[position - chunk * self.chunk_size]
+
+    def _request_for(self, chunk: int) -> Tuple[int, int]:
+        """The offset from the newest and the number of messages to ask the server for to get a chunk."""
+        end = min(self.total, (chunk + 1) * self.chunk_size)
+        return self.total - end, end - chunk * self.chunk_size
+
+    def missing(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """The requests to make for the messages from position start up to end that aren't here or asked for yet."""
+        requests = []
+        asked = set(self.pending.values())
+        for chunk in range(max(0, start) // self.chunk_size, (min(end, self.total) - 1) // self.chunk_size + 1):
+            if chunk not in self.chunks and chunk not in asked:
+                request = self._request_for(chunk)
+                self.pending[request] = chunk
+                requests.append(request)
+        return requests
+
+    def store(self, offset: int, limit: int, messages: List[Message]) -> bool:
+        """Take in the answer to a request. Returns False if it's out of date, since the count changed."""
+        chunk = self.pending.pop((offset, limit), None)
+        if chunk is None or len(messages) != limit:
+            return False
+        self.chunks[chunk] = messages
+        while len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+        return True
+
+
+class VirtualList:
+    """
+    The rows of a mailbox that are on screen, newest at the top. There are only ever as many rows as fit, whatever
+    the size of the mailbox, and scrolling changes what they show instead of making new ones. draw(row, values) is
+    only called for a row whose values changed, and fetch(offset, limit) for messages that are needed and missing,
+    including a screenful either side so they're there before they're scrolled to.
+    """
+
+    def __init__(self, model: MailboxModel, rows: int, draw: Callable[[int, tuple], None],
+                 fetch: Callable[[int, int], None]):
+        self.model = model
+        self.rows = rows
+        self.draw = draw
+        self.fetch = fetch
+        self.first = 0  # Messages from the newest to the top row
+        self.shown: List[Optional[tuple]] = [None] * rows
+        self.stats = dict.fromkeys(["renders", "rows_drawn"], 0)
+
+    def position(self, row: int) -> int:
+        """The position from the oldest of the message a row shows."""
+        return self.model.total - 1 - (self.first + row)
+
+    def message_at(self, row: int) -> Optional[Message]:
+        position = self.position(row)
+        return self.model.get(position) if 0 <= position < self.model.total else None
+
+    def ids_shown(self) -> Dict[int, int]:
+        """The rows showing fetched messages, by the message's id."""
+        messages = ((row, self.message_at(row)) for row in range(self.rows))
+        return {message.id: row for row, message in messages if message is not None}
+
+    def select(self, selected: Set[int], rows: List[int]) -> Set[int]:
+        """
+        The ids selected once the rows on screen are set to the given ones. Messages selected that aren't on screen
+        stay selected, since the rows are reused as the list scrolls and their selection doesn't follow the messages.
+        """
+        shown = self.ids_shown()
+        chosen = {message.id for message in map(self.message_at, rows) if message is not None}
+        return (selected - shown.keys()) | chosen
+
+    def scroll_to(self, first: int):
+        self.first = max(0, min(first, self.model.total - self.rows))
+        self.render()
+
+    def scroll(self, rows: int):
+        self.scroll_to(self.first + rows)
+
+    def render(self):
+        """Bring the rows up to date, and fetch what's needed near them."""
+        self.first = max(0, min(self.first, self.model.total - self.rows))
+        self.stats["renders"] += 1
+        for row in range(self.rows):
+            position = self.position(row)
+            if position < 0:
+                values = ()
+            else:
+                message = self.model.get(position)
+                values = LOADING if message is None else (message.id, message.sender, message.content)
+            if values != self.shown[row]:
+                self.shown[row] = values
+                self.stats["rows_drawn"] += 1
+                self.draw(row, values)
+        top = self.position(0)
+        for offset, limit in self.model.missing(top - 2 * self.rows + 1, top + self.rows + 1):
+            self.fetch(offset, limit)
@@ -0,0 +1,51 @@
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from .user import Message, _page
+
+
+@dataclass
+class ChannelMessage:
+    """A message posted to a channel, as queued for a member's subscriber. Every member gets the same one."""
+    channel: str
+    message: Message
+
+
+@dataclass
+class Channel:
+    """
+    A group chat. Each message is stored once, in the channel, and each member has a read cursor: how many of the
+    channel's messages they've read. Messages are only appended, so readers don't need a lock.
+    """
+    name: str
+    owner: str
+    messages: List[Message] = field(default_factory=list)
+    members: Dict[str, int] = field(default_factory=dict)  # username -> read cursor
+
+    def add_member(self, username: str):
+        """New members start with nothing unread, but can page back through the history."""
+        self.members.setdefault(username, len(self.messages))
+
+    def remove_member(self, username: str):
+        self.members.pop(username, None)
+
+    def add_message(self, message: Message):
+        self.messages.append(message)
+
+    def get_number_of_unread_messages(self, username: str) -> int:
+        return len(self.messages) - self.members[username]
+
+    def read_messages(self, username: str, num_messages: int) -> List[Message]:
+        """The oldest num_messages unread messages of a member, or all if it's < 0, moving their cursor past them."""
+        cursor = self.members[username]
+        end = len(self.messages) if num_messages < 0 else min(len(self.messages), cursor + num_messages)
+        self.members[username] = end
+        return self.messages[cursor:end]
+
+    def set_cursor(self, username: str, cursor: int):
+        if username in self.members:
+            self.members[username] = min(cursor, len(self.messages))
+
+    def get_messages(self, offset: int, num_messages: int) -> List[Message]:
+        """Messages paged from the newest, like a user's read mailbox."""
+        return _page(self.messages, offset, num_messages)
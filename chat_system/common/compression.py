@@ -0,0 +1,47 @@
+import gzip
+import zlib
+from enum import IntEnum
+
+import grpc
+
+
+class CompressionAlgorithm(IntEnum):
+    # Values are used as the flag in custom protocol frames, so don't renumber
+    NONE = 0
+    DEFLATE = 1
+    GZIP = 2
+
+
+def parse_compression(name: str) -> CompressionAlgorithm:
+    """Parse the compression setting from the config file."""
+    try:
+        return CompressionAlgorithm[name.upper()]
+    except KeyError as e:
+        raise ValueError(f"Unknown compression algorithm: {name}") from e
+
+
+def compress(data: bytes, algorithm: CompressionAlgorithm) -> bytes:
+    """Compress data with the given algorithm."""
+    if algorithm == CompressionAlgorithm.DEFLATE:
+        return zlib.compress(data)
+    if algorithm == CompressionAlgorithm.GZIP:
+        return gzip.compress(data, compresslevel=6)  # Same default level as zlib
+    return data
+
+
+def decompress(data: bytes, algorithm: CompressionAlgorithm) -> bytes:
+    """Decompress data that was compressed with the given algorithm."""
+    if algorithm == CompressionAlgorithm.DEFLATE:
+        return zlib.decompress(data)
+    if algorithm == CompressionAlgorithm.GZIP:
+        return gzip.decompress(data)
+    return data
+
+
+def grpc_compression(algorithm: CompressionAlgorithm) -> grpc.Compression:
+    """Map to the equivalent gRPC compression option."""
+    return {
+        CompressionAlgorithm.NONE: grpc.Compression.NoCompression,
+        CompressionAlgorithm.DEFLATE: grpc.Compression.Deflate,
+        CompressionAlgorithm.GZIP: grpc.Compression.Gzip,
+    }[algorithm]
@@ -1,10 +1,43 @@
 import json
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
 
 DEFAULT_HOST = 'localhost'
 DEFAULT_PORT = 8888
 DEFAULT_USE_CUSTOM_PROTOCOL = True
-DEFAULT_SERVER_DATA_PATH = 'server_data.json'
+DEFAULT_SERVER_DATA_PATH = 'server_data.snapshot'
+DEFAULT_COMPRESSION = 'none'
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+DEFAULT_MAX_UNREAD_MESSAGES = 0
+DEFAULT_MAX_READ_MESSAGES = 0
+DEFAULT_MAX_SUBSCRIBER_QUEUE = 0
+DEFAULT_OVERFLOW_POLICY = 'reject'
+DEFAULT_SPILL_DIR = 'spill'
+DEFAULT_HOT_READ_MESSAGES = 0
+DEFAULT_SEGMENT_DIR = 'segments'
+DEFAULT_RATE_LIMIT = 0
+DEFAULT_RATE_LIMIT_BURST = 20
+DEFAULT_SHARD_ID = 0
+DEFAULT_WORKERS = 0
+DEFAULT_REPLICATION_LOG_SIZE = 0
+DEFAULT_REPLICA_OF = ''
+DEFAULT_CLUSTER_SECRET = ''
+DEFAULT_KEEPALIVE_TIME = 30.0
+DEFAULT_KEEPALIVE_TIMEOUT = 10.0
+DEFAULT_HEARTBEAT_INTERVAL = 15.0
+DEFAULT_SESSION_TIMEOUT = 0.0
+DEFAULT_SEARCH_INDEX = 'scan'
+DEFAULT_FANOUT_BATCH_SIZE = 256
+DEFAULT_CHECKPOINT_INTERVAL = 0.0
+DEFAULT_SHUTDOWN_GRACE = 5.0
+DEFAULT_RETENTION_MAX_AGE = 0.0
+DEFAULT_RETENTION_MAX_MESSAGES = 0
+DEFAULT_COMPACTION_INTERVAL = 60.0
+DEFAULT_RPC_TIMEOUT = 10.0
+DEFAULT_RETRY_ATTEMPTS = 3
+DEFAULT_RETRY_BACKOFF = 0.1
+DEFAULT_RETRY_MAX_BACKOFF = 1.0
+DEFAULT_HEDGE_DELAY = 0.0
 
 @dataclass
 class ConnectionSettings:
@@ -12,6 +45,48 @@ class ConnectionSettings:
     port: int = DEFAULT_PORT
     use_custom_protocol: bool = DEFAULT_USE_CUSTOM_PROTOCOL
     server_data_path: str = DEFAULT_SERVER_DATA_PATH
+    compression: str = DEFAULT_COMPRESSION  # 'none', 'gzip' or 'deflate'
+    compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD  # bytes
+    # Per-user mailbox limits, 0 means unbounded
+    max_unread_messages: int = DEFAULT_MAX_UNREAD_MESSAGES
+    max_read_messages: int = DEFAULT_MAX_READ_MESSAGES
+    max_subscriber_queue: int = DEFAULT_MAX_SUBSCRIBER_QUEUE
+    overflow_policy: str = DEFAULT_OVERFLOW_POLICY  # 'reject', 'drop_oldest' or 'spill'
+    spill_dir: str = DEFAULT_SPILL_DIR
+    hot_read_messages: int = DEFAULT_HOT_READ_MESSAGES  # Per user, older read messages go to segment files
+    segment_dir: str = DEFAULT_SEGMENT_DIR
+    # Calls per second allowed per user for each method, 0 turns rate limiting off
+    rate_limit: float = DEFAULT_RATE_LIMIT
+    rate_limit_burst: int = DEFAULT_RATE_LIMIT_BURST
+    rate_limit_methods: Dict[str, List[float]] = field(default_factory=dict)  # method -> [rate, burst]
+    # Addresses of every server when users are sharded across several, empty for a single server
+    shards: List[str] = field(default_factory=list)
+    shard_id: int = DEFAULT_SHARD_ID  # Index of this server in shards
+    workers: int = DEFAULT_WORKERS  # Server processes sharing the port, 0 for a single process
+    replication_log_size: int = DEFAULT_REPLICATION_LOG_SIZE  # Mutations kept for replicas, 0 disables replication
+    replica_of: str = DEFAULT_REPLICA_OF  # Address of the primary to follow, empty unless this is a replica
+    cluster_secret: str = DEFAULT_CLUSTER_SECRET  # Shared by a deployment's servers, who send it in their calls
+    # Liveness of connections and sessions, all in seconds, 0 turns each off
+    keepalive_time: float = DEFAULT_KEEPALIVE_TIME  # Between HTTP/2 pings on a connection
+    keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT  # For a ping to be answered before the connection is closed
+    heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL  # Between heartbeats on an idle subscription
+    session_timeout: float = DEFAULT_SESSION_TIMEOUT  # Before a session with no calls or subscription is logged out
+    search_index: str = DEFAULT_SEARCH_INDEX  # 'scan', 'inverted', or 'none' to turn message search off
+    fanout_batch_size: int = DEFAULT_FANOUT_BATCH_SIZE  # Channel members notified at a time
+    checkpoint_interval: float = DEFAULT_CHECKPOINT_INTERVAL  # Seconds between saves, 0 only saves on shutdown
+    shutdown_grace: float = DEFAULT_SHUTDOWN_GRACE  # Seconds calls in flight get to finish on shutdown
+    # Read and sent messages kept per user, 0 keeps them all. Unread messages are always kept
+    retention_max_age: float = DEFAULT_RETENTION_MAX_AGE  # Seconds
+    retention_max_messages: int = DEFAULT_RETENTION_MAX_MESSAGES
+    retention_overrides: Dict[str, List[float]] = field(default_factory=dict)  # username -> [max_age, max_messages]
+    compaction_interval: float = DEFAULT_COMPACTION_INTERVAL  # Seconds between retention and compaction passes
+    # Client calls, all times in seconds
+    rpc_timeout: float = DEFAULT_RPC_TIMEOUT  # For a call to be answered, 0 waits as long as it takes
+    rpc_timeouts: Dict[str, float] = field(default_factory=dict)  # method -> timeout, in place of rpc_timeout
+    retry_attempts: int = DEFAULT_RETRY_ATTEMPTS  # Tries of a read while the server's unavailable, 1 never retries
+    retry_backoff: float = DEFAULT_RETRY_BACKOFF  # Most a first retry waits, doubling after each up to the max
+    retry_max_backoff: float = DEFAULT_RETRY_MAX_BACKOFF
+    hedge_delay: float = DEFAULT_HEDGE_DELAY  # Before a read that hasn't been answered is sent again, 0 never
 
 def load_config(config_path: str = "config.json") -> ConnectionSettings:
     """Load connection settings from config file."""
@@ -23,8 +98,58 @@ def load_config(config_path: str = "config.json") -> ConnectionSettings:
                 host=d.get("host", DEFAULT_HOST),
                 port=d.get("port", DEFAULT_PORT),
                 use_custom_protocol=d.get("use_custom_protocol", DEFAULT_USE_CUSTOM_PROTOCOL),
-                server_data_path=d.get("server_data_path", DEFAULT_SERVER_DATA_PATH)
+                server_data_path=d.get("server_data_path", DEFAULT_SERVER_DATA_PATH),
+                compression=d.get("compression", DEFAULT_COMPRESSION),
+                compression_threshold=d.get("compression_threshold", DEFAULT_COMPRESSION_THRESHOLD),
+                max_unread_messages=d.get("max_unread_messages", DEFAULT_MAX_UNREAD_MESSAGES),
+                max_read_messages=d.get("max_read_messages", DEFAULT_MAX_READ_MESSAGES),
+                max_subscriber_queue=d.get("max_subscriber_queue", DEFAULT_MAX_SUBSCRIBER_QUEUE),
+                overflow_policy=d.get("overflow_policy", DEFAULT_OVERFLOW_POLICY),
+                spill_dir=d.get("spill_dir", DEFAULT_SPILL_DIR),
+                hot_read_messages=d.get("hot_read_messages", DEFAULT_HOT_READ_MESSAGES),
+                segment_dir=d.get("segment_dir", DEFAULT_SEGMENT_DIR),
+                rate_limit=d.get("rate_limit", DEFAULT_RATE_LIMIT),
+                rate_limit_burst=d.get("rate_limit_burst", DEFAULT_RATE_LIMIT_BURST),
+                rate_limit_methods=d.get("rate_limit_methods", {}),
+                shards=d.get("shards", []),
+                shard_id=d.get("shard_id", DEFAULT_SHARD_ID),
+                workers=d.get("workers", DEFAULT_WORKERS),
+                replication_log_size=d.get("replication_log_size", DEFAULT_REPLICATION_LOG_SIZE),
+                replica_of=d.get("replica_of", DEFAULT_REPLICA_OF),
+                cluster_secret=d.get("cluster_secret", DEFAULT_CLUSTER_SECRET),
+                keepalive_time=d.get("keepalive_time", DEFAULT_KEEPALIVE_TIME),
+                keepalive_timeout=d.get("keepalive_timeout", DEFAULT_KEEPALIVE_TIMEOUT),
+                heartbeat_interval=d.get("heartbeat_interval", DEFAULT_HEARTBEAT_INTERVAL),
+                session_timeout=d.get("session_timeout", DEFAULT_SESSION_TIMEOUT),
+                search_index=d.get("search_index", DEFAULT_SEARCH_INDEX),
+                fanout_batch_size=d.get("fanout_batch_size", DEFAULT_FANOUT_BATCH_SIZE),
+                checkpoint_interval=d.get("checkpoint_interval", DEFAULT_CHECKPOINT_INTERVAL),
+                shutdown_grace=d.get("shutdown_grace", DEFAULT_SHUTDOWN_GRACE),
+                retention_max_age=d.get("retention_max_age", DEFAULT_RETENTION_MAX_AGE),
+                retention_max_messages=d.get("retention_max_messages", DEFAULT_RETENTION_MAX_MESSAGES),
+                retention_overrides=d.get("retention_overrides", {}),
+                compaction_interval=d.get("compaction_interval", DEFAULT_COMPACTION_INTERVAL),
+                rpc_timeout=d.get("rpc_timeout", DEFAULT_RPC_TIMEOUT),
+                rpc_timeouts=d.get("rpc_timeouts", {}),
+                retry_attempts=d.get("retry_attempts", DEFAULT_RETRY_ATTEMPTS),
+                retry_backoff=d.get("retry_backoff", DEFAULT_RETRY_BACKOFF),
+                retry_max_backoff=d.get("retry_max_backoff", DEFAULT_RETRY_MAX_BACKOFF),
+                hedge_delay=d.get("hedge_delay", DEFAULT_HEDGE_DELAY)
             )
     except FileNotFoundError:
         print("Config file not found, using default settings")
         return ConnectionSettings()
+
+def keepalive_options(config: ConnectionSettings) -> List[Tuple[str, Any]]:
+    """gRPC channel and server options for pinging idle connections, so that dead peers are noticed."""
+    if config.keepalive_time <= 0:
+        return []
+    keepalive_ms = int(config.keepalive_time * 1000)
+    return [
+        ("grpc.keepalive_time_ms", keepalive_ms),
+        ("grpc.keepalive_timeout_ms", int(config.keepalive_timeout * 1000)),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+        # The server end has to accept pings this often, or it hangs up on clients for pinging too much
+        ("grpc.http2.min_ping_interval_without_data_ms", keepalive_ms),
+    ]
@@ -0,0 +1,63 @@
+from typing import Dict, List
+
+from .segment import ColdMessage
+from .user import Message
+from ..proto import chat_pb2
+
+
+def add_messages(field, messages: List[Message]):
+    """
+    Append messages to a repeated Message field. Messages in segment files are read straight from the mapping,
+    and their UTF-8 goes into the protobuf message as it is, without being decoded to str and encoded again.
+    """
+    add = field.add
+    for m in messages:
+        if type(m) is ColdMessage:
+            message_id, sender, content = m.read_raw()
+            add(id=message_id, sender=sender, content=content)
+        else:
+            add(id=m.id, sender=m.sender, content=m.content)
+
+
+def pack_message_batch(messages: List[Message]) -> chat_pb2.MessageBatch:
+    """Encode messages with a sender table and delta-encoded ids."""
+    sender_index: Dict[str, int] = {}
+    sender_indices = []
+    id_deltas = []
+    contents = []
+    previous_id = 0
+    for m in messages:
+        if type(m) is ColdMessage:
+            message_id, sender, content = m.read_raw()
+            # Senders are looked up in the table as str, whichever tier the message is in
+            sender = sender.decode('utf-8')
+        else:
+            message_id, sender, content = m.id, m.sender, m.content
+        sender_indices.append(sender_index.setdefault(sender, len(sender_index)))
+        id_deltas.append(message_id - previous_id)
+        contents.append(content)
+        previous_id = message_id
+    return chat_pb2.MessageBatch(
+        senders=list(sender_index),
+        sender_indices=sender_indices,
+        id_deltas=id_deltas,
+        contents=contents
+    )
+
+
+def unpack_message_batch(batch: chat_pb2.MessageBatch) -> List[Message]:
+    """Decode a MessageBatch back into messages."""
+    senders = batch.senders
+    messages = []
+    msg_id = 0
+    for index, delta, content in zip(batch.sender_indices, batch.id_deltas, batch.contents):
+        msg_id += delta
+        messages.append(Message(msg_id, senders[index], content))
+    return messages
+
+
+def messages_from_response(response) -> List[Message]:
+    """Get the messages from a response that carries them, whichever encoding it uses."""
+    if response.HasField('batch'):
+        return unpack_message_batch(response.batch)
+    return [Message(m.id, m.sender, m.content) for m in response.messages]
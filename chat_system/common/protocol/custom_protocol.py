@@ -1,6 +1,8 @@
 import struct
 from typing import Optional, Tuple, Self
 from .protocol import *
+from ..compression import CompressionAlgorithm, compress, decompress
+from ..config import DEFAULT_COMPRESSION_THRESHOLD
 from ..user import Message, User
 
 def encode_str(s: str) -> bytes:
@@ -23,6 +25,15 @@ def decode_int(data: bytes, offset: int = 0) -> Tuple[int, int]:
     i = struct.unpack('!L', data[offset:offset+4])[0]
     return i, offset + 4
 
+def encode_sint(i: int) -> bytes:
+    """Encode a signed integer into bytes."""
+    return struct.pack('!l', i)
+
+def decode_sint(data: bytes, offset: int = 0) -> Tuple[int, int]:
+    """Decode a signed integer from bytes."""
+    i = struct.unpack('!l', data[offset:offset+4])[0]
+    return i, offset + 4
+
 def encode_bool(b: bool) -> bytes:
     """Encode a boolean into bytes."""
     return struct.pack('!B', 1 if b else 0)
@@ -32,76 +43,151 @@ def decode_bool(data: bytes, offset: int = 0) -> Tuple[bool, int]:
     b = struct.unpack('!B', data[offset:offset+1])[0]
     return b == 1, offset + 1
 
-def encode_message(msg: Message) -> bytes:
-    """Encode a Message object into bytes."""
-    return encode_int(msg.id) + encode_str(msg.sender) + encode_str(msg.content)
+class CustomCodec:
+    """
+    Primitive encodings used by the custom protocol messages. Version 1 uses fixed 4-byte integers, and sends
+    message lists as a count followed by each message in full.
+    """
+    version = 1
+    encode_str = staticmethod(encode_str)
+    decode_str = staticmethod(decode_str)
+    encode_int = staticmethod(encode_int)
+    decode_int = staticmethod(decode_int)
+    encode_sint = staticmethod(encode_sint)
+    decode_sint = staticmethod(decode_sint)
+    encode_bool = staticmethod(encode_bool)
+    decode_bool = staticmethod(decode_bool)
+
+    @classmethod
+    def encode_optional_str(cls, s: Optional[str]) -> bytes:
+        """Encode an optional string: a bool for whether it is present, then the string."""
+        if s is None:
+            return cls.encode_bool(False)
+        return cls.encode_bool(True) + cls.encode_str(s)
 
-def decode_message(data: bytes, offset: int = 0) -> Tuple[Message, int]:
-    """Decode a Message object from bytes."""
-    msg_id, offset = decode_int(data, offset)
-    sender, offset = decode_str(data, offset)
-    content, offset = decode_str(data, offset)
-    return Message(msg_id, sender, content), offset
+    @classmethod
+    def decode_optional_str(cls, data: bytes, offset: int = 0) -> Tuple[Optional[str], int]:
+        """Decode an optional string."""
+        present, offset = cls.decode_bool(data, offset)
+        if present:
+            return cls.decode_str(data, offset)
+        return None, offset
+
+    @classmethod
+    def encode_message(cls, msg: Message) -> bytes:
+        """Encode a Message object into bytes."""
+        return cls.encode_int(msg.id) + cls.encode_str(msg.sender) + cls.encode_str(msg.content)
+
+    @classmethod
+    def decode_message(cls, data: bytes, offset: int = 0) -> Tuple[Message, int]:
+        """Decode a Message object from bytes."""
+        msg_id, offset = cls.decode_int(data, offset)
+        sender, offset = cls.decode_str(data, offset)
+        content, offset = cls.decode_str(data, offset)
+        return Message(msg_id, sender, content), offset
+
+    @classmethod
+    def encode_messages(cls, messages: List[Message]) -> bytes:
+        """Encode a list of messages: count + messages."""
+        return cls.encode_int(len(messages)) + b''.join(map(cls.encode_message, messages))
+
+    @classmethod
+    def decode_messages(cls, data: bytes, offset: int = 0) -> Tuple[List[Message], int]:
+        """Decode a list of messages encoded with encode_messages."""
+        count, offset = cls.decode_int(data, offset)
+        messages = []
+        for _ in range(count):
+            message, offset = cls.decode_message(data, offset)
+            messages.append(message)
+        return messages, offset
+
+encode_message = CustomCodec.encode_message
+decode_message = CustomCodec.decode_message
+
+# Frames wrap each packed message on the wire: 1-byte compression algorithm + payload length + payload.
+# Receivers can decode every algorithm, so the sender alone decides whether a frame is worth compressing.
+FRAME_HEADER_SIZE = 5  # With version 1 fixed-width lengths
+
+def pack_frame(payload: bytes,
+               algorithm: CompressionAlgorithm = CompressionAlgorithm.NONE,
+               threshold: int = DEFAULT_COMPRESSION_THRESHOLD,
+               codec: Type[CustomCodec] = CustomCodec) -> bytes:
+    """Frame a packed message, compressing it if it is at least threshold bytes long."""
+    if algorithm != CompressionAlgorithm.NONE and len(payload) >= threshold:
+        compressed = compress(payload, algorithm)
+        # Incompressible payloads are sent as is
+        if len(compressed) < len(payload):
+            return struct.pack('!B', algorithm) + codec.encode_int(len(compressed)) + compressed
+    return struct.pack('!B', CompressionAlgorithm.NONE) + codec.encode_int(len(payload)) + payload
+
+def unpack_frame(data: bytes, offset: int = 0,
+                 codec: Type[CustomCodec] = CustomCodec) -> Tuple[Optional[bytes], int]:
+    """Unframe a message. Returns None and the unchanged offset if the frame hasn't fully arrived yet."""
+    if len(data) - offset < 1:
+        return None, offset
+    try:
+        length, start = codec.decode_int(data, offset + 1)
+    except (IndexError, struct.error):  # Length itself is incomplete
+        return None, offset
+    end = start + length
+    if len(data) < end:
+        return None, offset
+    payload = decompress(data[start:end], CompressionAlgorithm(data[offset]))
+    return payload, end
 
 class Custom_CreateAccountMessage(CreateAccountMessage):
+    codec = CustomCodec
+
     def pack_server(self) -> bytes:
         """Pack message for server: type + name + password"""
-        return struct.pack('!B', self.type.value) + encode_str(self.name) + encode_str(self.password)
+        return (struct.pack('!B', self.type.value) +
+                self.codec.encode_str(self.name) +
+                self.codec.encode_str(self.password))
 
     def pack_client(self, data: Optional[str]) -> bytes:
         """Pack response for client: type + has_error + [error_message]"""
-        has_error = data is not None
-        result = struct.pack('!B', self.type.value) + encode_bool(has_error)
-        if has_error:
-            result += encode_str(data)
-        return result
+        return struct.pack('!B', self.type.value) + self.codec.encode_optional_str(data)
 
     @classmethod
     def unpack_server(cls, data: bytes) -> Tuple[Self, int]:
         """Unpack server message: skip type, then name + password"""
-        name, offset = decode_str(data, 1)  # Skip message type
-        password, offset = decode_str(data, offset)
+        name, offset = cls.codec.decode_str(data, 1)  # Skip message type
+        password, offset = cls.codec.decode_str(data, offset)
         return cls(name, password), offset
 
     @classmethod
     def unpack_client(cls, data: bytes) -> Tuple[Optional[str], int]:
         """Unpack client response: skip type, then has_error + [error_message]"""
-        has_error, offset = decode_bool(data, 1)  # Skip message type
-        if has_error:
-            error, offset = decode_str(data, offset)
-            return error, offset
-        return None, offset
+        return cls.codec.decode_optional_str(data, 1)  # Skip message type
 
 class Custom_LoginMessage(LoginMessage):
+    codec = CustomCodec
+
     def pack_server(self) -> bytes:
         """Pack message for server: type + name + password"""
-        return struct.pack('!B', self.type.value) + encode_str(self.name) + encode_str(self.password)
+        return (struct.pack('!B', self.type.value) +
+                self.codec.encode_str(self.name) +
+                self.codec.encode_str(self.password))
 
     def pack_client(self, data: Optional[str]) -> bytes:
         """Pack response for client: type + has_error + [error_message]"""
-        has_error = data is not None
-        result = struct.pack('!B', self.type.value) + encode_bool(has_error)
-        if has_error:
-            result += encode_str(data)
-        return result
+        return struct.pack('!B', self.type.value) + self.codec.encode_optional_str(data)
 
     @classmethod
     def unpack_server(cls, data: bytes) -> Tuple[Self, int]:
         """Unpack server message: skip type, then name + password"""
-        name, offset = decode_str(data, 1)  # Skip message type
-        password, offset = decode_str(data, offset)
+        name, offset = cls.codec.decode_str(data, 1)  # Skip message type
+        password, offset = cls.codec.decode_str(data, offset)
         return cls(name, password), offset
 
     @classmethod
     def unpack_client(cls, data: bytes) -> Tuple[Optional[str], int]:
         """Unpack client response: skip type, then has_error + [error_message]"""
-        has_error, offset = decode_bool(data, 1)  # Skip message type
-        if has_error:
-            error, offset = decode_str(data, offset)
-            return error, offset
-        return None, offset
+        return cls.codec.decode_optional_str(data, 1)  # Skip message type
 
 class Custom_LogoutMessage(LogoutMessage):
+    codec = CustomCodec
+
     def pack_server(self) -> bytes:
         """Pack message for server: type + name + password"""
         return struct.pack('!B', self.type.value)
@@ -121,41 +207,45 @@ class Custom_LogoutMessage(LogoutMessage):
         pass
 
 class Custom_ListUsersMessage(ListUsersMessage):
+    codec = CustomCodec
+
     def pack_server(self) -> bytes:
         """Pack message for server: type + pattern + offset + limit"""
         return (struct.pack('!B', self.type.value) +
-                encode_str(self.pattern) +
-                encode_int(self.offset) +
-                encode_int(self.limit))
+                self.codec.encode_str(self.pattern) +
+                self.codec.encode_sint(self.offset) +
+                self.codec.encode_sint(self.limit))
 
     def pack_client(self, data: List[User]) -> bytes:
         """Pack response for client: type + count + usernames"""
         result = struct.pack('!B', self.type.value)
-        result += encode_int(len(data))
+        result += self.codec.encode_int(len(data))
         for user in data:
-            result += encode_str(user.name)
+            result += self.codec.encode_str(user.name)
         return result
 
     @classmethod
     def unpack_server(cls, data: bytes) -> Tuple[Self, int]:
         """Unpack server message: skip type, then pattern + offset + limit"""
-        pattern, offset = decode_str(data, 1)  # Skip message type
-        list_offset, offset = decode_int(data, offset)
-        limit, offset = decode_int(data, offset)
+        pattern, offset = cls.codec.decode_str(data, 1)  # Skip message type
+        list_offset, offset = cls.codec.decode_sint(data, offset)
+        limit, offset = cls.codec.decode_sint(data, offset)
         return cls(pattern, list_offset, limit), offset
 
     @classmethod
     def unpack_client(cls, data: bytes) -> Tuple[List[str], int]:
         """Unpack client response: skip type, then count + usernames"""
-        count, offset = decode_int(data, 1)  # Skip message type
+        count, offset = cls.codec.decode_int(data, 1)  # Skip message type
         usernames = []
         for _ in range(count):
-            username, offset = decode_str(data, offset)
+            username, offset = cls.codec.decode_str(data, offset)
             usernames.append(username)
         return usernames, offset
 
 
 class Custom_DeleteAccountMessage(DeleteAccountMessage):
+    codec = CustomCodec
+
     def pack_server(self) -> bytes:
         """Pack message for server: type only"""
         return struct.pack('!B', self.type.value)
@@ -175,45 +265,40 @@ class Custom_DeleteAccountMessage(DeleteAccountMessage):
         return None
 
 class Custom_SendMessageMessage(SendMessageMessage):
+    codec = CustomCodec
+
     def pack_server(self) -> bytes:
         """Pack message for server: type + recipient_username + content"""
         return (struct.pack('!B', self.type.value) +
-                encode_str(self.receiver) +
-                encode_str(self.content))
+                self.codec.encode_str(self.receiver) +
+                self.codec.encode_str(self.content))
 
     def pack_client(self, data: Optional[str]) -> bytes:
         """Pack response for client: type + optional error message"""
-        result = struct.pack('!B', self.type.value)
-        if data is not None:  # Error message
-            result += encode_bool(True) + encode_str(data)
-        else:
-            result += encode_bool(False)
-        return result
+        return struct.pack('!B', self.type.value) + self.codec.encode_optional_str(data)
 
     @classmethod
     def unpack_server(cls, data: bytes) -> Tuple[Self, int]:
         """Unpack server message: skip type, then recipient_username + content"""
-        recipient, pos = decode_str(data, 1)  # Skip message type
-        content, offset = decode_str(data, pos)
+        recipient, pos = cls.codec.decode_str(data, 1)  # Skip message type
+        content, offset = cls.codec.decode_str(data, pos)
         return cls(recipient, content), offset
 
     @classmethod
     def unpack_client(cls, data: bytes) -> Tuple[Optional[str], int]:
         """Unpack client response: skip type, then optional error message"""
-        has_error, offset = decode_bool(data, 1)
-        if has_error:
-            error_msg, offset = decode_str(data, offset)
-            return error_msg, offset
-        return None, offset
+        return cls.codec.decode_optional_str(data, 1)  # Skip message type
 
 class Custom_ReceivedMessageMessage(ReceivedMessageMessage):
+    codec = CustomCodec
+
     def pack_server(self) -> bytes:
         """Pack message for server: type + message"""
         pass
 
     def pack_client(self, data: None) -> bytes:
         """Pack response for client: type + message"""
-        return struct.pack('!B', self.type.value) + encode_message(self.new_message)
+        return struct.pack('!B', self.type.value) + self.codec.encode_message(self.new_message)
 
     @classmethod
     def unpack_server(cls, data: bytes) -> Self:
@@ -223,17 +308,19 @@ class Custom_ReceivedMessageMessage(ReceivedMessageMessage):
     @classmethod
     def unpack_client(cls, data: bytes) -> Tuple[Self, int]:
         """Unpack client response: skip type, then message"""
-        message, offset = decode_message(data, 1)  # Skip message type
+        message, offset = cls.codec.decode_message(data, 1)  # Skip message type
         return cls(message), offset
 
 class Custom_GetNumberOfUnreadMessagesMessage(GetNumberOfUnreadMessagesMessage):
+    codec = CustomCodec
+
     def pack_server(self) -> bytes:
         """Pack message for server: type only"""
         return struct.pack('!B', self.type.value)
 
     def pack_client(self, data: int) -> bytes:
         """Pack response for client: type + count"""
-        return struct.pack('!B', self.type.value) + encode_int(data)
+        return struct.pack('!B', self.type.value) + self.codec.encode_int(data)
 
     @classmethod
     def unpack_server(cls, data: bytes) -> Tuple[Self, int]:
@@ -243,18 +330,20 @@ class Custom_GetNumberOfUnreadMessagesMessage(GetNumberOfUnreadMessagesMessage):
     @classmethod
     def unpack_client(cls, data: bytes) -> Tuple[int, int]:
         """Unpack client response: skip type, then count"""
-        count, offset = decode_int(data, 1)  # Skip message type
+        count, offset = cls.codec.decode_int(data, 1)  # Skip message type
         return count, offset
 
 
 class Custom_GetNumberOfReadMessagesMessage(GetNumberOfReadMessagesMessage):
+    codec = CustomCodec
+
     def pack_server(self) -> bytes:
         """Pack message for server: type only"""
         return struct.pack('!B', self.type.value)
 
     def pack_client(self, data: int) -> bytes:
         """Pack response for client: type + count"""
-        return struct.pack('!B', self.type.value) + encode_int(data)
+        return struct.pack('!B', self.type.value) + self.codec.encode_int(data)
 
     @classmethod
     def unpack_server(cls, data: bytes) -> Tuple[Self, int]:
@@ -264,74 +353,64 @@ class Custom_GetNumberOfReadMessagesMessage(GetNumberOfReadMessagesMessage):
     @classmethod
     def unpack_client(cls, data: bytes) -> Tuple[int, int]:
         """Unpack client response: skip type, then count"""
-        count, offset = decode_int(data, 1)  # Skip message type
+        count, offset = cls.codec.decode_int(data, 1)  # Skip message type
         return count, offset
 
 class Custom_PopUnreadMessagesMessage(PopUnreadMessagesMessage):
+    codec = CustomCodec
+
     def pack_server(self) -> bytes:
         """Pack message for server: type + num_messages"""
-        return struct.pack('!B', self.type.value) + encode_int(self.num_messages)
+        return struct.pack('!B', self.type.value) + self.codec.encode_sint(self.num_messages)
 
     def pack_client(self, data: List[Message]) -> bytes:
         """Pack response for client: type + count + messages"""
-        result = struct.pack('!B', self.type.value) + encode_int(len(data))
-        for message in data:
-            result += encode_message(message)
-        return result
+        return struct.pack('!B', self.type.value) + self.codec.encode_messages(data)
 
     @classmethod
     def unpack_server(cls, data: bytes) -> Tuple[Self, int]:
         """Unpack server message: skip type, then num_messages"""
-        num_messages, offset = decode_int(data, 1)  # Skip message type
+        num_messages, offset = cls.codec.decode_sint(data, 1)  # Skip message type
         return cls(num_messages), offset
 
     @classmethod
     def unpack_client(cls, data: bytes) -> Tuple[List[Message], int]:
         """Unpack client response: skip type, then count + messages"""
-        count, offset = decode_int(data, 1)  # Skip message type
-        messages = []
-        for _ in range(count):
-            message, offset = decode_message(data, offset)
-            messages.append(message)
-        return messages, offset
+        return cls.codec.decode_messages(data, 1)  # Skip message type
 
 class Custom_GetReadMessagesMessage(GetReadMessagesMessage):
+    codec = CustomCodec
+
     def pack_server(self) -> bytes:
         """Pack message for server: type + offset + num_messages"""
         return (struct.pack('!B', self.type.value) +
-                encode_int(self.offset) +
-                encode_int(self.num_messages))
+                self.codec.encode_sint(self.offset) +
+                self.codec.encode_sint(self.num_messages))
 
     def pack_client(self, data: List[Message]) -> bytes:
         """Pack response for client: type + count + messages"""
-        result = struct.pack('!B', self.type.value) + encode_int(len(data))
-        for message in data:
-            result += encode_message(message)
-        return result
+        return struct.pack('!B', self.type.value) + self.codec.encode_messages(data)
 
     @classmethod
     def unpack_server(cls, data: bytes) -> Tuple[Self, int]:
         """Unpack server message: skip type, then offset + num_messages"""
-        offset, next_offset = decode_int(data, 1)  # Skip message type
-        num_messages, next_offset = decode_int(data, next_offset)
+        offset, next_offset = cls.codec.decode_sint(data, 1)  # Skip message type
+        num_messages, next_offset = cls.codec.decode_sint(data, next_offset)
         return cls(offset, num_messages), next_offset
 
     @classmethod
     def unpack_client(cls, data: bytes) -> Tuple[List[Message], int]:
         """Unpack client response: skip type, then count + messages"""
-        count, offset = decode_int(data, 1)  # Skip message type
-        messages = []
-        for _ in range(count):
-            message, offset = decode_message(data, offset)
-            messages.append(message)
-        return messages, offset
+        return cls.codec.decode_messages(data, 1)  # Skip message type
 
 class Custom_DeleteMessagesMessage(DeleteMessagesMessage):
+    codec = CustomCodec
+
     def pack_server(self) -> bytes:
         """Pack message for server: type + count + message_ids"""
-        result = struct.pack('!B', self.type.value) + encode_int(len(self.message_ids))
+        result = struct.pack('!B', self.type.value) + self.codec.encode_int(len(self.message_ids))
         for msg_id in self.message_ids:
-            result += encode_int(msg_id)
+            result += self.codec.encode_int(msg_id)
         return result
 
     def pack_client(self, data: None) -> bytes:
@@ -341,10 +420,10 @@ class Custom_DeleteMessagesMessage(DeleteMessagesMessage):
     @classmethod
     def unpack_server(cls, data: bytes) -> Tuple[Self, int]:
         """Unpack server message: skip type, then count + message_ids"""
-        count, offset = decode_int(data, 1)  # Skip message type
+        count, offset = cls.codec.decode_int(data, 1)  # Skip message type
         message_ids = []
         for _ in range(count):
-            msg_id, offset = decode_int(data, offset)
+            msg_id, offset = cls.codec.decode_int(data, offset)
             message_ids.append(msg_id)
         return cls(message_ids), offset
 
@@ -355,6 +434,8 @@ class Custom_DeleteMessagesMessage(DeleteMessagesMessage):
 
 class CustomProtocol(Protocol):
     """Custom binary protocol implementation."""
+    version = 1
+    codec = CustomCodec
     message_classes: Dict[MessageType, Type[ProtocolMessage]] = {
         MessageType.CREATE_ACCOUNT: Custom_CreateAccountMessage,
         MessageType.LOGIN: Custom_LoginMessage,
@@ -370,6 +451,20 @@ class CustomProtocol(Protocol):
         MessageType.DELETE_MESSAGES: Custom_DeleteMessagesMessage,
     }
 
+    def __init__(self,
+                 compression: CompressionAlgorithm = CompressionAlgorithm.NONE,
+                 compression_threshold: int = DEFAULT_COMPRESSION_THRESHOLD):
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+
+    def pack_frame(self, payload: bytes) -> bytes:
+        """Frame a packed message, compressing it if it is large enough."""
+        return pack_frame(payload, self.compression, self.compression_threshold, self.codec)
+
+    def unpack_frame(self, data: bytes, offset: int = 0) -> Tuple[Optional[bytes], int]:
+        """Unframe a message. Returns None if the frame is incomplete."""
+        return unpack_frame(data, offset, self.codec)
+
     def get_message_type(self, data: bytes) -> MessageType:
         """Extract message type from first byte of message."""
         if not data:
@@ -0,0 +1,220 @@
+"""
+Version 2 of the custom protocol. Messages are laid out like version 1, but integers and length
+prefixes are LEB128 varints, and signed fields (offsets, limits, id deltas) are zigzag encoded so
+that small values of either sign take a single byte. Message lists send each distinct sender once,
+and each message's id as the difference from the previous one.
+
+Clients pick the version with a handshake byte sent when the connection opens. The byte has its
+high bit set, so it can't be confused with the message type that starts every version 1 message
+from a client that doesn't send a handshake at all.
+"""
+import struct
+from typing import Dict, List, Optional, Tuple, Type
+
+from .custom_protocol import *
+
+HANDSHAKE_FLAG = 0x80
+
+
+def encode_varint(i: int) -> bytes:
+    """Encode a non-negative integer as a LEB128 varint."""
+    if i < 0:
+        raise ValueError(f"Varints must be non-negative, got {i}")
+    out = bytearray()
+    while i >= 0x80:
+        out.append((i & 0x7F) | 0x80)
+        i >>= 7
+    out.append(i)
+    return bytes(out)
+
+def decode_varint(data: bytes, offset: int = 0) -> Tuple[int, int]:
+    """Decode a LEB128 varint."""
+    result = 0
+    shift = 0
+    while True:
+        b = data[offset]
+        offset += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, offset
+        shift += 7
+
+def encode_zigzag(i: int) -> bytes:
+    """Encode a signed integer as a zigzag varint: 0, -1, 1, -2, ... map to 0, 1, 2, 3, ..."""
+    return encode_varint(i * 2 if i >= 0 else -i * 2 - 1)
+
+def decode_zigzag(data: bytes, offset: int = 0) -> Tuple[int, int]:
+    """Decode a zigzag varint."""
+    z, offset = decode_varint(data, offset)
+    return (z >> 1) ^ -(z & 1), offset
+
+def encode_varint_str(s: str) -> bytes:
+    """Encode a string into bytes with a varint length prefix."""
+    b = s.encode('utf-8')
+    return encode_varint(len(b)) + b
+
+def decode_varint_str(data: bytes, offset: int = 0) -> Tuple[str, int]:
+    """Decode a string from bytes with a varint length prefix."""
+    length, offset = decode_varint(data, offset)
+    if offset + length > len(data):
+        raise IndexError("String extends past the end of the data")
+    return data[offset:offset+length].decode('utf-8'), offset + length
+
+
+class VarintCodec(CustomCodec):
+    """Primitive encodings for version 2 of the custom protocol."""
+    version = 2
+    encode_str = staticmethod(encode_varint_str)
+    decode_str = staticmethod(decode_varint_str)
+    encode_int = staticmethod(encode_varint)
+    decode_int = staticmethod(decode_varint)
+    encode_sint = staticmethod(encode_zigzag)
+    decode_sint = staticmethod(decode_zigzag)
+
+    @classmethod
+    def encode_optional_str(cls, s: Optional[str]) -> bytes:
+        """Encode an optional string, with the presence folded into the length: 0 for None, else length + 1."""
+        if s is None:
+            return encode_varint(0)
+        b = s.encode('utf-8')
+        return encode_varint(len(b) + 1) + b
+
+    @classmethod
+    def decode_optional_str(cls, data: bytes, offset: int = 0) -> Tuple[Optional[str], int]:
+        """Decode an optional string."""
+        length, offset = decode_varint(data, offset)
+        if length == 0:
+            return None, offset
+        length -= 1
+        return data[offset:offset+length].decode('utf-8'), offset + length
+
+    @classmethod
+    def encode_messages(cls, messages: List[Message]) -> bytes:
+        """Encode a list of messages: count + sender table + (sender index, id delta, content) per message."""
+        if not messages:  # No sender table either
+            return cls.encode_int(0)
+        sender_index = {}
+        body = []
+        previous_id = 0
+        for msg in messages:
+            index = sender_index.setdefault(msg.sender, len(sender_index))
+            body.append(cls.encode_int(index) + cls.encode_sint(msg.id - previous_id) + cls.encode_str(msg.content))
+            previous_id = msg.id
+        senders = [cls.encode_str(sender) for sender in sender_index]
+        return cls.encode_int(len(messages)) + cls.encode_int(len(senders)) + b''.join(senders) + b''.join(body)
+
+    @classmethod
+    def decode_messages(cls, data: bytes, offset: int = 0) -> Tuple[List[Message], int]:
+        """Decode a list of messages encoded with encode_messages."""
+        count, offset = cls.decode_int(data, offset)
+        if count == 0:
+            return [], offset
+        num_senders, offset = cls.decode_int(data, offset)
+        senders = []
+        for _ in range(num_senders):
+            sender, offset = cls.decode_str(data, offset)
+            senders.append(sender)
+        messages = []
+        msg_id = 0
+        for _ in range(count):
+            index, offset = cls.decode_int(data, offset)
+            delta, offset = cls.decode_sint(data, offset)
+            content, offset = cls.decode_str(data, offset)
+            msg_id += delta
+            messages.append(Message(msg_id, senders[index], content))
+        return messages, offset
+
+
+class CustomV2_CreateAccountMessage(Custom_CreateAccountMessage):
+    codec = VarintCodec
+
+class CustomV2_LoginMessage(Custom_LoginMessage):
+    codec = VarintCodec
+
+class CustomV2_LogoutMessage(Custom_LogoutMessage):
+    codec = VarintCodec
+
+class CustomV2_ListUsersMessage(Custom_ListUsersMessage):
+    codec = VarintCodec
+
+class CustomV2_DeleteAccountMessage(Custom_DeleteAccountMessage):
+    codec = VarintCodec
+
+class CustomV2_SendMessageMessage(Custom_SendMessageMessage):
+    codec = VarintCodec
+
+class CustomV2_ReceivedMessageMessage(Custom_ReceivedMessageMessage):
+    codec = VarintCodec
+
+class CustomV2_GetNumberOfUnreadMessagesMessage(Custom_GetNumberOfUnreadMessagesMessage):
+    codec = VarintCodec
+
+class CustomV2_GetNumberOfReadMessagesMessage(Custom_GetNumberOfReadMessagesMessage):
+    codec = VarintCodec
+
+class CustomV2_PopUnreadMessagesMessage(Custom_PopUnreadMessagesMessage):
+    codec = VarintCodec
+
+class CustomV2_GetReadMessagesMessage(Custom_GetReadMessagesMessage):
+    codec = VarintCodec
+
+class CustomV2_DeleteMessagesMessage(Custom_DeleteMessagesMessage):
+    codec = VarintCodec
+
+
+class CustomProtocolV2(CustomProtocol):
+    """Custom binary protocol with varint integers."""
+    version = 2
+    codec = VarintCodec
+    message_classes: Dict[MessageType, Type[ProtocolMessage]] = {
+        MessageType.CREATE_ACCOUNT: CustomV2_CreateAccountMessage,
+        MessageType.LOGIN: CustomV2_LoginMessage,
+        MessageType.LOGOUT: CustomV2_LogoutMessage,
+        MessageType.LIST_USERS: CustomV2_ListUsersMessage,
+        MessageType.DELETE_ACCOUNT: CustomV2_DeleteAccountMessage,
+        MessageType.SEND_MESSAGE: CustomV2_SendMessageMessage,
+        MessageType.RECEIVED_MESSAGE: CustomV2_ReceivedMessageMessage,
+        MessageType.GET_NUMBER_OF_UNREAD_MESSAGES: CustomV2_GetNumberOfUnreadMessagesMessage,
+        MessageType.GET_NUMBER_OF_READ_MESSAGES: CustomV2_GetNumberOfReadMessagesMessage,
+        MessageType.POP_UNREAD_MESSAGES: CustomV2_PopUnreadMessagesMessage,
+        MessageType.GET_READ_MESSAGES: CustomV2_GetReadMessagesMessage,
+        MessageType.DELETE_MESSAGES: CustomV2_DeleteMessagesMessage,
+    }
+
+
+PROTOCOL_VERSIONS: Dict[int, Type[CustomProtocol]] = {
+    CustomProtocol.version: CustomProtocol,
+    CustomProtocolV2.version: CustomProtocolV2,
+}
+LATEST_VERSION = max(PROTOCOL_VERSIONS)
+
+
+def pack_handshake(version: int = LATEST_VERSION) -> bytes:
+    """Client side: offer the highest protocol version the client supports."""
+    return struct.pack('!B', HANDSHAKE_FLAG | version)
+
+def accept_handshake(data: bytes) -> Tuple[Optional[Type[CustomProtocol]], bytes, int]:
+    """
+    Server side: read the first byte of a connection. Returns the negotiated protocol (None if the
+    client offered no version we support), the handshake reply to send back, and the number of
+    bytes consumed. Clients that don't handshake get version 1 and no reply.
+    """
+    if not data:
+        raise ValueError("Empty handshake received")
+    if not data[0] & HANDSHAKE_FLAG:
+        return CustomProtocol, b'', 0
+    offered = data[0] & ~HANDSHAKE_FLAG
+    supported = [v for v in PROTOCOL_VERSIONS if v <= offered]
+    if not supported:
+        return None, pack_handshake(0), 1
+    version = max(supported)
+    return PROTOCOL_VERSIONS[version], pack_handshake(version), 1
+
+def unpack_handshake(data: bytes) -> Type[CustomProtocol]:
+    """Client side: read the server's handshake reply."""
+    if not data or not data[0] & HANDSHAKE_FLAG:
+        raise ValueError("Invalid handshake reply")
+    version = data[0] & ~HANDSHAKE_FLAG
+    if version not in PROTOCOL_VERSIONS:
+        raise ValueError("Server doesn't support any common protocol version")
+    return PROTOCOL_VERSIONS[version]
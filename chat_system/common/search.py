@@ -0,0 +1,192 @@
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+_WORD = re.compile(r"\w+")
+# Documents from the shortest posting list checked against the others at a time, growing as more are needed
+FIRST_CHUNK = 256
+
+
+def tokenize(text: str) -> List[str]:
+    """The lowercased words of a text."""
+    return _WORD.findall(text.lower())
+
+
+class TokenTable:
+    """Interns words as small ints. Shared by every user's index, so each distinct word is only stored once."""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def intern(self, token: str) -> int:
+        return self.ids.setdefault(token, len(self.ids))
+
+    def lookup(self, token: str) -> Optional[int]:
+        return self.ids.get(token)
+
+
+class SearchIndex:
+    """
+    Full-text search over one user's read mailbox. The user keeps it up to date as messages are added to and
+    removed from the mailbox. Messages are anything with an id and content.
+    """
+
+    def add(self, messages: Iterable[Any]):
+        raise NotImplementedError
+
+    def remove(self, message_ids: Iterable[int]):
+        raise NotImplementedError
+
+    def replace(self, messages: Iterable[Any]):
+        """Swap in other objects for messages already in the index, matched by id, like ones moved to disk."""
+        raise NotImplementedError
+
+    def search(self, query: str, limit: int, cursor: int) -> Tuple[List[Any], int]:
+        """
+        Messages containing every word of the query, most recently added first. Pass a cursor of 0 for the first
+        page and the returned cursor for the next, which is 0 once there are no more. A limit < 0 returns all.
+        """
+        raise NotImplementedError
+
+    def memory_usage(self) -> int:
+        """Approximate bytes used by the index, not counting the messages themselves."""
+        raise NotImplementedError
+
+
+class InvertedIndex(SearchIndex):
+    """
+    A posting list of document numbers for each word. Documents are numbered in the order they're added, so
+    posting lists are sorted. Queries with several words walk the shortest list back from the newest document
+    in chunks, and intersect each chunk with the same range of the other lists as sets.
+
+    Writers must be serialized by the caller. Readers don't need a lock: posting lists are only appended to,
+    and removing messages replaces the whole postings dict once enough of them are stale.
+    """
+
+    def __init__(self, tokens: TokenTable):
+        self.tokens = tokens
+        self.postings: Dict[int, array] = {}  # token id -> document numbers
+        # Document number -> message, None once removed. Numbers start at 1 so that a cursor of 0 means the start
+        self.docs: List[Optional[Any]] = [None]
+        self.doc_numbers: Dict[int, int] = {}  # message id -> document number
+        self.stale = 0  # Removed documents still in the posting lists
+
+    def add(self, messages: Iterable[Any]):
+        postings = self.postings
+        for message in messages:
+            doc = len(self.docs)
+            self.docs.append(message)
+            self.doc_numbers[message.id] = doc
+            for token_id in {self.tokens.intern(token) for token in tokenize(message.content)}:
+                posting = postings.get(token_id)
+                if posting is None:
+                    posting = postings[token_id] = array('i')
+                posting.append(doc)
+
+    def remove(self, message_ids: Iterable[int]):
+        for message_id in message_ids:
+            doc = self.doc_numbers.pop(message_id, None)
+            if doc is not None:
+                self.docs[doc] = None
+                self.stale += 1
+        # Compact once stale entries could make up half of the postings
+        if self.stale > len(self.doc_numbers):
+            self._compact()
+
+    def replace(self, messages: Iterable[Any]):
+        for message in messages:
+            doc = self.doc_numbers.get(message.id)
+            if doc is not None:
+                self.docs[doc] = message
+
+    def _compact(self):
+        docs = self.docs
+        postings = {}
+        for token_id, posting in self.postings.items():
+            live = array('i', (doc for doc in posting if docs[doc] is not None))
+            if live:
+                postings[token_id] = live
+        self.postings = postings
+        self.stale = 0
+
+    def search(self, query: str, limit: int, cursor: int) -> Tuple[List[Any], int]:
+        postings, docs = self.postings, self.docs
+        lists = []
+        for token in set(tokenize(query)):
+            token_id = self.tokens.lookup(token)
+            posting = postings.get(token_id) if token_id is not None else None
+            if not posting:
+                return [], 0
+            lists.append(posting)
+        if not lists:
+            return [], 0
+        lists.sort(key=len)
+        shortest, others = lists[0], lists[1:]
+
+        results = []
+        hi = bisect_left(shortest, cursor) if cursor > 0 else len(shortest)
+        chunk = FIRST_CHUNK
+        while hi > 0:
+            lo = max(0, hi - chunk)
+            chunk *= 4
+            if others:
+                candidates = set(shortest[lo:hi])
+                first, last = shortest[lo], shortest[hi - 1]
+                for posting in others:
+                    candidates.intersection_update(posting[bisect_left(posting, first):bisect_right(posting, last)])
+                matches = sorted(candidates, reverse=True)
+            else:
+                matches = reversed(shortest[lo:hi])
+            for doc in matches:
+                message = docs[doc]
+                if message is None:
+                    continue
+                results.append(message)
+                if len(results) == limit:
+                    return results, doc
+            hi = lo
+        return results, 0
+
+    def memory_usage(self) -> int:
+        postings = self.postings
+        size = sum(posting.buffer_info()[1] * posting.itemsize for posting in postings.values())
+        # Dict entries are about three words each, arrays have a fixed header
+        size += len(postings) * (3 * 8 + 64) + len(self.doc_numbers) * 3 * 8 + len(self.docs) * 8
+        return size
+
+
+def scan(messages: Sequence[Any], query: str, limit: int, cursor: int) -> Tuple[List[Any], int]:
+    """
+    Search a list of messages without an index, the last first, paged like SearchIndex.search. Cursors are
+    positions in the list, so a page after messages are removed can skip some.
+    """
+    words = set(tokenize(query))
+    if not words:
+        return [], 0
+    results = []
+    for position in range((cursor if cursor > 0 else len(messages) + 1) - 2, -1, -1):
+        message = messages[position]
+        if words.issubset(tokenize(message.content)):
+            results.append(message)
+            if len(results) == limit:
+                return results, position + 1
+    return results, 0
+
+
+# Search backends that can be configured, by name
+SEARCH_INDEXES = {
+    "inverted": InvertedIndex,
+}
+
+
+def make_search_index(kind: str, tokens: TokenTable) -> Optional[SearchIndex]:
+    """A new, empty index of the configured kind, or None if there's no index to keep: with 'scan' and 'none'."""
+    if kind in ("scan", "none"):
+        return None
+    if kind not in SEARCH_INDEXES:
+        raise ValueError(f"Unknown search index: {kind}")
+    return SEARCH_INDEXES[kind](tokens)
@@ -0,0 +1,188 @@
+import base64
+import glob
+import mmap
+import os
+import struct
+import threading
+from typing import List, Optional, Tuple
+
+# Records are a 4-byte length, then the message laid out like the custom protocol's encode_message:
+# 4-byte id, then sender and content, each a 4-byte length and UTF-8 bytes
+_RECORD_HEADER = struct.Struct('!LLL')  # Record length, message id, sender length
+_LENGTH = struct.Struct('!L')
+# Segments are closed once they're this big, so that a few huge files don't have to be remapped as they grow
+SEGMENT_SIZE = 64 * 2**20
+
+
+def encode_record(message_id: int, sender: str, content: str) -> bytes:
+    sender_bytes = sender.encode('utf-8')
+    content_bytes = content.encode('utf-8')
+    body = (_LENGTH.pack(message_id) + _LENGTH.pack(len(sender_bytes)) + sender_bytes
+            + _LENGTH.pack(len(content_bytes)) + content_bytes)
+    return _LENGTH.pack(len(body)) + body
+
+
+class Segment:
+    """
+    One append-only file of records, read through mmap. Records are decoded straight from the mapping, and
+    read_raw copies the UTF-8 out once for protobuf fields, which take bytes without a round trip through str.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "w+b")
+        self.size = 0
+        self.records = 0  # Written, including any of messages that have since gone
+        self.map: Optional[mmap.mmap] = None
+        self.map_lock = threading.Lock()
+
+    def append(self, records: List[bytes]) -> List[int]:
+        """Write records to the end of the file. Returns their offsets."""
+        offsets = []
+        offset = self.size
+        for record in records:
+            offsets.append(offset)
+            offset += len(record)
+        self.file.write(b''.join(records))
+        self.file.flush()
+        self.size = offset
+        self.records += len(records)
+        return offsets
+
+    def view(self) -> mmap.mmap:
+        """A mapping of everything written so far."""
+        current = self.map
+        if current is not None and len(current) >= self.size:
+            return current
+        with self.map_lock:
+            if self.map is None or len(self.map) < self.size:
+                # Readers may still hold the old mapping, it's unmapped once they let go of it
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.map
+
+    def read(self, offset: int) -> Tuple[int, str, str]:
+        """The id, sender and content of the record at offset."""
+        data = self.view()
+        _, message_id, length = _RECORD_HEADER.unpack_from(data, offset)
+        offset += _RECORD_HEADER.size
+        sender = data[offset:offset + length].decode('utf-8')
+        offset += length
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += 4
+        return message_id, sender, data[offset:offset + length].decode('utf-8')
+
+    def read_raw(self, offset: int) -> Tuple[int, bytes, bytes]:
+        """The id, and the sender and content as UTF-8, of the record at offset."""
+        data = self.view()
+        _, message_id, length = _RECORD_HEADER.unpack_from(data, offset)
+        offset += _RECORD_HEADER.size
+        # Slicing the mapping is the one copy. A memoryview would save it, but protobuf won't take one
+        sender = data[offset:offset + length]
+        offset += length
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += 4
+        return message_id, sender, data[offset:offset + length]
+
+    def read_record(self, offset: int) -> bytes:
+        """The whole record at offset, length and all, to copy into another segment."""
+        data = self.view()
+        (length,) = _LENGTH.unpack_from(data, offset)
+        return data[offset:offset + _LENGTH.size + length]
+
+    def close(self):
+        self.file.close()
+        self.map = None
+
+    def retire(self):
+        """
+        Delete the file once no new readers will come to it. Readers that still hold its messages keep the file
+        and mapping open, and can read them until they let go.
+        """
+        os.remove(self.path)
+
+
+class ColdMessage:
+    """
+    A message kept in a segment file. It can be used like a Message, but only its id and where its record is
+    are kept in memory: the sender and content are read from the file each time they're used.
+    """
+    __slots__ = ("id", "segment", "offset")
+
+    def __init__(self, message_id: int, segment: Segment, offset: int):
+        self.id = message_id
+        self.segment = segment
+        self.offset = offset
+
+    @property
+    def sender(self) -> str:
+        return self.read()[1]
+
+    @property
+    def content(self) -> str:
+        return self.read()[2]
+
+    def read(self) -> Tuple[int, str, str]:
+        """The id, sender and content, read from the file at once."""
+        return self.segment.read(self.offset)
+
+    def read_raw(self) -> Tuple[int, bytes, bytes]:
+        """The id, and the sender and content as UTF-8 bytes, ready for a protobuf message."""
+        return self.segment.read_raw(self.offset)
+
+    def __repr__(self):
+        return f"ColdMessage(id={self.id}, offset={self.offset})"
+
+
+class SegmentStore:
+    """A user's messages moved out of memory, in a series of append-only segment files."""
+
+    def __init__(self, directory: str, name: str, segment_size: int = SEGMENT_SIZE):
+        # Usernames can contain anything, so encode them to get a safe file name
+        self.prefix = os.path.join(directory, base64.urlsafe_b64encode(name.encode('utf-8')).decode('ascii'))
+        self.segment_size = segment_size
+        self.segments: List[Segment] = []
+        self.next_index = 0  # Segments are numbered in the order they're made, gaps are left by compaction
+        self.index_lock = threading.Lock()  # Compaction makes segments without holding the writers' lock
+        # Anything left over from a previous run is part of the saved server state instead
+        for path in glob.glob(glob.escape(self.prefix) + ".*.seg"):
+            os.remove(path)
+
+    def append(self, messages) -> List[ColdMessage]:
+        """Write messages to the newest segment, starting a new one when it's full. Returns their replacements."""
+        if not messages:
+            return []
+        if not self.segments or self.segments[-1].size >= self.segment_size:
+            self.segments.append(self.new_segment())
+        segment = self.segments[-1]
+        offsets = segment.append([encode_record(m.id, m.sender, m.content) for m in messages])
+        return [ColdMessage(m.id, segment, offset) for m, offset in zip(messages, offsets)]
+
+    def new_segment(self) -> Segment:
+        """An empty segment file. It's only written to by appends once it's added to segments."""
+        os.makedirs(os.path.dirname(self.prefix) or ".", exist_ok=True)
+        with self.index_lock:
+            index = self.next_index
+            self.next_index += 1
+        return Segment(f"{self.prefix}.{index}.seg")
+
+    def replace(self, old: Segment, new: Optional[Segment]):
+        """Put a compacted copy of a segment in its place, or just drop it if nothing in it is left."""
+        segments = list(self.segments)
+        i = segments.index(old)
+        if new is None:
+            del segments[i]
+        else:
+            segments[i] = new
+        self.segments = segments
+        old.retire()
+
+    def size(self) -> int:
+        """Bytes on disk."""
+        return sum(segment.size for segment in self.segments)
+
+    def clear(self):
+        """Delete every segment file."""
+        for segment in self.segments:
+            segment.close()
+            os.remove(segment.path)
+        self.segments = []
@@ -0,0 +1,38 @@
+import bisect
+import hashlib
+from typing import List
+
+DEFAULT_VIRTUAL_NODES = 64
+
+
+def _hash(key: str) -> int:
+    # Python's hash() is randomized per process, and every client and shard has to agree
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of usernames onto shards. Adding a shard only moves the users it takes over."""
+
+    def __init__(self, shards: List[str], virtual_nodes: int = DEFAULT_VIRTUAL_NODES):
+        if not shards:
+            raise ValueError("A hash ring needs at least one shard")
+        self.shards = list(shards)
+        points = sorted(
+            (_hash(f"{shard}#{v}"), i)
+            for i, shard in enumerate(self.shards)
+            for v in range(virtual_nodes)
+        )
+        self.points = [p for p, _ in points]
+        self.owners = [i for _, i in points]
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def shard_index(self, username: str) -> int:
+        """Index of the shard that owns a user."""
+        i = bisect.bisect(self.points, _hash(username)) % len(self.points)
+        return self.owners[i]
+
+    def shard_for(self, username: str) -> str:
+        """Address of the shard that owns a user."""
+        return self.shards[self.shard_index(username)]
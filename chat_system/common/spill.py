@@ -0,0 +1,65 @@
+import json
+import os
+from typing import Any, List
+
+
+class SpillFile:
+    """An on-disk FIFO of records, stored as JSON lines. Used to hold messages that don't fit in memory."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.read_offset = 0  # Byte offset of the oldest message not yet read back
+        self.count = 0
+        # Anything left over from a previous run is part of the saved server state instead
+        if os.path.exists(path):
+            os.remove(path)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, records: List[Any]):
+        """Append JSON-serializable records to the end of the file."""
+        if not records:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+        self.count += len(records)
+
+    def peek(self, num_records: int = -1) -> List[Any]:
+        """Read the oldest records without removing them. Pass -1 to read all of them."""
+        records, _ = self._read(num_records)
+        return records
+
+    def pop(self, num_records: int = -1) -> List[Any]:
+        """Remove and return the oldest records. Pass -1 to take all of them."""
+        records, offset = self._read(num_records)
+        if not records:
+            return records
+        self.count -= len(records)
+        if self.count == 0:
+            # Start a fresh file so it doesn't grow forever
+            os.remove(self.path)
+            self.read_offset = 0
+        else:
+            self.read_offset = offset
+        return records
+
+    def clear(self):
+        """Remove all records."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.read_offset = 0
+        self.count = 0
+
+    def _read(self, num_records: int):
+        if self.count == 0 or num_records == 0:
+            return [], self.read_offset
+        if num_records < 0:
+            num_records = self.count
+        records = []
+        with open(self.path, "rb") as f:
+            f.seek(self.read_offset)
+            for _ in range(min(num_records, self.count)):
+                records.append(json.loads(f.readline()))
+            return records, f.tell()
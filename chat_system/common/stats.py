@@ -0,0 +1,12 @@
+import math
+from typing import Sequence
+
+
+def percentile(samples: Sequence[float], p: float) -> float:
+    """Nearest-rank percentile of the samples, p in [0, 100]."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    # The smallest sample with at least p% of them at or below it
+    k = min(len(ordered) - 1, max(0, math.ceil(p * len(ordered) / 100) - 1))
+    return ordered[k]
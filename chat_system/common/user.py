@@ -1,56 +1,483 @@
-from dataclasses import dataclass
-from typing import List
-from queue import Queue
+import base64
+import os
+import threading
+from bisect import bisect_left
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+from itertools import groupby, takewhile
+from operator import attrgetter
+from typing import Deque, Dict, List, Optional, Tuple
+from queue import Empty, Full, Queue
 
-@dataclass
+from .search import SearchIndex, scan
+from .segment import ColdMessage, Segment, SegmentStore
+from .spill import SpillFile
+
+# Notifications remembered per user, to replay to a subscriber that reconnects
+NOTIFICATION_LOG_SIZE = 1000
+# Makes sure a user's subscriber queue is only made once, it's created by whoever needs it first
+_SUBSCRIBER_QUEUE_LOCK = threading.Lock()
+
+# Slots make them quicker to build and smaller, there are millions of them in a loaded state
+@dataclass(slots=True)
 class Message:
     id: int
     sender: str
     content: str
 
+@dataclass(slots=True)
+class SentMessage(Message):
+    """A copy of a message kept for its sender, in their conversation with the receiver."""
+    receiver: str = ""
+
+class OverflowPolicy(Enum):
+    REJECT = "reject"  # Refuse the new message
+    DROP_OLDEST = "drop_oldest"  # Make room by discarding the oldest message
+    SPILL = "spill"  # Move unread messages that don't fit to disk
+
+class MailboxFullError(Exception):
+    """Raised when a message doesn't fit in a mailbox and the overflow policy is to reject it."""
+
+@dataclass
+class MailboxLimits:
+    # 0 means unbounded
+    max_unread_messages: int = 0
+    max_read_messages: int = 0
+    max_subscriber_queue: int = 0
+    overflow_policy: OverflowPolicy = OverflowPolicy.REJECT
+    spill_dir: str = "spill"
+    # Read messages kept in memory, older ones are moved to segment files. 0 keeps them all in memory
+    hot_read_messages: int = 0
+    segment_dir: str = "segments"
+
+@dataclass
+class BacklogStats:
+    rejected: int = 0
+    dropped: int = 0
+    spilled: int = 0
+
+@dataclass
+class Conversation:
+    """
+    A user's read and sent messages with one correspondent, in id order, and how many unread messages from them
+    are waiting. Unread messages join the conversation when they're popped.
+    """
+    messages: List[Message] = field(default_factory=list)
+    unread: int = 0
+
+    def replace(self, message):
+        """Swap in another object for the message with the same id, in place."""
+        i = bisect_left(self.messages, message.id, key=lambda m: m.id)
+        if i < len(self.messages) and self.messages[i].id == message.id:
+            self.messages[i] = message
+
+    def add(self, message: Message):
+        if not self.messages or self.messages[-1].id < message.id:
+            self.messages.append(message)
+            return
+        # Older than the newest, like an unread message popped late. A new list, so readers aren't disturbed
+        i = len(self.messages)
+        while i > 0 and self.messages[i - 1].id > message.id:
+            i -= 1
+        self.messages = self.messages[:i] + [message] + self.messages[i:]
+
+    def remove(self, message_ids: set):
+        self.messages = [m for m in self.messages if m.id not in message_ids]
+
+def _expired(messages: List[Message], max_messages: int, min_id: int, limit: int) -> int:
+    """How many of the oldest messages retention drops, up to limit. Only the oldest go, so ids are checked in order."""
+    count = min(limit, max(0, len(messages) - max_messages) if max_messages > 0 else 0)
+    while count < min(limit, len(messages)) and messages[count].id < min_id:
+        count += 1
+    return count
+
+def _page(messages: List[Message], offset: int, num_messages: int) -> List[Message]:
+    """num_messages messages ending offset messages from the newest, or all of them before that if it's < 0."""
+    n = len(messages)
+    # Cap to make sure we stay within bounds
+    offset = max(0, min(n, offset))
+    num_messages = min(num_messages, n-offset)
+    if num_messages < 0:
+        return messages[:n-offset]
+    else:
+        return messages[n-num_messages-offset:n-offset]
+
 @dataclass
 class User:
+    """
+    A user and their mailboxes. Writers must be serialized by the caller, but readers don't need a lock: the read
+    mailbox is only ever appended to in place, and anything that removes messages builds a new list instead. A
+    reader that takes the list and its length once sees a consistent view, whatever writers do afterwards.
+
+    With a hot_read_messages limit, the oldest read messages are moved to segment files and replaced in place by
+    ColdMessages, which read their sender and content back from the file. They're always at the start of the read
+    mailbox.
+    """
     name: str
     message_queue: List[Message]
     read_mailbox: List[Message]
-    message_subscriber_queue: Queue = Queue()
+    limits: MailboxLimits = field(default_factory=MailboxLimits)
+    _subscriber_queue: Optional[Queue] = field(default=None, init=False, repr=False, compare=False)
+    stats: BacklogStats = field(default_factory=BacklogStats, compare=False)
+    spill: Optional[SpillFile] = field(default=None, init=False, repr=False, compare=False)
+    # Unread messages in memory and on disk, kept up to date by writers so readers get it in one load
+    unread_count: int = field(default=0, init=False, repr=False, compare=False)
+    # Made on the first notification, like the subscriber queue
+    notification_log: Optional[Deque[Message]] = field(default=None, init=False, repr=False, compare=False)
+    index: Optional[SearchIndex] = field(default=None, repr=False, compare=False)  # Over the read mailbox
+    sent_messages: List[SentMessage] = field(default_factory=list)
+    # Built the first time it's asked for, since most users loaded from saved state never are
+    conversations: Optional[Dict[str, Conversation]] = field(default=None, init=False, repr=False, compare=False)
+    cold: Optional[SegmentStore] = field(default=None, init=False, repr=False, compare=False)
+    cold_count: int = field(default=0, init=False, repr=False, compare=False)  # ColdMessages in the read mailbox
+
+    def __post_init__(self):
+        self.unread_count = len(self.message_queue)
+        if self.index is not None:
+            self.index.add(self.read_mailbox)
+        # Saved state may hold more unread messages than fit in memory
+        max_unread = self.limits.max_unread_messages
+        if self.limits.overflow_policy == OverflowPolicy.SPILL and 0 < max_unread < len(self.message_queue):
+            self._spill(self.message_queue[max_unread:])
+            self.message_queue = self.message_queue[:max_unread]
+        self._cool()
+
+    @property
+    def message_subscriber_queue(self) -> Queue:
+        """Made on first use, since most users loaded from saved state never log in and a Queue is slow to make."""
+        subscriber_queue = self._subscriber_queue
+        if subscriber_queue is None:
+            with _SUBSCRIBER_QUEUE_LOCK:
+                # Each user needs their own queue, a shared default would deliver notifications to everyone
+                if self._subscriber_queue is None:
+                    self._subscriber_queue = Queue(self.limits.max_subscriber_queue)
+                subscriber_queue = self._subscriber_queue
+        return subscriber_queue
+
+    def _cool(self):
+        """Move the oldest read messages to disk if there are too many in memory."""
+        hot_limit = self.limits.hot_read_messages
+        # A little over the limit before moving any, so that they're written a batch at a time
+        if hot_limit <= 0 or len(self.read_mailbox) - self.cold_count <= hot_limit + max(1, hot_limit // 8):
+            return
+        start, end = self.cold_count, len(self.read_mailbox) - hot_limit
+        if self.cold is None:
+            self.cold = SegmentStore(self.limits.segment_dir, self.name)
+        messages = self.read_mailbox[start:end]
+        cold_messages = self.cold.append(messages)
+        # Replaced in place, readers see one or the other and either will do
+        self.read_mailbox[start:end] = cold_messages
+        self.cold_count = end
+        if self.index is not None:
+            self.index.replace(cold_messages)
+        for message, cold_message in zip(messages, cold_messages):
+            self._conversation(message.sender).replace(cold_message)
+
+    def _spill(self, messages: List[Message]):
+        if self.spill is None:
+            # Usernames can contain anything, so encode them to get a safe file name
+            filename = base64.urlsafe_b64encode(self.name.encode('utf-8')).decode('ascii') + ".spill"
+            self.spill = SpillFile(os.path.join(self.limits.spill_dir, filename))
+        self.spill.append([(m.id, m.sender, m.content) for m in messages])
+        self.stats.spilled += len(messages)
+
+    def _reject(self, mailbox: str):
+        self.stats.rejected += 1
+        raise MailboxFullError(f"{mailbox} for {self.name} is full")
+
+    def _spilled_count(self) -> int:
+        return len(self.spill) if self.spill is not None else 0
+
+    def index_conversations(self):
+        """
+        Build the conversation index if it isn't built yet. Writers have to be kept out while it's built, but only
+        the first time: from then on they keep it up to date.
+        """
+        if self.conversations is not None:
+            return
+        # Taken in id order, so each conversation's messages only need appending
+        by_correspondent: Dict[str, List[Message]] = {}
+        for message in sorted(self.read_mailbox + self.sent_messages, key=attrgetter('id')):
+            correspondent = message.receiver if isinstance(message, SentMessage) else message.sender
+            by_correspondent.setdefault(correspondent, []).append(message)
+        conversations = {correspondent: Conversation(messages)
+                         for correspondent, messages in by_correspondent.items()}
+        for message in self.get_unread_messages():
+            conversation = conversations.get(message.sender)
+            if conversation is None:
+                conversation = conversations[message.sender] = Conversation()
+            conversation.unread += 1
+        # Set once it's whole, readers see all of it or none
+        self.conversations = conversations
+
+    def _conversation(self, correspondent: str) -> Conversation:
+        if self.conversations is None:
+            # Nothing to keep up to date, the index is built from the mailboxes as they are when it's needed
+            return Conversation()
+        conversation = self.conversations.get(correspondent)
+        if conversation is None:
+            conversation = self.conversations[correspondent] = Conversation()
+        return conversation
+
+    def _conversation_of(self, message: Message) -> Conversation:
+        return self._conversation(message.receiver if isinstance(message, SentMessage) else message.sender)
+
+    def _forget(self, messages: List[Message]):
+        """Take messages that are gone out of the search index and conversations."""
+        if self.index is not None:
+            self.index.remove(m.id for m in messages)
+        by_conversation: Dict[str, set] = {}
+        for message in messages:
+            by_conversation.setdefault(message.receiver if isinstance(message, SentMessage) else message.sender,
+                                       set()).add(message.id)
+        for correspondent, message_ids in by_conversation.items():
+            self._conversation(correspondent).remove(message_ids)
 
     def add_message(self, message: Message):
-        self.message_queue.append(message)
+        max_unread = self.limits.max_unread_messages
+        if self._spilled_count() > 0:
+            # Anything newer than a spilled message has to go after it to keep the order
+            self._spill([message])
+        elif max_unread <= 0 or len(self.message_queue) < max_unread:
+            self.message_queue.append(message)
+        elif self.limits.overflow_policy == OverflowPolicy.DROP_OLDEST:
+            self._conversation(self.message_queue[0].sender).unread -= 1
+            self.message_queue = self.message_queue[1:] + [message]
+            self.stats.dropped += 1
+            self._conversation(message.sender).unread += 1
+            return
+        elif self.limits.overflow_policy == OverflowPolicy.SPILL:
+            self._spill([message])
+        else:
+            self._reject("Unread message queue")
+        self.unread_count += 1
+        self._conversation(message.sender).unread += 1
+
+    def _make_read_room(self, num_messages: int) -> int:
+        """Free up space in the read mailbox for new messages. Returns how many of them fit."""
+        max_read = self.limits.max_read_messages
+        if max_read <= 0:
+            return num_messages
+        excess = len(self.read_mailbox) + num_messages - max_read
+        if excess > 0 and self.limits.overflow_policy == OverflowPolicy.DROP_OLDEST:
+            # Even the new messages themselves get dropped if there are more than fit
+            dropped = min(excess, len(self.read_mailbox))
+            self._drop_oldest_read(dropped)
+            self.stats.dropped += dropped
+        # Read messages are accessed by offset, so they aren't spilled. Spill rejects like reject does.
+        # It can already be over the limit, loaded from state saved under a higher one
+        return max(0, min(num_messages, max_read - len(self.read_mailbox)))
+
+    def _drop_oldest_read(self, count: int) -> List[Message]:
+        dropped = self.read_mailbox[:count]
+        self._forget(dropped)
+        self.read_mailbox = self.read_mailbox[count:]
+        self.cold_count = max(0, self.cold_count - count)
+        return dropped
 
     def add_read_message(self, message: Message):
+        if self._make_read_room(1) < 1:
+            self._reject("Read mailbox")
         self.read_mailbox.append(message)
+        if self.index is not None:
+            self.index.add([message])
+        self._conversation(message.sender).add(message)
+        self._cool()
+
+    def deliver_online(self, message: Message) -> bool:
+        """
+        Deliver a message to a logged in user: store it as read and notify their subscriber.
+        Returns False if it was stored as unread instead because the subscriber isn't keeping up.
+        """
+        if self.message_subscriber_queue.full():
+            if self.limits.overflow_policy == OverflowPolicy.DROP_OLDEST:
+                try:
+                    self.message_subscriber_queue.get_nowait()
+                    self.stats.dropped += 1
+                except Empty:
+                    pass
+            elif self.limits.overflow_policy == OverflowPolicy.SPILL:
+                # The subscriber can't keep up, so deliver it like the user were offline
+                self.add_message(message)
+                return False
+            else:
+                self._reject("Subscriber queue")
+
+        self.add_read_message(message)
+        self.log_notification(message)
+        try:
+            self.message_subscriber_queue.put_nowait(message)
+        except Full:
+            # Lost a race with another sender. The message is still in the read mailbox
+            self.stats.dropped += 1
+        return True
 
     def pop_unread_messages(self, num_messages: int) -> List[Message]:
+        spilled = self._spilled_count()
         if num_messages < 0:
-            messages = self.message_queue
-            self.message_queue = []
-        else:
-            num_messages = min(num_messages, len(self.message_queue))
-            messages = self.message_queue[:num_messages]
-            self.message_queue = self.message_queue[num_messages:]
+            num_messages = len(self.message_queue) + spilled
+        num_messages = min(num_messages, len(self.message_queue) + spilled)
+        fits = self._make_read_room(num_messages)
+        if num_messages > 0 and fits < 1:
+            self._reject("Read mailbox")
+        num_messages = fits
+
+        messages = self.message_queue[:num_messages]
+        self.message_queue = self.message_queue[num_messages:]
+        if spilled:
+            if len(messages) < num_messages:
+                messages.extend(Message(*m) for m in self.spill.pop(num_messages - len(messages)))
+            # Refill the in-memory queue from disk
+            max_unread = self.limits.max_unread_messages
+            refill = max_unread - len(self.message_queue) if max_unread > 0 else -1
+            self.message_queue.extend(Message(*m) for m in self.spill.pop(refill))
         self.read_mailbox.extend(messages)
+        if self.index is not None:
+            self.index.add(messages)
+        for message in messages:
+            conversation = self._conversation(message.sender)
+            conversation.add(message)
+            conversation.unread -= 1
+        self.unread_count -= len(messages)
+        self._cool()
         return messages
 
+    def log_notification(self, message: Message):
+        """Remember a notification, to replay to a subscriber that reconnects."""
+        if self.notification_log is None:
+            self.notification_log = deque(maxlen=NOTIFICATION_LOG_SIZE)
+        self.notification_log.append(message)
+
+    def get_notifications_after(self, message_id: int) -> List[Message]:
+        """
+        Notifications sent after the one for message_id. Only looks back as far as that one, so catching up
+        costs as much as was missed. If it's too old to be remembered, returns everything that is.
+        """
+        missed = []
+        for message in reversed(self.notification_log or ()):
+            if message.id == message_id:
+                break
+            missed.append(message)
+        missed.reverse()
+        return missed
+
+    def get_unread_messages(self) -> List[Message]:
+        """All unread messages, including any spilled to disk, without popping them."""
+        if self._spilled_count() == 0:
+            return list(self.message_queue)
+        return self.message_queue + [Message(*m) for m in self.spill.peek()]
+
     def get_number_of_unread_messages(self) -> int:
-        return len(self.message_queue)
+        return self.unread_count
 
     def get_number_of_read_messages(self) -> int:
         return len(self.read_mailbox)
 
     def get_read_messages(self, offset: int, num_messages: int) -> List[Message]:
-        n = len(self.read_mailbox)
-        # Cap to make sure we stay within bounds
-        offset = max(0, min(n, offset))
-        num_messages = min(num_messages, n-offset)
-        if num_messages < 0:
-            return self.read_mailbox[:n-offset]
-        else:
-            return self.read_mailbox[n-num_messages-offset:n-offset]
+        # The list is taken once, and only what was in it then is looked at
+        return _page(self.read_mailbox, offset, num_messages)
+
+    def add_sent_message(self, message: SentMessage):
+        self.sent_messages.append(message)
+        self._conversation(message.receiver).add(message)
+
+    def get_conversation(self, correspondent: str, offset: int, num_messages: int) -> List[Message]:
+        """Read and sent messages with a correspondent, paged like the read mailbox."""
+        self.index_conversations()
+        conversation = self.conversations.get(correspondent)
+        return _page(conversation.messages, offset, num_messages) if conversation else []
+
+    def get_number_of_unread_messages_from(self, correspondent: str) -> int:
+        self.index_conversations()
+        conversation = self.conversations.get(correspondent)
+        return conversation.unread if conversation else 0
+
+    def get_unread_counts(self) -> Dict[str, int]:
+        """Number of unread messages from each correspondent who has sent any."""
+        self.index_conversations()
+        return {name: c.unread for name, c in list(self.conversations.items()) if c.unread > 0}
 
     def delete_messages(self, message_ids: List[int]):
-        for id in message_ids:
-            for message in self.read_mailbox:
-                if message.id == id:
-                    self.read_mailbox.remove(message)
-                    break
+        """Delete read or sent messages."""
+        self.remove_messages(message_ids, message_ids)
+
+    def remove_messages(self, read_ids: List[int], sent_ids: List[int]):
+        """Remove the read messages with some ids, and the sent messages with others."""
+        read_ids, sent_ids = set(read_ids), set(sent_ids)
+        deleted = [m for m in self.read_mailbox if m.id in read_ids]
+        if deleted:
+            self.read_mailbox = [m for m in self.read_mailbox if m.id not in read_ids]
+            # Their records stay in the segment files until they're compacted
+            self.cold_count -= sum(1 for m in deleted if isinstance(m, ColdMessage))
+        deleted_sent = [m for m in self.sent_messages if m.id in sent_ids]
+        if deleted_sent:
+            self.sent_messages = [m for m in self.sent_messages if m.id not in sent_ids]
+        self._forget(deleted + deleted_sent)
+
+    def trim(self, max_messages: int, min_id: int, limit: int) -> List[Message]:
+        """
+        Remove up to limit of the oldest read and sent messages that retention no longer keeps: any past the newest
+        max_messages of each (0 keeps any number), and any with an id below min_id. Returns what was removed.
+        """
+        read = _expired(self.read_mailbox, max_messages, min_id, limit)
+        sent = _expired(self.sent_messages, max_messages, min_id, limit - read)
+        removed = self._drop_oldest_read(read) if read else []
+        if sent:
+            removed_sent = self.sent_messages[:sent]
+            self.sent_messages = self.sent_messages[sent:]
+            self._forget(removed_sent)
+            removed += removed_sent
+        return removed
+
+    def cold_runs(self) -> List[Tuple[Segment, int, List[ColdMessage]]]:
+        """
+        The messages in each segment file that are still in the read mailbox, with where the first of them is.
+        They're next to each other, in the order they were moved out. Doesn't need a lock.
+        """
+        # The count can be ahead of the mailbox for a moment while messages are removed
+        cold = takewhile(lambda m: isinstance(m, ColdMessage), self.read_mailbox[:self.cold_count])
+        runs = []
+        start = 0
+        for segment, messages in groupby(cold, key=attrgetter('segment')):
+            messages = list(messages)
+            runs.append((segment, start, messages))
+            start += len(messages)
+        return runs
+
+    def replace_cold(self, old_messages: List[ColdMessage], new_messages: List[ColdMessage], position: int) -> int:
+        """
+        Swap in copies of messages from a segment that's been compacted, given where the first of them was in the
+        read mailbox. Ones deleted since are skipped. Returns where the message after the last is likely to be.
+        """
+        mailbox = self.read_mailbox
+        for old, new in zip(old_messages, new_messages):
+            if position >= len(mailbox) or mailbox[position] is not old:
+                # Earlier messages were removed since, so it's moved up, or it was removed itself
+                try:
+                    position = mailbox.index(old, 0, self.cold_count)
+                except ValueError:
+                    continue
+            # In place, readers see one or the other and either will do
+            mailbox[position] = new
+            self._conversation(old.sender).replace(new)
+            position += 1
+        if self.index is not None:
+            self.index.replace(new_messages)
+        return position
+
+    def search_messages(self, query: str, limit: int, cursor: int):
+        """Read messages containing every word of the query, newest first, and the cursor for the next page."""
+        if self.index is None:
+            return scan(self.read_mailbox, query, limit, cursor)
+        return self.index.search(query, limit, cursor)
+
+    def discard_spill(self):
+        """Delete any messages spilled or moved to disk."""
+        if self.spill is not None:
+            self.unread_count -= len(self.spill)
+            self.spill.clear()
+            self.spill = None
+        if self.cold is not None:
+            self.cold.clear()
+            self.cold = None
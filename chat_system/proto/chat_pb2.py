@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
+# source: chat_system/proto/chat.proto
+# Protobuf Python Version: 7.35.1
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import runtime_version as _runtime_version
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    7,
+    35,
+    1,
+    '',
+    'chat_system/proto/chat.proto'
+)
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x1c\x63hat_system/proto/chat.proto\x12\x04\x63hat\":\n\x14\x43reateAccountRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\"5\n\x15\x43reateAccountResponse\x12\x12\n\x05\x65rror\x18\x01 \x01(\tH\x00\x88\x01\x01\x42\x08\n\x06_error\"2\n\x0cLoginRequest\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08password\x18\x02 \x01(\t\"-\n\rLoginResponse\x12\x12\n\x05\x65rror\x18\x01 \x01(\tH\x00\x88\x01\x01\x42\x08\n\x06_error\"\x0f\n\rLogoutRequest\"\x10\n\x0eLogoutResponse\"\x16\n\x14\x44\x65leteAccountRequest\"\x17\n\x15\x44\x65leteAccountResponse\"V\n\x10ListUsersRequest\x12\x0f\n\x07pattern\x18\x01 \x01(\t\x12\x0e\n\x06offset\x18\x02 \x01(\x05\x12\r\n\x05limit\x18\x03 \x01(\x05\x12\x12\n\nlocal_only\x18\x04 \x01(\x08\"&\n\x11ListUsersResponse\x12\x11\n\tusernames\x18\x01 \x03(\t\"7\n\x12SendMessageRequest\x12\x10\n\x08receiver\x18\x01 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x02 \x01(\t\"\x15\n\x13SendMessageResponse\"I\n\x15\x44\x65liverMessageRequest\x12\x1e\n\x07message\x18\x01 \x01(\x0b\x32\r.chat.Message\x12\x10\n\x08receiver\x18\x02 \x01(\t\"\x18\n\x16\x44\x65liverMessageResponse\"6\n\x07Message\x12\n\n\x02id\x18\x01 \x01(\x05\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x03 \x01(\t\"\\\n\x0cMessageBatch\x12\x0f\n\x07senders\x18\x01 \x03(\t\x12\x16\n\x0esender_indices\x18\x02 \x03(\r\x12\x11\n\tid_deltas\x18\x03 \x03(\x11\x12\x10\n\x08\x63ontents\x18\x04 \x03(\t\"\"\n GetNumberOfUnreadMessagesRequest\"2\n!GetNumberOfUnreadMessagesResponse\x12\r\n\x05\x63ount\x18\x01 \x01(\x05\" \n\x1eGetNumberOfReadMessagesRequest\"0\n\x1fGetNumberOfReadMessagesResponse\x12\r\n\x05\x63ount\x18\x01 \x01(\x05\"A\n\x18PopUnreadMessagesRequest\x12\x14\n\x0cnum_messages\x18\x01 \x01(\x05\x12\x0f\n\x07\x63ompact\x18\x02 \x01(\x08\"_\n\x19PopUnreadMessagesResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\x12!\n\x05\x62\x61tch\x18\x02 \x01(\x0b\x32\x12.chat.MessageBatch\"O\n\x16GetReadMessagesRequest\x12\x0e\n\x06offset\x18\x01 \x01(\x05\x12\x14\n\x0cnum_messages\x18\x02 \x01(\x05\x12\x0f\n\x07\x63ompact\x18\x03 \x01(\x08\"]\n\x17GetReadMessagesResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\x12!\n\x05\x62\x61tch\x18\x02 \x01(\x0b\x32\x12.chat.MessageBatch\",\n\x15\x44\x65leteMessagesRequest\x12\x13\n\x0bmessage_ids\x18\x01 \x03(\x05\"\x18\n\x16\x44\x65leteMessagesResponse\"f\n\x16GetConversationRequest\x12\x15\n\rcorrespondent\x18\x01 \x01(\t\x12\x0e\n\x06offset\x18\x02 \x01(\x05\x12\x14\n\x0cnum_messages\x18\x03 \x01(\x05\x12\x0f\n\x07\x63ompact\x18\x04 \x01(\x08\"m\n\x17GetConversationResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\x12!\n\x05\x62\x61tch\x18\x02 \x01(\x0b\x32\x12.chat.MessageBatch\x12\x0e\n\x06unread\x18\x03 \x01(\x05\"\x18\n\x16GetUnreadCountsRequest\"\x83\x01\n\x17GetUnreadCountsResponse\x12\x39\n\x06\x63ounts\x18\x01 \x03(\x0b\x32).chat.GetUnreadCountsResponse.CountsEntry\x1a-\n\x0b\x43ountsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x05:\x02\x38\x01\"\'\n\x14\x43reateChannelRequest\x12\x0f\n\x07\x63hannel\x18\x01 \x01(\t\"5\n\x15\x43reateChannelResponse\x12\x12\n\x05\x65rror\x18\x01 \x01(\tH\x00\x88\x01\x01\x42\x08\n\x06_error\"%\n\x12JoinChannelRequest\x12\x0f\n\x07\x63hannel\x18\x01 \x01(\t\"3\n\x13JoinChannelResponse\x12\x12\n\x05\x65rror\x18\x01 \x01(\tH\x00\x88\x01\x01\x42\x08\n\x06_error\"&\n\x13LeaveChannelRequest\x12\x0f\n\x07\x63hannel\x18\x01 \x01(\t\"4\n\x14LeaveChannelResponse\x12\x12\n\x05\x65rror\x18\x01 \x01(\tH\x00\x88\x01\x01\x42\x08\n\x06_error\"=\n\x19SendChannelMessageRequest\x12\x0f\n\x07\x63hannel\x18\x01 \x01(\t\x12\x0f\n\x07\x63ontent\x18\x02 \x01(\t\":\n\x1aSendChannelMessageResponse\x12\x12\n\x05\x65rror\x18\x01 \x01(\tH\x00\x88\x01\x01\x42\x08\n\x06_error\"T\n\x1aReadChannelMessagesRequest\x12\x0f\n\x07\x63hannel\x18\x01 \x01(\t\x12\x14\n\x0cnum_messages\x18\x02 \x01(\x05\x12\x0f\n\x07\x63ompact\x18\x03 \x01(\x08\"a\n\x1bReadChannelMessagesResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\x12!\n\x05\x62\x61tch\x18\x02 \x01(\x0b\x32\x12.chat.MessageBatch\"b\n\x18GetChannelHistoryRequest\x12\x0f\n\x07\x63hannel\x18\x01 \x01(\t\x12\x0e\n\x06offset\x18\x02 \x01(\x05\x12\x14\n\x0cnum_messages\x18\x03 \x01(\x05\x12\x0f\n\x07\x63ompact\x18\x04 \x01(\x08\"_\n\x19GetChannelHistoryResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\x12!\n\x05\x62\x61tch\x18\x02 \x01(\x0b\x32\x12.chat.MessageBatch\"\x15\n\x13ListChannelsRequest\"<\n\x0b\x43hannelInfo\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0f\n\x07members\x18\x02 \x01(\x05\x12\x0e\n\x06unread\x18\x03 \x01(\x05\";\n\x14ListChannelsResponse\x12#\n\x08\x63hannels\x18\x01 \x03(\x0b\x32\x11.chat.ChannelInfo\"V\n\x15SearchMessagesRequest\x12\r\n\x05query\x18\x01 \x01(\t\x12\r\n\x05limit\x18\x02 \x01(\x05\x12\x0e\n\x06\x63ursor\x18\x03 \x01(\x05\x12\x0f\n\x07\x63ompact\x18\x04 \x01(\x08\"q\n\x16SearchMessagesResponse\x12\x1f\n\x08messages\x18\x01 \x03(\x0b\x32\r.chat.Message\x12!\n\x05\x62\x61tch\x18\x02 \x01(\x0b\x32\x12.chat.MessageBatch\x12\x13\n\x0bnext_cursor\x18\x03 \x01(\x05\">\n\x10SubscribeRequest\x12\x19\n\x0clast_seen_id\x18\x01 \x01(\x05H\x00\x88\x01\x01\x42\x0f\n\r_last_seen_id\"Y\n\x13MessageNotification\x12\x1e\n\x07message\x18\x01 \x01(\x0b\x32\r.chat.Message\x12\x11\n\theartbeat\x18\x02 \x01(\x08\x12\x0f\n\x07\x63hannel\x18\x03 \x01(\t\"+\n\x16StreamMutationsRequest\x12\x11\n\tafter_seq\x18\x01 \x01(\x03\"\xd2\x04\n\x08Mutation\x12\x0b\n\x03seq\x18\x01 \x01(\x03\x12\x11\n\ttimestamp\x18\x02 \x01(\x01\x12\x12\n\x08snapshot\x18\x03 \x01(\x0cH\x00\x12/\n\x0e\x63reate_account\x18\x04 \x01(\x0b\x32\x15.chat.AccountMutationH\x00\x12\x18\n\x0e\x64\x65lete_account\x18\x05 \x01(\tH\x00\x12(\n\x07\x64\x65liver\x18\x06 \x01(\x0b\x32\x15.chat.DeliverMutationH\x00\x12 \n\x03pop\x18\x07 \x01(\x0b\x32\x11.chat.PopMutationH\x00\x12\x37\n\x0f\x64\x65lete_messages\x18\x08 \x01(\x0b\x32\x1c.chat.DeleteMessagesMutationH\x00\x12%\n\x04sent\x18\t \x01(\x0b\x32\x15.chat.DeliverMutationH\x00\x12/\n\x0e\x63reate_channel\x18\n \x01(\x0b\x32\x15.chat.ChannelMutationH\x00\x12-\n\x0cjoin_channel\x18\x0b \x01(\x0b\x32\x15.chat.ChannelMutationH\x00\x12.\n\rleave_channel\x18\x0c \x01(\x0b\x32\x15.chat.ChannelMutationH\x00\x12\x30\n\x0f\x63hannel_message\x18\r \x01(\x0b\x32\x15.chat.DeliverMutationH\x00\x12-\n\x0cread_channel\x18\x0e \x01(\x0b\x32\x15.chat.ChannelMutationH\x00\x12\"\n\x04trim\x18\x0f \x01(\x0b\x32\x12.chat.TrimMutationH\x00\x42\x06\n\x04kind\"D\n\x0f\x43hannelMutation\x12\x0f\n\x07\x63hannel\x18\x01 \x01(\t\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x0e\n\x06\x63ursor\x18\x03 \x01(\x05\"H\n\x0f\x41\x63\x63ountMutation\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x15\n\rpassword_hash\x18\x02 \x01(\x0c\x12\x0c\n\x04salt\x18\x03 \x01(\x0c\"Q\n\x0f\x44\x65liverMutation\x12\x10\n\x08receiver\x18\x01 \x01(\t\x12\x1e\n\x07message\x18\x02 \x01(\x0b\x32\r.chat.Message\x12\x0c\n\x04read\x18\x03 \x01(\x08\"5\n\x0bPopMutation\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x14\n\x0cnum_messages\x18\x02 \x01(\x05\"?\n\x16\x44\x65leteMessagesMutation\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x13\n\x0bmessage_ids\x18\x02 \x03(\x05\"D\n\x0cTrimMutation\x12\x10\n\x08username\x18\x01 \x01(\t\x12\x10\n\x08read_ids\x18\x02 \x03(\x05\x12\x10\n\x08sent_ids\x18\x03 \x03(\x05\"\x10\n\x0ePromoteRequest\"\x11\n\x0fPromoteResponse2\xad\x0f\n\x0b\x43hatService\x12J\n\rCreateAccount\x12\x1a.chat.CreateAccountRequest\x1a\x1b.chat.CreateAccountResponse\"\x00\x12\x32\n\x05Login\x12\x12.chat.LoginRequest\x1a\x13.chat.LoginResponse\"\x00\x12\x35\n\x06Logout\x12\x13.chat.LogoutRequest\x1a\x14.chat.LogoutResponse\"\x00\x12J\n\rDeleteAccount\x12\x1a.chat.DeleteAccountRequest\x1a\x1b.chat.DeleteAccountResponse\"\x00\x12>\n\tListUsers\x12\x16.chat.ListUsersRequest\x1a\x17.chat.ListUsersResponse\"\x00\x12\x44\n\x0bSendMessage\x12\x18.chat.SendMessageRequest\x1a\x19.chat.SendMessageResponse\"\x00\x12n\n\x19GetNumberOfUnreadMessages\x12&.chat.GetNumberOfUnreadMessagesRequest\x1a\'.chat.GetNumberOfUnreadMessagesResponse\"\x00\x12h\n\x17GetNumberOfReadMessages\x12$.chat.GetNumberOfReadMessagesRequest\x1a%.chat.GetNumberOfReadMessagesResponse\"\x00\x12V\n\x11PopUnreadMessages\x12\x1e.chat.PopUnreadMessagesRequest\x1a\x1f.chat.PopUnreadMessagesResponse\"\x00\x12P\n\x0fGetReadMessages\x12\x1c.chat.GetReadMessagesRequest\x1a\x1d.chat.GetReadMessagesResponse\"\x00\x12M\n\x0e\x44\x65leteMessages\x12\x1b.chat.DeleteMessagesRequest\x1a\x1c.chat.DeleteMessagesResponse\"\x00\x12M\n\x0eSearchMessages\x12\x1b.chat.SearchMessagesRequest\x1a\x1c.chat.SearchMessagesResponse\"\x00\x12P\n\x0fGetConversation\x12\x1c.chat.GetConversationRequest\x1a\x1d.chat.GetConversationResponse\"\x00\x12P\n\x0fGetUnreadCounts\x12\x1c.chat.GetUnreadCountsRequest\x1a\x1d.chat.GetUnreadCountsResponse\"\x00\x12J\n\rCreateChannel\x12\x1a.chat.CreateChannelRequest\x1a\x1b.chat.CreateChannelResponse\"\x00\x12\x44\n\x0bJoinChannel\x12\x18.chat.JoinChannelRequest\x1a\x19.chat.JoinChannelResponse\"\x00\x12G\n\x0cLeaveChannel\x12\x19.chat.LeaveChannelRequest\x1a\x1a.chat.LeaveChannelResponse\"\x00\x12Y\n\x12SendChannelMessage\x12\x1f.chat.SendChannelMessageRequest\x1a .chat.SendChannelMessageResponse\"\x00\x12\\\n\x13ReadChannelMessages\x12 .chat.ReadChannelMessagesRequest\x1a!.chat.ReadChannelMessagesResponse\"\x00\x12V\n\x11GetChannelHistory\x12\x1e.chat.GetChannelHistoryRequest\x1a\x1f.chat.GetChannelHistoryResponse\"\x00\x12G\n\x0cListChannels\x12\x19.chat.ListChannelsRequest\x1a\x1a.chat.ListChannelsResponse\"\x00\x12L\n\x13SubscribeToMessages\x12\x16.chat.SubscribeRequest\x1a\x19.chat.MessageNotification\"\x00\x30\x01\x12M\n\x0e\x44\x65liverMessage\x12\x1b.chat.DeliverMessageRequest\x1a\x1c.chat.DeliverMessageResponse\"\x00\x12\x43\n\x0fStreamMutations\x12\x1c.chat.StreamMutationsRequest\x1a\x0e.chat.Mutation\"\x00\x30\x01\x12\x38\n\x07Promote\x12\x14.chat.PromoteRequest\x1a\x15.chat.PromoteResponse\"\x00\x62\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'chat_system.proto.chat_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  DESCRIPTOR._loaded_options = None
+  _globals['_GETUNREADCOUNTSRESPONSE_COUNTSENTRY']._loaded_options = None
+  _globals['_GETUNREADCOUNTSRESPONSE_COUNTSENTRY']._serialized_options = b'8\001'
+  _globals['_CREATEACCOUNTREQUEST']._serialized_start=38
+  _globals['_CREATEACCOUNTREQUEST']._serialized_end=96
+  _globals['_CREATEACCOUNTRESPONSE']._serialized_start=98
+  _globals['_CREATEACCOUNTRESPONSE']._serialized_end=151
+  _globals['_LOGINREQUEST']._serialized_start=153
+  _globals['_LOGINREQUEST']._serialized_end=203
+  _globals['_LOGINRESPONSE']._serialized_start=205
+  _globals['_LOGINRESPONSE']._serialized_end=250
+  _globals['_LOGOUTREQUEST']._serialized_start=252
+  _globals['_LOGOUTREQUEST']._serialized_end=267
+  _globals['_LOGOUTRESPONSE']._serialized_start=269
+  _globals['_LOGOUTRESPONSE']._serialized_end=285
+  _globals['_DELETEACCOUNTREQUEST']._serialized_start=287
+  _globals['_DELETEACCOUNTREQUEST']._serialized_end=309
+  _globals['_DELETEACCOUNTRESPONSE']._serialized_start=311
+  _globals['_DELETEACCOUNTRESPONSE']._serialized_end=334
+  _globals['_LISTUSERSREQUEST']._serialized_start=336
+  _globals['_LISTUSERSREQUEST']._serialized_end=422
+  _globals['_LISTUSERSRESPONSE']._serialized_start=424
+  _globals['_LISTUSERSRESPONSE']._serialized_end=462
+  _globals['_SENDMESSAGEREQUEST']._serialized_start=464
+  _globals['_SENDMESSAGEREQUEST']._serialized_end=519
+  _globals['_SENDMESSAGERESPONSE']._serialized_start=521
+  _globals['_SENDMESSAGERESPONSE']._serialized_end=542
+  _globals['_DELIVERMESSAGEREQUEST']._serialized_start=544
+  _globals['_DELIVERMESSAGEREQUEST']._serialized_end=617
+  _globals['_DELIVERMESSAGERESPONSE']._serialized_start=619
+  _globals['_DELIVERMESSAGERESPONSE']._serialized_end=643
+  _globals['_MESSAGE']._serialized_start=645
+  _globals['_MESSAGE']._serialized_end=699
+  _globals['_MESSAGEBATCH']._serialized_start=701
+  _globals['_MESSAGEBATCH']._serialized_end=793
+  _globals['_GETNUMBEROFUNREADMESSAGESREQUEST']._serialized_start=795
+  _globals['_GETNUMBEROFUNREADMESSAGESREQUEST']._serialized_end=829
+  _globals['_GETNUMBEROFUNREADMESSAGESRESPONSE']._serialized_start=831
+  _globals['_GETNUMBEROFUNREADMESSAGESRESPONSE']._serialized_end=881
+  _globals['_GETNUMBEROFREADMESSAGESREQUEST']._serialized_start=883
+  _globals['_GETNUMBEROFREADMESSAGESREQUEST']._serialized_end=915
+  _globals['_GETNUMBEROFREADMESSAGESRESPONSE']._serialized_start=917
+  _globals['_GETNUMBEROFREADMESSAGESRESPONSE']._serialized_end=965
+  _globals['_POPUNREADMESSAGESREQUEST']._serialized_start=967
+  _globals['_POPUNREADMESSAGESREQUEST']._serialized_end=1032
+  _globals['_POPUNREADMESSAGESRESPONSE']._serialized_start=1034
+  _globals['_POPUNREADMESSAGESRESPONSE']._serialized_end=1129
+  _globals['_GETREADMESSAGESREQUEST']._serialized_start=1131
+  _globals['_GETREADMESSAGESREQUEST']._serialized_end=1210
+  _globals['_GETREADMESSAGESRESPONSE']._serialized_start=1212
+  _globals['_GETREADMESSAGESRESPONSE']._serialized_end=1305
+  _globals['_DELETEMESSAGESREQUEST']._serialized_start=1307
+  _globals['_DELETEMESSAGESREQUEST']._serialized_end=1351
+  _globals['_DELETEMESSAGESRESPONSE']._serialized_start=1353
+  _globals['_DELETEMESSAGESRESPONSE']._serialized_end=1377
+  _globals['_GETCONVERSATIONREQUEST']._serialized_start=1379
+  _globals['_GETCONVERSATIONREQUEST']._serialized_end=1481
+  _globals['_GETCONVERSATIONRESPONSE']._serialized_start=1483
+  _globals['_GETCONVERSATIONRESPONSE']._serialized_end=1592
+  _globals['_GETUNREADCOUNTSREQUEST']._serialized_start=1594
+  _globals['_GETUNREADCOUNTSREQUEST']._serialized_end=1618
+  _globals['_GETUNREADCOUNTSRESPONSE']._serialized_start=1621
+  _globals['_GETUNREADCOUNTSRESPONSE']._serialized_end=1752
+  _globals['_GETUNREADCOUNTSRESPONSE_COUNTSENTRY']._serialized_start=1707
+  _globals['_GETUNREADCOUNTSRESPONSE_COUNTSENTRY']._serialized_end=1752
+  _globals['_CREATECHANNELREQUEST']._serialized_start=1754
+  _globals['_CREATECHANNELREQUEST']._serialized_end=1793
+  _globals['_CREATECHANNELRESPONSE']._serialized_start=1795
+  _globals['_CREATECHANNELRESPONSE']._serialized_end=1848
+  _globals['_JOINCHANNELREQUEST']._serialized_start=1850
+  _globals['_JOINCHANNELREQUEST']._serialized_end=1887
+  _globals['_JOINCHANNELRESPONSE']._serialized_start=1889
+  _globals['_JOINCHANNELRESPONSE']._serialized_end=1940
+  _globals['_LEAVECHANNELREQUEST']._serialized_start=1942
+  _globals['_LEAVECHANNELREQUEST']._serialized_end=1980
+  _globals['_LEAVECHANNELRESPONSE']._serialized_start=1982
+  _globals['_LEAVECHANNELRESPONSE']._serialized_end=2034
+  _globals['_SENDCHANNELMESSAGEREQUEST']._serialized_start=2036
+  _globals['_SENDCHANNELMESSAGEREQUEST']._serialized_end=2097
+  _globals['_SENDCHANNELMESSAGERESPONSE']._serialized_start=2099
+  _globals['_SENDCHANNELMESSAGERESPONSE']._serialized_end=2157
+  _globals['_READCHANNELMESSAGESREQUEST']._serialized_start=2159
+  _globals['_READCHANNELMESSAGESREQUEST']._serialized_end=2243
+  _globals['_READCHANNELMESSAGESRESPONSE']._serialized_start=2245
+  _globals['_READCHANNELMESSAGESRESPONSE']._serialized_end=2342
+  _globals['_GETCHANNELHISTORYREQUEST']._serialized_start=2344
+  _globals['_GETCHANNELHISTORYREQUEST']._serialized_end=2442
+  _globals['_GETCHANNELHISTORYRESPONSE']._serialized_start=2444
+  _globals['_GETCHANNELHISTORYRESPONSE']._serialized_end=2539
+  _globals['_LISTCHANNELSREQUEST']._serialized_start=2541
+  _globals['_LISTCHANNELSREQUEST']._serialized_end=2562
+  _globals['_CHANNELINFO']._serialized_start=2564
+  _globals['_CHANNELINFO']._serialized_end=2624
+  _globals['_LISTCHANNELSRESPONSE']._serialized_start=2626
+  _globals['_LISTCHANNELSRESPONSE']._serialized_end=2685
+  _globals['_SEARCHMESSAGESREQUEST']._serialized_start=2687
+  _globals['_SEARCHMESSAGESREQUEST']._serialized_end=2773
+  _globals['_SEARCHMESSAGESRESPONSE']._serialized_start=2775
+  _globals['_SEARCHMESSAGESRESPONSE']._serialized_end=2888
+  _globals['_SUBSCRIBEREQUEST']._serialized_start=2890
+  _globals['_SUBSCRIBEREQUEST']._serialized_end=2952
+  _globals['_MESSAGENOTIFICATION']._serialized_start=2954
+  _globals['_MESSAGENOTIFICATION']._serialized_end=3043
+  _globals['_STREAMMUTATIONSREQUEST']._serialized_start=3045
+  _globals['_STREAMMUTATIONSREQUEST']._serialized_end=3088
+  _globals['_MUTATION']._serialized_start=3091
+  _globals['_MUTATION']._serialized_end=3685
+  _globals['_CHANNELMUTATION']._serialized_start=3687
+  _globals['_CHANNELMUTATION']._serialized_end=3755
+  _globals['_ACCOUNTMUTATION']._serialized_start=3757
+  _globals['_ACCOUNTMUTATION']._serialized_end=3829
+  _globals['_DELIVERMUTATION']._serialized_start=3831
+  _globals['_DELIVERMUTATION']._serialized_end=3912
+  _globals['_POPMUTATION']._serialized_start=3914
+  _globals['_POPMUTATION']._serialized_end=3967
+  _globals['_DELETEMESSAGESMUTATION']._serialized_start=3969
+  _globals['_DELETEMESSAGESMUTATION']._serialized_end=4032
+  _globals['_TRIMMUTATION']._serialized_start=4034
+  _globals['_TRIMMUTATION']._serialized_end=4102
+  _globals['_PROMOTEREQUEST']._serialized_start=4104
+  _globals['_PROMOTEREQUEST']._serialized_end=4120
+  _globals['_PROMOTERESPONSE']._serialized_start=4122
+  _globals['_PROMOTERESPONSE']._serialized_end=4139
+  _globals['_CHATSERVICE']._serialized_start=4142
+  _globals['_CHATSERVICE']._serialized_end=6107
+# @@protoc_insertion_point(module_scope)
@@ -0,0 +1,1136 @@
+# Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
+"""Client and server classes corresponding to protobuf-defined services."""
+import grpc
+import warnings
+
+from chat_system.proto import chat_pb2 as chat__system_dot_proto_dot_chat__pb2
+
+GRPC_GENERATED_VERSION = '1.84.0'
+GRPC_VERSION = grpc.__version__
+_version_not_supported = False
+
+try:
+    from grpc._utilities import first_version_is_lower
+    _version_not_supported = first_version_is_lower(GRPC_VERSION, GRPC_GENERATED_VERSION)
+except ImportError:
+    _version_not_supported = True
+
+if _version_not_supported:
+    raise RuntimeError(
+        f'The grpc package installed is at version {GRPC_VERSION},'
+        + ' but the generated code in chat_system/proto/chat_pb2_grpc.py depends on'
+        + f' grpcio>={GRPC_GENERATED_VERSION}.'
+        + f' Please upgrade your grpc module to grpcio>={GRPC_GENERATED_VERSION}'
+        + f' or downgrade your generated code using grpcio-tools<={GRPC_VERSION}.'
+    )
+
+
+class ChatServiceStub:
+    """Missing associated documentation comment in .proto file."""
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.CreateAccount = channel.unary_unary(
+                '/chat.ChatService/CreateAccount',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.CreateAccountRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.CreateAccountResponse.FromString,
+                _registered_method=True)
+        self.Login = channel.unary_unary(
+                '/chat.ChatService/Login',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.LoginRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.LoginResponse.FromString,
+                _registered_method=True)
+        self.Logout = channel.unary_unary(
+                '/chat.ChatService/Logout',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.LogoutRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.LogoutResponse.FromString,
+                _registered_method=True)
+        self.DeleteAccount = channel.unary_unary(
+                '/chat.ChatService/DeleteAccount',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.DeleteAccountRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.DeleteAccountResponse.FromString,
+                _registered_method=True)
+        self.ListUsers = channel.unary_unary(
+                '/chat.ChatService/ListUsers',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.ListUsersRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.ListUsersResponse.FromString,
+                _registered_method=True)
+        self.SendMessage = channel.unary_unary(
+                '/chat.ChatService/SendMessage',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.SendMessageRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.SendMessageResponse.FromString,
+                _registered_method=True)
+        self.GetNumberOfUnreadMessages = channel.unary_unary(
+                '/chat.ChatService/GetNumberOfUnreadMessages',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.GetNumberOfUnreadMessagesRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.GetNumberOfUnreadMessagesResponse.FromString,
+                _registered_method=True)
+        self.GetNumberOfReadMessages = channel.unary_unary(
+                '/chat.ChatService/GetNumberOfReadMessages',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.GetNumberOfReadMessagesRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.GetNumberOfReadMessagesResponse.FromString,
+                _registered_method=True)
+        self.PopUnreadMessages = channel.unary_unary(
+                '/chat.ChatService/PopUnreadMessages',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.PopUnreadMessagesRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.PopUnreadMessagesResponse.FromString,
+                _registered_method=True)
+        self.GetReadMessages = channel.unary_unary(
+                '/chat.ChatService/GetReadMessages',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.GetReadMessagesRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.GetReadMessagesResponse.FromString,
+                _registered_method=True)
+        self.DeleteMessages = channel.unary_unary(
+                '/chat.ChatService/DeleteMessages',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.DeleteMessagesRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.DeleteMessagesResponse.FromString,
+                _registered_method=True)
+        self.SearchMessages = channel.unary_unary(
+                '/chat.ChatService/SearchMessages',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.SearchMessagesRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.SearchMessagesResponse.FromString,
+                _registered_method=True)
+        self.GetConversation = channel.unary_unary(
+                '/chat.ChatService/GetConversation',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.GetConversationRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.GetConversationResponse.FromString,
+                _registered_method=True)
+        self.GetUnreadCounts = channel.unary_unary(
+                '/chat.ChatService/GetUnreadCounts',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.GetUnreadCountsRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.GetUnreadCountsResponse.FromString,
+                _registered_method=True)
+        self.CreateChannel = channel.unary_unary(
+                '/chat.ChatService/CreateChannel',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.CreateChannelRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.CreateChannelResponse.FromString,
+                _registered_method=True)
+        self.JoinChannel = channel.unary_unary(
+                '/chat.ChatService/JoinChannel',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.JoinChannelRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.JoinChannelResponse.FromString,
+                _registered_method=True)
+        self.LeaveChannel = channel.unary_unary(
+                '/chat.ChatService/LeaveChannel',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.LeaveChannelRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.LeaveChannelResponse.FromString,
+                _registered_method=True)
+        self.SendChannelMessage = channel.unary_unary(
+                '/chat.ChatService/SendChannelMessage',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.SendChannelMessageRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.SendChannelMessageResponse.FromString,
+                _registered_method=True)
+        self.ReadChannelMessages = channel.unary_unary(
+                '/chat.ChatService/ReadChannelMessages',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.ReadChannelMessagesRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.ReadChannelMessagesResponse.FromString,
+                _registered_method=True)
+        self.GetChannelHistory = channel.unary_unary(
+                '/chat.ChatService/GetChannelHistory',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.GetChannelHistoryRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.GetChannelHistoryResponse.FromString,
+                _registered_method=True)
+        self.ListChannels = channel.unary_unary(
+                '/chat.ChatService/ListChannels',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.ListChannelsRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.ListChannelsResponse.FromString,
+                _registered_method=True)
+        self.SubscribeToMessages = channel.unary_stream(
+                '/chat.ChatService/SubscribeToMessages',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.SubscribeRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.MessageNotification.FromString,
+                _registered_method=True)
+        self.DeliverMessage = channel.unary_unary(
+                '/chat.ChatService/DeliverMessage',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.DeliverMessageRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.DeliverMessageResponse.FromString,
+                _registered_method=True)
+        self.StreamMutations = channel.unary_stream(
+                '/chat.ChatService/StreamMutations',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.StreamMutationsRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.Mutation.FromString,
+                _registered_method=True)
+        self.Promote = channel.unary_unary(
+                '/chat.ChatService/Promote',
+                request_serializer=chat__system_dot_proto_dot_chat__pb2.PromoteRequest.SerializeToString,
+                response_deserializer=chat__system_dot_proto_dot_chat__pb2.PromoteResponse.FromString,
+                _registered_method=True)
+
+
+class ChatServiceServicer:
+    """Missing associated documentation comment in .proto file."""
+
+    def CreateAccount(self, request, context):
+        """Account management
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Login(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Logout(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def DeleteAccount(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ListUsers(self, request, context):
+        """User listing
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SendMessage(self, request, context):
+        """Messaging
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetNumberOfUnreadMessages(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetNumberOfReadMessages(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def PopUnreadMessages(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetReadMessages(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def DeleteMessages(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SearchMessages(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetConversation(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetUnreadCounts(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def CreateChannel(self, request, context):
+        """Channels: group chats whose messages are stored once and read by every member
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def JoinChannel(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def LeaveChannel(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SendChannelMessage(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ReadChannelMessages(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetChannelHistory(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ListChannels(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SubscribeToMessages(self, request, context):
+        """Message streaming
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def DeliverMessage(self, request, context):
+        """Shard to shard, when users are split across several servers
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def StreamMutations(self, request, context):
+        """Replication: replicas tail the primary's mutations, and can be promoted to take over from it
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Promote(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_ChatServiceServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'CreateAccount': grpc.unary_unary_rpc_method_handler(
+                    servicer.CreateAccount,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.CreateAccountRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.CreateAccountResponse.SerializeToString,
+            ),
+            'Login': grpc.unary_unary_rpc_method_handler(
+                    servicer.Login,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.LoginRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.LoginResponse.SerializeToString,
+            ),
+            'Logout': grpc.unary_unary_rpc_method_handler(
+                    servicer.Logout,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.LogoutRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.LogoutResponse.SerializeToString,
+            ),
+            'DeleteAccount': grpc.unary_unary_rpc_method_handler(
+                    servicer.DeleteAccount,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.DeleteAccountRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.DeleteAccountResponse.SerializeToString,
+            ),
+            'ListUsers': grpc.unary_unary_rpc_method_handler(
+                    servicer.ListUsers,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.ListUsersRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.ListUsersResponse.SerializeToString,
+            ),
+            'SendMessage': grpc.unary_unary_rpc_method_handler(
+                    servicer.SendMessage,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.SendMessageRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.SendMessageResponse.SerializeToString,
+            ),
+            'GetNumberOfUnreadMessages': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetNumberOfUnreadMessages,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.GetNumberOfUnreadMessagesRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.GetNumberOfUnreadMessagesResponse.SerializeToString,
+            ),
+            'GetNumberOfReadMessages': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetNumberOfReadMessages,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.GetNumberOfReadMessagesRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.GetNumberOfReadMessagesResponse.SerializeToString,
+            ),
+            'PopUnreadMessages': grpc.unary_unary_rpc_method_handler(
+                    servicer.PopUnreadMessages,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.PopUnreadMessagesRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.PopUnreadMessagesResponse.SerializeToString,
+            ),
+            'GetReadMessages': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetReadMessages,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.GetReadMessagesRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.GetReadMessagesResponse.SerializeToString,
+            ),
+            'DeleteMessages': grpc.unary_unary_rpc_method_handler(
+                    servicer.DeleteMessages,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.DeleteMessagesRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.DeleteMessagesResponse.SerializeToString,
+            ),
+            'SearchMessages': grpc.unary_unary_rpc_method_handler(
+                    servicer.SearchMessages,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.SearchMessagesRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.SearchMessagesResponse.SerializeToString,
+            ),
+            'GetConversation': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetConversation,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.GetConversationRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.GetConversationResponse.SerializeToString,
+            ),
+            'GetUnreadCounts': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetUnreadCounts,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.GetUnreadCountsRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.GetUnreadCountsResponse.SerializeToString,
+            ),
+            'CreateChannel': grpc.unary_unary_rpc_method_handler(
+                    servicer.CreateChannel,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.CreateChannelRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.CreateChannelResponse.SerializeToString,
+            ),
+            'JoinChannel': grpc.unary_unary_rpc_method_handler(
+                    servicer.JoinChannel,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.JoinChannelRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.JoinChannelResponse.SerializeToString,
+            ),
+            'LeaveChannel': grpc.unary_unary_rpc_method_handler(
+                    servicer.LeaveChannel,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.LeaveChannelRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.LeaveChannelResponse.SerializeToString,
+            ),
+            'SendChannelMessage': grpc.unary_unary_rpc_method_handler(
+                    servicer.SendChannelMessage,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.SendChannelMessageRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.SendChannelMessageResponse.SerializeToString,
+            ),
+            'ReadChannelMessages': grpc.unary_unary_rpc_method_handler(
+                    servicer.ReadChannelMessages,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.ReadChannelMessagesRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.ReadChannelMessagesResponse.SerializeToString,
+            ),
+            'GetChannelHistory': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetChannelHistory,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.GetChannelHistoryRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.GetChannelHistoryResponse.SerializeToString,
+            ),
+            'ListChannels': grpc.unary_unary_rpc_method_handler(
+                    servicer.ListChannels,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.ListChannelsRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.ListChannelsResponse.SerializeToString,
+            ),
+            'SubscribeToMessages': grpc.unary_stream_rpc_method_handler(
+                    servicer.SubscribeToMessages,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.SubscribeRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.MessageNotification.SerializeToString,
+            ),
+            'DeliverMessage': grpc.unary_unary_rpc_method_handler(
+                    servicer.DeliverMessage,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.DeliverMessageRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.DeliverMessageResponse.SerializeToString,
+            ),
+            'StreamMutations': grpc.unary_stream_rpc_method_handler(
+                    servicer.StreamMutations,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.StreamMutationsRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.Mutation.SerializeToString,
+            ),
+            'Promote': grpc.unary_unary_rpc_method_handler(
+                    servicer.Promote,
+                    request_deserializer=chat__system_dot_proto_dot_chat__pb2.PromoteRequest.FromString,
+                    response_serializer=chat__system_dot_proto_dot_chat__pb2.PromoteResponse.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'chat.ChatService', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('chat.ChatService', rpc_method_handlers)
+
+
+ # This class is part of an EXPERIMENTAL API.
+class ChatService:
+    """Missing associated documentation comment in .proto file."""
+
+    @staticmethod
+    def CreateAccount(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/CreateAccount',
+            chat__system_dot_proto_dot_chat__pb2.CreateAccountRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.CreateAccountResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Login(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/Login',
+            chat__system_dot_proto_dot_chat__pb2.LoginRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.LoginResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Logout(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/Logout',
+            chat__system_dot_proto_dot_chat__pb2.LogoutRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.LogoutResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def DeleteAccount(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/DeleteAccount',
+            chat__system_dot_proto_dot_chat__pb2.DeleteAccountRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.DeleteAccountResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ListUsers(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/ListUsers',
+            chat__system_dot_proto_dot_chat__pb2.ListUsersRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.ListUsersResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SendMessage(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/SendMessage',
+            chat__system_dot_proto_dot_chat__pb2.SendMessageRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.SendMessageResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetNumberOfUnreadMessages(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/GetNumberOfUnreadMessages',
+            chat__system_dot_proto_dot_chat__pb2.GetNumberOfUnreadMessagesRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.GetNumberOfUnreadMessagesResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetNumberOfReadMessages(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/GetNumberOfReadMessages',
+            chat__system_dot_proto_dot_chat__pb2.GetNumberOfReadMessagesRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.GetNumberOfReadMessagesResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def PopUnreadMessages(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/PopUnreadMessages',
+            chat__system_dot_proto_dot_chat__pb2.PopUnreadMessagesRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.PopUnreadMessagesResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetReadMessages(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/GetReadMessages',
+            chat__system_dot_proto_dot_chat__pb2.GetReadMessagesRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.GetReadMessagesResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def DeleteMessages(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/DeleteMessages',
+            chat__system_dot_proto_dot_chat__pb2.DeleteMessagesRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.DeleteMessagesResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SearchMessages(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/SearchMessages',
+            chat__system_dot_proto_dot_chat__pb2.SearchMessagesRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.SearchMessagesResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetConversation(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/GetConversation',
+            chat__system_dot_proto_dot_chat__pb2.GetConversationRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.GetConversationResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetUnreadCounts(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/GetUnreadCounts',
+            chat__system_dot_proto_dot_chat__pb2.GetUnreadCountsRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.GetUnreadCountsResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def CreateChannel(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/CreateChannel',
+            chat__system_dot_proto_dot_chat__pb2.CreateChannelRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.CreateChannelResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def JoinChannel(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/JoinChannel',
+            chat__system_dot_proto_dot_chat__pb2.JoinChannelRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.JoinChannelResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def LeaveChannel(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/LeaveChannel',
+            chat__system_dot_proto_dot_chat__pb2.LeaveChannelRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.LeaveChannelResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SendChannelMessage(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/SendChannelMessage',
+            chat__system_dot_proto_dot_chat__pb2.SendChannelMessageRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.SendChannelMessageResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ReadChannelMessages(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/ReadChannelMessages',
+            chat__system_dot_proto_dot_chat__pb2.ReadChannelMessagesRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.ReadChannelMessagesResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetChannelHistory(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/GetChannelHistory',
+            chat__system_dot_proto_dot_chat__pb2.GetChannelHistoryRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.GetChannelHistoryResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ListChannels(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/ListChannels',
+            chat__system_dot_proto_dot_chat__pb2.ListChannelsRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.ListChannelsResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SubscribeToMessages(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/chat.ChatService/SubscribeToMessages',
+            chat__system_dot_proto_dot_chat__pb2.SubscribeRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.MessageNotification.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def DeliverMessage(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/DeliverMessage',
+            chat__system_dot_proto_dot_chat__pb2.DeliverMessageRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.DeliverMessageResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def StreamMutations(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(
+            request,
+            target,
+            '/chat.ChatService/StreamMutations',
+            chat__system_dot_proto_dot_chat__pb2.StreamMutationsRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.Mutation.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def Promote(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/Promote',
+            chat__system_dot_proto_dot_chat__pb2.PromoteRequest.SerializeToString,
+            chat__system_dot_proto_dot_chat__pb2.PromoteResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
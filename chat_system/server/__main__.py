@@ -1,5 +1,6 @@
 import sys
 from .server import ChatServer
+from .prefork import run_prefork
 from ..common.config import load_config
 
 def main():
@@ -9,6 +10,10 @@ def main():
     else:
         config = load_config()
 
+    if config.workers > 0:
+        run_prefork(config)
+        return
+
     # Start server
     server = ChatServer(config)
     server.load_state()
@@ -1,13 +1,38 @@
-from typing import Dict, Optional, List, Tuple
+from queue import Queue
+from typing import Dict, FrozenSet, Iterable, Optional, List, Tuple
 import base64
 import re
+import threading
+from ..common.channel import Channel
+from ..common.search import TokenTable, make_search_index
 from ..common.security import Security
-from ..common.user import User, Message
+from ..common.user import MailboxLimits, SentMessage, User, Message
+from ..proto import chat_pb2
+from .replication import MutationLog
 
 class AccountManager:
-    def __init__(self):
+    def __init__(self, limits: MailboxLimits = MailboxLimits(), search_index: str = "none"):
+        self.limits = limits
+        self.search_index = search_index
+        self.tokens = TokenTable()  # Words in every user's search index
+        # Copy on write: creating or deleting an account replaces the dict, so readers can iterate it without a lock
         self.accounts: Dict[str, User] = {}  # username -> User
         self.login_info: Dict[str, Tuple[bytes, bytes]] = {}  # username -> (password hash, salt)
+        # Copy on write like accounts, and so are the sets of channel names
+        self.channels: Dict[str, Channel] = {}  # channel name -> Channel
+        self.memberships: Dict[str, FrozenSet[str]] = {}  # username -> names of the channels they're in
+        # Changes are made and logged under one lock, so replicas see them in the order they happened
+        self.mutation_lock = threading.RLock()
+        self.mutation_log: Optional[MutationLog] = None
+
+    def _new_user(self, username: str, messages: List[Message], read_messages: List[Message],
+                  sent_messages: List[SentMessage]) -> User:
+        return User(username, messages, read_messages, self.limits,
+                    index=make_search_index(self.search_index, self.tokens), sent_messages=sent_messages)
+
+    def _log(self, mutation: chat_pb2.Mutation):
+        if self.mutation_log is not None:
+            self.mutation_log.append(mutation)
 
     def get_state(self):
         """Save the account manager state to a file."""
@@ -17,25 +42,67 @@ class AccountManager:
             state[user_id] = {
                 "password_hash": base64.b64encode(password_hash).decode('ascii'),
                 "salt": base64.b64encode(salt).decode('ascii'),
-                "message_queue": [(m.id, m.sender, m.content) for m in user.message_queue],
-                "read_mailbox": [(m.id, m.sender, m.content) for m in user.read_mailbox]
+                "message_queue": [(m.id, m.sender, m.content) for m in user.get_unread_messages()],
+                "read_mailbox": [(m.id, m.sender, m.content) for m in user.read_mailbox],
+                "sent_messages": [(m.id, m.receiver, m.content) for m in user.sent_messages]
             }
         return state
 
     def load_state(self, state: Dict):
         """Load the account manager state from a file."""
-        self.accounts.clear()
-        self.login_info.clear()
+        self.load_accounts(
+            (username,
+             base64.b64decode(user_state["password_hash"].encode('ascii')),
+             base64.b64decode(user_state["salt"].encode('ascii')),
+             [Message(*m) for m in user_state["message_queue"]],
+             [Message(*m) for m in user_state["read_mailbox"]],
+             # Saved before sent messages were kept
+             [SentMessage(id, username, content, receiver)
+              for id, receiver, content in user_state.get("sent_messages", [])])
+            for username, user_state in state.items()
+        )
 
-        for username, user_state in state.items():
-            password_hash = base64.b64decode(user_state["password_hash"].encode('ascii'))
-            salt = base64.b64decode(user_state["salt"].encode('ascii'))
-            messages = [Message(*m) for m in user_state["message_queue"]]
-            received_messages = [Message(*m) for m in user_state["read_mailbox"]]
+    def load_accounts(self, accounts: Iterable[Tuple[str, bytes, bytes, List[Message], List[Message],
+                                                     List[SentMessage]]]):
+        """
+        Replace every account with the given ones: username, password hash, salt, unread, read and sent
+        messages.
+        """
+        users = {}
+        login_info = {}
+        for username, password_hash, salt, messages, read_messages, sent_messages in accounts:
+            users[username] = self._new_user(username, messages, read_messages, sent_messages)
+            login_info[username] = (password_hash, salt)
 
-            user = User(username, messages, received_messages)
-            self.accounts[username] = user
-            self.login_info[username] = (password_hash, salt)
+        with self.mutation_lock:
+            self.login_info = login_info
+            self.accounts = users
+
+    def get_channel_state(self) -> Dict:
+        """Channels, their messages and their members' read cursors, to save alongside the accounts."""
+        return {
+            name: {
+                "owner": channel.owner,
+                "messages": [(m.id, m.sender, m.content) for m in channel.messages],
+                "members": dict(channel.members)
+            }
+            for name, channel in self.channels.items()
+        }
+
+    def load_channel_state(self, state: Dict):
+        self.load_channels([Channel(name, channel_state["owner"], [Message(*m) for m in channel_state["messages"]],
+                                    dict(channel_state["members"]))
+                            for name, channel_state in state.items()])
+
+    def load_channels(self, channels: List[Channel]):
+        """Replace every channel with the given ones."""
+        memberships: Dict[str, set] = {}
+        for channel in channels:
+            for username in channel.members:
+                memberships.setdefault(username, set()).add(channel.name)
+        with self.mutation_lock:
+            self.channels = {channel.name: channel for channel in channels}
+            self.memberships = {username: frozenset(names) for username, names in memberships.items()}
 
     def get_user(self, user_id: str) -> Optional[User]:
         """Get a user by id."""
@@ -52,35 +119,340 @@ class AccountManager:
         if username in self.accounts:
             return "Username already taken"
 
-        # New user exists, create the account
-        new_user = User(username, [], [])
-
-        # Store new user
         password_hash, salt = Security.hash_password(password)
-        self.login_info[username] = (password_hash, salt)
-        self.accounts[username] = new_user
+        return self.add_account(username, password_hash, salt)
 
+    def add_account(self, username: str, password_hash: bytes, salt: bytes) -> Optional[str]:
+        """Store a new account whose password has already been hashed. Returns an error message on failure."""
+        with self.mutation_lock:
+            if username in self.accounts:
+                return "Username already taken"
+            accounts = dict(self.accounts)
+            accounts[username] = self._new_user(username, [], [], [])
+            self.login_info[username] = (password_hash, salt)
+            self.accounts = accounts
+            self._log(chat_pb2.Mutation(create_account=chat_pb2.AccountMutation(
+                username=username, password_hash=password_hash, salt=salt)))
         return None
 
+    def get_login_info(self, username: str) -> Optional[Tuple[bytes, bytes]]:
+        """The password hash and salt of a user."""
+        return self.login_info.get(username)
+
     def login(self, username: str, password: str) -> Optional[User]:
         """Attempt to log in. Return True if successful."""
 
         # See if the user exists
-        if username not in self.accounts:
+        login_info = self.login_info.get(username)
+        if login_info is None:
             return None
 
         # Verify password
-        password_hash, salt = self.login_info[username]
+        password_hash, salt = login_info
         if Security.verify_password(password, password_hash, salt):
-            return self.accounts[username]
+            return self.accounts.get(username)
         return None
 
+    def authenticate(self, username: str, password: str) -> bool:
+        """Check a username and password."""
+        return self.login(username, password) is not None
+
     def list_accounts(self, pattern: str) -> List[User]:
         """List accounts matching the pattern."""
         regex = re.compile(pattern.replace('*', '.*'))
         return [user for user in self.accounts.values() if regex.match(user.name)]
 
+    def list_usernames(self, pattern: str) -> List[str]:
+        """Names of accounts matching the pattern."""
+        return [user.name for user in self.list_accounts(pattern)]
+
     def delete_account(self, user_id: str):
         """Delete an account."""
-        self.accounts.pop(user_id)
-        self.login_info.pop(user_id)
+        with self.mutation_lock:
+            accounts = dict(self.accounts)
+            user = accounts.pop(user_id)
+            self.accounts = accounts
+            self.login_info.pop(user_id)
+            user.discard_spill()
+            # Their channel messages stay, like messages they sent to other users
+            for name in self.memberships.pop(user_id, ()):
+                self.channels[name].remove_member(user_id)
+            self._log(chat_pb2.Mutation(delete_account=user_id))
+
+    # Mailbox operations, by username so that callers never need to hold on to User objects
+
+    def deliver_message(self, recipient: str, message: Message, online: bool) -> bool:
+        """Store a new message for a user, and notify them if they're online. Returns False if there's no such user."""
+        with self.mutation_lock:
+            user = self.accounts.get(recipient)
+            if user is None:
+                return False
+            if online:
+                read = user.deliver_online(message)
+            else:
+                user.add_message(message)
+                read = False
+            self._log_delivery(recipient, message, read)
+        return True
+
+    def record_sent_message(self, receiver: str, message: Message):
+        """Keep a copy of a message for its sender, if they have an account here."""
+        with self.mutation_lock:
+            user = self.accounts.get(message.sender)
+            if user is None:
+                return
+            user.add_sent_message(SentMessage(message.id, message.sender, message.content, receiver))
+            if self.mutation_log is not None:
+                self._log(chat_pb2.Mutation(sent=chat_pb2.DeliverMutation(
+                    receiver=receiver,
+                    message=chat_pb2.Message(id=message.id, sender=message.sender, content=message.content)
+                )))
+
+    def _log_delivery(self, recipient: str, message: Message, read: bool):
+        if self.mutation_log is not None:
+            self._log(chat_pb2.Mutation(deliver=chat_pb2.DeliverMutation(
+                receiver=recipient,
+                message=chat_pb2.Message(id=message.id, sender=message.sender, content=message.content),
+                read=read
+            )))
+
+    def pop_unread_messages(self, username: str, num_messages: int) -> List[Message]:
+        """Pop a user's unread messages, moving them to their read mailbox."""
+        with self.mutation_lock:
+            messages = self.accounts[username].pop_unread_messages(num_messages)
+            if messages:
+                self._log(chat_pb2.Mutation(pop=chat_pb2.PopMutation(username=username, num_messages=len(messages))))
+        return messages
+
+    def get_read_messages(self, username: str, offset: int, num_messages: int) -> List[Message]:
+        """Get messages from a user's read mailbox."""
+        return self.accounts[username].get_read_messages(offset, num_messages)
+
+    def get_notifications_after(self, username: str, message_id: int) -> List[Message]:
+        """Notifications a user was sent after the given message, to replay to a subscriber that reconnects."""
+        # The notification log is a deque, which can't be iterated while it's appended to
+        with self.mutation_lock:
+            return self.accounts[username].get_notifications_after(message_id)
+
+    def _indexed(self, username: str) -> User:
+        """A user with their conversation index built. The first time, it's built under the writers' lock."""
+        user = self.accounts[username]
+        if user.conversations is None:
+            with self.mutation_lock:
+                user.index_conversations()
+        return user
+
+    def get_conversation(self, username: str, correspondent: str, offset: int, num_messages: int) -> List[Message]:
+        """Read and sent messages between a user and a correspondent."""
+        return self._indexed(username).get_conversation(correspondent, offset, num_messages)
+
+    def get_number_of_unread_messages_from(self, username: str, correspondent: str) -> int:
+        """Number of unread messages a user has from one correspondent."""
+        return self._indexed(username).get_number_of_unread_messages_from(correspondent)
+
+    def get_unread_counts(self, username: str) -> Dict[str, int]:
+        """Number of unread messages a user has from each correspondent."""
+        return self._indexed(username).get_unread_counts()
+
+    def search_messages(self, username: str, query: str, limit: int,
+                        cursor: int) -> Optional[Tuple[List[Message], int]]:
+        """Search a user's read messages. Returns the matches and the cursor for the next page, or None if search is off."""
+        if self.search_index == "none":
+            return None
+        return self.accounts[username].search_messages(query, limit, cursor)
+
+    def get_number_of_unread_messages(self, username: str) -> int:
+        """Number of unread messages a user has."""
+        return self.accounts[username].get_number_of_unread_messages()
+
+    def get_number_of_read_messages(self, username: str) -> int:
+        """Number of messages in a user's read mailbox."""
+        return self.accounts[username].get_number_of_read_messages()
+
+    def delete_messages(self, username: str, message_ids: List[int]):
+        """Delete messages from a user's read mailbox, or ones they sent."""
+        with self.mutation_lock:
+            self.accounts[username].delete_messages(message_ids)
+            self._log(chat_pb2.Mutation(delete_messages=chat_pb2.DeleteMessagesMutation(
+                username=username, message_ids=message_ids)))
+
+    def trim_messages(self, username: str, max_messages: int, min_id: int, limit: int) -> int:
+        """
+        Remove up to limit of a user's oldest read and sent messages that retention doesn't keep: any past their
+        newest max_messages, and any with an id below min_id. Returns how many were removed.
+        """
+        with self.mutation_lock:
+            user = self.accounts.get(username)
+            if user is None:
+                return 0
+            removed = user.trim(max_messages, min_id, limit)
+            if removed:
+                self._log(chat_pb2.Mutation(trim=chat_pb2.TrimMutation(
+                    username=username,
+                    read_ids=[m.id for m in removed if not isinstance(m, SentMessage)],
+                    sent_ids=[m.id for m in removed if isinstance(m, SentMessage)])))
+        return len(removed)
+
+    # Channels. Members must be users of this server
+
+    def create_channel(self, name: str, owner: str) -> Optional[str]:
+        """Create a channel with its owner as the only member. Returns an error message on failure."""
+        if len(name) == 0:
+            return "Invalid channel name"
+        with self.mutation_lock:
+            if name in self.channels:
+                return "Channel name already taken"
+            channel = Channel(name, owner)
+            channels = dict(self.channels)
+            channels[name] = channel
+            self.channels = channels
+            self._add_member(channel, owner)
+            self._log(chat_pb2.Mutation(create_channel=chat_pb2.ChannelMutation(channel=name, username=owner)))
+        return None
+
+    def _add_member(self, channel: Channel, username: str):
+        channel.add_member(username)
+        self.memberships[username] = self.memberships.get(username, frozenset()) | {channel.name}
+
+    def join_channel(self, name: str, username: str) -> Optional[str]:
+        """Add a user to a channel. Returns an error message on failure."""
+        with self.mutation_lock:
+            channel = self.channels.get(name)
+            if channel is None:
+                return "Channel not found"
+            if username in channel.members:
+                return None
+            self._add_member(channel, username)
+            self._log(chat_pb2.Mutation(join_channel=chat_pb2.ChannelMutation(channel=name, username=username)))
+        return None
+
+    def leave_channel(self, name: str, username: str) -> Optional[str]:
+        """Remove a user from a channel. Returns an error message on failure."""
+        with self.mutation_lock:
+            channel = self.channels.get(name)
+            if channel is None or username not in channel.members:
+                return "Not a member of the channel"
+            channel.remove_member(username)
+            self.memberships[username] = self.memberships[username] - {name}
+            self._log(chat_pb2.Mutation(leave_channel=chat_pb2.ChannelMutation(channel=name, username=username)))
+        return None
+
+    def post_channel_message(self, name: str, message: Message) -> Optional[str]:
+        """Store a message from a member once for the whole channel. Returns an error message on failure."""
+        with self.mutation_lock:
+            channel = self.channels.get(name)
+            if channel is None or message.sender not in channel.members:
+                return "Not a member of the channel"
+            channel.add_message(message)
+            if self.mutation_log is not None:
+                self._log(chat_pb2.Mutation(channel_message=chat_pb2.DeliverMutation(
+                    receiver=name,
+                    message=chat_pb2.Message(id=message.id, sender=message.sender, content=message.content)
+                )))
+        return None
+
+    def read_channel_messages(self, name: str, username: str, num_messages: int) -> Optional[List[Message]]:
+        """A member's unread channel messages, which then count as read. None if they aren't a member."""
+        with self.mutation_lock:
+            channel = self.channels.get(name)
+            if channel is None or username not in channel.members:
+                return None
+            messages = channel.read_messages(username, num_messages)
+            if messages:
+                self._log(chat_pb2.Mutation(read_channel=chat_pb2.ChannelMutation(
+                    channel=name, username=username, cursor=channel.members[username])))
+        return messages
+
+    def get_channel_history(self, name: str, username: str, offset: int,
+                            num_messages: int) -> Optional[List[Message]]:
+        """A page of a channel's messages, for one of its members. None if they aren't a member."""
+        channel = self.channels.get(name)
+        if channel is None or username not in channel.members:
+            return None
+        return channel.get_messages(offset, num_messages)
+
+    def get_channel_members(self, name: str) -> List[str]:
+        """Usernames of a channel's members, empty if there's no such channel."""
+        # Members are added in place, so the dict can't be iterated while someone joins
+        with self.mutation_lock:
+            channel = self.channels.get(name)
+            return list(channel.members) if channel else []
+
+    def list_channels(self, username: str) -> List[Tuple[str, int, int]]:
+        """Name, number of members and number of unread messages of each channel a user is in."""
+        channels = self.channels
+        result = []
+        for name in sorted(self.memberships.get(username, ())):
+            channel = channels[name]
+            result.append((name, len(channel.members), channel.get_number_of_unread_messages(username)))
+        return result
+
+    def apply_mutation(self, mutation: chat_pb2.Mutation):
+        """Make a change that was made on the primary. It goes in this server's log too, if it keeps one."""
+        kind = mutation.WhichOneof("kind")
+        if kind == "create_account":
+            m = mutation.create_account
+            self.add_account(m.username, m.password_hash, m.salt)
+        elif kind == "delete_account":
+            self.delete_account(mutation.delete_account)
+        elif kind == "deliver":
+            m = mutation.deliver
+            message = Message(m.message.id, m.message.sender, m.message.content)
+            with self.mutation_lock:
+                user = self.accounts[m.receiver]
+                if m.read:
+                    user.add_read_message(message)
+                else:
+                    user.add_message(message)
+                self._log_delivery(m.receiver, message, m.read)
+        elif kind == "sent":
+            m = mutation.sent
+            self.record_sent_message(m.receiver, Message(m.message.id, m.message.sender, m.message.content))
+        elif kind == "create_channel":
+            self.create_channel(mutation.create_channel.channel, mutation.create_channel.username)
+        elif kind == "join_channel":
+            self.join_channel(mutation.join_channel.channel, mutation.join_channel.username)
+        elif kind == "leave_channel":
+            self.leave_channel(mutation.leave_channel.channel, mutation.leave_channel.username)
+        elif kind == "channel_message":
+            m = mutation.channel_message
+            self.post_channel_message(m.receiver, Message(m.message.id, m.message.sender, m.message.content))
+        elif kind == "read_channel":
+            m = mutation.read_channel
+            with self.mutation_lock:
+                self.channels[m.channel].set_cursor(m.username, m.cursor)
+                self._log(chat_pb2.Mutation(read_channel=m))
+        elif kind == "pop":
+            self.pop_unread_messages(mutation.pop.username, mutation.pop.num_messages)
+        elif kind == "delete_messages":
+            self.delete_messages(mutation.delete_messages.username, list(mutation.delete_messages.message_ids))
+        elif kind == "trim":
+            m = mutation.trim
+            with self.mutation_lock:
+                self.accounts[m.username].remove_messages(list(m.read_ids), list(m.sent_ids))
+                self._log(chat_pb2.Mutation(trim=m))
+        else:
+            raise ValueError(f"Unknown mutation: {kind}")
+
+    def get_subscriber_queue(self, username: str) -> Optional[Queue]:
+        """Queue of new message notifications for a logged in user."""
+        user = self.accounts.get(username)
+        return user.message_subscriber_queue if user else None
+
+    def get_backlog_stats(self) -> Dict[str, int]:
+        """Totals of messages held for users, and of messages that didn't fit in their mailboxes."""
+        stats = dict.fromkeys(["unread", "spilled_unread", "read", "pending_notifications",
+                               "max_user_unread", "rejected", "dropped", "spilled"], 0)
+        for user in self.accounts.values():
+            unread = user.get_number_of_unread_messages()
+            stats["unread"] += unread
+            stats["spilled_unread"] += unread - len(user.message_queue)
+            stats["read"] += user.get_number_of_read_messages()
+            # Queues are only made for users who log in, and this mustn't make one for everyone else
+            if user._subscriber_queue is not None:
+                stats["pending_notifications"] += user._subscriber_queue.qsize()
+            stats["max_user_unread"] = max(stats["max_user_unread"], unread)
+            stats["rejected"] += user.stats.rejected
+            stats["dropped"] += user.stats.dropped
+            stats["spilled"] += user.stats.spilled
+        return stats
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from .snapshot import encode_capture, paused_gc, write_atomically
+
+
+class Checkpointer:
+    """
+    Saves the server state to its data file, every interval seconds on a thread of its own and whenever asked.
+    Writers are only held up while the state is captured, which copies references rather than messages. It's
+    encoded and written after they've carried on, to a temporary file that then replaces the data file, so a crash
+    part way through leaves the last checkpoint whole.
+    """
+
+    def __init__(self, server, interval: float):
+        self.server = server
+        self.interval = interval
+        # One checkpoint at a time, so periodic ones and saves on shutdown don't write the same file at once
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.stats = dict.fromkeys(["checkpoints", "failed", "last_pause_ms", "last_duration_ms"], 0)
+
+    def start(self):
+        if self.interval > 0 and self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop the periodic checkpoints, waiting for one in progress to finish."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                # Messages moved to disk can go with an account deleted mid-checkpoint. The next one will do
+                self.stats["failed"] += 1
+                print(f"Checkpoint failed: {e!r}")
+
+    def checkpoint(self):
+        """Save the state as it is now."""
+        with self.lock:
+            start = time.perf_counter()
+            capture = self.server.capture_state()
+            captured = time.perf_counter()
+            # Encoding keeps what it makes until it's done, so collections it sets off would only hold up writers
+            with paused_gc():
+                data = encode_capture(capture)
+            write_atomically(self.server.server_path, data)
+            self.stats["checkpoints"] += 1
+            self.stats["last_pause_ms"] = (captured - start) * 1000
+            self.stats["last_duration_ms"] = (time.perf_counter() - start) * 1000
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from typing import Callable, Deque, Dict, List, Tuple
+
+from ..common.segment import ColdMessage, Segment
+
+# Messages removed from a mailbox at a time, and cold messages repointed at a time, each under the writers' lock
+BATCH_SIZE = 1000
+# Segment files are rewritten once less than this fraction of their records are of messages still kept
+MIN_LIVE_FRACTION = 0.5
+
+
+class Compactor:
+    """
+    Enforces retention rules and reclaims the disk space of removed messages, a little at a time on a thread of
+    its own. Each pass trims every mailbox of read and sent messages past the newest max_messages or older than
+    max_age seconds, in batches so the writers' lock is never held for long. Then it rewrites any closed segment
+    file that's mostly records of messages that are gone: the live records are copied to a new file without the
+    lock, the mailbox is pointed at the copies a batch at a time, and the old file is deleted.
+
+    Messages don't carry a time, but ids are handed out in order, so the age of a message is known from the next
+    id at each pass: anything below the next id at a pass max_age ago is older than max_age. After a restart,
+    the messages that were loaded count as sent when the server started.
+    """
+
+    def __init__(self, server, interval: float, max_age: float, max_messages: int,
+                 overrides: Dict[str, Tuple[float, int]], clock: Callable[[], float] = time.time):
+        self.server = server
+        self.interval = interval
+        self.max_age = max_age
+        self.max_messages = max_messages
+        self.overrides = overrides  # username -> (max_age, max_messages)
+        self.clock = clock
+        self.id_clock: Deque[Tuple[float, int]] = deque()  # (time, next message id), oldest first
+        self.stopped = threading.Event()
+        self.thread = None
+        self.stats = dict.fromkeys(["passes", "failed", "trimmed", "segments_rewritten", "reclaimed_bytes"], 0)
+
+    def start(self):
+        self.tick()
+        if self.interval > 0 and self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop the passes, waiting for one in progress to finish."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.compact()
+            except Exception as e:
+                # Retention keeps going, the next pass picks up what this one didn't
+                self.stats["failed"] += 1
+                print(f"Compaction failed: {e!r}")
+
+    def rules_for(self, username: str) -> Tuple[float, int]:
+        """The (max_age, max_messages) a user's mailbox is kept to. 0 means no limit."""
+        return self.overrides.get(username, (self.max_age, self.max_messages))
+
+    def tick(self):
+        """Note the next message id, to tell the age of messages by later."""
+        now = self.clock()
+        with self.server.message_id_lock:
+            self.id_clock.append((now, self.server.next_message_id))
+        # Only the newest note from before the longest max_age is ever needed
+        longest = max([self.max_age] + [max_age for max_age, _ in self.overrides.values()])
+        while len(self.id_clock) > 1 and self.id_clock[1][0] <= now - longest:
+            self.id_clock.popleft()
+
+    def oldest_kept_id(self, max_age: float) -> int:
+        """Messages with an id below this are known to be older than max_age."""
+        times = [t for t, _ in self.id_clock]
+        i = bisect_right(times, self.clock() - max_age)
+        return self.id_clock[i - 1][1] if i > 0 else 0
+
+    def compact(self) -> Dict[str, int]:
+        """Run one pass over every mailbox. Returns what it did."""
+        self.tick()
+        done = dict.fromkeys(["trimmed", "segments_rewritten", "reclaimed_bytes"], 0)
+        account_manager = self.server.account_manager
+        for username, user in account_manager.accounts.items():
+            max_age, max_messages = self.rules_for(username)
+            # A replica removes what the primary tells it to
+            if (max_age > 0 or max_messages > 0) and not self.server.read_only:
+                min_id = self.oldest_kept_id(max_age) if max_age > 0 else 0
+                while True:
+                    trimmed = account_manager.trim_messages(username, max_messages, min_id, BATCH_SIZE)
+                    done["trimmed"] += trimmed
+                    if trimmed < BATCH_SIZE:
+                        break
+            if user.cold is not None:
+                rewritten, reclaimed = self._compact_segments(username, user)
+                done["segments_rewritten"] += rewritten
+                done["reclaimed_bytes"] += reclaimed
+        self.stats["passes"] += 1
+        for key, value in done.items():
+            self.stats[key] += value
+        return done
+
+    def _compact_segments(self, username: str, user) -> Tuple[int, int]:
+        """Rewrite a user's mostly dead segment files. Returns how many were rewritten and the bytes freed."""
+        store = user.cold
+        runs = {segment: (start, messages) for segment, start, messages in user.cold_runs()}
+        rewritten = reclaimed = 0
+        # The newest segment is still being appended to
+        for segment in store.segments[:-1]:
+            start, messages = runs.get(segment, (0, []))
+            if len(messages) >= segment.records * MIN_LIVE_FRACTION:
+                continue
+            account_manager = self.server.account_manager
+            new_segment = None
+            copies: List[ColdMessage] = []
+            if messages:
+                new_segment = store.new_segment()
+                try:
+                    offsets = new_segment.append([segment.read_record(m.offset) for m in messages])
+                except ValueError:
+                    # The segment was closed, along with the rest, as the user was deleted
+                    if account_manager.accounts.get(username) is user:
+                        raise
+                    self._discard(new_segment)
+                    return rewritten, reclaimed
+                copies = [ColdMessage(m.id, new_segment, offset) for m, offset in zip(messages, offsets)]
+            batches = [slice(i, i + BATCH_SIZE) for i in range(0, len(messages), BATCH_SIZE)]
+            position = start
+            # The old file goes once nothing points to it
+            for batch in batches + [None]:
+                with account_manager.mutation_lock:
+                    if account_manager.accounts.get(username) is not user:
+                        # Deleted along with its segment files, which didn't include this one yet
+                        if new_segment is not None:
+                            self._discard(new_segment)
+                        return rewritten, reclaimed
+                    if batch is not None:
+                        position = user.replace_cold(messages[batch], copies[batch], position)
+                    else:
+                        store.replace(segment, new_segment)
+            rewritten += 1
+            reclaimed += segment.size - (new_segment.size if new_segment else 0)
+        return rewritten, reclaimed
+
+    @staticmethod
+    def _discard(segment: Segment):
+        segment.close()
+        os.remove(segment.path)
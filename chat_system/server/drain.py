@@ -0,0 +1,42 @@
+import threading
+
+import grpc
+
+
+class InFlightInterceptor(grpc.ServerInterceptor):
+    """
+    Counts the unary calls the server has taken on and not yet answered, so that shutdown can wait for them.
+    Streams aren't counted: subscriptions never finish on their own, they're ended once their queues are flushed.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.condition = threading.Condition()
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or handler.unary_unary is None:
+            return handler
+
+        # Counted as soon as it's taken on, before it waits for a thread, so a call in the queue isn't missed
+        with self.condition:
+            self.count += 1
+        behavior = handler.unary_unary
+        def tracked(request, context):
+            try:
+                return behavior(request, context)
+            finally:
+                with self.condition:
+                    self.count -= 1
+                    self.condition.notify_all()
+
+        return grpc.unary_unary_rpc_method_handler(
+            tracked,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer
+        )
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Wait for every call to be answered. Returns False if some were still going after timeout seconds."""
+        with self.condition:
+            return self.condition.wait_for(lambda: self.count == 0, timeout)
@@ -0,0 +1,89 @@
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+
+from ..common.channel import ChannelMessage
+
+
+class ChannelFanout:
+    """
+    Notifies the online members of a channel of its new messages, on a thread of its own so that sending doesn't
+    wait for every member. Members are notified a batch at a time, yielding in between so that requests aren't
+    held up behind a large channel. Notifications are only a hint: members that are offline or can't keep up
+    still see the messages as unread, from their read cursor.
+    """
+
+    def __init__(self, server, batch_size: int):
+        self.server = server
+        self.batch_size = max(1, batch_size)
+        self.pending: "queue.Queue[ChannelMessage]" = queue.Queue()
+        self.stats = dict.fromkeys(["messages", "notified", "dropped", "failed"], 0)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, channel_message: ChannelMessage):
+        self.pending.put(channel_message)
+
+    def _online_members(self, channel: str) -> List[str]:
+        members = self.server.account_manager.get_channel_members(channel)
+        with self.server.sessions_lock:
+            online = set(self.server.client_sessions.values())
+        if len(members) <= len(online):
+            return [username for username in members if username in online]
+        # Large channels usually have far fewer members online than not, so go through the sessions instead
+        member_set = set(members)
+        return [username for username in online if username in member_set]
+
+    def _run(self):
+        while True:
+            channel_message = self.pending.get()
+            if channel_message is None:
+                return
+            try:
+                self.notify(channel_message)
+            except Exception as e:
+                # Like looking up who's online failing. The members still find the message unread in the channel
+                self.stats["failed"] += 1
+                print(f"Notifying members of {channel_message.channel} failed: {e!r}")
+            finally:
+                self.pending.task_done()
+
+    def notify(self, channel_message: ChannelMessage):
+        """Put a channel message in the subscriber queue of each of its online members."""
+        members = self._online_members(channel_message.channel)
+        notified = dropped = 0
+        for start in range(0, len(members), self.batch_size):
+            try:
+                for username in members[start:start + self.batch_size]:
+                    subscriber_queue = self.server.subscriber_queue(username)
+                    if subscriber_queue is None:
+                        continue
+                    try:
+                        subscriber_queue.put_nowait(channel_message)
+                        notified += 1
+                    except queue.Full:
+                        dropped += 1
+            except Exception as e:
+                # The other batches' members can still be notified
+                self.stats["failed"] += 1
+                print(f"Notifying members of {channel_message.channel} failed: {e!r}")
+            time.sleep(0)
+        self.stats["messages"] += 1
+        self.stats["notified"] += notified
+        self.stats["dropped"] += dropped
+
+    def wait_idle(self, timeout: float = 10) -> bool:
+        """Wait until every submitted message has been fanned out. For tests and benchmarks."""
+        deadline = time.monotonic() + timeout
+        while self.pending.unfinished_tasks > 0 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return self.pending.unfinished_tasks == 0
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop once the messages submitted so far have been fanned out, waiting up to timeout seconds for it."""
+        self.pending.put(None)
+        self.thread.join(timeout)
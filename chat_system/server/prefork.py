@@ -0,0 +1,402 @@
+"""
+Prefork mode: several worker processes serve gRPC on the same port with SO_REUSEPORT, so CPU-bound work
+like password hashing and serialization can use more than one core. Accounts and mailboxes live in a
+coordinator process that the workers reach through a multiprocessing manager. Notifications for a user
+who is logged in to another worker are pushed to that worker's inbox queue.
+"""
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from collections import defaultdict
+from multiprocessing.managers import BaseManager
+from typing import Dict, List, Optional, Tuple
+
+from ..common.channel import ChannelMessage
+from ..common.config import ConnectionSettings
+from ..common.security import Security
+from ..common.segment import ColdMessage
+from ..common.user import Message
+from .account_manager import AccountManager
+from .checkpoint import Checkpointer
+from .compaction import Compactor
+from .server import ChatServer, mailbox_limits
+from .snapshot import StateCapture, capture_state, decode_snapshot, paused_gc, read_state
+
+
+def _in_memory(messages: List) -> List[Message]:
+    """
+    Messages to send to a worker. ColdMessages hold their segment file open and can't be pickled, so they're read
+    here, while the lock keeps compaction from rewriting the file under them.
+    """
+    return [Message(*m.read()) if isinstance(m, ColdMessage) else m for m in messages]
+
+
+class CoordinatorState(AccountManager):
+    """The shared account manager, plus the state that has to be shared between workers: presence and message ids."""
+
+    def __init__(self, config: ConnectionSettings, inboxes: List[multiprocessing.Queue]):
+        super().__init__(mailbox_limits(config), config.search_index)
+        self.inboxes = inboxes
+        self.online: Dict[str, Dict[int, int]] = defaultdict(dict)  # username -> worker id -> number of sessions
+        self.next_message_id = 0
+        # The manager serves each worker connection on its own thread. The compactor's batches take the
+        # account manager's lock, so it's the same one
+        self.lock = self.mutation_lock
+        # Checkpoints, retention and compaction run here, where the mailboxes are, with the coordinator in the
+        # server's place
+        self.account_manager = self
+        self.message_id_lock = self.lock
+        self.read_only = False
+        self.server_path = config.server_data_path
+        self.checkpointer = Checkpointer(self, config.checkpoint_interval)
+        self.compactor = Compactor(self, config.compaction_interval, config.retention_max_age,
+                                   config.retention_max_messages,
+                                   {name: tuple(rule) for name, rule in config.retention_overrides.items()})
+
+    def start_maintenance(self):
+        """Start the background checkpoints and passes over the state."""
+        self.checkpointer.start()
+        self.compactor.start()
+
+    def stop_maintenance(self):
+        """Stop the background checkpoints and passes, waiting for any in progress to finish."""
+        self.checkpointer.stop()
+        self.compactor.stop()
+
+    def set_online(self, username: str, worker_id: int, online: bool):
+        """Count a session logging in or out on a worker."""
+        with self.lock:
+            sessions = self.online[username]
+            sessions[worker_id] = sessions.get(worker_id, 0) + (1 if online else -1)
+            if sessions[worker_id] <= 0:
+                del sessions[worker_id]
+            if not sessions:
+                del self.online[username]
+
+    def is_online(self, username: str) -> bool:
+        with self.lock:
+            return username in self.online
+
+    def allocate_message_id(self) -> int:
+        with self.lock:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        return message_id
+
+    def deliver_message(self, recipient: str, message: Message, online: bool) -> bool:
+        with self.lock:
+            user = self.accounts.get(recipient)
+            if user is None:
+                return False
+            # Presence is tracked here, so this is more up to date than the online flag from the worker
+            workers = list(self.online.get(recipient, ()))
+            if not workers:
+                user.add_message(message)
+                return True
+            # Subscriber queues live in the workers, so only the read mailbox and notification log are kept here
+            user.add_read_message(message)
+            user.log_notification(message)
+        for worker_id in workers:
+            self.inboxes[worker_id].put((recipient, message))
+        return True
+
+    def get_read_messages(self, username: str, offset: int, num_messages: int) -> List[Message]:
+        with self.lock:
+            return _in_memory(super().get_read_messages(username, offset, num_messages))
+
+    def search_messages(self, username: str, query: str, limit: int,
+                        cursor: int) -> Optional[Tuple[List[Message], int]]:
+        with self.lock:
+            found = super().search_messages(username, query, limit, cursor)
+        return None if found is None else (_in_memory(found[0]), found[1])
+
+    def get_conversation(self, username: str, correspondent: str, offset: int, num_messages: int) -> List[Message]:
+        with self.lock:
+            return _in_memory(super().get_conversation(username, correspondent, offset, num_messages))
+
+    def publish_channel_message(self, channel_message: ChannelMessage):
+        """Every worker may have members of the channel logged in, so they each fan it out to their own."""
+        for inbox in self.inboxes:
+            inbox.put(channel_message)
+
+    def capture_state(self) -> StateCapture:
+        with self.lock, paused_gc():
+            return capture_state(self, self.next_message_id)
+
+    def save_state(self):
+        """Save in the same format as a single process server."""
+        self.checkpointer.checkpoint()
+
+    def load_state(self):
+        data = read_state(self.server_path)
+        if data is None:
+            print("No server state found, starting fresh")
+            return
+        with self.lock, paused_gc(freeze=True):
+            self.next_message_id = decode_snapshot(data, self)
+
+
+# Everything a worker calls on the coordinator state takes its lock, the reads of read messages above do too
+for _name in ["add_account", "get_login_info", "list_usernames", "delete_account", "pop_unread_messages",
+              "get_notifications_after", "get_number_of_unread_messages", "get_number_of_read_messages",
+              "delete_messages", "get_backlog_stats", "get_state", "record_sent_message",
+              "get_number_of_unread_messages_from", "get_unread_counts", "create_channel", "join_channel",
+              "leave_channel", "post_channel_message", "read_channel_messages", "get_channel_history",
+              "get_channel_members", "list_channels"]:
+    def _locked(self, *args, _method=getattr(AccountManager, _name), **kwargs):
+        with self.lock:
+            return _method(self, *args, **kwargs)
+    setattr(CoordinatorState, _name, _locked)
+del _name, _locked
+
+
+_coordinator_state: Optional[CoordinatorState] = None
+
+def _init_coordinator(config: ConnectionSettings, inboxes: List[multiprocessing.Queue]):
+    global _coordinator_state
+    _coordinator_state = CoordinatorState(config, inboxes)
+
+def _get_coordinator_state() -> CoordinatorState:
+    return _coordinator_state
+
+
+class CoordinatorManager(BaseManager):
+    pass
+
+CoordinatorManager.register("coordinator_state", callable=_get_coordinator_state)
+
+
+class RemoteAccountManager:
+    """Account manager interface for a worker. Passwords are hashed in the worker, everything else is forwarded."""
+
+    def __init__(self, state):
+        self.state = state
+
+    def create_account(self, username: str, password: str) -> Optional[str]:
+        if len(username) == 0:
+            return "Invalid username"
+        password_hash, salt = Security.hash_password(password)
+        return self.state.add_account(username, password_hash, salt)
+
+    def authenticate(self, username: str, password: str) -> bool:
+        login_info = self.state.get_login_info(username)
+        return login_info is not None and Security.verify_password(password, *login_info)
+
+    def list_usernames(self, pattern: str) -> List[str]:
+        return self.state.list_usernames(pattern)
+
+    def delete_account(self, username: str):
+        self.state.delete_account(username)
+
+    def deliver_message(self, recipient: str, message: Message, online: bool) -> bool:
+        return self.state.deliver_message(recipient, message, online)
+
+    def pop_unread_messages(self, username: str, num_messages: int) -> List[Message]:
+        return self.state.pop_unread_messages(username, num_messages)
+
+    def get_read_messages(self, username: str, offset: int, num_messages: int) -> List[Message]:
+        return self.state.get_read_messages(username, offset, num_messages)
+
+    def get_notifications_after(self, username: str, message_id: int) -> List[Message]:
+        return self.state.get_notifications_after(username, message_id)
+
+    def search_messages(self, username: str, query: str, limit: int,
+                        cursor: int) -> Optional[Tuple[List[Message], int]]:
+        return self.state.search_messages(username, query, limit, cursor)
+
+    def record_sent_message(self, receiver: str, message: Message):
+        self.state.record_sent_message(receiver, message)
+
+    def get_conversation(self, username: str, correspondent: str, offset: int, num_messages: int) -> List[Message]:
+        return self.state.get_conversation(username, correspondent, offset, num_messages)
+
+    def get_number_of_unread_messages_from(self, username: str, correspondent: str) -> int:
+        return self.state.get_number_of_unread_messages_from(username, correspondent)
+
+    def get_unread_counts(self, username: str) -> Dict[str, int]:
+        return self.state.get_unread_counts(username)
+
+    def create_channel(self, name: str, owner: str) -> Optional[str]:
+        return self.state.create_channel(name, owner)
+
+    def join_channel(self, name: str, username: str) -> Optional[str]:
+        return self.state.join_channel(name, username)
+
+    def leave_channel(self, name: str, username: str) -> Optional[str]:
+        return self.state.leave_channel(name, username)
+
+    def post_channel_message(self, name: str, message: Message) -> Optional[str]:
+        return self.state.post_channel_message(name, message)
+
+    def read_channel_messages(self, name: str, username: str, num_messages: int) -> Optional[List[Message]]:
+        return self.state.read_channel_messages(name, username, num_messages)
+
+    def get_channel_history(self, name: str, username: str, offset: int,
+                            num_messages: int) -> Optional[List[Message]]:
+        return self.state.get_channel_history(name, username, offset, num_messages)
+
+    def get_channel_members(self, name: str) -> List[str]:
+        return self.state.get_channel_members(name)
+
+    def list_channels(self, username: str) -> List[Tuple[str, int, int]]:
+        return self.state.list_channels(username)
+
+    def get_number_of_unread_messages(self, username: str) -> int:
+        return self.state.get_number_of_unread_messages(username)
+
+    def get_number_of_read_messages(self, username: str) -> int:
+        return self.state.get_number_of_read_messages(username)
+
+    def delete_messages(self, username: str, message_ids: List[int]):
+        self.state.delete_messages(username, message_ids)
+
+    def get_backlog_stats(self) -> Dict[str, int]:
+        return self.state.get_backlog_stats()
+
+
+class PreforkWorker(ChatServer):
+    """One of several server processes sharing a port. Sessions are local, accounts and mailboxes are in the coordinator."""
+
+    def __init__(self, config: ConnectionSettings, worker_id: int, coordinator_address, authkey: bytes,
+                 inboxes: List[multiprocessing.Queue]):
+        super().__init__(config)
+        self.worker_id = worker_id
+        manager = CoordinatorManager(coordinator_address, authkey)
+        manager.connect()
+        self.state = manager.coordinator_state()
+        self.account_manager = RemoteAccountManager(self.state)
+        self.grpc_options.append(("grpc.so_reuseport", 1))
+        # The state is the coordinator's, which saves and trims it, not the workers
+        self.checkpointer.interval = 0
+        self.compactor.interval = 0
+
+        self.max_subscriber_queue = config.max_subscriber_queue
+        self.subscriber_queues: Dict[str, queue.Queue] = {}
+        self.subscriber_queues_lock = threading.Lock()
+        self.inbox = inboxes[worker_id]
+        threading.Thread(target=self._receive_notifications, daemon=True).start()
+
+    def _receive_notifications(self):
+        """Move notifications from this worker's inbox to the subscriber queues of its users."""
+        while True:
+            item = self.inbox.get()
+            if item is None:
+                break
+            if isinstance(item, ChannelMessage):
+                super().publish_channel_message(item)
+                continue
+            username, message = item
+            try:
+                self.subscriber_queue(username).put_nowait(message)
+            except queue.Full:
+                pass  # The message is still in the read mailbox, only the notification is lost
+
+    def allocate_message_id(self) -> int:
+        return self.state.allocate_message_id()
+
+    def publish_channel_message(self, channel_message: ChannelMessage):
+        # Through the coordinator, so that members logged in to other workers hear of it too
+        self.state.publish_channel_message(channel_message)
+
+    def is_online(self, username: str) -> bool:
+        return self.state.is_online(username)
+
+    def set_online(self, username: str, online: bool):
+        self.state.set_online(username, self.worker_id, online)
+
+    def subscriber_queue(self, username: str) -> queue.Queue:
+        with self.subscriber_queues_lock:
+            if username not in self.subscriber_queues:
+                self.subscriber_queues[username] = queue.Queue(self.max_subscriber_queue)
+            return self.subscriber_queues[username]
+
+    def close_subscriptions(self):
+        with self.subscriber_queues_lock:
+            for subscriber_queue in self.subscriber_queues.values():
+                try:
+                    subscriber_queue.put_nowait(None)
+                except queue.Full:
+                    pass
+
+    def handle_shutdown(self):
+        # The coordinator owns the state and saves it, once every worker has drained
+        print(f"Worker {self.worker_id} stopped")
+
+
+def _run_worker(config: ConnectionSettings, worker_id: int, coordinator_address, authkey: bytes,
+                inboxes: List[multiprocessing.Queue]):
+    PreforkWorker(config, worker_id, coordinator_address, authkey, inboxes).start()
+
+
+class PreforkCluster:
+    """A coordinator process and the worker processes serving the configured port."""
+
+    def __init__(self, config: ConnectionSettings, num_workers: int):
+        if config.port == 0:
+            raise ValueError("Prefork workers have to share a fixed port")
+        self.config = config
+        self.num_workers = num_workers
+        # Workers are spawned rather than forked, gRPC doesn't support forking once it's running
+        self.context = multiprocessing.get_context("spawn")
+        self.manager: Optional[CoordinatorManager] = None
+        self.state = None
+        self.workers: List[multiprocessing.Process] = []
+        self.inboxes: List[multiprocessing.Queue] = []
+
+    def start(self):
+        """Start the coordinator, load the saved state into it, and start the workers."""
+        self.inboxes = [self.context.Queue() for _ in range(self.num_workers)]
+        authkey = os.urandom(32)
+        self.manager = CoordinatorManager(authkey=authkey, ctx=self.context)
+        self.manager.start(_init_coordinator, (self.config, self.inboxes))
+        self.state = self.manager.coordinator_state()
+        self.state.load_state()
+        self.state.start_maintenance()
+
+        self.workers = [
+            self.context.Process(target=_run_worker,
+                                 args=(self.config, i, self.manager.address, authkey, self.inboxes))
+            for i in range(self.num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def wait(self):
+        for worker in self.workers:
+            worker.join()
+
+    def stop(self, save: bool = True):
+        """Stop the workers, which drain their calls in flight first, then save the state and stop the coordinator."""
+        if self.manager is None:
+            return
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
+        self.state.stop_maintenance()
+        if save:
+            print(f"Saving server state to {self.config.server_data_path}")
+            self.state.save_state()
+        self.manager.shutdown()
+        self.manager = None
+
+
+def _interrupt(signum, frame):
+    # SIGTERM stops the cluster the same way Ctrl-C does
+    raise KeyboardInterrupt
+
+
+def run_prefork(config: ConnectionSettings):
+    """Run the server as config.workers processes until interrupted."""
+    cluster = PreforkCluster(config, config.workers)
+    cluster.start()
+    print(f"Started {config.workers} workers on {config.host}:{config.port}")
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        cluster.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cluster.stop()
@@ -0,0 +1,138 @@
+import threading
+import time
+from array import array
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+import grpc
+
+RETRY_AFTER_KEY = "retry-after-ms"
+DEFAULT_STRIPES = 16
+MIN_SWEEP_SIZE = 64  # Buckets in a stripe before full ones are looked for to reuse
+
+
+class _Stripe:
+    """One lock and the buckets it guards. Bucket state lives in flat arrays instead of an object per bucket."""
+    __slots__ = ("lock", "slots", "tokens", "stamps", "full_at", "free", "sweep_size")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slots: Dict[Hashable, int] = {}  # key -> index into tokens, stamps and full_at
+        self.tokens = array('d')
+        self.stamps = array('d')
+        self.full_at = array('d')  # When the bucket will have refilled
+        self.free: List[int] = []  # Indexes of buckets that were dropped, to reuse
+        self.sweep_size = MIN_SWEEP_SIZE
+
+
+class TokenBucketTable:
+    """
+    Token buckets keyed by any hashable, spread over a fixed number of locks so callers rarely contend. A bucket
+    that has refilled is no different from a new one, so those are dropped and their slots reused once a stripe
+    has twice as many buckets as at its last sweep. Callers that come and go, like anonymous peers, don't
+    leave their buckets behind.
+    """
+
+    def __init__(self, stripes: int = DEFAULT_STRIPES, clock: Callable[[], float] = time.monotonic):
+        self.stripes = [_Stripe() for _ in range(stripes)]
+        self.clock = clock
+
+    def __len__(self) -> int:
+        return sum(len(stripe.slots) for stripe in self.stripes)
+
+    def acquire(self, key: Hashable, rate: float, burst: float) -> float:
+        """Take a token from the bucket for key. Returns 0 on success, else the seconds until a token is available."""
+        stripe = self.stripes[hash(key) % len(self.stripes)]
+        now = self.clock()
+        with stripe.lock:
+            i = stripe.slots.get(key)
+            if i is None:
+                i = stripe.slots[key] = self._new_slot(stripe, now)
+                # New buckets start full
+                stripe.tokens[i] = burst
+                stripe.stamps[i] = now
+            tokens = min(burst, stripe.tokens[i] + (now - stripe.stamps[i]) * rate)
+            stripe.stamps[i] = now
+            taken = tokens >= 1
+            stripe.tokens[i] = tokens - 1 if taken else tokens
+            stripe.full_at[i] = now + (burst - stripe.tokens[i]) / rate
+        return 0.0 if taken else (1 - tokens) / rate
+
+    @staticmethod
+    def _new_slot(stripe: _Stripe, now: float) -> int:
+        """An index for a new bucket, reusing a dropped one's if there are any. The stripe's lock must be held."""
+        if not stripe.free and len(stripe.slots) >= stripe.sweep_size:
+            TokenBucketTable._sweep(stripe, now)
+        if stripe.free:
+            return stripe.free.pop()
+        stripe.tokens.append(0)
+        stripe.stamps.append(0)
+        stripe.full_at.append(0)
+        return len(stripe.tokens) - 1
+
+    @staticmethod
+    def _sweep(stripe: _Stripe, now: float):
+        """Drop the buckets that have refilled. The stripe's lock must be held."""
+        for key, i in list(stripe.slots.items()):
+            if stripe.full_at[i] <= now:
+                del stripe.slots[key]
+                stripe.free.append(i)
+        # Sweeping again only once it's doubled keeps the cost per new bucket constant
+        stripe.sweep_size = max(MIN_SWEEP_SIZE, 2 * len(stripe.slots))
+
+    def sweep(self):
+        """Drop every bucket that has refilled."""
+        now = self.clock()
+        for stripe in self.stripes:
+            with stripe.lock:
+                self._sweep(stripe, now)
+
+
+class RateLimitInterceptor(grpc.ServerInterceptor):
+    """
+    Limits how often each user can call each unary method. Sessions that aren't logged in are limited by peer.
+    Rejected calls fail with RESOURCE_EXHAUSTED and say how long to wait in the retry-after-ms trailing metadata.
+    """
+
+    def __init__(self, server, rate: float, burst: float,
+                 method_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 buckets: Optional[TokenBucketTable] = None):
+        self.server = server
+        self.rate = rate
+        self.burst = burst
+        self.method_limits = method_limits or {}  # method name -> (rate, burst)
+        self.buckets = buckets or TokenBucketTable()
+
+    def limits_for(self, method: str) -> Tuple[float, float]:
+        """The (rate, burst) for a method. A rate of 0 means unlimited."""
+        return self.method_limits.get(method, (self.rate, self.burst))
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        method = handler_call_details.method.rsplit('/', 1)[-1]
+        rate, burst = self.limits_for(method)
+        # Streams are long lived, so there's nothing to gain from limiting them
+        if handler is None or handler.unary_unary is None or rate <= 0:
+            return handler
+
+        behavior = handler.unary_unary
+        def limited(request, context):
+            self.check(method, rate, burst, context)
+            return behavior(request, context)
+
+        return grpc.unary_unary_rpc_method_handler(
+            limited,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer
+        )
+
+    def check(self, method: str, rate: float, burst: float, context):
+        """Abort the call if the caller has run out of tokens for this method."""
+        peer = context.peer()
+        # A single dict lookup is atomic, so this doesn't need the sessions lock
+        caller = self.server.client_sessions.get(peer) or peer
+        wait = self.buckets.acquire((caller, method), rate, burst)
+        if wait > 0:
+            retry_after_ms = max(1, int(wait * 1000 + 0.5))
+            context.set_trailing_metadata(((RETRY_AFTER_KEY, str(retry_after_ms)),))
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                          f"Rate limit exceeded for {method}, retry in {retry_after_ms} ms")
@@ -0,0 +1,116 @@
+import itertools
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+import grpc
+
+from ..proto import chat_pb2, chat_pb2_grpc
+
+RECONNECT_DELAY = 0.5  # seconds
+
+
+class MutationLog:
+    """The most recent mutations made on this server, for replicas to tail."""
+
+    def __init__(self, max_entries: int):
+        self.entries = deque(maxlen=max_entries)
+        self.last_seq = 0
+        self.condition = threading.Condition()
+
+    def append(self, mutation: chat_pb2.Mutation):
+        """Number and timestamp a mutation, and wake up any replicas waiting for it."""
+        with self.condition:
+            self.last_seq += 1
+            mutation.seq = self.last_seq
+            mutation.timestamp = time.time()
+            self.entries.append(mutation)
+            self.condition.notify_all()
+
+    def read_after(self, seq: int, timeout: float) -> Optional[List[chat_pb2.Mutation]]:
+        """
+        Mutations after seq, waiting up to timeout for one if there are none yet. Returns None if the replica
+        needs a snapshot instead: it fell behind what the log keeps, or this server restarted.
+        """
+        with self.condition:
+            first_seq = self.last_seq - len(self.entries) + 1
+            if seq < first_seq - 1 or seq > self.last_seq:
+                return None
+            if seq == self.last_seq:
+                self.condition.wait(timeout)
+            return list(itertools.islice(self.entries, seq - first_seq + 1, None))
+
+
+class Replicator:
+    """Keeps a replica's state in step with the primary by applying its mutation stream."""
+
+    def __init__(self, server, primary_address: str):
+        self.server = server
+        self.primary_address = primary_address
+        self.applied_seq = 0
+        self.lags: deque = deque(maxlen=10000)  # Seconds between the primary's change and applying it here
+        self.errors = 0
+        self.last_error = ""
+        self.stopped = threading.Event()
+        self.stream = None
+        self.stream_lock = threading.Lock()  # So a stream can't be opened just after stop() cancelled the last
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop tailing the primary. Whatever has been applied so far is kept."""
+        with self.stream_lock:
+            self.stopped.set()
+            if self.stream is not None:
+                self.stream.cancel()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _run(self):
+        with grpc.insecure_channel(self.primary_address) as channel:
+            stub = chat_pb2_grpc.ChatServiceStub(channel)
+            while not self.stopped.is_set():
+                try:
+                    with self.stream_lock:
+                        if self.stopped.is_set():
+                            break
+                        self.stream = stub.StreamMutations(
+                            chat_pb2.StreamMutationsRequest(after_seq=self.applied_seq),
+                            metadata=self.server.cluster_metadata())
+                    for mutation in self.stream:
+                        self.apply(mutation)
+                except grpc.RpcError:
+                    # The primary is down or restarting. Keep serving reads and try again
+                    self.stopped.wait(RECONNECT_DELAY)
+                except Exception as e:
+                    # The state no longer matches the primary's, so start over from a snapshot
+                    self.errors += 1
+                    self.last_error = repr(e)
+                    print(f"Replication failed applying mutation {self.applied_seq + 1}, resyncing: {e!r}")
+                    self.stream.cancel()
+                    self.applied_seq = 0
+                    self.stopped.wait(RECONNECT_DELAY)
+
+    def apply(self, mutation: chat_pb2.Mutation):
+        if mutation.WhichOneof("kind") == "snapshot":
+            self.server.load_snapshot(mutation.snapshot)
+        else:
+            self.server.apply_mutation(mutation)
+            self.lags.append(time.time() - mutation.timestamp)
+        self.applied_seq = mutation.seq
+
+    def get_stats(self) -> dict:
+        """Replication lag in seconds, over the most recent mutations, and mutations that couldn't be applied."""
+        lags = list(self.lags)
+        return {
+            "applied_seq": self.applied_seq,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "mutations": len(lags),
+            "mean_lag": sum(lags) / len(lags) if lags else 0.0,
+            "max_lag": max(lags, default=0.0),
+        }
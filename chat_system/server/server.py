@@ -1,48 +1,116 @@
 import grpc
 from concurrent import futures
+import hmac
 import signal
-import json
+import queue
 import threading
-from typing import Dict, Optional
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
-from chat_system.common.config import ConnectionSettings
+from chat_system.common.config import ConnectionSettings, keepalive_options
 from .account_manager import AccountManager
-from ..common.user import Message
+from .checkpoint import Checkpointer
+from .compaction import Compactor
+from .drain import InFlightInterceptor
+from .fanout import ChannelFanout
+from .rate_limiter import RateLimitInterceptor
+from .replication import MutationLog, Replicator
+from .snapshot import StateCapture, capture_state, decode_snapshot, encode_capture, paused_gc, read_state
+from ..common.channel import ChannelMessage
+from ..common.compression import CompressionAlgorithm, grpc_compression, parse_compression
+from ..common.message_batch import add_messages, pack_message_batch
+from ..common.sharding import HashRing
+from ..common.user import MailboxFullError, MailboxLimits, Message, OverflowPolicy
 from ..proto import chat_pb2, chat_pb2_grpc
 
+SUBSCRIPTION_POLL_INTERVAL = 1  # seconds
+SESSION_REAP_INTERVAL = 10  # seconds
+CLUSTER_SECRET_KEY = "x-cluster-secret"  # Metadata a server's calls to another carry the cluster secret in
+
 class ChatServicer(chat_pb2_grpc.ChatServiceServicer):
     def __init__(self, server):
         self.server = server
 
+    def _compress_if_large(self, response, context):
+        """Compress a response if it is large enough. Small responses aren't worth the CPU time."""
+        if (self.server.compression != CompressionAlgorithm.NONE
+                and response.ByteSize() >= self.server.compression_threshold):
+            context.set_compression(grpc_compression(self.server.compression))
+        return response
+
+    def _session_user(self, context) -> Optional[str]:
+        """The user logged in on the caller's connection. Counts as activity, so the session isn't reaped."""
+        peer = context.peer()
+        with self.server.sessions_lock:
+            username = self.server.client_sessions[peer]
+            self.server.session_activity[peer] = time.monotonic()
+        return username
+
+    def _check_cluster_peer(self, context):
+        """Calls between servers are only taken from callers that know the cluster secret."""
+        secret = dict(context.invocation_metadata()).get(CLUSTER_SECRET_KEY, "")
+        if not self.server.cluster_secret or not hmac.compare_digest(secret.encode(),
+                                                                     self.server.cluster_secret.encode()):
+            context.abort(grpc.StatusCode.PERMISSION_DENIED, "Only other servers of the cluster can call this")
+
+    def _check_writable(self, context):
+        """Replicas only serve reads until they're promoted."""
+        if self.server.read_only:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "This server is a read-only replica")
+
+    @staticmethod
+    def _messages_response(response_cls, messages, compact: bool):
+        """Build a response carrying messages, in the compact batch encoding if the client asked for it."""
+        if compact:
+            return response_cls(batch=pack_message_batch(messages))
+        response = response_cls()
+        add_messages(response.messages, messages)
+        return response
+
     def CreateAccount(self, request, context):
-        error = self.server.account_manager.create_account(request.username, request.password)
+        self._check_writable(context)
+        error = self.server.wrong_shard_error(request.username)
+        if not error:
+            error = self.server.account_manager.create_account(request.username, request.password)
         return chat_pb2.CreateAccountResponse(error=error if error else None)
 
     def Login(self, request, context):
-        user = self.server.account_manager.login(request.username, request.password)
-        if user:
+        if self.server.account_manager.authenticate(request.username, request.password):
             with self.server.sessions_lock:
-                self.server.client_sessions[context.peer()] = user.name
+                previous = self.server.client_sessions.get(context.peer())
+                self.server.client_sessions[context.peer()] = request.username
+                self.server.session_activity[context.peer()] = time.monotonic()
+            if previous:
+                self.server.set_online(previous, False)
+            self.server.set_online(request.username, True)
             return chat_pb2.LoginResponse()
         return chat_pb2.LoginResponse(error="Invalid username or password")
 
     def Logout(self, request, context):
         with self.server.sessions_lock:
+            username = self.server.client_sessions.get(context.peer())
             if context.peer() in self.server.client_sessions:
                 self.server.client_sessions[context.peer()] = None
+        if username:
+            self.server.set_online(username, False)
         return chat_pb2.LogoutResponse()
 
     def ListUsers(self, request, context):
-        accounts = self.server.account_manager.list_accounts(request.pattern)
+        if self.server.ring is not None and not request.local_only:
+            accounts = self.server.gather_usernames(request.pattern)
+        else:
+            accounts = self.server.account_manager.list_usernames(request.pattern)
         offset = max(0, request.offset)
         if request.limit == -1:
             accounts = accounts[offset:]
         else:
             limit = min(len(accounts), offset + request.limit)
             accounts = accounts[offset:limit]
-        return chat_pb2.ListUsersResponse(usernames=[user.name for user in accounts])
+        response = chat_pb2.ListUsersResponse(usernames=accounts)
+        return self._compress_if_large(response, context)
 
     def DeleteAccount(self, request, context):
+        self._check_writable(context)
         with self.server.sessions_lock:
             peer = context.peer()
             if peer not in self.server.client_sessions:
@@ -55,166 +123,623 @@ class ChatServicer(chat_pb2_grpc.ChatServiceServicer):
             # Delete the account and remove session properly
             self.server.account_manager.delete_account(username)
             self.server.client_sessions[peer] = None
+            self.server.delivery_cursors.pop(username, None)
+        self.server.set_online(username, False)
         return chat_pb2.DeleteAccountResponse()
 
     def SendMessage(self, request, context):
+        self._check_writable(context)
         with self.server.sessions_lock:
             sender_id = self.server.client_sessions.get(context.peer())
-        
+            self.server.session_activity[context.peer()] = time.monotonic()
+
         if not sender_id:
             context.abort(grpc.StatusCode.UNAUTHENTICATED, "Not logged in")
 
-        recipient = request.receiver
-        if self.server.account_manager.get_user(recipient) is None:
-            context.abort(grpc.StatusCode.NOT_FOUND, "Recipient not found")
+        message = Message(self.server.allocate_message_id(), sender_id, request.content)
+        shard = self.server.remote_shard_for(request.receiver)
+        if shard is None:
+            self._deliver(message, request.receiver, context)
+        else:
+            try:
+                shard.DeliverMessage(chat_pb2.DeliverMessageRequest(
+                    message=chat_pb2.Message(id=message.id, sender=message.sender, content=message.content),
+                    receiver=request.receiver
+                ), metadata=self.server.cluster_metadata())
+            except grpc.RpcError as e:
+                context.abort(e.code(), e.details())
 
-        message = Message(self.server.next_message_id, sender_id, request.content)
-        self.server.next_message_id += 1
+        self.server.account_manager.record_sent_message(request.receiver, message)
+        return chat_pb2.SendMessageResponse()
+
+    def DeliverMessage(self, request, context):
+        if self.server.ring is None:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "Sharding is not enabled on this server")
+        self._check_cluster_peer(context)
+        self._check_writable(context)
+        m = request.message
+        error = self.server.forwarded_message_error(m.id, m.sender, request.receiver)
+        if error:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, error)
+        self._deliver(Message(m.id, m.sender, m.content), request.receiver, context)
+        return chat_pb2.DeliverMessageResponse()
 
+    def _deliver(self, message: Message, recipient: str, context):
+        """Store a message for a recipient on this server, and notify them if they're online."""
         # Check if recipient is online. Do this atomically
         with self.server.sessions_lock:
-            online = False
-            for peer, username in self.server.client_sessions.items():
-                if username == recipient:
-                    online = True
-                    break
-
-            if online:
-                user = self.server.account_manager.get_user(recipient)
-                user.add_read_message(message)
-                user.message_subscriber_queue.put(message)
-            else:
-                self.server.account_manager.get_user(recipient).add_message(message)
-
-        return chat_pb2.SendMessageResponse()
+            online = self.server.is_online(recipient)
+            try:
+                found = self.server.account_manager.deliver_message(recipient, message, online)
+            except MailboxFullError as e:
+                context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+        if not found:
+            context.abort(grpc.StatusCode.NOT_FOUND, "Recipient not found")
 
     def GetNumberOfUnreadMessages(self, request, context):
-        with self.server.sessions_lock:
-            username = self.server.client_sessions[context.peer()]
-        
-        user = self.server.account_manager.get_user(username)
+        username = self._session_user(context)
+
         return chat_pb2.GetNumberOfUnreadMessagesResponse(
-            count=user.get_number_of_unread_messages()
+            count=self.server.account_manager.get_number_of_unread_messages(username)
         )
 
     def GetNumberOfReadMessages(self, request, context):
-        with self.server.sessions_lock:
-            username = self.server.client_sessions[context.peer()]
-        
-        user = self.server.account_manager.get_user(username)
+        username = self._session_user(context)
+
         return chat_pb2.GetNumberOfReadMessagesResponse(
-            count=user.get_number_of_read_messages()
+            count=self.server.account_manager.get_number_of_read_messages(username)
         )
 
     def PopUnreadMessages(self, request, context):
-        with self.server.sessions_lock:
-            username = self.server.client_sessions[context.peer()]
-        
-        user = self.server.account_manager.get_user(username)
-        messages = user.pop_unread_messages(request.num_messages)
-        return chat_pb2.PopUnreadMessagesResponse(
-            messages=[
-                chat_pb2.Message(id=m.id, sender=m.sender, content=m.content)
-                for m in messages
-            ]
-        )
+        self._check_writable(context)
+        username = self._session_user(context)
+
+        try:
+            messages = self.server.account_manager.pop_unread_messages(username, request.num_messages)
+        except MailboxFullError as e:
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(e))
+        response = self._messages_response(chat_pb2.PopUnreadMessagesResponse, messages, request.compact)
+        return self._compress_if_large(response, context)
 
     def GetReadMessages(self, request, context):
-        with self.server.sessions_lock:
-            username = self.server.client_sessions[context.peer()]
-        
-        user = self.server.account_manager.get_user(username)
-        messages = user.get_read_messages(request.offset, request.num_messages)
-        return chat_pb2.GetReadMessagesResponse(
-            messages=[
-                chat_pb2.Message(id=m.id, sender=m.sender, content=m.content)
-                for m in messages
-            ]
-        )
+        username = self._session_user(context)
+
+        messages = self.server.account_manager.get_read_messages(username, request.offset, request.num_messages)
+        response = self._messages_response(chat_pb2.GetReadMessagesResponse, messages, request.compact)
+        return self._compress_if_large(response, context)
+
+    def GetConversation(self, request, context):
+        username = self._session_user(context)
+
+        messages = self.server.account_manager.get_conversation(
+            username, request.correspondent, request.offset, request.num_messages)
+        response = self._messages_response(chat_pb2.GetConversationResponse, messages, request.compact)
+        response.unread = self.server.account_manager.get_number_of_unread_messages_from(
+            username, request.correspondent)
+        return self._compress_if_large(response, context)
+
+    def GetUnreadCounts(self, request, context):
+        username = self._session_user(context)
+
+        return chat_pb2.GetUnreadCountsResponse(counts=self.server.account_manager.get_unread_counts(username))
+
+    def CreateChannel(self, request, context):
+        self._check_writable(context)
+        username = self._session_user(context)
+
+        error = self.server.account_manager.create_channel(request.channel, username)
+        return chat_pb2.CreateChannelResponse(error=error)
+
+    def JoinChannel(self, request, context):
+        self._check_writable(context)
+        username = self._session_user(context)
+
+        error = self.server.account_manager.join_channel(request.channel, username)
+        return chat_pb2.JoinChannelResponse(error=error)
+
+    def LeaveChannel(self, request, context):
+        self._check_writable(context)
+        username = self._session_user(context)
+
+        error = self.server.account_manager.leave_channel(request.channel, username)
+        return chat_pb2.LeaveChannelResponse(error=error)
+
+    def SendChannelMessage(self, request, context):
+        self._check_writable(context)
+        username = self._session_user(context)
+
+        message = Message(self.server.allocate_message_id(), username, request.content)
+        error = self.server.account_manager.post_channel_message(request.channel, message)
+        if not error:
+            # Stored once for every member, who are notified in the background
+            self.server.publish_channel_message(ChannelMessage(request.channel, message))
+        return chat_pb2.SendChannelMessageResponse(error=error)
+
+    def ReadChannelMessages(self, request, context):
+        self._check_writable(context)
+        username = self._session_user(context)
+
+        messages = self.server.account_manager.read_channel_messages(request.channel, username, request.num_messages)
+        if messages is None:
+            context.abort(grpc.StatusCode.PERMISSION_DENIED, "Not a member of the channel")
+        response = self._messages_response(chat_pb2.ReadChannelMessagesResponse, messages, request.compact)
+        return self._compress_if_large(response, context)
+
+    def GetChannelHistory(self, request, context):
+        username = self._session_user(context)
+
+        messages = self.server.account_manager.get_channel_history(
+            request.channel, username, request.offset, request.num_messages)
+        if messages is None:
+            context.abort(grpc.StatusCode.PERMISSION_DENIED, "Not a member of the channel")
+        response = self._messages_response(chat_pb2.GetChannelHistoryResponse, messages, request.compact)
+        return self._compress_if_large(response, context)
+
+    def ListChannels(self, request, context):
+        username = self._session_user(context)
+
+        return chat_pb2.ListChannelsResponse(channels=[
+            chat_pb2.ChannelInfo(name=name, members=members, unread=unread)
+            for name, members, unread in self.server.account_manager.list_channels(username)
+        ])
+
+    def SearchMessages(self, request, context):
+        username = self._session_user(context)
+
+        result = self.server.account_manager.search_messages(username, request.query, request.limit, request.cursor)
+        if result is None:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "Message search is turned off on this server")
+        messages, next_cursor = result
+        response = self._messages_response(chat_pb2.SearchMessagesResponse, messages, request.compact)
+        response.next_cursor = next_cursor
+        return self._compress_if_large(response, context)
 
     def DeleteMessages(self, request, context):
-        with self.server.sessions_lock:
-            username = self.server.client_sessions[context.peer()]
-        
-        user = self.server.account_manager.get_user(username)
-        user.delete_messages(request.message_ids)
+        self._check_writable(context)
+        username = self._session_user(context)
+
+        self.server.account_manager.delete_messages(username, request.message_ids)
         return chat_pb2.DeleteMessagesResponse()
 
+    @staticmethod
+    def _notification(message: Message):
+        return chat_pb2.MessageNotification(
+            message=chat_pb2.Message(
+                id=message.id,
+                sender=message.sender,
+                content=message.content
+            )
+        )
+
+    @staticmethod
+    def _channel_notification(channel_message: ChannelMessage):
+        notification = ChatServicer._notification(channel_message.message)
+        notification.channel = channel_message.channel
+        return notification
+
     def SubscribeToMessages(self, request, context):
         peer = context.peer()
+        last_seen_id = request.last_seen_id if request.HasField('last_seen_id') else None
+        subscribed_user = None
+        sent_ahead = set()  # Ids sent from the notification log that are still to come through the queue
+        heartbeat_interval = self.server.heartbeat_interval
+        poll_interval = min(SUBSCRIPTION_POLL_INTERVAL, heartbeat_interval) if heartbeat_interval > 0 \
+            else SUBSCRIPTION_POLL_INTERVAL
+        last_frame = time.monotonic()
+        self.server.stream_opened(peer)
+        try:
+            while context.is_active():
+                with self.server.sessions_lock:
+                    username = self.server.client_sessions.get(peer)
 
-        while context.is_active():
-            with self.server.sessions_lock:
-                username = self.server.client_sessions.get(peer)
-            
-            if username:
-                user = self.server.account_manager.get_user(username)
-                if user:
-                    # Check for new messages
-                    # This get should block until a message is available
-                    message = user.message_subscriber_queue.get()
+                if username and username != subscribed_user:
+                    # Catch up on what earlier streams didn't get to deliver before waiting for new messages
+                    if subscribed_user is not None:
+                        # Logged in as someone else on the same peer, whose ids say nothing about this user's
+                        last_seen_id = None
+                        sent_ahead.clear()
+                    subscribed_user = username
+                    if last_seen_id is None:
+                        last_seen_id = self.server.delivery_cursors.get(username)
+                    if last_seen_id is None:
+                        continue
+                    pending = self.server.account_manager.get_notifications_after(username, last_seen_id)
+                elif username:
+                    subscriber_queue = self.server.subscriber_queue(username)
+                    if not subscriber_queue:
+                        continue
+                    # Check for new messages, waking up now and then to notice if the client has gone
+                    try:
+                        message = subscriber_queue.get(timeout=poll_interval)
+                    except queue.Empty:
+                        if not self.server.running:
+                            break  # Everything queued has been sent, and nothing more is coming
+                        if heartbeat_interval > 0 and time.monotonic() - last_frame >= heartbeat_interval:
+                            # Writing to a connection is what finds out it's dead, if keepalive pings haven't yet
+                            last_frame = time.monotonic()
+                            self.server.count_session_event("heartbeats")
+                            yield chat_pb2.MessageNotification(heartbeat=True)
+                        continue
                     if message is None: # None is the sentinel value for shutdown
                         break
-                    yield chat_pb2.MessageNotification(
-                        message=chat_pb2.Message(
-                            id=message.id,
-                            sender=message.sender,
-                            content=message.content
-                        )
-                    )
+                    if isinstance(message, ChannelMessage):
+                        # Not replayed, a member who misses it still has it unread in the channel
+                        last_frame = time.monotonic()
+                        yield self._channel_notification(message)
+                        continue
+                    if message.id in sent_ahead:
+                        sent_ahead.discard(message.id)
+                        continue
+                    if last_seen_id is None:
+                        pending = [message]
+                    else:
+                        # A stream that died waiting on this queue may have taken messages that came before this one
+                        pending = self.server.account_manager.get_notifications_after(username, last_seen_id)
+                        sent_ahead.update(m.id for m in pending)
+                        sent_ahead.discard(message.id)
+                elif not self.server.running:
+                    break
+                else:
+                    # Not logged in yet
+                    time.sleep(poll_interval / 10)
+                    continue
+
+                for message in pending:
+                    yield self._notification(message)
+                    # Only counts as delivered once the client asks for the next one
+                    last_frame = time.monotonic()
+                    last_seen_id = message.id
+                    self.server.delivery_cursors[username] = message.id
+        finally:
+            self.server.stream_closed(peer, client_gone=not context.is_active())
+
+    def StreamMutations(self, request, context):
+        if self.server.account_manager.mutation_log is None:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION, "Replication is not enabled on this server")
+        # The snapshot holds every user's password hash
+        self._check_cluster_peer(context)
+
+        seq = request.after_seq
+        while context.is_active() and self.server.running:
+            # A new replica always starts from a snapshot, since the log doesn't go back to the start of the state
+            mutations = self.server.account_manager.mutation_log.read_after(seq, timeout=1) if seq > 0 else None
+            if mutations is None:
+                snapshot, seq = self.server.snapshot()
+                yield chat_pb2.Mutation(seq=seq, snapshot=snapshot)
+                continue
+            for mutation in mutations:
+                yield mutation
+                seq = mutation.seq
+
+    def Promote(self, request, context):
+        self._check_cluster_peer(context)
+        self.server.promote()
+        return chat_pb2.PromoteResponse()
+
+def mailbox_limits(config: ConnectionSettings) -> MailboxLimits:
+    """Per-user mailbox limits from the config."""
+    return MailboxLimits(
+        max_unread_messages=config.max_unread_messages,
+        max_read_messages=config.max_read_messages,
+        max_subscriber_queue=config.max_subscriber_queue,
+        overflow_policy=OverflowPolicy(config.overflow_policy),
+        spill_dir=config.spill_dir,
+        hot_read_messages=config.hot_read_messages,
+        segment_dir=config.segment_dir
+    )
 
 class ChatServer:
     def __init__(self, config: ConnectionSettings = ConnectionSettings()):
         self.host = config.host
         self.port = config.port
-        self.account_manager = AccountManager()
+        self.account_manager = AccountManager(mailbox_limits(config), config.search_index)
         self.client_sessions: Dict[str, Optional[str]] = {}  # peer -> username
-        self.next_message_id = 0
+        self.delivery_cursors: Dict[str, int] = {}  # username -> id of the last notification a stream delivered
+        self.shard_id = config.shard_id
+        self.ring = HashRing(config.shards) if config.shards else None
+        self.shard_stubs: Dict[int, chat_pb2_grpc.ChatServiceStub] = {}
+        self.shard_stubs_lock = threading.Lock()
+        # Shards hand out interleaved ids, starting at their own index, so ids never clash
+        self.message_id_stride = len(config.shards) if config.shards else 1
+        self.next_message_id = self.shard_id if self.ring else 0
+        self.message_id_lock = threading.Lock()
         self.running = True
         self.server_path = config.server_data_path
         self.sessions_lock = threading.Lock()
+        # Sessions are never closed by the client going away, so idle ones are reaped
+        self.session_activity: Dict[str, float] = {}  # peer -> time of the last call
+        self.open_streams: Dict[str, int] = {}  # peer -> number of open subscriptions
+        self.session_stats = dict.fromkeys(["heartbeats", "reaped_streams", "reaped_sessions"], 0)
+        self.heartbeat_interval = config.heartbeat_interval
+        self.session_timeout = config.session_timeout
+        self.grpc_options: List[Tuple[str, Any]] = keepalive_options(config)
+        self.replication_log_size = config.replication_log_size
+        if config.replication_log_size > 0:
+            self.account_manager.mutation_log = MutationLog(config.replication_log_size)
+        self.cluster_secret = config.cluster_secret
+        if self.ring is not None and not self.cluster_secret:
+            raise ValueError("Sharded servers need a cluster_secret to take messages forwarded by each other")
+        if config.replica_of and not self.cluster_secret:
+            raise ValueError("A replica needs the primary's cluster_secret to follow it")
+        self.replicator = Replicator(self, config.replica_of) if config.replica_of else None
+        self.read_only = self.replicator is not None
+        self.compression = parse_compression(config.compression)
+        self.compression_threshold = config.compression_threshold
+        self.rate_limiter: Optional[RateLimitInterceptor] = None
+        if config.rate_limit > 0 or config.rate_limit_methods:
+            method_limits = {method: tuple(limits) for method, limits in config.rate_limit_methods.items()}
+            # Forwarded messages arrive from a shard on behalf of all its users, they were limited there.
+            # Only other shards can make these calls
+            method_limits.setdefault("DeliverMessage", (0, 0))
+            self.rate_limiter = RateLimitInterceptor(self, config.rate_limit, config.rate_limit_burst, method_limits)
+        self.fanout = ChannelFanout(self, config.fanout_batch_size)
+        self.checkpointer = Checkpointer(self, config.checkpoint_interval)
+        self.compactor = Compactor(self, config.compaction_interval, config.retention_max_age,
+                                   config.retention_max_messages,
+                                   {name: tuple(rule) for name, rule in config.retention_overrides.items()})
+        self.in_flight = InFlightInterceptor()
+        self.shutdown_grace = config.shutdown_grace
+
+    def allocate_message_id(self) -> int:
+        """Get an id for a new message."""
+        with self.message_id_lock:
+            message_id = self.next_message_id
+            self.next_message_id += self.message_id_stride
+        return message_id
+
+    def wrong_shard_error(self, username: str) -> Optional[str]:
+        """Error for a client that sent a user's account request to a shard that doesn't own the user."""
+        if self.ring is not None and self.ring.shard_index(username) != self.shard_id:
+            return f"{username} belongs to shard {self.ring.shard_for(username)}"
+        return None
+
+    def cluster_metadata(self) -> Tuple[Tuple[str, str], ...]:
+        """Metadata for calls to other servers of the cluster, which they check before taking them."""
+        return ((CLUSTER_SECRET_KEY, self.cluster_secret),)
+
+    def forwarded_message_error(self, message_id: int, sender: str, receiver: str) -> Optional[str]:
+        """
+        Error for a message forwarded from another shard that that shard couldn't have sent: the sender has to be
+        one of its users, the receiver one of ours, and the id one of those it hands out.
+        """
+        sender_shard = self.ring.shard_index(sender)
+        if sender_shard == self.shard_id:
+            return f"{sender} belongs to this shard"
+        if self.ring.shard_index(receiver) != self.shard_id:
+            return f"{receiver} belongs to shard {self.ring.shard_for(receiver)}"
+        if message_id % self.message_id_stride != sender_shard:
+            return f"Message id {message_id} wasn't handed out by shard {self.ring.shards[sender_shard]}"
+        return None
+
+    def shard_stub(self, index: int) -> chat_pb2_grpc.ChatServiceStub:
+        """Stub for another shard. Channels are opened on first use and kept."""
+        with self.shard_stubs_lock:
+            if index not in self.shard_stubs:
+                channel = grpc.insecure_channel(self.ring.shards[index])
+                self.shard_stubs[index] = chat_pb2_grpc.ChatServiceStub(channel)
+            return self.shard_stubs[index]
+
+    def remote_shard_for(self, username: str) -> Optional[chat_pb2_grpc.ChatServiceStub]:
+        """Stub for the shard that owns a user, or None if it's this server."""
+        if self.ring is None:
+            return None
+        index = self.ring.shard_index(username)
+        return None if index == self.shard_id else self.shard_stub(index)
+
+    def gather_usernames(self, pattern: str) -> List[str]:
+        """Usernames matching the pattern on every shard, sorted so pages are stable across calls."""
+        request = chat_pb2.ListUsersRequest(pattern=pattern, offset=0, limit=-1, local_only=True)
+        # Ask every other shard at once, then do the local part while they work
+        pending = [self.shard_stub(i).ListUsers.future(request) for i in range(len(self.ring)) if i != self.shard_id]
+        usernames = self.account_manager.list_usernames(pattern)
+        for future in pending:
+            usernames.extend(future.result().usernames)
+        return sorted(usernames)
+
+    def capture_state(self) -> StateCapture:
+        """The whole server state as of now, to be encoded without holding up writers."""
+        # A collection set off by the capture's lists would go over every message while writers wait on the lock
+        with self.account_manager.mutation_lock, paused_gc():
+            with self.message_id_lock:
+                next_message_id = self.next_message_id
+            return capture_state(self.account_manager, next_message_id)
+
+    def snapshot(self) -> Tuple[bytes, int]:
+        """The whole server state as a binary snapshot, and the last mutation it includes."""
+        with self.account_manager.mutation_lock:
+            capture = self.capture_state()
+            log = self.account_manager.mutation_log
+            seq = log.last_seq if log else 0
+        return encode_capture(capture), seq
+
+    def _load(self, data: bytes):
+        """Replace the accounts and channels with those in a snapshot."""
+        # The loaded state lasts until the next load, if there is one
+        with paused_gc(freeze=True):
+            next_message_id = decode_snapshot(data, self.account_manager)
+        with self.message_id_lock:
+            self.next_message_id = next_message_id
+
+    def load_snapshot(self, data: bytes):
+        """Replace the whole server state with a snapshot from the primary."""
+        with self.account_manager.mutation_lock:
+            self._load(data)
+            if self.account_manager.mutation_log is not None:
+                # Our own replicas can't follow on from a log that skipped to a new state, so they start over too
+                self.account_manager.mutation_log = MutationLog(self.replication_log_size)
+
+    def apply_mutation(self, mutation: chat_pb2.Mutation):
+        """Apply a mutation streamed from the primary."""
+        self.account_manager.apply_mutation(mutation)
+        kind = mutation.WhichOneof("kind")
+        if kind in ("deliver", "channel_message"):
+            message_id = getattr(mutation, kind).message.id
+            with self.message_id_lock:
+                self.next_message_id = max(self.next_message_id, message_id + self.message_id_stride)
+
+    def promote(self):
+        """Stop following the primary and start accepting writes."""
+        if self.replicator is not None:
+            self.replicator.stop()
+        self.read_only = False
+
+    def get_replication_stats(self) -> Dict:
+        """Position in the mutation log, and for a replica, how far it lags behind the primary."""
+        log = self.account_manager.mutation_log
+        stats = {"read_only": self.read_only, "last_seq": log.last_seq if log else 0}
+        if self.replicator is not None:
+            stats.update(self.replicator.get_stats())
+        return stats
+
+    def get_backlog_stats(self) -> Dict[str, int]:
+        """Totals of messages held for users, and of messages that didn't fit in their mailboxes."""
+        return self.account_manager.get_backlog_stats()
+
+    def stream_opened(self, peer: str):
+        with self.sessions_lock:
+            self.open_streams[peer] = self.open_streams.get(peer, 0) + 1
+
+    def stream_closed(self, peer: str, client_gone: bool):
+        """A subscription ended. If the client went away, its session times out from now."""
+        with self.sessions_lock:
+            self.open_streams[peer] -= 1
+            if not self.open_streams[peer]:
+                del self.open_streams[peer]
+            self.session_activity[peer] = time.monotonic()
+            if client_gone:
+                self.session_stats["reaped_streams"] += 1
+
+    def count_session_event(self, name: str):
+        with self.sessions_lock:
+            self.session_stats[name] += 1
+
+    def reap_stale_sessions(self, now: Optional[float] = None) -> List[str]:
+        """Log out sessions with no open subscription and no calls for session_timeout. Returns their usernames."""
+        now = time.monotonic() if now is None else now
+        reaped = []
+        with self.sessions_lock:
+            for peer in list(self.client_sessions):
+                if peer in self.open_streams or now - self.session_activity.get(peer, 0) < self.session_timeout:
+                    continue
+                username = self.client_sessions.pop(peer)
+                self.session_activity.pop(peer, None)
+                if username:
+                    reaped.append(username)
+            self.session_stats["reaped_sessions"] += len(reaped)
+        for username in reaped:
+            self.set_online(username, False)
+        return reaped
+
+    def _reap_sessions(self):
+        while self.running:
+            time.sleep(min(self.session_timeout / 2, SESSION_REAP_INTERVAL))
+            self.reap_stale_sessions()
+
+    def get_session_stats(self) -> Dict[str, int]:
+        """Open sessions and subscriptions, and how many were found dead."""
+        with self.sessions_lock:
+            stats = dict(self.session_stats)
+            stats["sessions"] = sum(1 for username in self.client_sessions.values() if username)
+            stats["open_streams"] = sum(self.open_streams.values())
+        return stats
+
+    def is_online(self, username: str) -> bool:
+        """Whether a user is logged in. Call with the sessions lock held."""
+        return username in self.client_sessions.values()
+
+    def set_online(self, username: str, online: bool):
+        """Called when a user logs in or out. Sessions are all local to this process, so there's nothing to do."""
+
+    def publish_channel_message(self, channel_message: ChannelMessage):
+        """Notify a channel's online members of a new message, without waiting for it to be done."""
+        self.fanout.submit(channel_message)
+
+    def subscriber_queue(self, username: str) -> Optional[queue.Queue]:
+        """Queue of new message notifications for a logged in user."""
+        return self.account_manager.get_subscriber_queue(username)
+
+    def close_subscriptions(self):
+        """Unblock all threads waiting for new messages."""
+        for user in self.account_manager.accounts.values():
+            if user._subscriber_queue is None:
+                continue  # Never logged in, so nobody is waiting on it
+            try:
+                user._subscriber_queue.put_nowait(None)
+            except queue.Full:
+                pass  # Nobody is blocked on a full queue
 
     def save_state(self):
         """Save the server state to a file."""
-        with open(self.server_path, "w") as f:
-            state = {
-                "account_manager": self.account_manager.get_state(),
-                "next_message_id": self.next_message_id
-            }
-            f.write(json.dumps(state))
+        self.checkpointer.checkpoint()
 
     def load_state(self):
         """Load the server state from a file."""
-        try:
-            with open(self.server_path) as f:
-                state = json.load(f)
-                self.account_manager.load_state(state["account_manager"])
-                self.next_message_id = state["next_message_id"]
-        except FileNotFoundError:
+        data = read_state(self.server_path)
+        if data is None:
             print("No server state found, starting fresh")
+            return
+        self._load(data)
 
-    def start(self):
-        """Start the chat server."""
-        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    def start_server(self) -> grpc.Server:
+        """Start serving without blocking. If the configured port is 0, the port picked by the OS is stored."""
+        interceptors = [self.in_flight] + ([self.rate_limiter] if self.rate_limiter else [])
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10), interceptors=interceptors,
+                             options=self.grpc_options)
         chat_pb2_grpc.add_ChatServiceServicer_to_server(ChatServicer(self), server)
-        server.add_insecure_port(f'{self.host}:{self.port}')
+        self.port = server.add_insecure_port(f'{self.host}:{self.port}')
         server.start()
         print(f"Server started on {self.host}:{self.port}")
+        if self.replicator is not None and self.read_only:
+            self.replicator.start()
+        if self.session_timeout > 0:
+            threading.Thread(target=self._reap_sessions, daemon=True).start()
+        self.checkpointer.start()
+        self.compactor.start()
+        return server
 
+    def start(self):
+        """Start the chat server, and serve until interrupted or sent SIGTERM."""
+        server = self.start_server()
+        stop_requested = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_requested.set())
         try:
-            server.wait_for_termination()
+            stop_requested.wait()
         except KeyboardInterrupt:
-            self.handle_shutdown()
-        finally:
-            print("Stopping server.")
-            # Unblock all threads waiting on user.message_subscriber_queue.get()
-            for user in self.account_manager.accounts.values():
-                user.message_subscriber_queue.put(None)
-            server.stop(None)
+            pass
+        self.shutdown(server)
 
-    def handle_shutdown(self):
-        """Handle server shutdown."""
+    def shutdown(self, server: grpc.Server) -> Dict[str, float]:
+        """
+        Stop serving without losing anything that was accepted. New calls are refused, calls in flight get up to
+        the grace period to finish, subscribers are sent what's queued for them, and then the state is saved.
+        Returns how long each step took, in milliseconds.
+        """
         print("Server shutting down...")
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.shutdown_grace
+        self.checkpointer.stop()
+        self.compactor.stop()
+        # Calls still going when the grace period is up are cancelled
+        stopped = server.stop(self.shutdown_grace)
+        self.in_flight.wait_idle(self.shutdown_grace)
+        drained = time.perf_counter()
+
         self.running = False
+        self.fanout.stop(max(0.0, deadline - time.monotonic()))
+        # Streams send what's ahead of the sentinel in their queue, then end
+        self.close_subscriptions()
+        stopped.wait(max(0.0, deadline - time.monotonic()))
+        flushed = time.perf_counter()
+
+        self.handle_shutdown()
+        saved = time.perf_counter()
+        timings = {"drain_ms": (drained - start) * 1000, "flush_ms": (flushed - drained) * 1000,
+                   "save_ms": (saved - flushed) * 1000, "total_ms": (saved - start) * 1000}
+        print("Stopped in {total_ms:.0f} ms: {drain_ms:.0f} ms for calls in flight, {flush_ms:.0f} ms for "
+              "subscriptions, {save_ms:.0f} ms to save".format(**timings))
+        return timings
+
+    def handle_shutdown(self):
+        """Save the state once nothing else can change it."""
         print(f"Saving server state to {self.server_path}")
         self.save_state()
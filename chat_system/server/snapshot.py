@@ -0,0 +1,387 @@
+"""
+Binary snapshots of the server state, for the server data file and for replicas that start over.
+
+A snapshot is a header followed by sections. Each section is a 4-byte tag, an 8-byte length, the payload and
+the CRC32 of the payload. Payloads are columnar: one field of every account or message, then the next field,
+so that each column is encoded and decoded in a few calls instead of value by value. Integers are little-endian.
+"""
+import gc
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import accumulate, chain, repeat
+from operator import sub
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from ..common.channel import Channel
+from ..common.user import Message, SentMessage
+from .account_manager import AccountManager
+
+MAGIC = b"CHATSNAP"
+VERSION = 1
+_HEADER = struct.Struct('<8sLQL')  # Magic, version, next message id, number of sections
+_SECTION = struct.Struct('<4sQ')  # Tag, payload length
+_CHECKSUM = struct.Struct('<L')
+_INTS = struct.Struct('<Qc')  # Count, array typecode
+_STRINGS = struct.Struct('<QBQ')  # Count, layout, bytes of data
+
+# String columns are joined with NUL when none of them contain one, so that they split again in one call.
+# Otherwise the length of each comes first
+_JOINED = 0
+_LENGTHS = 1
+# Accounts with their login info and mailbox sizes, unread, read and sent messages, then channels
+_SECTIONS = [b"ACCT", b"UNRD", b"READ", b"SENT", b"CHAN"]
+# Integer columns are stored in the narrowest of these that fits all of them
+_INT_TYPES = [('b', 2**7), ('h', 2**15), ('i', 2**31), ('q', 2**63)]
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot is truncated, fails a checksum or is from a newer version."""
+
+
+@contextmanager
+def paused_gc(freeze: bool = False):
+    """
+    Loading makes millions of objects that all stay alive. The collections they set off on the way make it
+    several times slower without finding anything to free. With freeze, everything alive at the end is moved out
+    of the collector's sight for good, so that later full collections don't go over the loaded state either.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+        if freeze:
+            gc.freeze()
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def is_snapshot(data: bytes) -> bool:
+    """Whether data is a binary snapshot, rather than the JSON state older versions saved."""
+    return data[:len(MAGIC)] == MAGIC
+
+
+def _to_bytes(typecode: str, values) -> bytes:
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _split(values: List, counts: List[int]) -> List[List]:
+    """Cut a column into consecutive runs of the given lengths."""
+    offsets = list(accumulate(counts, initial=0))
+    return [values[start:end] for start, end in zip(offsets, offsets[1:])]
+
+
+class _ColumnWriter:
+    def __init__(self):
+        self.parts: List[bytes] = []
+
+    def ints(self, values: Sequence[int]):
+        typecode = 'b'
+        if values:
+            low, high = min(values), max(values)
+            typecode = next(typecode for typecode, limit in _INT_TYPES if -limit <= low and high < limit)
+        self.parts.append(_INTS.pack(len(values), typecode.encode('ascii')))
+        self.parts.append(_to_bytes(typecode, values))
+
+    def ids(self, values: List[int]):
+        """Increasing ids, as the difference from the one before so that they fit in a byte or two."""
+        self.ints(list(map(sub, values, [0] + values[:-1])))
+
+    def strs(self, values: Sequence[str]):
+        joined = '\0'.join(values)
+        if joined.count('\0') == max(0, len(values) - 1):
+            data = joined.encode('utf-8')
+            self.parts.append(_STRINGS.pack(len(values), _JOINED, len(data)))
+            self.parts.append(data)
+        else:
+            self.blobs([value.encode('utf-8') for value in values])
+
+    def blobs(self, values: Sequence[bytes]):
+        data = b''.join(values)
+        self.parts.append(_STRINGS.pack(len(values), _LENGTHS, len(data)))
+        self.parts.append(_to_bytes('I', [len(value) for value in values]))
+        self.parts.append(data)
+
+    def symbols(self, values: Sequence[str]):
+        """A column with few distinct values, like senders: a table of them, then an index into it per value."""
+        table: Dict[str, int] = {}
+        indices = [table.setdefault(value, len(table)) for value in values]
+        self.strs(list(table))
+        self.ints(indices)
+
+    def messages(self, messages: List[Message], correspondents: List[str]):
+        self.ids([m.id for m in messages])
+        self.symbols(correspondents)
+        self.strs([m.content for m in messages])
+
+    def getvalue(self) -> bytes:
+        return b''.join(self.parts)
+
+
+class _ColumnReader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+
+    def _take(self, length: int) -> bytes:
+        if self.offset + length > len(self.data):
+            raise SnapshotError("Column runs past the end of its section")
+        chunk = self.data[self.offset:self.offset + length]
+        self.offset += length
+        return chunk
+
+    def _array(self, typecode: str, count: int) -> List[int]:
+        values = array(typecode)
+        values.frombytes(self._take(count * values.itemsize))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values.tolist()
+
+    def ints(self) -> List[int]:
+        count, typecode = _INTS.unpack(self._take(_INTS.size))
+        typecode = typecode.decode('ascii', 'replace')
+        if typecode not in dict(_INT_TYPES):
+            raise SnapshotError(f"Unknown integer column type {typecode!r}")
+        return self._array(typecode, count)
+
+    def ids(self) -> List[int]:
+        return list(accumulate(self.ints()))
+
+    def strs(self) -> List[str]:
+        count, layout, length = _STRINGS.unpack(self._take(_STRINGS.size))
+        if layout == _JOINED:
+            return self._take(length).decode('utf-8').split('\0') if count else []
+        offsets = list(accumulate(self._array('I', count), initial=0))
+        data = self._take(length)
+        if data.isascii():
+            # A character per byte, so the offsets work on the decoded string too
+            text = data.decode('ascii')
+            return [text[start:end] for start, end in zip(offsets, offsets[1:])]
+        return [data[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+
+    def blobs(self) -> List[bytes]:
+        count, _, length = _STRINGS.unpack(self._take(_STRINGS.size))
+        offsets = list(accumulate(self._array('I', count), initial=0))
+        data = self._take(length)
+        return [data[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def symbols(self) -> List[str]:
+        table = self.strs()
+        # Every message from one sender shares the table's string
+        return list(map(table.__getitem__, self.ints()))
+
+    def messages(self) -> List[Message]:
+        return list(map(Message, self.ids(), self.symbols(), self.strs()))
+
+
+@dataclass
+class StateCapture:
+    """
+    Everything a snapshot holds, as of one moment. Mailboxes and channel histories are only appended to in place,
+    and replaced when anything is removed, so a list and how long it was stand in for a copy of it.
+    """
+    next_message_id: int
+    names: List[str]
+    login_info: List[Tuple[bytes, bytes]]
+    unread: List[Tuple[List[Message], int]]
+    read: List[Tuple[List[Message], int]]
+    sent: List[Tuple[List[SentMessage], int]]
+    channels: List[Tuple[str, str, List[Message], int, Dict[str, int]]]  # Name, owner, messages, count, members
+
+
+def capture_state(account_manager: AccountManager, next_message_id: int) -> StateCapture:
+    """
+    Capture an account manager's accounts and channels for encode_capture. The caller has to keep writers out,
+    but only while this runs: it takes references and lengths, not copies of the messages.
+    """
+    accounts = account_manager.accounts
+    names = list(accounts)
+    users = list(accounts.values())
+    unread = []
+    for user in users:
+        if user.unread_count == len(user.message_queue):
+            unread.append((user.message_queue, len(user.message_queue)))
+        else:
+            # Some are in a spill file, which is changed in place, so they're read now
+            messages = user.get_unread_messages()
+            unread.append((messages, len(messages)))
+    return StateCapture(
+        next_message_id=next_message_id,
+        names=names,
+        login_info=list(map(account_manager.login_info.__getitem__, names)),
+        unread=unread,
+        read=[(user.read_mailbox, len(user.read_mailbox)) for user in users],
+        sent=[(user.sent_messages, len(user.sent_messages)) for user in users],
+        channels=[(channel.name, channel.owner, channel.messages, len(channel.messages), dict(channel.members))
+                  for channel in account_manager.channels.values()],
+    )
+
+
+def encode_capture(capture: StateCapture) -> bytes:
+    """A snapshot of captured state. Writers can carry on while it's encoded."""
+    unread, read, sent = ([messages[:count] for messages, count in mailboxes]
+                          for mailboxes in [capture.unread, capture.read, capture.sent])
+
+    accounts = _ColumnWriter()
+    accounts.strs(capture.names)
+    accounts.blobs([password_hash for password_hash, _ in capture.login_info])
+    accounts.blobs([salt for _, salt in capture.login_info])
+    for mailboxes in [unread, read, sent]:
+        accounts.ints([len(messages) for messages in mailboxes])
+
+    sections = {b"ACCT": accounts.getvalue()}
+    for tag, mailboxes in [(b"UNRD", unread), (b"READ", read)]:
+        messages = list(chain.from_iterable(mailboxes))
+        columns = _ColumnWriter()
+        columns.messages(messages, [m.sender for m in messages])
+        sections[tag] = columns.getvalue()
+    # The sender of a sent message is the account it's saved under
+    messages = list(chain.from_iterable(sent))
+    columns = _ColumnWriter()
+    columns.messages(messages, [m.receiver for m in messages])
+    sections[b"SENT"] = columns.getvalue()
+
+    channels = capture.channels
+    columns = _ColumnWriter()
+    columns.strs([name for name, _, _, _, _ in channels])
+    columns.strs([owner for _, owner, _, _, _ in channels])
+    columns.ints([count for _, _, _, count, _ in channels])
+    columns.ints([len(members) for _, _, _, _, members in channels])
+    messages = list(chain.from_iterable(messages[:count] for _, _, messages, count, _ in channels))
+    columns.messages(messages, [m.sender for m in messages])
+    columns.symbols(list(chain.from_iterable(members for _, _, _, _, members in channels)))
+    columns.ints(list(chain.from_iterable(members.values() for _, _, _, _, members in channels)))
+    sections[b"CHAN"] = columns.getvalue()
+
+    header = _HEADER.pack(MAGIC, VERSION, capture.next_message_id, len(sections))
+    parts = [header, _CHECKSUM.pack(zlib.crc32(header))]
+    for tag, payload in sections.items():
+        parts += [_SECTION.pack(tag, len(payload)), payload, _CHECKSUM.pack(zlib.crc32(payload))]
+    return b''.join(parts)
+
+
+def encode_snapshot(account_manager: AccountManager, next_message_id: int) -> bytes:
+    """A snapshot of an account manager's accounts and channels. The caller has to keep writers out."""
+    return encode_capture(capture_state(account_manager, next_message_id))
+
+
+def write_atomically(path: str, data: bytes):
+    """Replace a file with data, so that a crash part way through leaves the old file whole."""
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _read_sections(data: bytes):
+    """The next message id and the payload of each section, once their checksums are verified."""
+    if not is_snapshot(data):
+        raise SnapshotError("Not a snapshot")
+    if len(data) < _HEADER.size + _CHECKSUM.size:
+        raise SnapshotError("Snapshot is truncated")
+    _, version, next_message_id, count = _HEADER.unpack_from(data)
+    if _CHECKSUM.unpack_from(data, _HEADER.size)[0] != zlib.crc32(data[:_HEADER.size]):
+        raise SnapshotError("Header checksum doesn't match")
+    if version > VERSION:
+        raise SnapshotError(f"Snapshot version {version} is newer than this server's {VERSION}")
+    sections = {}
+    offset = _HEADER.size + _CHECKSUM.size
+    for _ in range(count):
+        if offset + _SECTION.size > len(data):
+            raise SnapshotError("Snapshot is truncated")
+        tag, length = _SECTION.unpack_from(data, offset)
+        offset += _SECTION.size
+        if offset + length + _CHECKSUM.size > len(data):
+            raise SnapshotError("Snapshot is truncated")
+        payload = data[offset:offset + length]
+        offset += length
+        if _CHECKSUM.unpack_from(data, offset)[0] != zlib.crc32(payload):
+            raise SnapshotError(f"Checksum of section {tag.decode('ascii', 'replace')} doesn't match")
+        offset += _CHECKSUM.size
+        sections[tag] = payload
+    missing = set(_SECTIONS) - sections.keys()
+    if missing:
+        raise SnapshotError(f"Snapshot has no {b', '.join(sorted(missing)).decode('ascii')} section")
+    return next_message_id, sections
+
+
+def decode_snapshot(data: bytes, account_manager: AccountManager) -> int:
+    """Decode a snapshot into an account manager, replacing its accounts and channels. Returns the next message id."""
+    next_message_id, sections = _read_sections(data)
+    accounts = _ColumnReader(sections[b"ACCT"])
+    names = accounts.strs()
+    password_hashes = accounts.blobs()
+    salts = accounts.blobs()
+    unread_counts, read_counts, sent_counts = accounts.ints(), accounts.ints(), accounts.ints()
+
+    unread = _split(_ColumnReader(sections[b"UNRD"]).messages(), unread_counts)
+    read = _split(_ColumnReader(sections[b"READ"]).messages(), read_counts)
+    columns = _ColumnReader(sections[b"SENT"])
+    ids, receivers, contents = columns.ids(), columns.symbols(), columns.strs()
+    senders = chain.from_iterable(map(repeat, names, sent_counts))
+    sent = _split(list(map(SentMessage, ids, senders, contents, receivers)), sent_counts)
+    account_manager.load_accounts(zip(names, password_hashes, salts, unread, read, sent))
+
+    columns = _ColumnReader(sections[b"CHAN"])
+    channel_names, owners = columns.strs(), columns.strs()
+    message_counts, member_counts = columns.ints(), columns.ints()
+    messages = _split(columns.messages(), message_counts)
+    members = _split(list(zip(columns.symbols(), columns.ints())), member_counts)
+    account_manager.load_channels([Channel(name, owner, channel_messages, dict(channel_members))
+                                   for name, owner, channel_messages, channel_members
+                                   in zip(channel_names, owners, messages, members)])
+    return next_message_id
+
+
+def convert_json_state(json_path: str, snapshot_path: str):
+    """Rewrite a server data file saved as JSON by an older version as a snapshot."""
+    with open(json_path) as f:
+        state = json.load(f)
+    account_manager = AccountManager()
+    account_manager.load_state(state["account_manager"])
+    account_manager.load_channel_state(state.get("channels", {}))
+    write_atomically(snapshot_path, encode_snapshot(account_manager, state["next_message_id"]))
+
+
+
+def read_state(path: str) -> Optional[bytes]:
+    """
+    The snapshot saved at path, or None if there's no saved state. Older versions saved JSON, by default to
+    server_data.json. That's converted with convert_json_state first: a JSON file at path is kept as path.bak and
+    replaced by the snapshot, and if there's nothing at path, a JSON file next to it with the same name ending in
+    .json is converted to path and left where it is.
+    """
+    legacy_path = os.path.splitext(path)[0] + ".json"
+    if not os.path.exists(path) and legacy_path != path and os.path.exists(legacy_path):
+        print(f"Converting {legacy_path} saved by an older version to a snapshot at {path}")
+        convert_json_state(legacy_path, path)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if not is_snapshot(data):
+        backup_path = path + ".bak"
+        print(f"Converting {path} saved by an older version to a snapshot, the original is kept as {backup_path}")
+        os.replace(path, backup_path)
+        convert_json_state(backup_path, path)
+        with open(path, "rb") as f:
+            data = f.read()
+    return data
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m chat_system.server.snapshot server_data.json server_data.snapshot")
+        sys.exit(1)
+    convert_json_state(sys.argv[1], sys.argv[2])
@@ -0,0 +1,79 @@
+"""
+Shared helpers for the benchmark-style tests.
+
+Benchmarks run at a reduced scale by default so the unit test suite stays fast.
+Set CHAT_SYSTEM_FULL_BENCHMARK=1 to run them at the scale quoted in their docstrings.
+"""
+
+import os
+import socket
+import time
+import tracemalloc
+from typing import Any, Callable, List, Sequence, Tuple
+
+from chat_system.common.stats import percentile
+
+FULL_BENCHMARK = os.environ.get("CHAT_SYSTEM_FULL_BENCHMARK") == "1"
+
+
+def bench_scale(full: int, quick: int) -> int:
+    """Pick the full or reduced problem size depending on the benchmark mode."""
+    return full if FULL_BENCHMARK else quick
+
+
+def time_ns(fn: Callable[[], Any], repeat: int = 1) -> int:
+    """Average wall time of fn() in nanoseconds over repeat runs."""
+    repeat = max(1, repeat)
+    start = time.perf_counter_ns()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter_ns() - start) // repeat
+
+
+def measure_allocations(fn: Callable[[], Any]) -> Tuple[Any, int]:
+    """Run fn() once under tracemalloc. Returns its result and the peak number of bytes allocated."""
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    if not was_tracing:
+        tracemalloc.stop()
+    return result, peak - base
+
+
+def format_table(headers: Sequence[str], rows: List[Sequence[Any]]) -> str:
+    """Format rows as a plain-text table with right-aligned numeric columns."""
+    cells = [[str(h) for h in headers]] + [["-" if c is None else str(c) for c in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(headers))]
+
+    def fmt(row):
+        return "  ".join(c.rjust(w) if c.replace('.', '', 1).isdigit() else c.ljust(w)
+                         for c, w in zip(row, widths))
+
+    lines = [fmt(cells[0]), "  ".join("-" * w for w in widths)]
+    lines += [fmt(row) for row in cells[1:]]
+    return "\n".join(lines)
+
+
+def start_loopback_server(**settings):
+    """Start a ChatServer on a free localhost port. Returns the ChatServer and its gRPC server."""
+    # Imported here so the protocol benchmarks don't need the server package
+    from chat_system.common.config import ConnectionSettings
+    from chat_system.server.server import ChatServer
+
+    chat_server = ChatServer(ConnectionSettings(host="localhost", port=0, **settings))
+    return chat_server, chat_server.start_server()
+
+
+def free_ports(n: int) -> List[int]:
+    """Find n free localhost ports, for servers that need to know each other's addresses before they start."""
+    sockets = [socket.socket() for _ in range(n)]
+    for s in sockets:
+        s.bind(("localhost", 0))
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
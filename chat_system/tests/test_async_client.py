@@ -0,0 +1,160 @@
+import asyncio
+import time
+import unittest
+
+import grpc
+
+from chat_system.client.async_client import AsyncChatClient, ChatError
+from chat_system.client.event_loop import EventLoopThread, LagMonitor
+from chat_system.common.config import ConnectionSettings
+from chat_system.proto import chat_pb2, chat_pb2_grpc
+from chat_system.tests.benchmark import FULL_BENCHMARK, format_table, start_loopback_server
+
+
+class LoopbackTestCase(unittest.TestCase):
+    def setUp(self):
+        self.chat_server, self.grpc_server = start_loopback_server()
+        self.config = ConnectionSettings(host="localhost", port=self.chat_server.port)
+
+    def tearDown(self):
+        self.grpc_server.stop(None)
+
+
+class TestAsyncChatClient(LoopbackTestCase):
+    def test_session(self):
+        async def session():
+            alice, bob = AsyncChatClient(self.config), AsyncChatClient(self.config)
+            await asyncio.gather(alice.connect(), bob.connect())
+            await asyncio.gather(alice.create_account("alice", "pw"), bob.create_account("bob", "pw"))
+            with self.assertRaises(ChatError):
+                await alice.create_account("bob", "pw")
+            with self.assertRaises(ChatError):
+                await alice.login("alice", "wrong")
+            await asyncio.gather(alice.login("alice", "pw"), bob.login("bob", "pw"))
+
+            notifications = bob.notifications()
+            first = asyncio.ensure_future(notifications.__anext__())
+            await asyncio.sleep(0.1)  # Subscribed before anything is sent
+            # Sent together, they arrive in whatever order
+            await asyncio.gather(*(alice.send_message("bob", f"message {i}") for i in range(20)))
+            self.assertEqual((await first).message.sender, "alice")
+            self.assertEqual(await bob.get_counts(), (0, 20))
+            messages = await bob.get_read_messages(0, -1)
+            self.assertEqual(sorted(m.content for m in messages), sorted(f"message {i}" for i in range(20)))
+            await bob.delete_messages([m.id for m in messages[:5]])
+            self.assertEqual(await bob.get_counts(), (0, 15))
+            self.assertEqual(sorted(await bob.list_accounts("*", 0, 10)), ["alice", "bob"])
+            await notifications.aclose()
+
+            await bob.logout()
+            await alice.send_message("bob", "while away")
+            await bob.login("bob", "pw")
+            self.assertEqual([m.content for m in await bob.pop_unread_messages(10)], ["while away"])
+            await asyncio.gather(alice.close(), bob.close())
+        asyncio.run(session())
+
+
+class TestEventLoopThread(unittest.TestCase):
+    def test_run_and_lag(self):
+        loop = EventLoopThread()
+        loop.start()
+        try:
+            async def add(a, b):
+                await asyncio.sleep(0.01)
+                return a + b
+            futures = [loop.submit(add(i, i)) for i in range(10)]
+            self.assertEqual([f.result(5) for f in futures], [2 * i for i in range(10)])
+            time.sleep(0.2)
+            self.assertGreater(loop.lag.stats()["samples"], 0)
+            # A callback that holds up the loop shows up as lag
+            loop.loop.call_soon_threadsafe(time.sleep, 0.3)
+            time.sleep(0.5)
+            self.assertGreaterEqual(loop.lag.stats()["max_ms"], 200)
+        finally:
+            loop.stop()
+        self.assertTrue(loop.loop.is_closed())
+
+    def test_lag_stats(self):
+        lag = LagMonitor(samples=100)
+        self.assertEqual(lag.stats()["samples"], 0)
+        for i in range(200):
+            lag.record(i / 1000)
+        stats = lag.stats()
+        self.assertEqual(stats["samples"], 100)
+        # Nearest rank, like the benchmarks: half of the samples kept, 100 to 199 ms, are at or below 149 ms
+        self.assertAlmostEqual(stats["p50_ms"], 149)
+        self.assertAlmostEqual(stats["p99_ms"], 198)
+        self.assertAlmostEqual(stats["max_ms"], 199)
+
+
+class TestResponsiveness(LoopbackTestCase):
+    """What a GUI's loop goes through while it logs in and sends, waiting on each call against not waiting."""
+    TICKS = 40
+    INTERVAL = 0.01
+    SENDS = 500
+
+    def ui_loop(self, on_tick) -> LagMonitor:
+        """A loop like Tk's that runs every INTERVAL seconds, calling on_tick each time."""
+        lag = LagMonitor(self.INTERVAL)
+        next_tick = time.monotonic()
+        for i in range(self.TICKS):
+            next_tick += self.INTERVAL
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+            lag.record(time.monotonic() - next_tick)
+            next_tick = max(next_tick, time.monotonic())
+            on_tick(i)
+        return lag
+
+    def test_login_and_sends(self):
+        with grpc.insecure_channel(f"localhost:{self.chat_server.port}") as channel:
+            stub = chat_pb2_grpc.ChatServiceStub(channel)
+            for name in ["alice", "bob"]:
+                stub.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"))
+
+            def blocking(i):
+                if i == 5:
+                    stub.Login(chat_pb2.LoginRequest(username="alice", password="pw"))
+                elif i == 10:
+                    for j in range(self.SENDS):
+                        stub.SendMessage(chat_pb2.SendMessageRequest(receiver="bob", content=f"message {j}"))
+            start = time.perf_counter()
+            blocking_lag = self.ui_loop(blocking)
+            blocking_time = time.perf_counter() - start
+
+        loop = EventLoopThread()
+        loop.start()
+        client = AsyncChatClient(self.config)
+        loop.run(client.connect())
+        sent = []
+        try:
+            async def send_all():
+                await asyncio.gather(*(client.send_message("bob", f"message {j}") for j in range(self.SENDS)))
+            def pipelined(i):
+                if i == 5:
+                    sent.append(loop.submit(client.login("alice", "pw")))
+                elif i == 10:
+                    sent.append(loop.submit(send_all()))
+            start = time.perf_counter()
+            pipelined_lag = self.ui_loop(pipelined)
+            for future in sent:
+                future.result(30)
+            pipelined_time = time.perf_counter() - start
+            loop.run(client.close())
+        finally:
+            loop.stop()
+        self.assertEqual(self.chat_server.account_manager.get_user("bob").unread_count, 2 * self.SENDS)
+
+        rows = []
+        for name, lag, elapsed in [("blocking stub", blocking_lag, blocking_time),
+                                   ("AsyncChatClient", pipelined_lag, pipelined_time)]:
+            stats = lag.stats()
+            rows.append([name, f"{stats['p50_ms']:.1f}", f"{stats['max_ms']:.1f}", f"{elapsed * 1000:.0f}"])
+        print()
+        print(f"UI loop ticking every {self.INTERVAL * 1000:.0f} ms through a login and {self.SENDS} sends")
+        print(format_table(["client", "lag p50 ms", "lag max ms", "total ms"], rows))
+        if FULL_BENCHMARK:
+            self.assertLess(pipelined_lag.stats()["max_ms"], blocking_lag.stats()["max_ms"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import os
+import tempfile
+import unittest
+
+import grpc
+
+from chat_system.common.config import ConnectionSettings
+from chat_system.common.user import MailboxFullError, MailboxLimits, Message, OverflowPolicy, User
+from chat_system.proto import chat_pb2
+from chat_system.server.server import ChatServer, ChatServicer
+from chat_system.tests.test_server import MockContext
+
+
+class TestUserLimits(unittest.TestCase):
+    def setUp(self):
+        self.spill_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.spill_dir.cleanup()
+
+    def make_user(self, policy: OverflowPolicy, **limits) -> User:
+        return User("test", [], [], MailboxLimits(overflow_policy=policy, spill_dir=self.spill_dir.name, **limits))
+
+    def test_separate_subscriber_queues(self):
+        """Each user gets their own subscriber queue."""
+        self.assertIsNot(User("a", [], []).message_subscriber_queue, User("b", [], []).message_subscriber_queue)
+
+    def test_reject(self):
+        user = self.make_user(OverflowPolicy.REJECT, max_unread_messages=2)
+        user.add_message(Message(0, "a", "0"))
+        user.add_message(Message(1, "a", "1"))
+        with self.assertRaises(MailboxFullError):
+            user.add_message(Message(2, "a", "2"))
+        self.assertEqual([m.id for m in user.message_queue], [0, 1])
+        self.assertEqual(user.stats.rejected, 1)
+
+    def test_drop_oldest(self):
+        user = self.make_user(OverflowPolicy.DROP_OLDEST, max_unread_messages=2, max_read_messages=3)
+        for i in range(5):
+            user.add_message(Message(i, "a", str(i)))
+        self.assertEqual([m.id for m in user.message_queue], [3, 4])
+        for i in range(5, 10):
+            user.add_read_message(Message(i, "a", str(i)))
+        self.assertEqual([m.id for m in user.read_mailbox], [7, 8, 9])
+        self.assertEqual(user.stats.dropped, 5)
+
+    def test_spill_keeps_order(self):
+        """Spilled messages come back in order, and the in-memory queue never grows past the limit."""
+        user = self.make_user(OverflowPolicy.SPILL, max_unread_messages=3)
+        for i in range(10):
+            user.add_message(Message(i, "a", str(i)))
+            self.assertLessEqual(len(user.message_queue), 3)
+        self.assertEqual(user.get_number_of_unread_messages(), 10)
+        self.assertEqual(user.stats.spilled, 7)
+        self.assertEqual([m.id for m in user.get_unread_messages()], list(range(10)))
+
+        self.assertEqual([m.id for m in user.pop_unread_messages(2)], [0, 1])
+        self.assertEqual([m.id for m in user.message_queue], [2, 3, 4])
+        user.add_message(Message(10, "a", "10"))
+        self.assertEqual([m.id for m in user.pop_unread_messages(-1)], list(range(2, 11)))
+        self.assertEqual(user.get_number_of_unread_messages(), 0)
+        self.assertEqual(os.listdir(self.spill_dir.name), [])
+
+    def test_pop_into_full_read_mailbox(self):
+        """Popping stops at the read mailbox limit rather than losing messages."""
+        user = self.make_user(OverflowPolicy.REJECT, max_read_messages=2)
+        for i in range(3):
+            user.add_message(Message(i, "a", str(i)))
+        self.assertEqual(len(user.pop_unread_messages(-1)), 2)
+        with self.assertRaises(MailboxFullError):
+            user.pop_unread_messages(1)
+        self.assertEqual(user.get_number_of_unread_messages(), 1)
+
+    def test_pop_into_read_mailbox_over_its_limit(self):
+        """Saved under a higher limit, the read mailbox can already hold more than fits."""
+        user = User("test", [Message(i, "a", str(i)) for i in range(10)],
+                    [Message(i, "a", str(i)) for i in range(10, 15)], MailboxLimits(max_read_messages=2))
+        self.assertEqual(user.pop_unread_messages(0), [])
+        with self.assertRaises(MailboxFullError):
+            user.pop_unread_messages(1)
+        self.assertEqual(user.get_number_of_unread_messages(), 10)
+
+    def test_slow_subscriber(self):
+        user = self.make_user(OverflowPolicy.SPILL, max_subscriber_queue=2)
+        for i in range(3):
+            user.deliver_online(Message(i, "a", str(i)))
+        # The third message didn't fit in the subscriber queue, so it waits as unread
+        self.assertEqual(user.message_subscriber_queue.qsize(), 2)
+        self.assertEqual([m.id for m in user.read_mailbox], [0, 1])
+        self.assertEqual([m.id for m in user.message_queue], [2])
+
+
+class TestFloodRecipient(unittest.TestCase):
+    """One sender floods a single offline recipient."""
+    FLOOD = 1000
+    LIMIT = 50
+
+    def setUp(self):
+        self.spill_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.spill_dir.cleanup()
+
+    def flood(self, policy: str):
+        server = ChatServer(ConnectionSettings(
+            max_unread_messages=self.LIMIT, overflow_policy=policy, spill_dir=self.spill_dir.name,
+            server_data_path=os.path.join(self.spill_dir.name, "server_data.json")
+        ))
+        servicer = ChatServicer(server)
+        context = MockContext()
+        server.account_manager.create_account("spammer", "password")
+        server.account_manager.create_account("victim", "password")
+        servicer.Login(chat_pb2.LoginRequest(username="spammer", password="password"), context)
+
+        rejected = 0
+        for i in range(self.FLOOD):
+            try:
+                servicer.SendMessage(chat_pb2.SendMessageRequest(receiver="victim", content=f"spam {i}"), context)
+            except grpc.RpcError:
+                self.assertEqual(context.code, grpc.StatusCode.RESOURCE_EXHAUSTED)
+                rejected += 1
+        return server, rejected
+
+    def test_reject(self):
+        server, rejected = self.flood("reject")
+        stats = server.get_backlog_stats()
+        # Only users who were online have subscriber queues, counting doesn't make them for the rest
+        self.assertIsNone(server.account_manager.get_user("victim")._subscriber_queue)
+        self.assertEqual(rejected, self.FLOOD - self.LIMIT)
+        self.assertEqual(stats["unread"], self.LIMIT)
+        self.assertEqual(stats["rejected"], rejected)
+
+    def test_drop_oldest(self):
+        server, rejected = self.flood("drop_oldest")
+        stats = server.get_backlog_stats()
+        self.assertEqual(rejected, 0)
+        self.assertEqual(stats["unread"], self.LIMIT)
+        self.assertEqual(stats["dropped"], self.FLOOD - self.LIMIT)
+        victim = server.account_manager.get_user("victim")
+        self.assertEqual(victim.message_queue[-1].content, f"spam {self.FLOOD - 1}")
+
+    def test_spill(self):
+        server, rejected = self.flood("spill")
+        stats = server.get_backlog_stats()
+        self.assertEqual(rejected, 0)
+        self.assertEqual(stats["unread"], self.FLOOD)
+        self.assertEqual(stats["spilled_unread"], self.FLOOD - self.LIMIT)
+        self.assertEqual(len(server.account_manager.get_user("victim").message_queue), self.LIMIT)
+
+        # Spilled messages are part of the saved state
+        server.save_state()
+        server.load_state()
+        victim = server.account_manager.get_user("victim")
+        self.assertEqual(victim.get_number_of_unread_messages(), self.FLOOD)
+        self.assertEqual(len(victim.message_queue), self.LIMIT)
+        self.assertEqual([m.content for m in victim.pop_unread_messages(-1)],
+                         [f"spam {i}" for i in range(self.FLOOD)])
+
+
+if __name__ == '__main__':
+    unittest.main()
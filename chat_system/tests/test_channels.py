@@ -0,0 +1,262 @@
+import time
+import tracemalloc
+import unittest
+
+import grpc
+
+from chat_system.common.channel import Channel
+from chat_system.common.config import ConnectionSettings
+from chat_system.common.user import Message
+from chat_system.proto import chat_pb2
+from chat_system.server.account_manager import AccountManager
+from chat_system.server.replication import MutationLog
+from chat_system.server.server import ChatServer, ChatServicer
+from chat_system.tests.benchmark import FULL_BENCHMARK, bench_scale, format_table, percentile
+from chat_system.tests.test_server import MockContext
+
+
+class TestChannel(unittest.TestCase):
+    def test_read_cursors(self):
+        channel = Channel("general", "alice")
+        channel.add_member("alice")
+        channel.add_message(Message(0, "alice", "first"))
+        # Joins with nothing unread, though the history is there
+        channel.add_member("bob")
+        channel.add_message(Message(1, "alice", "second"))
+        channel.add_message(Message(2, "bob", "third"))
+        self.assertEqual(channel.get_number_of_unread_messages("alice"), 3)
+        self.assertEqual(channel.get_number_of_unread_messages("bob"), 2)
+
+        self.assertEqual([m.id for m in channel.read_messages("bob", 1)], [1])
+        self.assertEqual([m.id for m in channel.read_messages("bob", -1)], [2])
+        self.assertEqual(channel.read_messages("bob", -1), [])
+        self.assertEqual(channel.get_number_of_unread_messages("alice"), 3)
+        self.assertEqual([m.id for m in channel.get_messages(0, 2)], [1, 2])
+        # Every member reads the same message objects
+        self.assertIs(channel.read_messages("alice", -1)[1], channel.messages[1])
+
+
+class TestChannelAccountManager(unittest.TestCase):
+    def setUp(self):
+        self.account_manager = AccountManager()
+        self.account_manager.mutation_log = MutationLog(100)
+        for name in ["alice", "bob", "carol"]:
+            self.account_manager.add_account(name, b"hash", b"salt")
+
+    def test_membership(self):
+        am = self.account_manager
+        self.assertIsNone(am.create_channel("general", "alice"))
+        self.assertEqual(am.create_channel("general", "bob"), "Channel name already taken")
+        self.assertEqual(am.join_channel("random", "bob"), "Channel not found")
+        self.assertIsNone(am.join_channel("general", "bob"))
+        self.assertEqual(am.post_channel_message("general", Message(0, "carol", "hi")), "Not a member of the channel")
+        self.assertIsNone(am.post_channel_message("general", Message(1, "bob", "hi")))
+        self.assertIsNone(am.read_channel_messages("general", "carol", -1))
+        self.assertEqual(am.list_channels("alice"), [("general", 2, 1)])
+
+        self.assertIsNone(am.leave_channel("general", "bob"))
+        self.assertEqual(am.leave_channel("general", "bob"), "Not a member of the channel")
+        self.assertEqual(am.list_channels("bob"), [])
+        am.delete_account("alice")
+        self.assertEqual(am.get_channel_members("general"), [])
+        # What they posted stays
+        self.assertEqual(len(am.get_channel_state()["general"]["messages"]), 1)
+
+    def test_replicated_and_saved(self):
+        am = self.account_manager
+        am.create_channel("general", "alice")
+        am.join_channel("general", "bob")
+        am.join_channel("general", "carol")
+        for i in range(3):
+            am.post_channel_message("general", Message(i, "alice", f"message {i}"))
+        am.read_channel_messages("general", "bob", 2)
+        am.leave_channel("general", "carol")
+
+        replica = AccountManager()
+        for mutation in am.mutation_log.read_after(0, timeout=0):
+            replica.apply_mutation(mutation)
+        loaded = AccountManager()
+        loaded.load_state(am.get_state())
+        loaded.load_channel_state(am.get_channel_state())
+        for other in [replica, loaded]:
+            self.assertEqual(other.get_channel_state(), am.get_channel_state())
+            self.assertEqual(other.list_channels("bob"), [("general", 2, 1)])
+            self.assertEqual(other.list_channels("carol"), [])
+
+
+class TestChannelRPCs(unittest.TestCase):
+    def setUp(self):
+        self.server = ChatServer(ConnectionSettings())
+        self.servicer = ChatServicer(self.server)
+        self.contexts = {}
+        for name in ["alice", "bob", "carol"]:
+            context = MockContext()
+            context.peer_value = f"{name}_peer"
+            self.contexts[name] = context
+            self.servicer.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"), context)
+            self.servicer.Login(chat_pb2.LoginRequest(username=name, password="pw"), context)
+
+    def test_send_and_read(self):
+        alice, bob, carol = (self.contexts[name] for name in ["alice", "bob", "carol"])
+        self.assertFalse(self.servicer.CreateChannel(chat_pb2.CreateChannelRequest(channel="general"), alice)
+                         .HasField("error"))
+        self.servicer.JoinChannel(chat_pb2.JoinChannelRequest(channel="general"), bob)
+        stream = self.servicer.SubscribeToMessages(chat_pb2.SubscribeRequest(), bob)
+
+        response = self.servicer.SendChannelMessage(
+            chat_pb2.SendChannelMessageRequest(channel="general", content="hello all"), alice)
+        self.assertFalse(response.HasField("error"))
+        notification = next(stream)
+        self.assertEqual((notification.channel, notification.message.content), ("general", "hello all"))
+        stream.close()
+        # Carol isn't a member
+        response = self.servicer.SendChannelMessage(
+            chat_pb2.SendChannelMessageRequest(channel="general", content="me too"), carol)
+        self.assertEqual(response.error, "Not a member of the channel")
+
+        channels = self.servicer.ListChannels(chat_pb2.ListChannelsRequest(), bob).channels
+        self.assertEqual([(c.name, c.members, c.unread) for c in channels], [("general", 2, 1)])
+        request = chat_pb2.ReadChannelMessagesRequest(channel="general", num_messages=-1)
+        self.assertEqual([m.content for m in self.servicer.ReadChannelMessages(request, bob).messages], ["hello all"])
+        self.assertEqual(len(self.servicer.ReadChannelMessages(request, bob).messages), 0)
+        history = self.servicer.GetChannelHistory(
+            chat_pb2.GetChannelHistoryRequest(channel="general", num_messages=-1, compact=True), bob)
+        self.assertEqual(list(history.batch.contents), ["hello all"])
+        with self.assertRaises(grpc.RpcError):
+            self.servicer.ReadChannelMessages(request, carol)
+        self.assertEqual(carol.code, grpc.StatusCode.PERMISSION_DENIED)
+
+    def test_direct_messages_still_resume(self):
+        alice, bob = self.contexts["alice"], self.contexts["bob"]
+        self.servicer.CreateChannel(chat_pb2.CreateChannelRequest(channel="general"), alice)
+        self.servicer.JoinChannel(chat_pb2.JoinChannelRequest(channel="general"), bob)
+        stream = self.servicer.SubscribeToMessages(chat_pb2.SubscribeRequest(), bob)
+        self.servicer.SendMessage(chat_pb2.SendMessageRequest(receiver="bob", content="direct"), alice)
+        self.assertEqual(next(stream).message.content, "direct")
+        self.servicer.SendChannelMessage(chat_pb2.SendChannelMessageRequest(channel="general", content="all"), alice)
+        self.assertEqual(next(stream).channel, "general")
+        stream.close()
+        # The channel message doesn't count as the last delivered one
+        self.servicer.SendMessage(chat_pb2.SendMessageRequest(receiver="bob", content="missed"), alice)
+        stream = self.servicer.SubscribeToMessages(chat_pb2.SubscribeRequest(), bob)
+        self.assertEqual(next(stream).message.content, "missed")
+        stream.close()
+
+    def test_fanout_survives_failures(self):
+        alice, bob = self.contexts["alice"], self.contexts["bob"]
+        self.servicer.CreateChannel(chat_pb2.CreateChannelRequest(channel="general"), alice)
+        self.servicer.JoinChannel(chat_pb2.JoinChannelRequest(channel="general"), bob)
+        subscriber_queue = self.server.subscriber_queue
+        def failing(username: str):
+            if username == "alice":
+                raise ConnectionError("coordinator went away")
+            return subscriber_queue(username)
+        self.server.subscriber_queue = failing
+        self.server.fanout.batch_size = 1
+        self.servicer.SendChannelMessage(chat_pb2.SendChannelMessageRequest(channel="general", content="1"), alice)
+        self.assertTrue(self.server.fanout.wait_idle())
+        self.server.subscriber_queue = subscriber_queue
+
+        # Bob was in another batch, and the thread is still there for the next message
+        self.servicer.SendChannelMessage(chat_pb2.SendChannelMessageRequest(channel="general", content="2"), alice)
+        self.assertTrue(self.server.fanout.wait_idle())
+        self.assertEqual([m.message.content for m in list(self.server.subscriber_queue("bob").queue)], ["1", "2"])
+        self.assertEqual(self.server.fanout.get_stats()["failed"], 1)
+        self.assertTrue(self.server.fanout.thread.is_alive())
+
+
+class TestChannelBenchmark(unittest.TestCase):
+    """A large channel, against sending every member their own copy as a direct message."""
+    MEMBERS = bench_scale(10000, 2000)
+    ONLINE = 0.1
+    MESSAGES = 20
+
+    def make_server(self):
+        server = ChatServer(ConnectionSettings())
+        for i in range(self.MEMBERS):
+            server.account_manager.add_account(f"user{i}", b"hash", b"salt")
+        # Some members are logged in and subscribed
+        with server.sessions_lock:
+            for i in range(int(self.MEMBERS * self.ONLINE)):
+                server.client_sessions[f"peer{i}"] = f"user{i}"
+        return server
+
+    def make_channel(self):
+        server = self.make_server()
+        server.account_manager.create_channel("everyone", "user0")
+        for i in range(1, self.MEMBERS):
+            server.account_manager.join_channel("everyone", f"user{i}")
+        return server
+
+    def measure(self, server, send):
+        """Latency of each send, in ns."""
+        latencies = []
+        for i in range(self.MESSAGES):
+            start = time.perf_counter_ns()
+            send(server, i)
+            latencies.append(time.perf_counter_ns() - start)
+        return latencies
+
+    def memory(self, server, send):
+        """Bytes allocated by all the sends. Tracing slows them down, so this is a separate run."""
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(self.MESSAGES):
+            send(server, i)
+        server.fanout.wait_idle(60)
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        return used
+
+    def test_memory_and_latency(self):
+        online = int(self.MEMBERS * self.ONLINE)
+        context = MockContext()
+
+        def send_to_channel(server, i):
+            request = chat_pb2.SendChannelMessageRequest(channel="everyone", content=f"announcement {i}")
+            ChatServicer(server).SendChannelMessage(request, context)
+
+        def send_copies(server, i):
+            # What SendMessage does for each of them
+            for j in range(self.MEMBERS):
+                server.account_manager.deliver_message(f"user{j}", Message(i, "user0", f"announcement {i}"), j < online)
+
+        server = self.make_channel()
+        with server.sessions_lock:
+            server.client_sessions[context.peer()] = "user0"
+        latencies = self.measure(server, send_to_channel)
+        start = time.perf_counter()
+        self.assertTrue(server.fanout.wait_idle(60))
+        fanout_time = time.perf_counter() - start + sum(latencies) / 1e9
+        self.assertEqual(server.fanout.get_stats(), {"messages": self.MESSAGES, "notified": self.MESSAGES * online,
+                                                     "dropped": 0, "failed": 0})
+        self.assertEqual(server.account_manager.list_channels("user5")[0][2], self.MESSAGES)
+        # Each member online was notified of every message once, in order, and the ones offline weren't
+        for name in ["user0", f"user{online - 1}"]:
+            self.assertEqual([m.message.content for m in list(server.subscriber_queue(name).queue)],
+                             [f"announcement {i}" for i in range(self.MESSAGES)])
+        self.assertTrue(server.subscriber_queue(f"user{online}").empty())
+        copy_latencies = self.measure(self.make_server(), send_copies)
+
+        server = self.make_channel()
+        with server.sessions_lock:
+            server.client_sessions[context.peer()] = "user0"
+        channel_memory = self.memory(server, send_to_channel)
+        copies_memory = self.memory(self.make_server(), send_copies)
+
+        rows = [
+            ["channel", f"{channel_memory / 2**20:.2f}", f"{percentile(latencies, 50) / 1000:.0f}",
+             f"{percentile(latencies, 99) / 1000:.0f}", f"{fanout_time * 1000 / self.MESSAGES:.1f}"],
+            ["copy per member", f"{copies_memory / 2**20:.2f}", f"{percentile(copy_latencies, 50) / 1000:.0f}",
+             f"{percentile(copy_latencies, 99) / 1000:.0f}", "-"],
+        ]
+        print()
+        print(f"{self.MESSAGES} messages to {self.MEMBERS} members, {online} of them online")
+        print(format_table(["storage", "memory MiB", "send p50 us", "send p99 us", "all notified ms/message"], rows))
+        self.assertLess(channel_memory, copies_memory)
+        if FULL_BENCHMARK:
+            self.assertLess(percentile(latencies, 50), percentile(copy_latencies, 50))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from chat_system.common.config import ConnectionSettings
+from chat_system.common.user import Message
+from chat_system.proto import chat_pb2
+from chat_system.server.account_manager import AccountManager
+from chat_system.server.server import ChatServer, ChatServicer
+from chat_system.server.snapshot import capture_state, decode_snapshot, encode_capture, encode_snapshot
+from chat_system.tests.benchmark import FULL_BENCHMARK, bench_scale, format_table, percentile
+from chat_system.tests.test_server import MockContext
+
+
+class TestCapture(unittest.TestCase):
+    def test_later_changes_left_out(self):
+        am = AccountManager()
+        for name in ["alice", "bob"]:
+            am.add_account(name, b"hash", b"salt")
+        am.deliver_message("bob", Message(0, "alice", "read"), online=True)
+        am.deliver_message("bob", Message(1, "alice", "unread"), online=False)
+        am.record_sent_message("alice", Message(1, "bob", "unread"))
+        am.create_channel("general", "alice")
+        am.join_channel("general", "bob")
+        am.post_channel_message("general", Message(2, "alice", "hello"))
+        state, channel_state = am.get_state(), am.get_channel_state()
+        capture = capture_state(am, 3)
+
+        # Appended to, replaced and removed while the capture is encoded
+        am.deliver_message("bob", Message(3, "alice", "later"), online=True)
+        am.deliver_message("bob", Message(4, "alice", "later"), online=False)
+        am.pop_unread_messages("bob", 1)
+        am.delete_messages("bob", [0])
+        am.record_sent_message("alice", Message(3, "bob", "later"))
+        am.post_channel_message("general", Message(5, "alice", "later"))
+        am.read_channel_messages("general", "bob", -1)
+        am.add_account("carol", b"hash", b"salt")
+        am.delete_account("alice")
+
+        loaded = AccountManager()
+        self.assertEqual(decode_snapshot(encode_capture(capture), loaded), 3)
+        self.assertEqual(loaded.get_state(), state)
+        self.assertEqual(loaded.get_channel_state(), channel_state)
+
+
+class TestCheckpointer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "server_data.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_periodic(self):
+        server = ChatServer(ConnectionSettings(server_data_path=self.path, checkpoint_interval=0.05))
+        server.account_manager.add_account("alice", b"hash", b"salt")
+        server.checkpointer.start()
+        try:
+            deadline = time.time() + 5
+            while server.checkpointer.stats["checkpoints"] < 2 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            server.checkpointer.stop()
+        self.assertGreaterEqual(server.checkpointer.stats["checkpoints"], 2)
+        # Written to a temporary file and renamed over the data file
+        self.assertEqual(os.listdir(self.directory.name), ["server_data.json"])
+        loaded = ChatServer(ConnectionSettings(server_data_path=self.path))
+        loaded.load_state()
+        self.assertEqual(list(loaded.account_manager.accounts), ["alice"])
+
+    def test_survives_failures(self):
+        server = ChatServer(ConnectionSettings(server_data_path=self.path, checkpoint_interval=0.01))
+        checkpoint = server.checkpointer.checkpoint
+        failures = iter([RuntimeError("first checkpoint")])
+        def failing():
+            error = next(failures, None)
+            if error is not None:
+                raise error
+            checkpoint()
+        server.checkpointer.checkpoint = failing
+        server.checkpointer.start()
+        try:
+            deadline = time.time() + 5
+            while server.checkpointer.stats["checkpoints"] < 1 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            server.checkpointer.stop()
+        self.assertEqual(server.checkpointer.stats["failed"], 1)
+        self.assertGreaterEqual(server.checkpointer.stats["checkpoints"], 1)
+
+    def test_off_by_default(self):
+        server = ChatServer(ConnectionSettings(server_data_path=self.path))
+        server.checkpointer.start()
+        self.assertIsNone(server.checkpointer.thread)
+        server.save_state()
+        self.assertEqual(server.checkpointer.stats["checkpoints"], 1)
+
+
+class TestCheckpointBenchmark(unittest.TestCase):
+    """Latency of sends while the state is saved, in the background against holding the lock throughout."""
+    USERS = bench_scale(100000, 10000)
+    MESSAGES = 10  # Per user
+    SENDS = 2000
+
+    def make_server(self, path: str) -> ChatServer:
+        server = ChatServer(ConnectionSettings(server_data_path=path))
+        am = server.account_manager
+        for u in range(self.USERS):
+            am.add_account(f"user{u}", b"hash", b"salt")
+            for i in range(self.MESSAGES):
+                am.deliver_message(f"user{u}", Message(u * self.MESSAGES + i, f"user{i}", f"message number {i}"),
+                                   i % 2 == 0)
+        server.next_message_id = self.USERS * self.MESSAGES
+        return server
+
+    def measure_sends(self, server: ChatServer, save) -> tuple:
+        servicer = ChatServicer(server)
+        context = MockContext()
+        with server.sessions_lock:
+            server.client_sessions[context.peer()] = "user0"
+        saving = threading.Thread(target=save)
+        latencies = []
+        saving.start()
+        # Sends for as long as the save takes, at least SENDS of them
+        while saving.is_alive() or len(latencies) < self.SENDS:
+            start = time.perf_counter_ns()
+            servicer.SendMessage(chat_pb2.SendMessageRequest(receiver="user1", content="hi"), context)
+            latencies.append(time.perf_counter_ns() - start)
+        saving.join()
+        return percentile(latencies, 50) / 1000, percentile(latencies, 99) / 1000, max(latencies) / 1e6
+
+    def test_send_latency(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "server_data.json")
+            server = self.make_server(path)
+
+            def stop_the_world():
+                with server.account_manager.mutation_lock:
+                    data = encode_snapshot(server.account_manager, server.next_message_id)
+                    with open(path, "wb") as f:
+                        f.write(data)
+
+            rows = []
+            for name, save in [("none", lambda: None), ("holding the lock", stop_the_world),
+                               ("background", server.save_state)]:
+                p50, p99, worst = self.measure_sends(server, save)
+                rows.append([name, f"{p50:.0f}", f"{p99:.0f}", f"{worst:.1f}"])
+            stats = server.checkpointer.stats
+            print()
+            print(f"{self.USERS} users with {self.MESSAGES} messages each, checkpoint took "
+                  f"{stats['last_duration_ms']:.0f} ms with writers held up for {stats['last_pause_ms']:.0f} ms")
+            print(format_table(["checkpoint", "send p50 us", "send p99 us", "worst ms"], rows))
+            self.assertEqual(stats["checkpoints"], 1)
+            self.assertLessEqual(stats["last_pause_ms"], stats["last_duration_ms"])
+            loaded = ChatServer(ConnectionSettings(server_data_path=path))
+            loaded.load_state()
+            self.assertEqual(len(loaded.account_manager.accounts), self.USERS)
+            # Wall-clock times swing with the load on the machine, so they're only compared at full scale
+            if FULL_BENCHMARK:
+                self.assertLess(float(rows[2][3]), float(rows[1][3]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from chat_system.common.config import ConnectionSettings
+from chat_system.common.user import Message
+from chat_system.server import compaction
+from chat_system.server.compaction import Compactor
+from chat_system.server.server import ChatServer
+from chat_system.tests.benchmark import format_table
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestRetention(unittest.TestCase):
+    def make_server(self, **settings) -> ChatServer:
+        server = ChatServer(ConnectionSettings(replication_log_size=1000, **settings))
+        for name in ["alice", "bob", "carol"]:
+            server.account_manager.add_account(name, b"hash", b"salt")
+        return server
+
+    def send(self, server: ChatServer, sender: str, receiver: str, count: int, online: bool = True):
+        for _ in range(count):
+            message_id = server.allocate_message_id()
+            message = Message(message_id, sender, f"message {message_id}")
+            server.account_manager.deliver_message(receiver, message, online)
+            server.account_manager.record_sent_message(receiver, message)
+
+    def test_max_messages(self):
+        server = self.make_server(retention_max_messages=5, retention_overrides={"carol": [0, 2]})
+        self.send(server, "alice", "bob", 20)
+        self.send(server, "alice", "carol", 10)
+        self.send(server, "alice", "bob", 3, online=False)
+        done = server.compactor.compact()
+
+        am = server.account_manager
+        bob, alice, carol = am.get_user("bob"), am.get_user("alice"), am.get_user("carol")
+        self.assertEqual([m.id for m in bob.read_mailbox], list(range(15, 20)))
+        # Unread messages are kept whatever their number
+        self.assertEqual([m.id for m in bob.get_unread_messages()], [30, 31, 32])
+        self.assertEqual([m.id for m in alice.sent_messages], list(range(28, 33)))
+        self.assertEqual([m.id for m in carol.read_mailbox], [28, 29])
+        self.assertEqual(done["trimmed"], 15 + 8 + 28)
+        self.assertEqual([m.id for m in bob.get_conversation("alice", 0, -1)], list(range(15, 20)))
+        # Replicas are told what to remove
+        removed = [(list(m.trim.read_ids), list(m.trim.sent_ids)) for m in am.mutation_log.entries
+                   if m.WhichOneof("kind") == "trim" and m.trim.username == "bob"]
+        self.assertEqual(removed, [(list(range(15)), [])])
+        self.assertEqual(server.compactor.compact()["trimmed"], 0)
+
+    def test_replicas_remove_the_same(self):
+        primary, replica = self.make_server(retention_max_messages=5), self.make_server()
+        for server in [primary, replica]:
+            # Sent to herself, so both of alice's mailboxes have them, and bob's fill only her read mailbox
+            self.send(server, "alice", "alice", 5)
+            self.send(server, "bob", "alice", 3)
+        # Only the read copies of the oldest three are past the newest five
+        self.assertEqual(primary.compactor.compact()["trimmed"], 3)
+        for mutation in primary.account_manager.mutation_log.entries:
+            if mutation.WhichOneof("kind") == "trim":
+                replica.account_manager.apply_mutation(mutation)
+        alice = primary.account_manager.get_user("alice")
+        self.assertEqual([m.id for m in alice.sent_messages], [0, 1, 2, 3, 4])
+        self.assertEqual(replica.account_manager.get_state(), primary.account_manager.get_state())
+
+    def test_batches(self):
+        server = self.make_server(retention_max_messages=1)
+        self.send(server, "alice", "bob", 25)
+        with mock.patch.object(compaction, "BATCH_SIZE", 4):
+            self.assertEqual(server.compactor.compact()["trimmed"], 24 + 24)
+        self.assertEqual([m.id for m in server.account_manager.get_user("bob").read_mailbox], [24])
+
+    def test_max_age(self):
+        server = self.make_server()
+        clock = FakeClock()
+        server.compactor = Compactor(server, 0, 60, 0, {"carol": (0, 0)}, clock=clock)
+        server.compactor.start()
+        self.send(server, "alice", "bob", 5)
+        clock.now = 30
+        server.compactor.compact()
+        self.send(server, "alice", "bob", 5)
+        self.send(server, "alice", "carol", 5)
+        clock.now = 70
+        # Messages 0 to 4 were sent between 0 and 30 seconds, so they may not be 60 seconds old yet
+        self.assertEqual(server.compactor.compact()["trimmed"], 0)
+        clock.now = 95
+        self.assertEqual(server.compactor.compact()["trimmed"], 10)
+        am = server.account_manager
+        self.assertEqual([m.id for m in am.get_user("bob").read_mailbox], list(range(5, 10)))
+        self.assertEqual([m.id for m in am.get_user("alice").sent_messages], list(range(5, 15)))
+        self.assertEqual(len(am.get_user("carol").read_mailbox), 5)
+        # Only the notes that can still matter are kept
+        self.assertLessEqual(len(server.compactor.id_clock), 3)
+
+    def test_survives_failures(self):
+        server = self.make_server(compaction_interval=0.01, retention_max_messages=1)
+        self.send(server, "alice", "bob", 5)
+        compact = server.compactor.compact
+        failures = iter([RuntimeError("first pass"), KeyError("second pass")])
+        def failing():
+            error = next(failures, None)
+            if error is not None:
+                raise error
+            return compact()
+        with mock.patch.object(server.compactor, "compact", failing):
+            server.compactor.start()
+            try:
+                deadline = time.time() + 5
+                while server.compactor.stats["passes"] < 1 and time.time() < deadline:
+                    time.sleep(0.01)
+            finally:
+                server.compactor.stop()
+        self.assertEqual(server.compactor.stats["failed"], 2)
+        self.assertGreaterEqual(server.compactor.stats["passes"], 1)
+        self.assertEqual([m.id for m in server.account_manager.get_user("bob").read_mailbox], [4])
+
+    def test_not_on_replicas(self):
+        server = self.make_server(retention_max_messages=1)
+        self.send(server, "alice", "bob", 5)
+        server.read_only = True
+        self.assertEqual(server.compactor.compact()["trimmed"], 0)
+
+
+class TestSegmentCompaction(unittest.TestCase):
+    MESSAGES = 5000
+    SEGMENT_SIZE = 4096
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # The index holds handles too, which compaction has to swap
+        self.server = ChatServer(ConnectionSettings(hot_read_messages=50, segment_dir=self.directory.name,
+                                                    search_index="inverted"))
+        self.am = self.server.account_manager
+        self.am.add_account("bob", b"hash", b"salt")
+        self.bob = self.am.get_user("bob")
+        for i in range(self.MESSAGES):
+            self.am.deliver_message("bob", Message(i, "alice" if i % 2 else "carol", f"message {i}"), online=True)
+            if i == 100:
+                self.bob.cold.segment_size = self.SEGMENT_SIZE
+        # Every message but each tenth is deleted
+        self.am.delete_messages("bob", [i for i in range(self.MESSAGES - 100) if i % 10])
+        self.kept = [f"message {i}" for i in range(self.MESSAGES) if i % 10 == 0 or i >= self.MESSAGES - 100]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def contents(self, messages):
+        return [m.content for m in messages]
+
+    def test_rewrite(self):
+        store = self.bob.cold
+        size = store.size()
+        with mock.patch.object(compaction, "BATCH_SIZE", 7):
+            done = self.server.compactor.compact()
+        self.assertGreater(done["segments_rewritten"], 0)
+        self.assertEqual(store.size(), size - done["reclaimed_bytes"])
+        self.assertLess(store.size(), size / 4)
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         sorted(os.path.basename(segment.path) for segment in store.segments))
+        self.assertEqual(self.contents(self.bob.get_read_messages(0, -1)), self.kept)
+        self.assertEqual(self.contents(self.bob.get_read_messages(len(self.kept) - 3, 2)), ["message 10", "message 20"])
+        self.assertEqual([m.id for m in self.bob.search_messages("message 30", -1, 0)[0]], [30])
+        self.assertEqual(self.contents(self.bob.get_conversation("carol", 0, -1))[:2], ["message 0", "message 10"])
+        self.assertEqual(self.server.compactor.compact()["segments_rewritten"], 0)
+        print()
+        print(format_table(["segments rewritten", "bytes before", "bytes after", "reclaimed"],
+                           [[done["segments_rewritten"], size, store.size(), done["reclaimed_bytes"]]]))
+
+    def test_concurrent_reads(self):
+        stop = threading.Event()
+        errors = []
+        reads = [0]
+
+        def read():
+            try:
+                while not stop.is_set():
+                    # New messages may have come in since, but the ones kept are all there in order
+                    self.assertEqual(self.contents(self.bob.get_read_messages(-1, -1))[:len(self.kept)], self.kept)
+                    self.assertEqual(len(self.bob.search_messages("message 40", -1, 0)[0]), 1)
+                    reads[0] += 1
+            except Exception as e:
+                errors.append(e)
+                raise
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        try:
+            for i in range(self.MESSAGES, self.MESSAGES + 200):
+                self.am.deliver_message("bob", Message(i, "alice", f"message {i}"), online=True)
+            with mock.patch.object(compaction, "BATCH_SIZE", 7):
+                done = self.server.compactor.compact()
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+        self.assertEqual(errors, [])
+        self.assertGreater(reads[0], 0)
+        self.assertGreater(done["reclaimed_bytes"], 0)
+        self.assertEqual(self.contents(self.bob.get_read_messages(-1, -1)),
+                         self.kept + [f"message {i}" for i in range(self.MESSAGES, self.MESSAGES + 200)])
+
+    def test_user_deleted(self):
+        store = self.bob.cold
+        new_segment = store.new_segment
+        def deleted_while_copying():
+            self.am.delete_account("bob")
+            return new_segment()
+        with mock.patch.object(store, "new_segment", deleted_while_copying):
+            self.assertEqual(self.server.compactor.compact()["segments_rewritten"], 0)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import time
+import unittest
+
+import grpc
+
+from chat_system.common.compression import CompressionAlgorithm, compress, grpc_compression
+from chat_system.common.config import ConnectionSettings
+from chat_system.common.protocol.custom_protocol import (
+    CustomProtocol, Custom_GetReadMessagesMessage, FRAME_HEADER_SIZE, pack_frame, unpack_frame
+)
+from chat_system.common.user import Message
+from chat_system.proto import chat_pb2, chat_pb2_grpc
+from chat_system.server.server import ChatServer, ChatServicer
+from chat_system.tests.benchmark import bench_scale, format_table, start_loopback_server, time_ns
+from chat_system.tests.test_server import MockContext
+
+
+def sample_messages(n: int):
+    return [Message(i, f"user{i % 5}", f"Message {i}: are we still meeting about the project?") for i in range(n)]
+
+
+class TestFraming(unittest.TestCase):
+    def test_small_payload_not_compressed(self):
+        """Payloads under the threshold are sent as is."""
+        payload = b"x" * 100
+        frame = pack_frame(payload, CompressionAlgorithm.DEFLATE, threshold=1024)
+        self.assertEqual(frame[0], CompressionAlgorithm.NONE)
+        self.assertEqual(len(frame), FRAME_HEADER_SIZE + len(payload))
+        self.assertEqual(unpack_frame(frame), (payload, len(frame)))
+
+    def test_large_payload_compressed(self):
+        """Payloads over the threshold are compressed and round trip."""
+        payload = Custom_GetReadMessagesMessage(0, 1000).pack_client(sample_messages(1000))
+        for algorithm in [CompressionAlgorithm.DEFLATE, CompressionAlgorithm.GZIP]:
+            frame = CustomProtocol(algorithm, compression_threshold=1024).pack_frame(payload)
+            self.assertEqual(frame[0], algorithm)
+            self.assertLess(len(frame), len(payload))
+            unpacked, offset = unpack_frame(frame)
+            self.assertEqual(unpacked, payload)
+            self.assertEqual(offset, len(frame))
+
+    def test_incompressible_payload(self):
+        """Random data is sent uncompressed, since compressing it would only make it bigger."""
+        payload = os.urandom(4096)
+        frame = pack_frame(payload, CompressionAlgorithm.GZIP, threshold=0)
+        self.assertEqual(frame[0], CompressionAlgorithm.NONE)
+        self.assertEqual(unpack_frame(frame)[0], payload)
+
+    def test_incomplete_frames(self):
+        """Partial frames are left alone until the rest arrives."""
+        first = pack_frame(b"hello" * 500, CompressionAlgorithm.DEFLATE, threshold=0)
+        second = pack_frame(b"world")
+        stream = first + second
+
+        self.assertEqual(unpack_frame(stream[:3]), (None, 0))
+        self.assertEqual(unpack_frame(stream[:len(first) - 1]), (None, 0))
+
+        payload, offset = unpack_frame(stream)
+        self.assertEqual(payload, b"hello" * 500)
+        payload, offset = unpack_frame(stream, offset)
+        self.assertEqual(payload, b"world")
+        self.assertEqual(offset, len(stream))
+
+
+class TestServerCompression(unittest.TestCase):
+    def setUp(self):
+        self.server = ChatServer(ConnectionSettings(compression="gzip", compression_threshold=1024))
+        self.servicer = ChatServicer(self.server)
+        self.context = MockContext()
+
+        self.server.account_manager.create_account("test", "password")
+        self.servicer.Login(chat_pb2.LoginRequest(username="test", password="password"), self.context)
+        self.server.account_manager.get_user("test").read_mailbox.extend(sample_messages(100))
+
+    def test_small_response_uncompressed(self):
+        """Responses under the threshold are left uncompressed."""
+        self.servicer.GetReadMessages(chat_pb2.GetReadMessagesRequest(offset=0, num_messages=1), self.context)
+        self.assertIsNone(self.context.compression)
+
+    def test_large_response_compressed(self):
+        """Responses over the threshold use the configured compression."""
+        self.servicer.GetReadMessages(chat_pb2.GetReadMessagesRequest(offset=0, num_messages=-1), self.context)
+        self.assertEqual(self.context.compression, grpc.Compression.Gzip)
+
+
+class TestCompressionBenchmark(unittest.TestCase):
+    """Bytes and latency trade-offs of compressing message batches over loopback."""
+    BATCH_SIZES = [10, 100, 1000, bench_scale(100000, 10000)]
+    ALGORITHMS = [CompressionAlgorithm.NONE, CompressionAlgorithm.DEFLATE, CompressionAlgorithm.GZIP]
+
+    def setUp(self):
+        self.chat_server, self.grpc_server = start_loopback_server(compression_threshold=1024)
+        self.chat_server.account_manager.create_account("reader", "password")
+        user = self.chat_server.account_manager.get_user("reader")
+        user.read_mailbox.extend(sample_messages(max(self.BATCH_SIZES)))
+
+        self.channel = grpc.insecure_channel(f"localhost:{self.chat_server.port}")
+        self.stub = chat_pb2_grpc.ChatServiceStub(self.channel)
+        self.stub.Login(chat_pb2.LoginRequest(username="reader", password="password"))
+
+    def tearDown(self):
+        self.channel.close()
+        self.grpc_server.stop(None)
+
+    def test_batch_compression(self):
+        rows = []
+        for n in self.BATCH_SIZES:
+            repeat = max(3, 3000 // n)
+            request = chat_pb2.GetReadMessagesRequest(offset=0, num_messages=n)
+            raw = self.stub.GetReadMessages(request).SerializeToString()
+            custom = Custom_GetReadMessagesMessage(0, n).pack_client(sample_messages(n))
+
+            for algorithm in self.ALGORITHMS:
+                # gRPC over loopback. gRPC doesn't expose wire bytes, so estimate them by compressing the payload
+                self.chat_server.compression = algorithm
+                response = self.stub.GetReadMessages(request)
+                self.assertEqual(len(response.messages), n)
+                latency = time_ns(lambda: self.stub.GetReadMessages(request), repeat)
+                rows.append([n, "grpc", algorithm.name.lower(), len(raw),
+                             len(compress(raw, algorithm)), latency // 1000])
+
+                # Custom protocol framing, encode + decode of the frame only
+                protocol = CustomProtocol(algorithm, compression_threshold=1024)
+                frame = protocol.pack_frame(custom)
+                latency = time_ns(lambda: protocol.unpack_frame(protocol.pack_frame(custom)), repeat)
+                rows.append([n, "custom", algorithm.name.lower(), len(custom), len(frame), latency // 1000])
+
+        print()
+        print(format_table(["batch", "transport", "compression", "raw bytes", "wire bytes", "latency us"], rows))
+
+        # Compression pays off on large, repetitive batches
+        largest = [row for row in rows if row[0] == self.BATCH_SIZES[-1]]
+        for row in largest:
+            if row[2] != "none":
+                self.assertLess(row[4], row[3] / 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
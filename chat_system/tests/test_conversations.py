@@ -0,0 +1,164 @@
+import unittest
+
+from chat_system.common.config import ConnectionSettings
+from chat_system.common.message_batch import messages_from_response
+from chat_system.common.user import MailboxLimits, Message, OverflowPolicy, SentMessage, User
+from chat_system.proto import chat_pb2
+from chat_system.server.account_manager import AccountManager
+from chat_system.server.server import ChatServer, ChatServicer
+from chat_system.tests.benchmark import bench_scale, format_table, time_ns
+from chat_system.tests.test_server import MockContext
+
+
+class TestUserConversations(unittest.TestCase):
+    def test_received_and_sent_in_id_order(self):
+        user = User("bob", [Message(1, "alice", "unread")], [Message(0, "alice", "hi bob")])
+        user.add_sent_message(SentMessage(2, "bob", "hi alice", "alice"))
+        user.add_read_message(Message(3, "carol", "hello"))
+        self.assertEqual([m.id for m in user.get_conversation("alice", 0, -1)], [0, 2])
+        self.assertEqual(user.get_unread_counts(), {"alice": 1})
+
+        # Popped late, but it goes where its id belongs
+        user.pop_unread_messages(-1)
+        self.assertEqual([m.id for m in user.get_conversation("alice", 0, -1)], [0, 1, 2])
+        self.assertEqual([m.id for m in user.get_conversation("alice", 1, 1)], [1])
+        self.assertEqual(user.get_unread_counts(), {})
+        self.assertEqual(user.get_conversation("nobody", 0, -1), [])
+
+        user.delete_messages([0, 2])
+        self.assertEqual([m.id for m in user.get_conversation("alice", 0, -1)], [1])
+        self.assertEqual(user.sent_messages, [])
+
+    def test_unread_counts_follow_dropped_messages(self):
+        user = User("bob", [], [], MailboxLimits(max_unread_messages=2, overflow_policy=OverflowPolicy.DROP_OLDEST))
+        for i, sender in enumerate(["alice", "alice", "carol"]):
+            user.add_message(Message(i, sender, "hi"))
+        self.assertEqual(user.get_unread_counts(), {"alice": 1, "carol": 1})
+        self.assertEqual(user.get_number_of_unread_messages_from("carol"), 1)
+
+    def test_saved_and_loaded(self):
+        account_manager = AccountManager()
+        for name in ["alice", "bob"]:
+            account_manager.add_account(name, b"hash", b"salt")
+        account_manager.deliver_message("bob", Message(0, "alice", "hi bob"), online=True)
+        account_manager.record_sent_message("bob", Message(0, "alice", "hi bob"))
+        account_manager.deliver_message("alice", Message(1, "bob", "hi alice"), online=False)
+        account_manager.record_sent_message("alice", Message(1, "bob", "hi alice"))
+
+        loaded = AccountManager()
+        loaded.load_state(account_manager.get_state())
+        for name, correspondent in [("alice", "bob"), ("bob", "alice")]:
+            self.assertEqual(loaded.get_conversation(name, correspondent, 0, -1),
+                             account_manager.get_conversation(name, correspondent, 0, -1))
+        self.assertEqual(loaded.get_unread_counts("alice"), {"bob": 1})
+
+    def test_built_when_first_asked_for(self):
+        user = User("bob", [Message(1, "alice", "unread")], [Message(0, "alice", "hi bob")])
+        self.assertIsNone(user.conversations)
+        # Changes before then are picked up from the mailboxes
+        user.pop_unread_messages(-1)
+        user.add_message(Message(2, "carol", "hello"))
+        user.add_sent_message(SentMessage(3, "bob", "hi alice", "alice"))
+        self.assertIsNone(user.conversations)
+        self.assertEqual([m.id for m in user.get_conversation("alice", 0, -1)], [0, 1, 3])
+        self.assertEqual(user.get_unread_counts(), {"carol": 1})
+        # And kept up to date from then on
+        user.pop_unread_messages(-1)
+        self.assertEqual(user.get_unread_counts(), {})
+        self.assertEqual([m.id for m in user.get_conversation("carol", 0, -1)], [2])
+
+
+class TestConversationRPCs(unittest.TestCase):
+    def setUp(self):
+        self.server = ChatServer(ConnectionSettings())
+        self.servicer = ChatServicer(self.server)
+        self.contexts = {}
+        for name in ["alice", "bob"]:
+            context = MockContext()
+            context.peer_value = f"{name}_peer"
+            self.contexts[name] = context
+            self.servicer.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"), context)
+            self.servicer.Login(chat_pb2.LoginRequest(username=name, password="pw"), context)
+
+    def send(self, sender: str, receiver: str, content: str):
+        self.servicer.SendMessage(chat_pb2.SendMessageRequest(receiver=receiver, content=content),
+                                  self.contexts[sender])
+
+    def test_conversation(self):
+        # Logged in, so messages go straight to the read mailbox
+        self.send("alice", "bob", "lunch?")
+        self.send("bob", "alice", "sure")
+        self.send("alice", "bob", "noon then")
+        request = chat_pb2.GetConversationRequest(correspondent="alice", offset=0, num_messages=-1)
+        response = self.servicer.GetConversation(request, self.contexts["bob"])
+        self.assertEqual([(m.sender, m.content) for m in response.messages],
+                         [("alice", "lunch?"), ("bob", "sure"), ("alice", "noon then")])
+        request.compact = True
+        request.num_messages = 2
+        response = self.servicer.GetConversation(request, self.contexts["bob"])
+        self.assertEqual([m.content for m in messages_from_response(response)], ["sure", "noon then"])
+
+    def test_unread_counts(self):
+        self.servicer.Logout(chat_pb2.LogoutRequest(), self.contexts["bob"])
+        for i in range(3):
+            self.send("alice", "bob", f"message {i}")
+        self.servicer.Login(chat_pb2.LoginRequest(username="bob", password="pw"), self.contexts["bob"])
+        response = self.servicer.GetUnreadCounts(chat_pb2.GetUnreadCountsRequest(), self.contexts["bob"])
+        self.assertEqual(dict(response.counts), {"alice": 3})
+        request = chat_pb2.GetConversationRequest(correspondent="alice", num_messages=-1)
+        response = self.servicer.GetConversation(request, self.contexts["bob"])
+        self.assertEqual((len(response.messages), response.unread), (0, 3))
+        # Alice sees what she sent
+        request = chat_pb2.GetConversationRequest(correspondent="bob", num_messages=-1)
+        self.assertEqual(len(self.servicer.GetConversation(request, self.contexts["alice"]).messages), 3)
+
+
+class TestConversationBenchmark(unittest.TestCase):
+    """A page of one conversation from the server, against fetching the read mailbox and filtering it."""
+    MESSAGES = bench_scale(100000, 10000)
+    CORRESPONDENTS = 100
+    PAGE = 20
+
+    def test_against_client_filtering(self):
+        server = ChatServer(ConnectionSettings())
+        servicer = ChatServicer(server)
+        context = MockContext()
+        server.account_manager.add_account("bob", b"hash", b"salt")
+        for i in range(self.MESSAGES):
+            server.account_manager.deliver_message("bob", Message(i, f"user{i % self.CORRESPONDENTS}", f"message {i}"),
+                                                   online=i % 2 == 0)
+        with server.sessions_lock:
+            server.client_sessions[context.peer()] = "bob"
+
+        def server_side():
+            request = chat_pb2.GetConversationRequest(correspondent="user7", offset=0, num_messages=self.PAGE)
+            return servicer.GetConversation(request, context).messages
+
+        def client_side():
+            request = chat_pb2.GetReadMessagesRequest(offset=0, num_messages=-1)
+            messages = servicer.GetReadMessages(request, context).messages
+            return [m for m in messages if m.sender == "user7"][-self.PAGE:]
+
+        def counts_server_side():
+            return servicer.GetUnreadCounts(chat_pb2.GetUnreadCountsRequest(), context).counts
+
+        def counts_by_scanning():
+            counts = {}
+            for m in server.account_manager.get_user("bob").get_unread_messages():
+                counts[m.sender] = counts.get(m.sender, 0) + 1
+            return counts
+
+        self.assertEqual(list(server_side()), client_side())
+        self.assertEqual(dict(counts_server_side()), counts_by_scanning())
+        rows = [
+            ["conversation page", f"{time_ns(server_side, 100) / 1000:.1f}", f"{time_ns(client_side, 5) / 1000:.1f}"],
+            ["unread counts", f"{time_ns(counts_server_side, 100) / 1000:.1f}",
+             f"{time_ns(counts_by_scanning, 5) / 1000:.1f}"],
+        ]
+        print()
+        print(f"{self.MESSAGES} messages from {self.CORRESPONDENTS} correspondents, half of them unread")
+        print(format_table(["operation", "server index us", "client filtering us"], rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
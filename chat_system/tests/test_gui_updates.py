@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from chat_system.client.async_client import AsyncChatClient
+from chat_system.client.client import ChatClient
+from chat_system.client.gui_updates import FRAME_MS, GuiUpdateQueue
+from chat_system.client.message_list import MailboxModel, VirtualList
+from chat_system.common.config import ConnectionSettings
+from chat_system.tests.benchmark import format_table, start_loopback_server
+
+
+class TestGuiUpdateQueue(unittest.TestCase):
+    def test_coalesced(self):
+        updates = GuiUpdateQueue()
+        applied = []
+        for i in range(100):
+            updates.put("count", applied.append, f"count {i}")
+            updates.put(None, applied.append, f"notice {i}" if i < 2 else None)
+        updates.put("page", applied.append, "page")
+        updates.drain()
+        # Keyed updates keep the place of the first one queued, with the value of the last
+        self.assertEqual(applied[:3], ["count 99", "notice 0", "notice 1"])
+        self.assertEqual(len(applied), 1 + 100 + 1)
+        self.assertEqual(applied[-1], "page")
+        self.assertEqual(updates.stats, {"queued": 201, "applied": 102, "frames": 1})
+        updates.drain()
+        self.assertEqual(len(applied), 102)
+
+    def test_from_other_threads(self):
+        updates = GuiUpdateQueue()
+        applied = []
+        threads = [threading.Thread(target=lambda: [updates.put(None, applied.append, 1) for _ in range(1000)])
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            updates.drain()
+        updates.drain()
+        self.assertEqual(len(applied), 4000)
+
+
+class FakeGUI:
+    """Stands in for ChatGUI where there's no display, keeping what it would show."""
+
+    def __init__(self, get_read_messages, **callbacks):
+        self.updates = GuiUpdateQueue()
+        self.logged_in = False
+        self.notices = []
+        self.page_size = 10
+        self.rows = [()] * self.page_size
+        self.mailbox = MailboxModel()
+        self.message_list = VirtualList(self.mailbox, self.page_size, self.rows.__setitem__, get_read_messages)
+        self.stats = dict.fromkeys(["redraws"], 0)
+
+    def show_main_widgets(self):
+        self.logged_in = True
+
+    def display_message(self, message: str):
+        self.notices.append(message)
+
+    def update_unread_count(self, count: int):
+        pass
+
+    def update_read_count(self, count: int):
+        self.mailbox.resize(count)
+        self.update_messages_view()
+
+    def update_messages_view(self):
+        drawn = self.message_list.stats["rows_drawn"]
+        self.message_list.render()
+        if self.message_list.stats["rows_drawn"] > drawn:
+            self.stats["redraws"] += 1
+
+    def store_messages(self, offset: int, limit: int, messages):
+        if self.mailbox.store(offset, limit, messages):
+            self.update_messages_view()
+
+
+class TestBurst(unittest.TestCase):
+    MESSAGES = 1000
+
+    def run_frames(self, gui: FakeGUI, done, timeout: float = 30) -> bool:
+        """Drain the GUI's updates once a frame, like its main loop would, until done()."""
+        deadline = time.monotonic() + timeout
+        while not done() and time.monotonic() < deadline:
+            time.sleep(FRAME_MS / 1000)
+            gui.updates.drain()
+        return done()
+
+    def noticed(self, gui: FakeGUI) -> int:
+        """How many messages the notices shown were of."""
+        return sum(1 if notice.startswith("New") else int(notice.split()[0]) for notice in gui.notices)
+
+    def test_redraws(self):
+        chat_server, grpc_server = start_loopback_server()
+        config = ConnectionSettings(host="localhost", port=chat_server.port)
+        sender = AsyncChatClient(config)
+        client = ChatClient(config, gui_class=FakeGUI)
+        gui = client.gui
+        try:
+            self.assertTrue(client.connect())
+            async def create_accounts():
+                await sender.connect()
+                await sender.create_account("alice", "pw")
+                await sender.create_account("bob", "pw")
+                await sender.login("alice", "pw")
+            client.loop.run(create_accounts())
+            client.login("bob", "pw")
+            self.assertTrue(self.run_frames(gui, lambda: gui.logged_in))
+            time.sleep(0.2)  # For the subscription to pick up the login
+
+            async def burst():
+                await asyncio.gather(*(sender.send_message("bob", f"message {i}") for i in range(self.MESSAGES)))
+            start = time.perf_counter()
+            client.loop.run(burst())
+            newest = chat_server.next_message_id - 1
+            # Every message has been told of, and the page shows the newest of them
+            self.assertTrue(self.run_frames(
+                gui, lambda: self.noticed(gui) == self.MESSAGES and gui.rows[0][:1] == (newest,)))
+            elapsed = time.perf_counter() - start
+        finally:
+            client.loop.run(sender.close())
+            client.loop.run(client.client.close())
+            client.loop.stop()
+            grpc_server.stop(None)
+
+        stats = dict(gui.stats, **gui.updates.stats, **gui.message_list.stats)
+        print()
+        print(f"Burst of {self.MESSAGES} messages, shown after {elapsed * 1000:.0f} ms")
+        print(format_table(["frames", "updates queued", "updates applied", "notices", "redraws", "rows drawn"],
+                           [[stats["frames"], stats["queued"], stats["applied"], len(gui.notices),
+                             stats["redraws"], stats["rows_drawn"]]]))
+        self.assertEqual([row[0] for row in gui.rows], list(range(newest, newest - gui.page_size, -1)))
+        # At most one of each a frame, rather than one each per message
+        self.assertLessEqual(stats["redraws"], stats["frames"])
+        self.assertLessEqual(len(gui.notices), stats["frames"])
+        self.assertLess(stats["redraws"], self.MESSAGES / 10)
+        self.assertEqual(gui.mailbox.total, self.MESSAGES)
+
+
+if __name__ == '__main__':
+    unittest.main()
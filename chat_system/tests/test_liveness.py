@@ -0,0 +1,133 @@
+import multiprocessing
+import os
+import signal
+import time
+import unittest
+
+import grpc
+
+from chat_system.common.config import ConnectionSettings, keepalive_options
+from chat_system.proto import chat_pb2, chat_pb2_grpc
+from chat_system.server.server import ChatServer, ChatServicer
+from chat_system.tests.benchmark import start_loopback_server
+from chat_system.tests.test_replication import wait_until
+from chat_system.tests.test_server import MockContext
+
+
+class TestHeartbeatsAndReaping(unittest.TestCase):
+    def setUp(self):
+        self.server = ChatServer(ConnectionSettings(heartbeat_interval=0.05, session_timeout=10))
+        self.servicer = ChatServicer(self.server)
+        self.contexts = {}
+        for name in ["alice", "bob"]:
+            context = MockContext()
+            context.peer_value = f"{name}_peer"
+            self.contexts[name] = context
+            self.servicer.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"), context)
+            self.servicer.Login(chat_pb2.LoginRequest(username=name, password="pw"), context)
+
+    def test_heartbeat_on_idle_stream(self):
+        stream = self.servicer.SubscribeToMessages(chat_pb2.SubscribeRequest(), self.contexts["bob"])
+        notification = next(stream)
+        self.assertTrue(notification.heartbeat)
+        self.assertFalse(notification.HasField('message'))
+        stream.close()
+        self.assertEqual(self.server.get_session_stats()["heartbeats"], 1)
+
+    def test_reaps_idle_sessions_without_streams(self):
+        stream = self.servicer.SubscribeToMessages(chat_pb2.SubscribeRequest(), self.contexts["bob"])
+        next(stream)
+        later = time.monotonic() + 11
+        # Bob is still subscribed, alice hasn't done anything for too long
+        self.assertEqual(self.server.reap_stale_sessions(now=later), ["alice"])
+        with self.server.sessions_lock:
+            self.assertFalse(self.server.is_online("alice"))
+            self.assertTrue(self.server.is_online("bob"))
+
+        # Bob's client goes away. The session only times out counting from then
+        self.contexts["bob"].is_active = lambda: False
+        stream.close()
+        self.assertEqual(self.server.reap_stale_sessions(now=time.monotonic() + 5), [])
+        self.assertEqual(self.server.reap_stale_sessions(now=time.monotonic() + 11), ["bob"])
+        stats = self.server.get_session_stats()
+        self.assertEqual((stats["reaped_streams"], stats["reaped_sessions"], stats["sessions"]), (1, 2, 0))
+
+    def test_calls_keep_sessions_alive(self):
+        self.server.session_activity["alice_peer"] -= 20
+        self.servicer.GetNumberOfUnreadMessages(chat_pb2.GetNumberOfUnreadMessagesRequest(), self.contexts["alice"])
+        self.assertEqual(self.server.reap_stale_sessions(now=time.monotonic() + 5), [])
+
+
+def run_subscribers(address: str, count: int, ready):
+    """Log in and subscribe on separate connections, then wait to be killed."""
+    streams = []
+    for i in range(count):
+        channel = grpc.insecure_channel(address, options=[("grpc.use_local_subchannel_pool", 1)])
+        stub = chat_pb2_grpc.ChatServiceStub(channel)
+        stub.Login(chat_pb2.LoginRequest(username=f"user{i}", password="pw"))
+        stream = stub.SubscribeToMessages(chat_pb2.SubscribeRequest())
+        next(stream)  # A heartbeat, once the server is in the stream
+        streams.append((channel, stream))
+    ready.set()
+    time.sleep(60)
+
+
+class TestKilledClients(unittest.TestCase):
+    """Clients that die without logging out or closing their streams."""
+    # Two rounds of them are more than the server has threads for, unless the first round is reaped
+    CLIENTS = 8
+    ROUNDS = 2
+
+    def test_dead_clients_are_reaped(self):
+        chat_server, grpc_server = start_loopback_server(heartbeat_interval=0.2, session_timeout=0.5,
+                                                         keepalive_time=0.5, keepalive_timeout=0.5)
+        address = f"localhost:{chat_server.port}"
+        for i in range(self.CLIENTS):
+            chat_server.account_manager.create_account(f"user{i}", "pw")
+        mp = multiprocessing.get_context("spawn")
+        try:
+            for _ in range(self.ROUNDS):
+                ready = mp.Event()
+                process = mp.Process(target=run_subscribers, args=(address, self.CLIENTS, ready))
+                process.start()
+                self.assertTrue(ready.wait(60))
+                self.assertEqual(chat_server.get_session_stats()["open_streams"], self.CLIENTS)
+                # No chance to say goodbye
+                os.kill(process.pid, signal.SIGKILL)
+                process.join(10)
+                self.assertTrue(wait_until(lambda: chat_server.get_session_stats()["open_streams"] == 0))
+                self.assertTrue(wait_until(lambda: chat_server.get_session_stats()["sessions"] == 0))
+
+            stats = chat_server.get_session_stats()
+            self.assertEqual(stats["reaped_streams"], self.CLIENTS * self.ROUNDS)
+            self.assertEqual(stats["reaped_sessions"], self.CLIENTS * self.ROUNDS)
+            with chat_server.sessions_lock:
+                self.assertFalse(chat_server.is_online("user0"))
+        finally:
+            grpc_server.stop(None)
+
+
+
+class TestKeepalive(unittest.TestCase):
+    def test_idle_client_keeps_its_connection(self):
+        """Pings from a client with nothing to do mustn't get it hung up on, which would lose its session."""
+        config = ConnectionSettings(heartbeat_interval=0, keepalive_time=0.5, keepalive_timeout=1)
+        chat_server, grpc_server = start_loopback_server(heartbeat_interval=0, keepalive_time=0.5,
+                                                         keepalive_timeout=1)
+        channel = grpc.insecure_channel(f"localhost:{chat_server.port}",
+                                        options=keepalive_options(config) + [("grpc.use_local_subchannel_pool", 1)])
+        try:
+            stub = chat_pb2_grpc.ChatServiceStub(channel)
+            stub.CreateAccount(chat_pb2.CreateAccountRequest(username="alice", password="pw"))
+            stub.Login(chat_pb2.LoginRequest(username="alice", password="pw"))
+            # Enough pings for the server to have hung up, if it counted them as too many
+            time.sleep(4)
+            response = stub.GetNumberOfUnreadMessages(chat_pb2.GetNumberOfUnreadMessagesRequest())
+            self.assertEqual(response.count, 0)
+        finally:
+            channel.close()
+            grpc_server.stop(None)
+
+
+if __name__ == '__main__':
+    unittest.main()
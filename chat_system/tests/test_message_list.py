@@ -0,0 +1,200 @@
+import random
+import time
+import tracemalloc
+import unittest
+from typing import List, Tuple
+
+from chat_system.client.message_list import LOADING, MailboxModel, VirtualList
+from chat_system.common.user import Message, _page
+from chat_system.tests.benchmark import FULL_BENCHMARK, bench_scale, format_table, percentile
+
+
+class FakeServer:
+    """Answers the list's fetches a frame later, like requests that go out and come back."""
+
+    def __init__(self, messages: List[Message]):
+        self.messages = messages
+        self.requests: List[Tuple[int, int]] = []
+
+    def fetch(self, offset: int, limit: int):
+        self.requests.append((offset, limit))
+
+    def answer(self, model: MailboxModel) -> int:
+        requests, self.requests = self.requests, []
+        stored = 0
+        for offset, limit in requests:
+            # Decoded from the response, so nothing is shared with the server's copy
+            page = [Message(m.id, m.sender, m.content.encode().decode()) for m in _page(self.messages, offset, limit)]
+            stored += model.store(offset, limit, page)
+        return stored
+
+
+class TestMailboxModel(unittest.TestCase):
+    def messages(self, n: int) -> List[Message]:
+        return [Message(i, "alice", f"message {i}") for i in range(n)]
+
+    def test_chunks(self):
+        server = FakeServer(self.messages(250))
+        model = MailboxModel(chunk_size=100, max_chunks=2)
+        model.resize(250)
+        requests = model.missing(0, 250)
+        # Asked for by distance from the newest, the newest chunk is the partly filled one
+        self.assertEqual(requests, [(150, 100), (50, 100), (0, 50)])
+        self.assertEqual(model.missing(0, 250), [])
+        server.requests = requests
+        self.assertEqual(server.answer(model), 3)
+        # Only two are kept, the one fetched first went
+        self.assertIsNone(model.get(0))
+        self.assertEqual(model.get(120).id, 120)
+        self.assertEqual(model.get(249).id, 249)
+
+    def test_growing_and_shrinking(self):
+        messages = self.messages(150)
+        server = FakeServer(messages)
+        model = MailboxModel(chunk_size=100)
+        model.resize(150)
+        server.requests = model.missing(0, 150)
+        server.answer(model)
+
+        # New messages leave what's fetched where it is, only the last chunk has to be fetched again
+        messages += self.messages(180)[150:]
+        model.resize(180)
+        self.assertEqual(model.get(99).id, 99)
+        self.assertIsNone(model.get(120))
+        requests = model.missing(0, 180)
+        self.assertEqual(requests, [(0, 80)])
+
+        # Answered after the count changed again, the request is out of date
+        messages.append(Message(180, "alice", "message 180"))
+        model.resize(181)
+        server.requests = requests
+        self.assertEqual(server.answer(model), 0)
+        self.assertIsNone(model.get(120))
+        server.requests = model.missing(0, 181)
+        self.assertEqual(server.answer(model), 1)
+        self.assertEqual(model.get(180).id, 180)
+
+        del messages[10:20]
+        model.resize(171)
+        self.assertIsNone(model.get(0))
+
+
+class TestVirtualList(unittest.TestCase):
+    ROWS = 20
+    MESSAGES = bench_scale(1000000, 100000)
+    FRAMES = 2000
+
+    def setUp(self):
+        self.server = FakeServer([Message(i, f"user{i % 50}", f"message number {i}") for i in range(self.MESSAGES)])
+        self.rows = [()] * self.ROWS
+        self.model = MailboxModel()
+        self.model.resize(self.MESSAGES)
+        self.list = VirtualList(self.model, self.ROWS, self.rows.__setitem__, self.server.fetch)
+
+    def frame(self) -> bool:
+        """Draw a frame, and another with anything fetched for it. Returns whether any row had to wait."""
+        self.list.render()
+        waited = LOADING in self.rows
+        if self.server.answer(self.model):
+            self.list.render()
+        return waited
+
+    def test_rows_follow_scrolling(self):
+        self.frame()
+        newest = self.MESSAGES - 1
+        self.assertEqual([row[0] for row in self.rows], list(range(newest, newest - self.ROWS, -1)))
+        self.list.scroll_to(self.MESSAGES)
+        # Scrolled past the end, stops at the oldest screenful, which isn't fetched until the next frame
+        self.assertEqual(self.list.first, self.MESSAGES - self.ROWS)
+        self.assertEqual(self.rows[0], LOADING)
+        self.frame()
+        self.assertEqual([row[0] for row in self.rows], list(range(self.ROWS - 1, -1, -1)))
+        self.assertEqual(self.list.message_at(self.ROWS - 1).id, 0)
+        # Rows already showing the right message aren't drawn again
+        drawn = self.list.stats["rows_drawn"]
+        self.list.scroll(-1)
+        self.assertEqual(self.list.stats["rows_drawn"], drawn + self.ROWS)
+        self.list.render()
+        self.assertEqual(self.list.stats["rows_drawn"], drawn + self.ROWS)
+
+    def test_selection_follows_messages(self):
+        self.frame()
+        newest = self.MESSAGES - 1
+        selected = self.list.select(set(), [0, 1])
+        self.assertEqual(selected, {newest, newest - 1})
+        # Scrolled by a row, the same messages are on different rows, and the first is off screen but still selected
+        self.list.scroll(1)
+        self.assertEqual(self.list.ids_shown()[newest - 1], 0)
+        self.assertNotIn(newest, self.list.ids_shown())
+        # Changing the selection on screen leaves the one off screen alone
+        selected = self.list.select(selected, [2])
+        self.assertEqual(selected, {newest, newest - 3})
+        self.list.scroll(-1)
+        shown = self.list.ids_shown()
+        self.assertEqual(sorted(shown[message_id] for message_id in selected), [0, 3])
+
+    def test_short_mailbox(self):
+        model = MailboxModel()
+        model.resize(5)
+        rows = [None] * self.ROWS
+        server = FakeServer([Message(i, "alice", f"message {i}") for i in range(5)])
+        virtual_list = VirtualList(model, self.ROWS, rows.__setitem__, server.fetch)
+        virtual_list.render()
+        server.answer(model)
+        virtual_list.scroll(10)
+        self.assertEqual([row[0] for row in rows[:5]], [4, 3, 2, 1, 0])
+        self.assertEqual(rows[5:], [()] * (self.ROWS - 5))
+
+    def test_scrolling_benchmark(self):
+        """Frame times and memory scrolling a large mailbox, against making a row for every message."""
+        rng = random.Random(0)
+        tracemalloc.start()
+        frame_times = []
+        rows_drawn = []
+        waits = 0
+        for i in range(self.FRAMES):
+            drawn = self.list.stats["rows_drawn"]
+            start = time.perf_counter()
+            if i % 100 == 99:
+                # Dragging the scrollbar somewhere
+                self.list.scroll_to(rng.randrange(self.MESSAGES))
+            else:
+                self.list.scroll(3)  # A turn of the mouse wheel
+            waits += self.frame()
+            frame_times.append(time.perf_counter() - start)
+            rows_drawn.append(self.list.stats["rows_drawn"] - drawn)
+        _, virtual_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # Every row shows the message it should, newest at the top
+        top = self.MESSAGES - 1 - self.list.first
+        self.assertEqual([row[0] for row in self.rows], list(range(top, top - self.ROWS, -1)))
+        self.assertLessEqual(len(self.model.chunks), self.model.max_chunks)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        every_row = [(m.id, m.sender, m.content) for m in reversed(self.server.messages)]
+        every_row_time = time.perf_counter() - start
+        _, every_row_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del every_row
+
+        print()
+        print(f"{self.FRAMES} frames scrolling {self.MESSAGES} messages, {self.ROWS} rows on screen, "
+              f"{waits} of them waiting for messages")
+        print(format_table(["list", "rows made", "frame p50 ms", "frame p99 ms", "first frame ms", "peak MiB"], [
+            ["virtual", self.ROWS, f"{percentile(frame_times, 50) * 1000:.3f}",
+             f"{percentile(frame_times, 99) * 1000:.3f}", f"{frame_times[0] * 1000:.1f}",
+             f"{virtual_peak / 2**20:.1f}"],
+            ["a row per message", self.MESSAGES, "", "", f"{every_row_time * 1000:.1f}",
+             f"{every_row_peak / 2**20:.1f}"],
+        ]))
+        self.assertLess(virtual_peak, every_row_peak)
+        # A frame draws at most the screen twice, once as scrolled and once with what was fetched for it,
+        # however large the mailbox
+        self.assertLessEqual(max(rows_drawn), 2 * self.ROWS)
+        if FULL_BENCHMARK:
+            self.assertLess(percentile(frame_times, 99), 0.016)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+import multiprocessing
+import os
+import pickle
+import queue
+import tempfile
+import threading
+import time
+import unittest
+
+import grpc
+
+from chat_system.common.channel import ChannelMessage
+from chat_system.common.config import ConnectionSettings
+from chat_system.common.user import Message
+from chat_system.proto import chat_pb2, chat_pb2_grpc
+from chat_system.server.account_manager import AccountManager
+from chat_system.server.prefork import CoordinatorState, PreforkCluster
+from chat_system.server.snapshot import decode_snapshot
+from chat_system.tests.benchmark import FULL_BENCHMARK, bench_scale, format_table, free_ports
+
+
+class TestCoordinatorState(unittest.TestCase):
+    def setUp(self):
+        self.inboxes = [queue.Queue(), queue.Queue()]
+        self.state = CoordinatorState(ConnectionSettings(), self.inboxes)
+        for name in ["alice", "bob"]:
+            self.state.add_account(name, b"hash", b"salt")
+
+    def test_offline_delivery(self):
+        self.assertTrue(self.state.deliver_message("bob", Message(0, "alice", "hi"), False))
+        self.assertEqual(self.state.get_number_of_unread_messages("bob"), 1)
+        self.assertTrue(all(inbox.empty() for inbox in self.inboxes))
+        self.assertFalse(self.state.deliver_message("nobody", Message(1, "alice", "hi"), False))
+
+    def test_notifies_workers_with_sessions(self):
+        self.state.set_online("bob", 1, True)
+        self.state.set_online("bob", 1, True)
+        self.state.deliver_message("bob", Message(0, "alice", "hi"), True)
+        self.assertEqual(self.inboxes[1].get_nowait(), ("bob", Message(0, "alice", "hi")))
+        self.assertTrue(self.inboxes[0].empty())
+        self.assertEqual(self.state.get_number_of_read_messages("bob"), 1)
+
+        # Still online until both sessions log out
+        self.state.set_online("bob", 1, False)
+        self.assertTrue(self.state.is_online("bob"))
+        self.state.set_online("bob", 1, False)
+        self.assertFalse(self.state.is_online("bob"))
+
+    def test_channel_messages_go_to_every_worker(self):
+        self.state.create_channel("general", "alice")
+        self.state.join_channel("general", "bob")
+        message = Message(0, "alice", "hi all")
+        self.assertIsNone(self.state.post_channel_message("general", message))
+        self.state.publish_channel_message(ChannelMessage("general", message))
+        # Each worker fans it out to the members logged in there
+        self.assertEqual([inbox.get_nowait() for inbox in self.inboxes], [ChannelMessage("general", message)] * 2)
+        self.assertEqual(self.state.list_channels("bob"), [("general", 2, 1)])
+
+    def test_cold_messages_sent_as_messages(self):
+        with tempfile.TemporaryDirectory() as directory:
+            state = CoordinatorState(ConnectionSettings(hot_read_messages=2, segment_dir=directory), self.inboxes)
+            for name in ["alice", "bob"]:
+                state.add_account(name, b"hash", b"salt")
+            state.set_online("bob", 0, True)
+            messages = [Message(i, "alice", f"hello {i}") for i in range(6)]
+            for message in messages:
+                state.deliver_message("bob", message, True)
+            # Older ones are in segment files, which can't be pickled to go back to a worker
+            for result in [state.get_read_messages("bob", 0, -1), state.get_conversation("bob", "alice", 0, -1),
+                           state.search_messages("bob", "hello", 10, 0)[0][::-1]]:
+                self.assertEqual(pickle.loads(pickle.dumps(result)), messages)
+
+
+    def test_retention(self):
+        state = CoordinatorState(ConnectionSettings(retention_max_messages=2, compaction_interval=0.01), self.inboxes)
+        state.add_account("bob", b"hash", b"salt")
+        state.set_online("bob", 0, True)
+        for i in range(5):
+            state.deliver_message("bob", Message(i, "alice", f"hello {i}"), True)
+        state.start_maintenance()
+        try:
+            deadline = time.time() + 5
+            while state.get_number_of_read_messages("bob") > 2 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            state.stop_maintenance()
+        self.assertEqual([m.id for m in state.get_read_messages("bob", 0, -1)], [3, 4])
+        self.assertGreaterEqual(state.compactor.stats["passes"], 1)
+
+
+    def test_checkpoints(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "server_data.json")
+            state = CoordinatorState(ConnectionSettings(server_data_path=path, checkpoint_interval=0.01), self.inboxes)
+            state.add_account("alice", b"hash", b"salt")
+            state.start_maintenance()
+            try:
+                deadline = time.time() + 5
+                while state.checkpointer.stats["checkpoints"] < 1 and time.time() < deadline:
+                    time.sleep(0.01)
+            finally:
+                state.stop_maintenance()
+            loaded = AccountManager()
+            with open(path, "rb") as f:
+                decode_snapshot(f.read(), loaded)
+            self.assertEqual(list(loaded.accounts), ["alice"])
+
+
+def wait_for_server(address: str, timeout: float = 30):
+    with grpc.insecure_channel(address) as channel:
+        grpc.channel_ready_future(channel).result(timeout=timeout)
+
+
+class TestPreforkCluster(unittest.TestCase):
+    def setUp(self):
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.config = ConnectionSettings(
+            host="localhost", port=free_ports(1)[0], workers=2,
+            server_data_path=os.path.join(self.data_dir.name, "server_data.json")
+        )
+        self.address = f"localhost:{self.config.port}"
+        self.cluster = PreforkCluster(self.config, self.config.workers)
+        self.cluster.start()
+        wait_for_server(self.address)
+
+    def tearDown(self):
+        self.cluster.stop(save=False)
+        self.data_dir.cleanup()
+
+    def test_shared_state_and_notifications(self):
+        # Separate connections, which the kernel is free to spread over the workers
+        channels = [grpc.insecure_channel(self.address) for _ in range(2)]
+        alice, bob = [chat_pb2_grpc.ChatServiceStub(channel) for channel in channels]
+        for stub, name in [(alice, "alice"), (bob, "bob")]:
+            stub.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"))
+            self.assertFalse(stub.Login(chat_pb2.LoginRequest(username=name, password="pw")).HasField('error'))
+        self.assertEqual(sorted(alice.ListUsers(chat_pb2.ListUsersRequest(pattern="*", limit=-1)).usernames),
+                         ["alice", "bob"])
+
+        received = []
+        stream = bob.SubscribeToMessages(chat_pb2.SubscribeRequest())
+        def receive():
+            for notification in stream:
+                received.append(notification.message.content)
+                break
+        thread = threading.Thread(target=receive)
+        thread.start()
+        alice.SendMessage(chat_pb2.SendMessageRequest(receiver="bob", content="hello"))
+        thread.join(10)
+        stream.cancel()
+        self.assertEqual(received, ["hello"])
+        self.assertEqual(bob.GetNumberOfReadMessages(chat_pb2.GetNumberOfReadMessagesRequest()).count, 1)
+
+        for channel in channels:
+            channel.close()
+        self.cluster.stop()
+        loaded = AccountManager()
+        with open(self.config.server_data_path, "rb") as f:
+            decode_snapshot(f.read(), loaded)
+        self.assertEqual(sorted(loaded.accounts), ["alice", "bob"])
+
+
+def run_logins(address: str, username: str, count: int, start, results):
+    """Log in repeatedly. Each login is a PBKDF2 hash on the server."""
+    with grpc.insecure_channel(address) as channel:
+        stub = chat_pb2_grpc.ChatServiceStub(channel)
+        start.wait()
+        for _ in range(count):
+            stub.Login(chat_pb2.LoginRequest(username=username, password="pw"))
+        results.put(count)
+
+
+class TestPreforkBenchmark(unittest.TestCase):
+    """Login throughput as the number of worker processes grows. Only scales with as many cores as workers."""
+    WORKER_COUNTS = [1, 2, 4, 8] if FULL_BENCHMARK else [1, 2]
+    CLIENTS = bench_scale(16, 2)
+    LOGINS = bench_scale(20, 2)
+
+    def run_cluster(self, workers: int) -> float:
+        with tempfile.TemporaryDirectory() as data_dir:
+            config = ConnectionSettings(host="localhost", port=free_ports(1)[0], workers=workers,
+                                        server_data_path=os.path.join(data_dir, "server_data.json"))
+            address = f"localhost:{config.port}"
+            cluster = PreforkCluster(config, workers)
+            cluster.start()
+            try:
+                wait_for_server(address)
+                time.sleep(1)  # Give the other workers time to bind too
+                with grpc.insecure_channel(address) as channel:
+                    stub = chat_pb2_grpc.ChatServiceStub(channel)
+                    for i in range(self.CLIENTS):
+                        stub.CreateAccount(chat_pb2.CreateAccountRequest(username=f"user{i}", password="pw"))
+
+                mp = multiprocessing.get_context("spawn")
+                start = mp.Event()
+                results = mp.Queue()
+                clients = [mp.Process(target=run_logins, args=(address, f"user{i}", self.LOGINS, start, results))
+                           for i in range(self.CLIENTS)]
+                for p in clients:
+                    p.start()
+                time.sleep(1)
+                begin = time.perf_counter()
+                start.set()
+                logins = sum(results.get(timeout=600) for _ in clients)
+                elapsed = time.perf_counter() - begin
+                for p in clients:
+                    p.join()
+                return logins / elapsed
+            finally:
+                cluster.stop(save=False)
+
+    def test_scaling(self):
+        rows = []
+        for workers in self.WORKER_COUNTS:
+            rows.append([workers, os.cpu_count(), f"{self.run_cluster(workers):.1f}"])
+        print()
+        print(format_table(["workers", "cpus", "logins/s"], rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,15 @@ import unittest
 from chat_system.common.protocol.custom_protocol import (
     CustomProtocol,
     Custom_CreateAccountMessage, Custom_LoginMessage,
-    Custom_ListUsersMessage
+    Custom_ListUsersMessage, Custom_PopUnreadMessagesMessage, Custom_GetReadMessagesMessage
 )
-from chat_system.common.user import User
+from chat_system.common.protocol.custom_protocol_v2 import (
+    CustomProtocolV2, CustomV2_ReceivedMessageMessage,
+    encode_varint, decode_varint, encode_zigzag, decode_zigzag,
+    pack_handshake, accept_handshake, unpack_handshake
+)
+from chat_system.common.protocol.protocol import MessageType
+from chat_system.common.user import Message, User
 
 class TestCustomProtocol(unittest.TestCase):
     def setUp(self):
@@ -66,3 +72,131 @@ class TestCustomProtocol(unittest.TestCase):
         packed_response = message.pack_client(users_obj)
         unpacked_response, _ = Custom_ListUsersMessage.unpack_client(packed_response)
         self.assertEqual(unpacked_response, users)
+
+    def test_message_lists(self):
+        """Test that version 1 message lists are a count followed by each message in full."""
+        messages = [Message(5, "alice", "hi"), Message(7, "bob", "hello")]
+        expected = (b"\x00\x00\x00\x02" +
+                    b"\x00\x00\x00\x05" + b"\x00\x00\x00\x05alice" + b"\x00\x00\x00\x02hi" +
+                    b"\x00\x00\x00\x07" + b"\x00\x00\x00\x03bob" + b"\x00\x00\x00\x05hello")
+        for message in [Custom_PopUnreadMessagesMessage(-1), Custom_GetReadMessagesMessage(0, -1)]:
+            packed = message.pack_client(messages)
+            self.assertEqual(packed, bytes([message.type.value]) + expected)
+            self.assertEqual(type(message).unpack_client(packed), (messages, len(packed)))
+
+
+class TestCustomProtocolV2(unittest.TestCase):
+    def setUp(self):
+        self.protocol = CustomProtocolV2()
+
+    def test_varints(self):
+        """Test varint and zigzag round trips, including multi-byte values."""
+        for i in [0, 1, 127, 128, 300, 2**31 - 1, 2**40]:
+            encoded = encode_varint(i)
+            self.assertEqual(decode_varint(encoded + b"tail"), (i, len(encoded)))
+        self.assertEqual(len(encode_varint(127)), 1)
+        self.assertEqual(len(encode_varint(128)), 2)
+
+        for i in [0, -1, 1, -64, 63, -2**31, 2**31 - 1]:
+            encoded = encode_zigzag(i)
+            self.assertEqual(decode_zigzag(encoded), (i, len(encoded)))
+        self.assertEqual(len(encode_zigzag(-1)), 1)
+
+        with self.assertRaises(ValueError):
+            encode_varint(-1)
+
+    def test_negative_limits(self):
+        """Test that the -1 limits accepted by the server round trip."""
+        message = self.protocol.message_class(MessageType.LIST_USERS)("*", 0, -1)
+        unpacked, _ = type(message).unpack_server(message.pack_server())
+        self.assertEqual(unpacked.limit, -1)
+
+        message = self.protocol.message_class(MessageType.POP_UNREAD_MESSAGES)(-1)
+        unpacked, _ = type(message).unpack_server(message.pack_server())
+        self.assertEqual(unpacked.num_messages, -1)
+
+        # Version 1 can carry them too now
+        unpacked, _ = Custom_ListUsersMessage.unpack_server(Custom_ListUsersMessage("*", 0, -1).pack_server())
+        self.assertEqual(unpacked.limit, -1)
+
+    def test_round_trips(self):
+        """Test that version 2 messages round trip and are smaller than version 1."""
+        messages = [Message(1, "alice", "hi"), Message(300, "bob", "こんにちは"), Message(2, "alice", "")]
+        cases = [
+            (MessageType.CREATE_ACCOUNT, ("testuser", "testpass"), "Username taken"),
+            (MessageType.LOGIN, ("testuser", "testpass"), None),
+            (MessageType.SEND_MESSAGE, ("bob", "Hello!"), None),
+            (MessageType.GET_NUMBER_OF_UNREAD_MESSAGES, (), 1000),
+            (MessageType.POP_UNREAD_MESSAGES, (-1,), messages),
+            (MessageType.GET_READ_MESSAGES, (0, 10), messages),
+            (MessageType.DELETE_MESSAGES, ([1, 300, 2**20],), None),
+        ]
+        for msg_type, args, response in cases:
+            v1 = CustomProtocol().message_class(msg_type)(*args)
+            v2 = self.protocol.message_class(msg_type)(*args)
+
+            packed = v2.pack_server()
+            unpacked, offset = type(v2).unpack_server(packed)
+            self.assertEqual(unpacked, v2)
+            self.assertEqual(offset, len(packed))
+            self.assertLessEqual(len(packed), len(v1.pack_server()))
+
+            if response is not None or msg_type in (MessageType.LOGIN, MessageType.SEND_MESSAGE):
+                packed = v2.pack_client(response)
+                unpacked, offset = type(v2).unpack_client(packed)
+                self.assertEqual(unpacked, response)
+                self.assertEqual(offset, len(packed))
+
+        notification = CustomV2_ReceivedMessageMessage(messages[1])
+        unpacked, _ = CustomV2_ReceivedMessageMessage.unpack_client(notification.pack_client(None))
+        self.assertEqual(unpacked.new_message, messages[1])
+
+    def test_message_batches(self):
+        """Test that message lists survive the sender table and id delta encoding."""
+        messages = [
+            Message(5, "alice", "hi"),
+            Message(7, "bob", "hello"),
+            Message(6, "alice", "こんにちは"),  # Ids aren't always increasing
+            Message(100, "carol", ""),
+        ]
+        for message in [self.protocol.message_class(MessageType.POP_UNREAD_MESSAGES)(-1),
+                        self.protocol.message_class(MessageType.GET_READ_MESSAGES)(0, -1)]:
+            packed = message.pack_client(messages)
+            unpacked, offset = type(message).unpack_client(packed)
+            self.assertEqual(unpacked, messages)
+            self.assertEqual(offset, len(packed))
+
+            # Empty lists work too
+            unpacked, _ = type(message).unpack_client(message.pack_client([]))
+            self.assertEqual(unpacked, [])
+
+    def test_frames(self):
+        """Test version 2 frames, whose lengths are varints."""
+        payload = b"x" * 300
+        frame = self.protocol.pack_frame(payload)
+        self.assertEqual(len(frame), len(payload) + 3)
+        self.assertEqual(self.protocol.unpack_frame(frame[:2]), (None, 0))
+        self.assertEqual(self.protocol.unpack_frame(frame[:-1]), (None, 0))
+        self.assertEqual(self.protocol.unpack_frame(frame), (payload, len(frame)))
+
+    def test_handshake(self):
+        """Test protocol version negotiation."""
+        # Both sides support version 2
+        protocol, reply, consumed = accept_handshake(pack_handshake())
+        self.assertIs(protocol, CustomProtocolV2)
+        self.assertEqual(consumed, 1)
+        self.assertIs(unpack_handshake(reply), CustomProtocolV2)
+
+        # Older clients get what they asked for, newer ones get our latest version
+        self.assertIs(accept_handshake(pack_handshake(1))[0], CustomProtocol)
+        self.assertIs(accept_handshake(pack_handshake(7))[0], CustomProtocolV2)
+
+        # Clients that don't handshake start straight away with a version 1 message
+        login = Custom_LoginMessage("testuser", "testpass").pack_server()
+        self.assertEqual(accept_handshake(login), (CustomProtocol, b'', 0))
+
+        # No common version
+        protocol, reply, _ = accept_handshake(pack_handshake(0))
+        self.assertIsNone(protocol)
+        with self.assertRaises(ValueError):
+            unpack_handshake(reply)
@@ -3,13 +3,23 @@ This file prints out the sizes of the protocol messages for each of the protocol
 - Custom protocol
 - JSON protocol
 - gRPC protocol
+
+It also contains a benchmark matrix that covers every MessageType at several payload sizes
+and character sets, reporting wire bytes, encode/decode time and allocations. Run
+`python -m chat_system.tests.test_protocol_size` to print just the table.
 """
 
+import dataclasses
+import struct
 import unittest
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from chat_system.common.protocol.custom_protocol import *
+from chat_system.common.protocol.custom_protocol_v2 import CustomProtocolV2, VarintCodec
 from chat_system.common.protocol.json_protocol import *
+from chat_system.common.message_batch import pack_message_batch, unpack_message_batch
 from chat_system.proto import chat_pb2
+from chat_system.tests.benchmark import format_table, measure_allocations, time_ns
 
 
 def print_protocol_sizes(type, custom_bytes, json_bytes, grpc_msg):
@@ -263,3 +273,375 @@ class TestProtocolSizes(unittest.TestCase):
         )
 
         print_protocol_sizes("MessageNotification", custom_req, json_req, grpc_req)
+
+
+# Benchmark matrix
+# Each case maps a protocol name to an (encode, decode) pair. Protocols that do not implement a
+# direction for a message are simply left out of the case.
+PROTOCOLS = ["custom", "custom-v2", "json", "grpc"]
+# Message list encodings with and without the sender table, to report what it saves
+BATCH_VARIANTS = ["custom-v2-plain", "grpc-batch"]
+PAYLOAD_SIZES = [0, 100, 10000]
+CHARSETS = {
+    "ascii": ("alice", "Hello, are we still meeting at noon?"),
+    "utf-8": ("アリス", "こんにちは、お昼に会いますか？🍱"),
+}
+Codec = Tuple[Callable[[], bytes], Callable[[bytes], Any]]
+
+
+def _request(msg: ProtocolMessage) -> Codec:
+    return msg.pack_server, type(msg).unpack_server
+
+
+def _response(msg: ProtocolMessage, data: Any) -> Codec:
+    return (lambda: msg.pack_client(data)), type(msg).unpack_client
+
+
+def _v2(msg: ProtocolMessage) -> ProtocolMessage:
+    """The version 2 equivalent of a custom protocol message."""
+    cls = CustomProtocolV2.message_classes[msg.type]
+    return cls(*[getattr(msg, field.name) for field in dataclasses.fields(msg)])
+
+
+def _custom_request(msg: ProtocolMessage) -> Dict[str, Codec]:
+    return {"custom": _request(msg), "custom-v2": _request(_v2(msg))}
+
+
+def _custom_response(msg: ProtocolMessage, data: Any) -> Dict[str, Codec]:
+    return {"custom": _response(msg, data), "custom-v2": _response(_v2(msg), data)}
+
+
+def _grpc(msg) -> Codec:
+    return msg.SerializeToString, type(msg).FromString
+
+
+def _sample_messages(n: int, name: str, content: str) -> List[Message]:
+    # Inboxes are usually dominated by a handful of correspondents
+    return [Message(i, f"{name}{i % 5}", content) for i in range(n)]
+
+
+def _grpc_messages(messages: List[Message]) -> List[chat_pb2.Message]:
+    return [chat_pb2.Message(id=m.id, sender=m.sender, content=m.content) for m in messages]
+
+
+def _custom_v2_plain(msg_type: MessageType, messages: List[Message]) -> Codec:
+    """Version 2 message lists without the sender table: count + full messages, as version 1 sends them."""
+    def encode():
+        return (struct.pack('!B', msg_type) + VarintCodec.encode_int(len(messages)) +
+                b''.join(map(VarintCodec.encode_message, messages)))
+
+    def decode(data):
+        count, offset = VarintCodec.decode_int(data, 1)
+        result = []
+        for _ in range(count):
+            message, offset = VarintCodec.decode_message(data, offset)
+            result.append(message)
+        return result
+    return encode, decode
+
+
+def _grpc_batch(response_cls, messages: List[Message]) -> Codec:
+    response = response_cls(batch=pack_message_batch(messages))
+    return response.SerializeToString, lambda data: unpack_message_batch(response_cls.FromString(data).batch)
+
+
+def _account_cases(custom_cls, json_cls, grpc_req, grpc_resp, name, content):
+    return {
+        "request": {
+            **_custom_request(custom_cls(name, content)),
+            "json": _request(json_cls(name, content)),
+            "grpc": _grpc(grpc_req(username=name, password=content)),
+        },
+        "response": {
+            **_custom_response(custom_cls(name, content), content),
+            "json": _response(json_cls(name, content), content),
+            "grpc": _grpc(grpc_resp(error=content)),
+        },
+    }
+
+
+def _list_users_cases(n, name, content):
+    users = [User(f"{name}{i}", [], []) for i in range(n)]
+    return {
+        "request": {
+            **_custom_request(Custom_ListUsersMessage(f"{name}*", 0, n)),
+            "json": _request(JSON_ListUsersMessage(f"{name}*", 0, n)),
+            "grpc": _grpc(chat_pb2.ListUsersRequest(pattern=f"{name}*", offset=0, limit=n)),
+        },
+        "response": {
+            **_custom_response(Custom_ListUsersMessage(f"{name}*", 0, n), users),
+            "json": _response(JSON_ListUsersMessage(f"{name}*", 0, n), users),
+            "grpc": _grpc(chat_pb2.ListUsersResponse(usernames=[u.name for u in users])),
+        },
+    }
+
+
+def _send_message_cases(n, name, content):
+    return {
+        "request": {
+            **_custom_request(Custom_SendMessageMessage(name, content)),
+            "json": _request(JSON_SendMessageMessage(name, content)),
+            "grpc": _grpc(chat_pb2.SendMessageRequest(receiver=name, content=content)),
+        },
+        "response": {
+            **_custom_response(Custom_SendMessageMessage(name, content), None),
+            "grpc": _grpc(chat_pb2.SendMessageResponse()),
+        },
+    }
+
+
+def _received_message_cases(n, name, content):
+    message = Message(1, name, content)
+    return {
+        "response": {
+            **_custom_response(Custom_ReceivedMessageMessage(message), None),
+            "json": _response(JSON_ReceivedMessageMessage(message), None),
+            "grpc": _grpc(chat_pb2.MessageNotification(
+                message=chat_pb2.Message(id=1, sender=name, content=content))),
+        },
+    }
+
+
+def _count_cases(custom_cls, json_cls, grpc_req, grpc_resp, count):
+    return {
+        "request": {
+            **_custom_request(custom_cls()),
+            "json": _request(json_cls()),
+            "grpc": _grpc(grpc_req()),
+        },
+        "response": {
+            **_custom_response(custom_cls(), count),
+            "json": _response(json_cls(), count),
+            "grpc": _grpc(grpc_resp(count=count)),
+        },
+    }
+
+
+def _pop_unread_cases(n, name, content):
+    messages = _sample_messages(n, name, content)
+    return {
+        "request": {
+            **_custom_request(Custom_PopUnreadMessagesMessage(n)),
+            "json": _request(JSON_PopUnreadMessagesMessage(n)),
+            "grpc": _grpc(chat_pb2.PopUnreadMessagesRequest(num_messages=n)),
+        },
+        "response": {
+            **_custom_response(Custom_PopUnreadMessagesMessage(n), messages),
+            "json": _response(JSON_PopUnreadMessagesMessage(n), messages),
+            "grpc": _grpc(chat_pb2.PopUnreadMessagesResponse(messages=_grpc_messages(messages))),
+            "custom-v2-plain": _custom_v2_plain(MessageType.POP_UNREAD_MESSAGES, messages),
+            "grpc-batch": _grpc_batch(chat_pb2.PopUnreadMessagesResponse, messages),
+        },
+    }
+
+
+def _get_read_cases(n, name, content):
+    messages = _sample_messages(n, name, content)
+    return {
+        "request": {
+            **_custom_request(Custom_GetReadMessagesMessage(0, n)),
+            "json": _request(JSON_GetReadMessagesMessage(0, n)),
+            "grpc": _grpc(chat_pb2.GetReadMessagesRequest(offset=0, num_messages=n)),
+        },
+        "response": {
+            **_custom_response(Custom_GetReadMessagesMessage(0, n), messages),
+            "json": _response(JSON_GetReadMessagesMessage(0, n), messages),
+            "grpc": _grpc(chat_pb2.GetReadMessagesResponse(messages=_grpc_messages(messages))),
+            "custom-v2-plain": _custom_v2_plain(MessageType.GET_READ_MESSAGES, messages),
+            "grpc-batch": _grpc_batch(chat_pb2.GetReadMessagesResponse, messages),
+        },
+    }
+
+
+def _delete_messages_cases(n, name, content):
+    ids = list(range(n))
+    return {
+        "request": {
+            **_custom_request(Custom_DeleteMessagesMessage(ids)),
+            "json": _request(JSON_DeleteMessagesMessage(ids)),
+            "grpc": _grpc(chat_pb2.DeleteMessagesRequest(message_ids=ids)),
+        },
+        "response": {
+            **_custom_response(Custom_DeleteMessagesMessage(ids), None),
+            "grpc": _grpc(chat_pb2.DeleteMessagesResponse()),
+        },
+    }
+
+
+def _empty_cases(custom_cls, json_cls, grpc_req, grpc_resp):
+    return {
+        "request": {
+            **_custom_request(custom_cls()),
+            "json": _request(json_cls()),
+            "grpc": _grpc(grpc_req()),
+        },
+        "response": {
+            **_custom_response(custom_cls(), None),
+            "grpc": _grpc(grpc_resp()),
+        },
+    }
+
+
+# MessageType -> builder(n, name, content). n is only meaningful for the list-carrying messages.
+CASE_BUILDERS: Dict[MessageType, Callable[[int, str, str], Dict[str, Dict[str, Codec]]]] = {
+    MessageType.CREATE_ACCOUNT: lambda n, name, content: _account_cases(
+        Custom_CreateAccountMessage, JSON_CreateAccountMessage,
+        chat_pb2.CreateAccountRequest, chat_pb2.CreateAccountResponse, name, content),
+    MessageType.LOGIN: lambda n, name, content: _account_cases(
+        Custom_LoginMessage, JSON_LoginMessage,
+        chat_pb2.LoginRequest, chat_pb2.LoginResponse, name, content),
+    MessageType.LOGOUT: lambda n, name, content: {
+        "request": {
+            **_custom_request(Custom_LogoutMessage()),
+            "json": _request(JSON_LogoutMessage()),
+            "grpc": _grpc(chat_pb2.LogoutRequest()),
+        },
+    },
+    MessageType.LIST_USERS: _list_users_cases,
+    MessageType.DELETE_ACCOUNT: lambda n, name, content: _empty_cases(
+        Custom_DeleteAccountMessage, JSON_DeleteAccountMessage,
+        chat_pb2.DeleteAccountRequest, chat_pb2.DeleteAccountResponse),
+    MessageType.SEND_MESSAGE: _send_message_cases,
+    MessageType.RECEIVED_MESSAGE: _received_message_cases,
+    MessageType.GET_NUMBER_OF_UNREAD_MESSAGES: lambda n, name, content: _count_cases(
+        Custom_GetNumberOfUnreadMessagesMessage, JSON_GetNumberOfUnreadMessagesMessage,
+        chat_pb2.GetNumberOfUnreadMessagesRequest, chat_pb2.GetNumberOfUnreadMessagesResponse, 10),
+    MessageType.GET_NUMBER_OF_READ_MESSAGES: lambda n, name, content: _count_cases(
+        Custom_GetNumberOfReadMessagesMessage, JSON_GetNumberOfReadMessagesMessage,
+        chat_pb2.GetNumberOfReadMessagesRequest, chat_pb2.GetNumberOfReadMessagesResponse, 10),
+    MessageType.POP_UNREAD_MESSAGES: _pop_unread_cases,
+    MessageType.GET_READ_MESSAGES: _get_read_cases,
+    MessageType.DELETE_MESSAGES: _delete_messages_cases,
+}
+
+# Messages whose size depends on the number of users/messages they carry
+SCALED_MESSAGES = {
+    MessageType.LIST_USERS,
+    MessageType.POP_UNREAD_MESSAGES,
+    MessageType.GET_READ_MESSAGES,
+    MessageType.DELETE_MESSAGES,
+}
+
+
+def benchmark_codec(encode: Callable[[], bytes], decode: Callable[[bytes], Any], repeat: int) -> Optional[list]:
+    """Measure one codec. Returns [bytes, encode ns, decode ns, encode alloc, decode alloc]."""
+    data = encode()
+    if data is None:  # Direction not implemented by this protocol
+        return None
+    decode(data)  # Warm up, and fail loudly if the payload doesn't round trip
+    encode_ns = time_ns(encode, repeat)
+    decode_ns = time_ns(lambda: decode(data), repeat)
+    _, encode_alloc = measure_allocations(encode)
+    _, decode_alloc = measure_allocations(lambda: decode(data))
+    return [len(data), encode_ns, decode_ns, encode_alloc, decode_alloc]
+
+
+def run_benchmark(sizes=PAYLOAD_SIZES, charsets=CHARSETS, protocols=PROTOCOLS + BATCH_VARIANTS) -> List[list]:
+    """Run the full matrix. Each row is [message, direction, n, charset, protocol, *measurements]."""
+    rows = []
+    for msg_type, builder in CASE_BUILDERS.items():
+        for n in (sizes if msg_type in SCALED_MESSAGES else [None]):
+            # Keep the total work per cell roughly constant
+            repeat = max(1, 200 // max(1, n or 1))
+            for charset, (name, content) in charsets.items():
+                for direction, codecs in builder(n or 0, name, content).items():
+                    for protocol in protocols:
+                        if protocol not in codecs:
+                            continue
+                        result = benchmark_codec(*codecs[protocol], repeat)
+                        if result is not None:
+                            rows.append([msg_type.name, direction, n, charset, protocol] + result)
+    return rows
+
+
+def print_benchmark_table(rows: List[list]):
+    headers = ["message", "direction", "n", "charset", "protocol",
+               "bytes", "encode ns", "decode ns", "encode alloc B", "decode alloc B"]
+    print(format_table(headers, rows))
+
+    # Per-protocol totals, the quick answer to "which wire format should this deployment use"
+    print()
+    summary = []
+    for protocol in sorted({row[4] for row in rows}):
+        selected = [row for row in rows if row[4] == protocol]
+        summary.append([protocol, len(selected)] + [sum(row[i] for row in selected) for i in range(5, 10)])
+    print(format_table(["protocol", "cells", "bytes", "encode ns", "decode ns",
+                        "encode alloc B", "decode alloc B"], summary))
+
+    # Wire savings of the sender table + id delta encoding for message lists
+    print()
+    print(format_table(["message", "n", "charset", "custom-v2-plain", "custom-v2", "saved %",
+                        "grpc", "grpc-batch", "saved %"], batch_savings(rows)))
+
+    # Custom protocol v2 against protobuf
+    print()
+    print(format_table(["message", "direction", "n", "charset", "custom-v2 body", "grpc body"],
+                       v2_against_protobuf(rows)))
+
+
+def v2_against_protobuf(rows: List[list]) -> List[list]:
+    """
+    Compare custom protocol v2 and protobuf sizes like for like. gRPC sends the method in the HTTP/2 headers
+    rather than in the protobuf body, so the v2 size leaves out the message type byte, and neither side
+    includes its framing.
+    """
+    sizes = {(row[0], row[1], row[2], row[3], row[4]): row[5] for row in rows}
+    comparison = []
+    for (message, direction, n, charset, protocol), v2 in sizes.items():
+        if protocol != "custom-v2":
+            continue
+        comparison.append([message, direction, n, charset, v2 - 1, sizes[(message, direction, n, charset, "grpc")]])
+    return comparison
+
+
+def batch_savings(rows: List[list]) -> List[list]:
+    """Compare message list sizes with and without the batch encoding."""
+    sizes = {(row[0], row[1], row[2], row[3], row[4]): row[5] for row in rows}
+    savings = []
+    for (message, direction, n, charset, protocol), plain in sizes.items():
+        if protocol != "custom-v2-plain" or not n:
+            continue
+        custom = sizes[(message, direction, n, charset, "custom-v2")]
+        grpc = sizes[(message, direction, n, charset, "grpc")]
+        batch = sizes[(message, direction, n, charset, "grpc-batch")]
+        savings.append([message, n, charset, plain, custom, round(100 * (1 - custom / plain), 1),
+                        grpc, batch, round(100 * (1 - batch / grpc), 1)])
+    return savings
+
+
+class TestProtocolBenchmark(unittest.TestCase):
+    def test_benchmark_matrix(self):
+        """Benchmark every message type across protocols, payload sizes and character sets."""
+        rows = run_benchmark()
+        print_benchmark_table(rows)
+
+        # Every message type is covered by every protocol in at least one direction
+        for msg_type in MessageType:
+            for protocol in PROTOCOLS:
+                self.assertTrue(any(row[0] == msg_type.name and row[4] == protocol for row in rows),
+                                f"{protocol} missing {msg_type.name}")
+
+        # Protobuf leaves out fields that are zero, so it can be smaller than custom protocol v2 for short requests,
+        # but lists of users and messages are smaller in v2
+        list_responses = {MessageType.LIST_USERS.name, MessageType.POP_UNREAD_MESSAGES.name,
+                          MessageType.GET_READ_MESSAGES.name}
+        for message, direction, n, charset, v2, grpc in v2_against_protobuf(rows):
+            if direction == "response" and n and message in list_responses:
+                self.assertLess(v2, grpc, f"{message} {direction} {n} {charset}")
+
+        # The batch encoding saves bytes on every non-empty message list
+        for row in batch_savings(rows):
+            self.assertGreater(row[5], 0)
+            self.assertGreater(row[8], 0)
+
+        # Scaled messages really do grow with the payload
+        for msg_type in SCALED_MESSAGES:
+            for protocol in PROTOCOLS:
+                for direction in ["request", "response"]:
+                    sizes = [row[5] for row in rows if row[0] == msg_type.name and row[1] == direction
+                             and row[3] == "ascii" and row[4] == protocol]
+                    self.assertEqual(sizes, sorted(sizes))
+
+
+if __name__ == "__main__":
+    print_benchmark_table(run_benchmark())
@@ -0,0 +1,148 @@
+import threading
+import unittest
+
+import grpc
+
+from chat_system.proto import chat_pb2, chat_pb2_grpc
+from chat_system.server.rate_limiter import RETRY_AFTER_KEY, RateLimitInterceptor, TokenBucketTable
+from chat_system.tests.benchmark import bench_scale, format_table, start_loopback_server, time_ns
+from chat_system.tests.test_server import MockContext
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucketTable(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.buckets = TokenBucketTable(stripes=4, clock=self.clock)
+
+    def test_burst_then_rate(self):
+        for _ in range(3):
+            self.assertEqual(self.buckets.acquire("a", rate=2, burst=3), 0)
+        # Out of tokens, and one refills every half second
+        self.assertAlmostEqual(self.buckets.acquire("a", rate=2, burst=3), 0.5)
+        self.clock.now += 0.5
+        self.assertEqual(self.buckets.acquire("a", rate=2, burst=3), 0)
+
+    def test_refill_capped_at_burst(self):
+        self.buckets.acquire("a", rate=10, burst=2)
+        self.clock.now += 100
+        for _ in range(2):
+            self.assertEqual(self.buckets.acquire("a", rate=10, burst=2), 0)
+        self.assertGreater(self.buckets.acquire("a", rate=10, burst=2), 0)
+
+    def test_keys_independent(self):
+        self.buckets.acquire(("alice", "SendMessage"), rate=1, burst=1)
+        self.assertGreater(self.buckets.acquire(("alice", "SendMessage"), rate=1, burst=1), 0)
+        self.assertEqual(self.buckets.acquire(("alice", "ListUsers"), rate=1, burst=1), 0)
+        self.assertEqual(self.buckets.acquire(("bob", "SendMessage"), rate=1, burst=1), 0)
+        self.assertEqual(len(self.buckets), 3)
+
+    def test_refilled_buckets_dropped(self):
+        # A new connection each time, like anonymous callers keyed by peer
+        for i in range(10000):
+            self.assertEqual(self.buckets.acquire((f"peer{i}", "Login"), rate=10, burst=5), 0)
+            self.clock.now += 0.01
+        # Only the buckets of the last half second or so haven't refilled, and the rest made room for newer ones
+        self.assertLess(len(self.buckets), 1000)
+        self.assertLess(sum(len(stripe.tokens) for stripe in self.buckets.stripes), 2000)
+
+        # A dropped bucket comes back full, as it would have been anyway
+        for _ in range(5):
+            self.assertEqual(self.buckets.acquire(("peer0", "Login"), rate=10, burst=5), 0)
+        self.assertGreater(self.buckets.acquire(("peer0", "Login"), rate=10, burst=5), 0)
+        self.clock.now += 1
+        self.buckets.sweep()
+        self.assertEqual(len(self.buckets), 0)
+
+
+class TestRateLimitInterceptor(unittest.TestCase):
+    def setUp(self):
+        self.chat_server, self.grpc_server = start_loopback_server(rate_limit_methods={"SendMessage": [1, 3]})
+        for name in ["alice", "bob"]:
+            self.chat_server.account_manager.create_account(name, "password")
+        self.channels = []
+
+    def tearDown(self):
+        for channel in self.channels:
+            channel.close()
+        self.grpc_server.stop(None)
+
+    def login(self, username: str):
+        channel = grpc.insecure_channel(f"localhost:{self.chat_server.port}")
+        self.channels.append(channel)
+        stub = chat_pb2_grpc.ChatServiceStub(channel)
+        stub.Login(chat_pb2.LoginRequest(username=username, password="password"))
+        return stub
+
+    def test_limits_per_user_and_method(self):
+        alice = self.login("alice")
+        request = chat_pb2.SendMessageRequest(receiver="bob", content="hi")
+        for _ in range(3):
+            alice.SendMessage(request)
+        with self.assertRaises(grpc.RpcError) as cm:
+            alice.SendMessage(request)
+        self.assertEqual(cm.exception.code(), grpc.StatusCode.RESOURCE_EXHAUSTED)
+        retry_after = dict(cm.exception.trailing_metadata())[RETRY_AFTER_KEY]
+        self.assertTrue(0 < int(retry_after) <= 1000)
+
+        # Other methods and other users have their own buckets
+        for _ in range(10):
+            alice.ListUsers(chat_pb2.ListUsersRequest(pattern="*", offset=0, limit=-1))
+        self.login("bob").SendMessage(chat_pb2.SendMessageRequest(receiver="alice", content="hi"))
+
+
+class TestRateLimiterBenchmark(unittest.TestCase):
+    """Cost of the limiter on each RPC, and how it scales with concurrent callers."""
+    CALLS = bench_scale(100000, 10000)
+    RPCS = bench_scale(2000, 200)
+    THREADS = 8
+
+    def test_overhead(self):
+        rows = []
+
+        # The check alone, with a bucket that never runs out
+        interceptor = RateLimitInterceptor(type("Server", (), {"client_sessions": {}})(), 1e9, 1e9)
+        context = MockContext()
+        rows.append(["check", "in process",
+                     time_ns(lambda: interceptor.check("SendMessage", 1e9, 1e9, context), self.CALLS)])
+
+        # Many threads hitting different keys, with all buckets behind one lock or striped
+        for stripes in [1, 16]:
+            buckets = TokenBucketTable(stripes)
+            def worker(n):
+                for i in range(self.CALLS // self.THREADS):
+                    buckets.acquire((n, i % 64), 1e9, 1e9)
+            threads = [threading.Thread(target=worker, args=(n,)) for n in range(self.THREADS)]
+            def run():
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+            rows.append([f"{stripes} stripes", f"{self.THREADS} threads", time_ns(run) // self.CALLS])
+
+        # Whole RPCs over loopback, with and without the interceptor
+        for rate in [0, 1e9]:
+            chat_server, grpc_server = start_loopback_server(rate_limit=rate, rate_limit_burst=1e9)
+            with grpc.insecure_channel(f"localhost:{chat_server.port}") as channel:
+                stub = chat_pb2_grpc.ChatServiceStub(channel)
+                request = chat_pb2.ListUsersRequest(pattern="*", offset=0, limit=-1)
+                stub.ListUsers(request)
+                rows.append(["ListUsers RPC", "limited" if rate else "unlimited",
+                             time_ns(lambda: stub.ListUsers(request), self.RPCS)])
+            grpc_server.stop(None)
+
+        print()
+        print(format_table(["operation", "setup", "ns/call"], rows))
+        # The check should be a tiny fraction of an RPC
+        self.assertLess(rows[0][2] * 10, rows[-1][2])
+
+
+if __name__ == '__main__':
+    unittest.main()
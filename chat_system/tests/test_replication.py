@@ -0,0 +1,225 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import grpc
+
+from chat_system.common.config import ConnectionSettings
+from chat_system.proto import chat_pb2, chat_pb2_grpc
+from chat_system.server.replication import MutationLog
+from chat_system.server.server import CLUSTER_SECRET_KEY, ChatServer
+from chat_system.tests.benchmark import bench_scale, format_table, free_ports, percentile, start_loopback_server
+
+
+CLUSTER_SECRET = "test secret"
+
+
+def wait_until(predicate, timeout: float = 10) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def login(address: str, username: str):
+    channel = grpc.insecure_channel(address)
+    stub = chat_pb2_grpc.ChatServiceStub(channel)
+    stub.Login(chat_pb2.LoginRequest(username=username, password="pw"))
+    return channel, stub
+
+
+class TestMutationLog(unittest.TestCase):
+    def test_read_after(self):
+        log = MutationLog(max_entries=3)
+        for _ in range(5):
+            log.append(chat_pb2.Mutation(delete_account="x"))
+        # Seqs 3 to 5 are kept
+        self.assertEqual([m.seq for m in log.read_after(2, timeout=0)], [3, 4, 5])
+        self.assertEqual([m.seq for m in log.read_after(4, timeout=0)], [5])
+        self.assertEqual(log.read_after(5, timeout=0), [])
+        # Too far behind, or ahead of a restarted primary, needs a snapshot
+        self.assertIsNone(log.read_after(1, timeout=0))
+        self.assertIsNone(log.read_after(6, timeout=0))
+
+    def test_wakes_up_reader(self):
+        log = MutationLog(max_entries=10)
+        log.append(chat_pb2.Mutation(delete_account="x"))
+        threading.Timer(0.05, lambda: log.append(chat_pb2.Mutation(delete_account="y"))).start()
+        self.assertEqual([m.delete_account for m in log.read_after(1, timeout=5)], ["y"])
+
+
+class TestReplication(unittest.TestCase):
+    def setUp(self):
+        self.primary, self.primary_grpc = start_loopback_server(replication_log_size=1000,
+                                                                cluster_secret=CLUSTER_SECRET)
+        self.primary_address = f"localhost:{self.primary.port}"
+        for name in ["alice", "bob"]:
+            self.primary.account_manager.create_account(name, "pw")
+        self.channel, self.alice = login(self.primary_address, "alice")
+        self.alice.SendMessage(chat_pb2.SendMessageRequest(receiver="bob", content="before the replica"))
+
+        self.replica, self.replica_grpc = start_loopback_server(replica_of=self.primary_address,
+                                                                replication_log_size=1000,
+                                                                cluster_secret=CLUSTER_SECRET)
+        self.replica_address = f"localhost:{self.replica.port}"
+
+    def tearDown(self):
+        self.replica.promote()
+        self.channel.close()
+        self.replica_grpc.stop(None)
+        self.primary_grpc.stop(None)
+
+    def caught_up(self) -> bool:
+        return self.replica.replicator.applied_seq == self.primary.account_manager.mutation_log.last_seq
+
+    def test_follows_primary(self):
+        self.assertTrue(wait_until(self.caught_up))
+        self.primary.account_manager.create_account("carol", "pw")
+        for i in range(5):
+            self.alice.SendMessage(chat_pb2.SendMessageRequest(receiver="bob", content=f"message {i}"))
+        bob_channel, bob = login(self.primary_address, "bob")
+        bob.PopUnreadMessages(chat_pb2.PopUnreadMessagesRequest(num_messages=2))
+        bob.DeleteMessages(chat_pb2.DeleteMessagesRequest(message_ids=[0]))
+        bob_channel.close()
+
+        self.assertTrue(wait_until(self.caught_up))
+        self.assertEqual(self.replica.account_manager.get_state(), self.primary.account_manager.get_state())
+        self.assertEqual(self.replica.next_message_id, self.primary.next_message_id)
+
+    def test_read_only_until_promoted(self):
+        self.assertTrue(wait_until(self.caught_up))
+        channel, bob = login(self.replica_address, "bob")
+        self.assertEqual(bob.GetNumberOfUnreadMessages(chat_pb2.GetNumberOfUnreadMessagesRequest()).count, 1)
+        self.assertEqual(list(bob.ListUsers(chat_pb2.ListUsersRequest(pattern="*", limit=-1)).usernames),
+                         ["alice", "bob"])
+        with self.assertRaises(grpc.RpcError) as cm:
+            bob.SendMessage(chat_pb2.SendMessageRequest(receiver="alice", content="hi"))
+        self.assertEqual(cm.exception.code(), grpc.StatusCode.FAILED_PRECONDITION)
+
+        with self.assertRaises(grpc.RpcError) as cm:
+            bob.Promote(chat_pb2.PromoteRequest())
+        self.assertEqual(cm.exception.code(), grpc.StatusCode.PERMISSION_DENIED)
+        self.assertTrue(self.replica.read_only)
+        bob.Promote(chat_pb2.PromoteRequest(), metadata=((CLUSTER_SECRET_KEY, CLUSTER_SECRET),))
+        bob.SendMessage(chat_pb2.SendMessageRequest(receiver="alice", content="hi"))
+        message = self.replica.account_manager.get_user("alice").message_queue[0]
+        # Ids carry on from the primary's
+        self.assertEqual(message.id, self.primary.next_message_id)
+        channel.close()
+
+    def test_resyncs_after_a_failed_mutation(self):
+        self.assertTrue(wait_until(self.caught_up))
+        apply_mutation = self.replica.account_manager.apply_mutation
+        def fail_once(mutation):
+            self.replica.account_manager.apply_mutation = apply_mutation
+            raise KeyError("nobody")
+        self.replica.account_manager.apply_mutation = fail_once
+        self.alice.SendMessage(chat_pb2.SendMessageRequest(receiver="bob", content="lost on the way"))
+        self.alice.SendMessage(chat_pb2.SendMessageRequest(receiver="bob", content="after it"))
+
+        # Still following, with the state from a fresh snapshot
+        self.assertTrue(wait_until(self.caught_up))
+        self.assertEqual(self.replica.account_manager.get_state(), self.primary.account_manager.get_state())
+        stats = self.replica.get_replication_stats()
+        self.assertEqual(stats["errors"], 1)
+        self.assertIn("nobody", stats["last_error"])
+
+    def test_only_servers_stream_mutations(self):
+        # A client would get every user's password hash from the snapshot
+        with self.assertRaises(grpc.RpcError) as cm:
+            next(self.alice.StreamMutations(chat_pb2.StreamMutationsRequest()))
+        self.assertEqual(cm.exception.code(), grpc.StatusCode.PERMISSION_DENIED)
+        with self.assertRaises(ValueError):
+            ChatServer(ConnectionSettings(replica_of=self.primary_address))
+
+
+def run_primary(port: int, data_path: str, ready, stop):
+    """Run a primary in its own process."""
+    server = ChatServer(ConnectionSettings(host="localhost", port=port, replication_log_size=100000,
+                                           server_data_path=data_path, cluster_secret=CLUSTER_SECRET))
+    grpc_server = server.start_server()
+    ready.set()
+    stop.wait()
+    grpc_server.stop(None)
+
+
+class TestReplicationLag(unittest.TestCase):
+    """A primary and a replica in separate processes, with clients sending messages to the primary."""
+    SENDERS = 4
+    MESSAGES = bench_scale(2000, 200)
+
+    def test_lag_under_load(self):
+        mp = multiprocessing.get_context("spawn")
+        port = free_ports(1)[0]
+        primary_address = f"localhost:{port}"
+        ready, stop = mp.Event(), mp.Event()
+        with tempfile.TemporaryDirectory() as data_dir:
+            primary = mp.Process(target=run_primary,
+                                 args=(port, os.path.join(data_dir, "server_data.json"), ready, stop))
+            primary.start()
+            try:
+                self.assertTrue(ready.wait(30))
+                with grpc.insecure_channel(primary_address) as channel:
+                    stub = chat_pb2_grpc.ChatServiceStub(channel)
+                    for i in range(self.SENDERS):
+                        stub.CreateAccount(chat_pb2.CreateAccountRequest(username=f"user{i}", password="pw"))
+
+                replica, replica_grpc = start_loopback_server(replica_of=primary_address,
+                                                                    cluster_secret=CLUSTER_SECRET)
+                self.assertTrue(wait_until(lambda: replica.replicator.applied_seq >= self.SENDERS))
+
+                def send(i):
+                    channel, stub = login(primary_address, f"user{i}")
+                    for n in range(self.MESSAGES):
+                        stub.SendMessage(chat_pb2.SendMessageRequest(
+                            receiver=f"user{(i + 1) % self.SENDERS}", content=f"message {n}"))
+                    channel.close()
+                senders = [threading.Thread(target=send, args=(i,)) for i in range(self.SENDERS)]
+                start = time.perf_counter()
+                for t in senders:
+                    t.start()
+                for t in senders:
+                    t.join()
+                elapsed = time.perf_counter() - start
+
+                # Account creations, then each message is delivered and kept for its sender
+                total = self.SENDERS + 2 * self.SENDERS * self.MESSAGES
+                self.assertTrue(wait_until(lambda: replica.replicator.applied_seq == total, timeout=30))
+                lags = list(replica.replicator.lags)
+
+                # Take over from the primary
+                stop.set()
+                primary.join(10)
+                start = time.perf_counter()
+                replica.promote()
+                with grpc.insecure_channel(f"localhost:{replica.port}") as channel:
+                    stub = chat_pb2_grpc.ChatServiceStub(channel)
+                    stub.Login(chat_pb2.LoginRequest(username="user0", password="pw"))
+                    stub.SendMessage(chat_pb2.SendMessageRequest(receiver="user1", content="after failover"))
+                failover = time.perf_counter() - start
+                replica_grpc.stop(None)
+            finally:
+                stop.set()
+                primary.join(10)
+
+        print()
+        print(format_table(
+            ["messages/s", "mean lag ms", "p99 lag ms", "max lag ms", "promote + first write ms"],
+            [[int(self.SENDERS * self.MESSAGES / elapsed), f"{sum(lags) / len(lags) * 1000:.2f}",
+              f"{percentile(lags, 99) * 1000:.2f}", f"{max(lags) * 1000:.2f}", f"{failover * 1000:.1f}"]]
+        ))
+        # Channels from one process can share a peer, so some senders may count as online and get messages as read
+        received = (replica.account_manager.get_number_of_unread_messages("user1")
+                    + replica.account_manager.get_number_of_read_messages("user1"))
+        self.assertEqual(received, self.MESSAGES + 1)
+        # Includes a PBKDF2 login, which is most of it
+        self.assertLess(failover, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
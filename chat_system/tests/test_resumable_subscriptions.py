@@ -0,0 +1,156 @@
+import threading
+import time
+import unittest
+
+import grpc
+
+from chat_system.common.config import ConnectionSettings
+from chat_system.common.user import Message
+from chat_system.proto import chat_pb2, chat_pb2_grpc
+from chat_system.server.server import ChatServer, ChatServicer
+from chat_system.tests.benchmark import bench_scale, format_table, start_loopback_server, time_ns
+from chat_system.tests.test_server import MockContext
+
+
+class TestResumeSubscription(unittest.TestCase):
+    def setUp(self):
+        self.server = ChatServer(ConnectionSettings())
+        self.servicer = ChatServicer(self.server)
+        self.alice = MockContext()
+        self.bob = MockContext()
+        self.bob.peer_value = "bob_peer"
+        for context, name in [(self.alice, "alice"), (self.bob, "bob")]:
+            self.servicer.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"), context)
+            self.servicer.Login(chat_pb2.LoginRequest(username=name, password="pw"), context)
+
+    def send(self, *contents):
+        for content in contents:
+            self.servicer.SendMessage(chat_pb2.SendMessageRequest(receiver="bob", content=content), self.alice)
+
+    def receive(self, stream, n):
+        return [next(stream).message.content for _ in range(n)]
+
+    def test_resumes_from_server_cursor(self):
+        stream = self.servicer.SubscribeToMessages(chat_pb2.SubscribeRequest(), self.bob)
+        self.send("0", "1", "2", "3", "4")
+        self.assertEqual(self.receive(stream, 3), ["0", "1", "2"])
+        # The stream dies with "2" on the wire, so it never reaches bob
+        stream.close()
+
+        stream = self.servicer.SubscribeToMessages(chat_pb2.SubscribeRequest(), self.bob)
+        # "2" is replayed, and "3" and "4" are only sent once although they're still in the queue too
+        self.assertEqual(self.receive(stream, 3), ["2", "3", "4"])
+        self.send("5")
+        self.assertEqual(self.receive(stream, 1), ["5"])
+
+    def test_resumes_from_last_seen_id(self):
+        stream = self.servicer.SubscribeToMessages(chat_pb2.SubscribeRequest(), self.bob)
+        self.send("0", "1", "2")
+        ids = [next(stream).message.id for _ in range(3)]
+        stream.close()
+
+        # The client says what it got, which trumps what the server thinks it delivered
+        stream = self.servicer.SubscribeToMessages(chat_pb2.SubscribeRequest(last_seen_id=ids[0]), self.bob)
+        self.assertEqual(self.receive(stream, 2), ["1", "2"])
+
+    def test_another_user_on_the_same_peer(self):
+        carol = MockContext()
+        carol.peer_value = "carol_peer"
+        self.servicer.CreateAccount(chat_pb2.CreateAccountRequest(username="carol", password="pw"), carol)
+        self.servicer.Login(chat_pb2.LoginRequest(username="carol", password="pw"), carol)
+        stream = self.servicer.SubscribeToMessages(chat_pb2.SubscribeRequest(), self.bob)
+        self.send("0", "1")
+        self.assertEqual(self.receive(stream, 2), ["0", "1"])
+        carol_stream = self.servicer.SubscribeToMessages(chat_pb2.SubscribeRequest(), carol)
+        self.servicer.SendMessage(chat_pb2.SendMessageRequest(receiver="carol", content="2"), self.alice)
+        self.assertEqual(self.receive(carol_stream, 1), ["2"])
+        carol_stream.close()
+        self.servicer.Logout(chat_pb2.LogoutRequest(), carol)
+
+        # Carol picks up from her own cursor, not from what bob saw, so "2" isn't sent again
+        self.servicer.Logout(chat_pb2.LogoutRequest(), self.bob)
+        self.servicer.Login(chat_pb2.LoginRequest(username="carol", password="pw"), self.bob)
+        self.servicer.SendMessage(chat_pb2.SendMessageRequest(receiver="carol", content="3"), self.alice)
+        self.assertEqual(self.receive(stream, 1), ["3"])
+
+    def test_replay_costs_what_was_missed(self):
+        user = self.server.account_manager.get_user("bob")
+        for i in range(500):
+            user.deliver_online(Message(i, "alice", str(i)))
+        self.assertEqual([m.id for m in user.get_notifications_after(497)], [498, 499])
+        self.assertEqual(user.get_notifications_after(499), [])
+        # Too old to be remembered: everything that is
+        self.assertEqual(len(user.get_notifications_after(-5)), 500)
+
+
+class TestKilledStreams(unittest.TestCase):
+    """Subscription streams cancelled over and over while messages keep arriving."""
+    MESSAGES = bench_scale(2000, 200)
+    KILL_EVERY = 7
+
+    def setUp(self):
+        self.chat_server, self.grpc_server = start_loopback_server()
+        address = f"localhost:{self.chat_server.port}"
+        # Separate connections, so that the two sessions have different peers
+        self.channels = [grpc.insecure_channel(address, options=[("grpc.use_local_subchannel_pool", 1)])
+                         for _ in range(2)]
+        self.alice, self.bob = [chat_pb2_grpc.ChatServiceStub(channel) for channel in self.channels]
+        for stub, name in [(self.alice, "alice"), (self.bob, "bob")]:
+            stub.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"))
+            stub.Login(chat_pb2.LoginRequest(username=name, password="pw"))
+
+    def tearDown(self):
+        for channel in self.channels:
+            channel.close()
+        self.grpc_server.stop(None)
+
+    def test_every_message_arrives_once(self):
+        def send():
+            for i in range(self.MESSAGES):
+                self.alice.SendMessage(chat_pb2.SendMessageRequest(receiver="bob", content=str(i)))
+        sender = threading.Thread(target=send)
+        sender.start()
+
+        received = []
+        reconnects = 0
+        deadline = time.monotonic() + 60
+        while len(received) < self.MESSAGES and time.monotonic() < deadline:
+            last_seen_id = int(received[-1][0]) if received else None
+            stream = self.bob.SubscribeToMessages(chat_pb2.SubscribeRequest(last_seen_id=last_seen_id))
+            for n, notification in enumerate(stream):
+                received.append((notification.message.id, notification.message.content))
+                if n + 1 == self.KILL_EVERY or len(received) == self.MESSAGES:
+                    break
+            stream.cancel()
+            reconnects += 1
+        sender.join()
+
+        self.assertEqual([content for _, content in received], [str(i) for i in range(self.MESSAGES)])
+        self.assertGreater(reconnects, self.MESSAGES // self.KILL_EVERY - 1)
+
+
+class TestResumeBenchmark(unittest.TestCase):
+    """Catching up a reconnecting subscriber, against reloading the whole read mailbox."""
+    MAILBOX_SIZES = [1000, bench_scale(100000, 10000)]
+    MISSED = 10
+
+    def test_resume_cost(self):
+        rows = []
+        for size in self.MAILBOX_SIZES:
+            server = ChatServer(ConnectionSettings())
+            server.account_manager.add_account("bob", b"hash", b"salt")
+            user = server.account_manager.get_user("bob")
+            for i in range(size):
+                user.deliver_online(Message(i, "alice", f"message {i}"))
+            last_seen_id = size - self.MISSED - 1
+
+            resume = time_ns(lambda: server.account_manager.get_notifications_after("bob", last_seen_id), repeat=100)
+            reload = time_ns(lambda: server.account_manager.get_read_messages("bob", 0, -1), repeat=10)
+            self.assertEqual(len(server.account_manager.get_notifications_after("bob", last_seen_id)), self.MISSED)
+            rows.append([size, self.MISSED, f"{resume / 1000:.1f}", f"{reload / 1000:.1f}"])
+        print()
+        print(format_table(["read messages", "missed", "resume us", "full reload us"], rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
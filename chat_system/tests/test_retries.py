@@ -0,0 +1,157 @@
+import asyncio
+import random
+import time
+import unittest
+from concurrent import futures
+from typing import Set
+
+import grpc
+
+from chat_system.client.async_client import AsyncChatClient, IDEMPOTENT_METHODS
+from chat_system.common.config import ConnectionSettings
+from chat_system.proto import chat_pb2_grpc
+from chat_system.server.server import ChatServer, ChatServicer
+from chat_system.tests.benchmark import FULL_BENCHMARK, format_table, percentile
+
+
+class FaultInjector(grpc.ServerInterceptor):
+    """Fails some of the calls to the given methods with UNAVAILABLE, and answers some of them late."""
+
+    def __init__(self, methods: Set[str], fail: float = 0.0, slow: float = 0.0, delay: float = 0.1, seed: int = 0):
+        self.methods = methods
+        self.fail = fail
+        self.slow = slow
+        self.delay = delay
+        self.rng = random.Random(seed)
+        self.stats = dict.fromkeys(["calls", "failed", "slowed"], 0)
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        method = handler_call_details.method.rsplit('/', 1)[-1]
+        if handler is None or handler.unary_unary is None or method not in self.methods:
+            return handler
+
+        behavior = handler.unary_unary
+        def faulty(request, context):
+            self.stats["calls"] += 1
+            roll = self.rng.random()
+            if roll < self.fail:
+                self.stats["failed"] += 1
+                context.abort(grpc.StatusCode.UNAVAILABLE, "Injected failure")
+            elif roll < self.fail + self.slow:
+                self.stats["slowed"] += 1
+                time.sleep(self.delay)
+            return behavior(request, context)
+
+        return grpc.unary_unary_rpc_method_handler(
+            faulty,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer
+        )
+
+
+class FaultyServerTestCase(unittest.TestCase):
+    CALLS = 500
+
+    def start(self, injector: FaultInjector):
+        self.injector = injector
+        self.chat_server = ChatServer(ConnectionSettings(host="localhost", port=0))
+        self.grpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=20), interceptors=[injector])
+        chat_pb2_grpc.add_ChatServiceServicer_to_server(ChatServicer(self.chat_server), self.grpc_server)
+        self.port = self.grpc_server.add_insecure_port("localhost:0")
+        self.grpc_server.start()
+        self.addCleanup(self.grpc_server.stop, None)
+
+    def run_calls(self, username: str, **settings):
+        """Make CALLS reads one after another. Returns their latencies in seconds, the failures and the client."""
+        async def calls():
+            client = AsyncChatClient(ConnectionSettings(host="localhost", port=self.port, **settings))
+            await client.connect()
+            await client.create_account(username, "pw")
+            await client.login(username, "pw")
+            latencies, failures = [], 0
+            try:
+                for _ in range(self.CALLS):
+                    start = time.perf_counter()
+                    try:
+                        await client.get_counts()
+                    except grpc.RpcError:
+                        failures += 1
+                    latencies.append(time.perf_counter() - start)
+            finally:
+                await client.close()
+            return latencies, failures, client
+        return asyncio.run(calls())
+
+
+class TestRetries(FaultyServerTestCase):
+    def test_unavailable_retried(self):
+        self.start(FaultInjector(set(IDEMPOTENT_METHODS), fail=0.2))
+        _, failures_without, _ = self.run_calls("alice", retry_attempts=1)
+        _, failures_with, _ = self.run_calls("bob", retry_attempts=3, retry_backoff=0.01, retry_max_backoff=0.05)
+        print()
+        print(f"{self.CALLS} count calls, each of 2 reads failing 20% of the time")
+        print(format_table(["attempts", "failed calls"], [[1, failures_without], [3, failures_with]]))
+        # Either read failing fails the call, about 36% of them without retries
+        self.assertGreater(failures_without, self.CALLS / 5)
+        # With three tries each read fails 0.8%, both about 1.6%
+        self.assertLess(failures_with, self.CALLS / 20)
+
+    def test_writes_not_retried(self):
+        self.start(FaultInjector({"SendMessage"}, fail=1.0))
+        async def send():
+            client = AsyncChatClient(ConnectionSettings(host="localhost", port=self.port, retry_attempts=5))
+            await client.connect()
+            await client.create_account("alice", "pw")
+            await client.login("alice", "pw")
+            try:
+                with self.assertRaises(grpc.RpcError):
+                    await client.send_message("alice", "hello")
+            finally:
+                await client.close()
+        asyncio.run(send())
+        self.assertEqual(self.injector.stats["calls"], 1)
+
+    def test_deadline(self):
+        self.start(FaultInjector({"ListUsers"}, slow=1.0, delay=1.0))
+        async def list_accounts():
+            client = AsyncChatClient(ConnectionSettings(host="localhost", port=self.port,
+                                                        rpc_timeouts={"ListUsers": 0.1}))
+            await client.connect()
+            start = time.perf_counter()
+            try:
+                with self.assertRaises(grpc.RpcError) as raised:
+                    await client.list_accounts("*", 0, 10)
+            finally:
+                await client.close()
+            return raised.exception, time.perf_counter() - start
+        error, elapsed = asyncio.run(list_accounts())
+        # The server answers after a second, so the call only fails if the deadline was sent
+        self.assertEqual(error.code(), grpc.StatusCode.DEADLINE_EXCEEDED)
+        if FULL_BENCHMARK:
+            self.assertLess(elapsed, 0.5)
+
+
+class TestHedging(FaultyServerTestCase):
+    def test_tail_latency(self):
+        self.start(FaultInjector(set(IDEMPOTENT_METHODS), slow=0.05, delay=0.1))
+        plain, _, _ = self.run_calls("alice")
+        hedged, failures, client = self.run_calls("bob", hedge_delay=0.01)
+        print()
+        print(f"{self.CALLS} count calls, each of 2 reads answered 100 ms late 5% of the time")
+        print(format_table(["hedge delay ms", "p50 ms", "p99 ms", "max ms", "reads", "hedged", "hedges won"], [
+            [0, f"{percentile(plain, 50) * 1000:.1f}", f"{percentile(plain, 99) * 1000:.1f}",
+             f"{max(plain) * 1000:.1f}", self.CALLS * 2, 0, 0],
+            [10, f"{percentile(hedged, 50) * 1000:.1f}", f"{percentile(hedged, 99) * 1000:.1f}",
+             f"{max(hedged) * 1000:.1f}", client.stats["calls"] - 2, client.stats["hedged"],
+             client.stats["hedges_won"]],
+        ]))
+        self.assertEqual(failures, 0)
+        self.assertGreater(client.stats["hedges_won"], 0)
+        self.assertLessEqual(client.stats["hedges_won"], client.stats["hedged"])
+        if FULL_BENCHMARK:
+            self.assertLess(percentile(hedged, 99), percentile(plain, 99))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+import itertools
+import random
+import time
+import unittest
+
+import grpc
+
+from chat_system.common.config import ConnectionSettings
+from chat_system.common.search import InvertedIndex, TokenTable, scan, tokenize
+from chat_system.common.user import MailboxLimits, Message, OverflowPolicy, User
+from chat_system.proto import chat_pb2
+from chat_system.server.server import ChatServer, ChatServicer
+from chat_system.tests.benchmark import bench_scale, format_table, percentile
+from chat_system.tests.test_server import MockContext
+
+
+def search_all(index, query: str, page_size: int):
+    """Every match, fetched page by page."""
+    results, cursor = [], 0
+    while True:
+        page, cursor = index.search(query, page_size, cursor)
+        results.extend(page)
+        if cursor == 0:
+            return results
+
+
+class TestInvertedIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = InvertedIndex(TokenTable())
+        self.index.add([
+            Message(0, "alice", "Lunch at noon?"),
+            Message(1, "bob", "lunch is at one, not noon"),
+            Message(2, "alice", "Meeting moved to noon"),
+            Message(3, "carol", "no LUNCH today"),
+        ])
+
+    def ids(self, query: str, limit: int = -1, cursor: int = 0):
+        messages, _ = self.index.search(query, limit, cursor)
+        return [m.id for m in messages]
+
+    def test_all_words_match_newest_first(self):
+        self.assertEqual(tokenize("Lunch at noon?"), ["lunch", "at", "noon"])
+        self.assertEqual(self.ids("lunch"), [3, 1, 0])
+        self.assertEqual(self.ids("NOON lunch"), [1, 0])
+        self.assertEqual(self.ids("lunch dinner"), [])
+        self.assertEqual(self.ids(""), [])
+
+    def test_pages(self):
+        self.assertEqual([m.id for m in search_all(self.index, "noon", 1)], [2, 1, 0])
+        messages, cursor = self.index.search("noon", 2, 0)
+        self.assertEqual(self.ids("noon", 2, cursor), [0])
+
+    def test_remove_and_compact(self):
+        self.index.remove([1, 3])
+        self.assertEqual(self.ids("lunch"), [0])
+        self.index.remove([0])
+        # Three of four removed, so the stale postings have been dropped
+        self.assertEqual(self.index.stale, 0)
+        self.assertNotIn(self.index.tokens.lookup("lunch"), self.index.postings)
+        self.assertEqual(self.ids("noon"), [2])
+        self.index.add([Message(4, "bob", "noon it is")])
+        self.assertEqual(self.ids("noon"), [4, 2])
+
+
+class TestScan(unittest.TestCase):
+    def test_same_as_index(self):
+        messages = [Message(i, "alice", f"message {i} {'even' if i % 2 == 0 else 'odd'}") for i in range(10)]
+        index = InvertedIndex(TokenTable())
+        index.add(messages)
+
+        class Scanner:
+            def search(self, query, limit, cursor):
+                return scan(messages, query, limit, cursor)
+
+        for query in ["even", "odd message", "message 3", "missing", ""]:
+            for page_size in [-1, 1, 3]:
+                self.assertEqual(search_all(Scanner(), query, page_size), search_all(index, query, page_size))
+
+
+class TestUserIndex(unittest.TestCase):
+    def test_follows_read_mailbox(self):
+        user = User("bob", [Message(0, "alice", "old news")], [Message(1, "alice", "read news")],
+                    MailboxLimits(max_read_messages=3, overflow_policy=OverflowPolicy.DROP_OLDEST),
+                    index=InvertedIndex(TokenTable()))
+        self.assertEqual([m.id for m in user.search_messages("news", -1, 0)[0]], [1])
+        user.pop_unread_messages(-1)
+        user.deliver_online(Message(2, "alice", "fresh news"))
+        self.assertEqual([m.id for m in user.search_messages("news", -1, 0)[0]], [2, 0, 1])
+        user.delete_messages([0])
+        self.assertEqual([m.id for m in user.search_messages("news", -1, 0)[0]], [2, 1])
+        # Dropping the oldest read messages takes them out of the index too
+        for i in range(3, 5):
+            user.add_read_message(Message(i, "alice", "more news"))
+        self.assertEqual([m.id for m in user.search_messages("news", -1, 0)[0]], [4, 3, 2])
+
+
+class TestSearchMessagesRPC(unittest.TestCase):
+    def make_servicer(self, **settings):
+        server = ChatServer(ConnectionSettings(**settings))
+        servicer = ChatServicer(server)
+        context = MockContext()
+        for name in ["alice", "bob"]:
+            servicer.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"), context)
+        server.account_manager.deliver_message("bob", Message(0, "alice", "see you at the station"), online=True)
+        server.account_manager.deliver_message("bob", Message(1, "alice", "train is late"), online=False)
+        servicer.Login(chat_pb2.LoginRequest(username="bob", password="pw"), context)
+        return servicer, context
+
+    def test_search(self):
+        for search_index in ["inverted", "scan"]:
+            with self.subTest(search_index):
+                servicer, context = self.make_servicer(search_index=search_index)
+                request = chat_pb2.SearchMessagesRequest(query="station", limit=10)
+                response = servicer.SearchMessages(request, context)
+                self.assertEqual([m.content for m in response.messages], ["see you at the station"])
+                self.assertEqual(response.next_cursor, 0)
+                # Unread messages are found once they've been read
+                request = chat_pb2.SearchMessagesRequest(query="train")
+                self.assertEqual(len(servicer.SearchMessages(request, context).messages), 0)
+                servicer.PopUnreadMessages(chat_pb2.PopUnreadMessagesRequest(num_messages=-1), context)
+                request = chat_pb2.SearchMessagesRequest(query="train", limit=-1, compact=True)
+                self.assertEqual(list(servicer.SearchMessages(request, context).batch.contents), ["train is late"])
+
+    def test_turned_off(self):
+        servicer, context = self.make_servicer(search_index="none")
+        with self.assertRaises(grpc.RpcError):
+            servicer.SearchMessages(chat_pb2.SearchMessagesRequest(query="station"), context)
+        self.assertEqual(context.code, grpc.StatusCode.FAILED_PRECONDITION)
+
+
+class TestSearchBenchmark(unittest.TestCase):
+    """Index size and query latency for one user's mailbox, against scanning the mailbox."""
+    MESSAGES = bench_scale(1000000, 50000)
+    VOCABULARY = 20000
+    WORDS_PER_MESSAGE = 8
+    QUERIES = 200
+    LIMIT = 20
+
+    def test_index_size_and_latency(self):
+        rng = random.Random(0)
+        # Word frequencies fall off like natural language
+        vocabulary = [f"w{i}" for i in range(self.VOCABULARY)]
+        cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(self.VOCABULARY)))
+        contents = [" ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=self.WORDS_PER_MESSAGE))
+                    for _ in range(self.MESSAGES)]
+        messages = [Message(i, "alice", content) for i, content in enumerate(contents)]
+
+        index = InvertedIndex(TokenTable())
+        start = time.perf_counter()
+        for message in messages:
+            index.add([message])
+        build = time.perf_counter() - start
+        content_bytes = sum(len(c) for c in contents)
+
+        queries = {
+            "common word": lambda: vocabulary[rng.randrange(10)],
+            "rare word": lambda: vocabulary[rng.randrange(1000, self.VOCABULARY)],
+            "two words": lambda: f"{vocabulary[rng.randrange(10, 100)]} {vocabulary[rng.randrange(10, 100)]}",
+        }
+        rows = []
+        for name, make_query in queries.items():
+            latencies = []
+            for _ in range(self.QUERIES):
+                query = make_query()
+                start = time.perf_counter_ns()
+                index.search(query, self.LIMIT, 0)
+                latencies.append(time.perf_counter_ns() - start)
+            # Scanning the whole mailbox, the way a client has to today
+            query = make_query()
+            words = set(query.split())
+            start = time.perf_counter_ns()
+            matches = [m for m in reversed(messages) if words <= set(tokenize(m.content))][:self.LIMIT]
+            scan = time.perf_counter_ns() - start
+            self.assertEqual(matches, index.search(query, self.LIMIT, 0)[0])
+            rows.append([name, f"{percentile(latencies, 50) / 1000:.1f}", f"{percentile(latencies, 99) / 1000:.1f}",
+                         f"{scan / 1000:.0f}"])
+            self.assertLess(percentile(latencies, 50), 1000000)
+
+        print()
+        print(f"{self.MESSAGES} messages, {len(index.tokens)} distinct words, built in {build:.1f} s, "
+              f"index {index.memory_usage() / 2**20:.1f} MiB for {content_bytes / 2**20:.1f} MiB of text")
+        print(format_table(["query", "p50 us", "p99 us", "scan us"], rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
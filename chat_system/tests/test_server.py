@@ -2,6 +2,7 @@ import unittest
 import grpc
 
 from chat_system.common.config import ConnectionSettings
+from chat_system.common.message_batch import messages_from_response
 from chat_system.server.server import ChatServer, ChatServicer
 from chat_system.proto import chat_pb2
 
@@ -9,11 +10,17 @@ from chat_system.proto import chat_pb2
 class MockContext:
     def __init__(self):
         self.peer_value = "test_peer"
+        self.compression = None
+        self.code = None
 
     def peer(self):
         return self.peer_value
 
+    def set_compression(self, compression):
+        self.compression = compression
+
     def abort(self, code, message):
+        self.code = code
         raise grpc.RpcError(f"Error {code}: {message}")
 
     def is_active(self):
@@ -304,6 +311,48 @@ class TestServer(unittest.TestCase):
         message_ids = [msg.id for msg in read_response.messages]
         self.assertNotIn(message_id, message_ids)
 
+    def test_compact_messages(self):
+        """Test that compact responses decode to the same messages."""
+        for username in ["alice", "bob", "receiver"]:
+            self.servicer.CreateAccount(
+                chat_pb2.CreateAccountRequest(username=username, password="password"),
+                self.context
+            )
+
+        # Alternate senders so the sender table has more than one entry
+        for i in range(4):
+            sender_context = MockContext()
+            sender_context.peer_value = ["alice", "bob"][i % 2]
+            self.servicer.Login(
+                chat_pb2.LoginRequest(username=sender_context.peer_value, password="password"),
+                sender_context
+            )
+            self.servicer.SendMessage(
+                chat_pb2.SendMessageRequest(receiver="receiver", content=f"Message {i}"),
+                sender_context
+            )
+
+        self.servicer.Login(
+            chat_pb2.LoginRequest(username="receiver", password="password"),
+            self.context
+        )
+        pop_response = self.servicer.PopUnreadMessages(
+            chat_pb2.PopUnreadMessagesRequest(num_messages=-1, compact=True), self.context
+        )
+        self.assertEqual(len(pop_response.messages), 0)
+        self.assertEqual(list(pop_response.batch.senders), ["alice", "bob"])
+        popped = messages_from_response(pop_response)
+        self.assertEqual([m.sender for m in popped], ["alice", "bob", "alice", "bob"])
+        self.assertEqual([m.content for m in popped], [f"Message {i}" for i in range(4)])
+
+        # Both encodings of the read mailbox agree
+        read_request = chat_pb2.GetReadMessagesRequest(offset=0, num_messages=-1)
+        plain = self.servicer.GetReadMessages(read_request, self.context)
+        read_request.compact = True
+        compact = self.servicer.GetReadMessages(read_request, self.context)
+        self.assertEqual(messages_from_response(plain), messages_from_response(compact))
+        self.assertEqual(messages_from_response(compact), popped)
+
     def test_delete_account(self):
         """Test account deletion."""
         # Create an account
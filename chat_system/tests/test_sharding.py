@@ -0,0 +1,229 @@
+import multiprocessing
+import random
+import time
+import unittest
+from collections import Counter
+from typing import List
+
+import grpc
+
+from chat_system.common.config import ConnectionSettings
+from chat_system.common.sharding import HashRing
+from chat_system.proto import chat_pb2, chat_pb2_grpc
+from chat_system.server.server import CLUSTER_SECRET_KEY, ChatServer
+from chat_system.tests.benchmark import FULL_BENCHMARK, bench_scale, format_table, free_ports, start_loopback_server
+
+
+class TestHashRing(unittest.TestCase):
+    USERS = [f"user{i}" for i in range(10000)]
+
+    def test_balanced(self):
+        ring = HashRing([f"localhost:{9000 + i}" for i in range(4)])
+        counts = Counter(ring.shard_index(user) for user in self.USERS)
+        for count in counts.values():
+            self.assertLess(abs(count - len(self.USERS) / 4), len(self.USERS) / 4 * 0.3)
+
+    def test_adding_shard_moves_few_users(self):
+        shards = [f"localhost:{9000 + i}" for i in range(4)]
+        before = HashRing(shards)
+        after = HashRing(shards + ["localhost:9004"])
+        moved = [user for user in self.USERS if before.shard_for(user) != after.shard_for(user)]
+        # Only the new shard takes users, and roughly its fair share of them
+        self.assertTrue(all(after.shard_for(user) == "localhost:9004" for user in moved))
+        self.assertLess(len(moved), len(self.USERS) * 0.3)
+
+
+CLUSTER_SECRET = "test secret"
+
+
+def start_shards(n: int):
+    addresses = [f"localhost:{port}" for port in free_ports(n)]
+    servers = []
+    for i, address in enumerate(addresses):
+        chat_server = ChatServer(ConnectionSettings(
+            host="localhost", port=int(address.split(":")[1]), shards=addresses, shard_id=i,
+            cluster_secret=CLUSTER_SECRET
+        ))
+        servers.append((chat_server, chat_server.start_server()))
+    return addresses, servers
+
+
+class TestShardedServers(unittest.TestCase):
+    def setUp(self):
+        self.addresses, self.servers = start_shards(2)
+        self.ring = HashRing(self.addresses)
+        self.channels = {address: grpc.insecure_channel(address) for address in self.addresses}
+        self.stubs = {address: chat_pb2_grpc.ChatServiceStub(c) for address, c in self.channels.items()}
+
+        # Pick users so that each shard owns some
+        users = [f"user{i}" for i in range(20)]
+        self.alice = next(u for u in users if self.ring.shard_index(u) == 0)
+        self.bob = next(u for u in users if self.ring.shard_index(u) == 1)
+        for user in [self.alice, self.bob]:
+            response = self.stub_for(user).CreateAccount(chat_pb2.CreateAccountRequest(username=user, password="pw"))
+            self.assertFalse(response.HasField('error'))
+
+    def tearDown(self):
+        for channel in self.channels.values():
+            channel.close()
+        for _, grpc_server in self.servers:
+            grpc_server.stop(None)
+
+    def stub_for(self, username: str):
+        return self.stubs[self.ring.shard_for(username)]
+
+    def test_accounts_on_owning_shard(self):
+        self.assertIsNotNone(self.servers[0][0].account_manager.get_user(self.alice))
+        self.assertIsNone(self.servers[1][0].account_manager.get_user(self.alice))
+        # Account requests sent to the wrong shard are refused rather than splitting a user's data
+        response = self.stub_for(self.bob).CreateAccount(chat_pb2.CreateAccountRequest(username=self.alice, password="pw"))
+        self.assertTrue(response.HasField('error'))
+
+    def test_cross_shard_message(self):
+        alice = self.stub_for(self.alice)
+        alice.Login(chat_pb2.LoginRequest(username=self.alice, password="pw"))
+        for i in range(3):
+            alice.SendMessage(chat_pb2.SendMessageRequest(receiver=self.bob, content=f"hi {i}"))
+
+        bob = self.servers[1][0].account_manager.get_user(self.bob)
+        self.assertEqual([m.content for m in bob.message_queue], ["hi 0", "hi 1", "hi 2"])
+        self.assertEqual([m.sender for m in bob.message_queue], [self.alice] * 3)
+        # Ids come from the sender's shard, interleaved with the other shard's ids
+        self.assertTrue(all(m.id % 2 == 0 for m in bob.message_queue))
+        self.assertEqual(len({m.id for m in bob.message_queue}), 3)
+
+        with self.assertRaises(grpc.RpcError) as cm:
+            alice.SendMessage(chat_pb2.SendMessageRequest(receiver="nobody", content="hi"))
+        self.assertEqual(cm.exception.code(), grpc.StatusCode.NOT_FOUND)
+
+    def test_deliver_only_from_shards(self):
+        bob_shard = self.stub_for(self.bob)
+        def deliver(message_id: int, sender: str, receiver: str, secret: str = None):
+            request = chat_pb2.DeliverMessageRequest(
+                message=chat_pb2.Message(id=message_id, sender=sender, content="forged"), receiver=receiver)
+            metadata = ((CLUSTER_SECRET_KEY, secret),) if secret is not None else None
+            with self.assertRaises(grpc.RpcError) as cm:
+                bob_shard.DeliverMessage(request, metadata=metadata)
+            return cm.exception.code()
+
+        # A client, which doesn't know the secret
+        self.assertEqual(deliver(0, self.alice, self.bob), grpc.StatusCode.PERMISSION_DENIED)
+        self.assertEqual(deliver(0, self.alice, self.bob, "guess"), grpc.StatusCode.PERMISSION_DENIED)
+        # Messages alice's shard couldn't have sent
+        self.assertEqual(deliver(0, self.bob, self.bob, CLUSTER_SECRET), grpc.StatusCode.INVALID_ARGUMENT)
+        self.assertEqual(deliver(0, self.alice, self.alice, CLUSTER_SECRET), grpc.StatusCode.INVALID_ARGUMENT)
+        self.assertEqual(deliver(1, self.alice, self.bob, CLUSTER_SECRET), grpc.StatusCode.INVALID_ARGUMENT)
+        self.assertEqual(len(self.servers[1][0].account_manager.get_user(self.bob).message_queue), 0)
+
+    def test_deliver_refused_without_sharding(self):
+        chat_server, grpc_server = start_loopback_server(cluster_secret=CLUSTER_SECRET)
+        chat_server.account_manager.create_account("bob", "pw")
+        try:
+            with grpc.insecure_channel(f"localhost:{chat_server.port}") as channel:
+                with self.assertRaises(grpc.RpcError) as cm:
+                    chat_pb2_grpc.ChatServiceStub(channel).DeliverMessage(
+                        chat_pb2.DeliverMessageRequest(message=chat_pb2.Message(id=0, sender="alice", content="hi"),
+                                                       receiver="bob"),
+                        metadata=((CLUSTER_SECRET_KEY, CLUSTER_SECRET),))
+            self.assertEqual(cm.exception.code(), grpc.StatusCode.FAILED_PRECONDITION)
+            self.assertEqual(chat_server.account_manager.get_number_of_unread_messages("bob"), 0)
+        finally:
+            grpc_server.stop(None)
+
+    def test_secret_required(self):
+        with self.assertRaises(ValueError):
+            ChatServer(ConnectionSettings(shards=self.addresses))
+
+    def test_list_users_gathers_all_shards(self):
+        for stub in self.stubs.values():
+            response = stub.ListUsers(chat_pb2.ListUsersRequest(pattern="*", offset=0, limit=-1))
+            self.assertEqual(list(response.usernames), sorted([self.alice, self.bob]))
+            response = stub.ListUsers(chat_pb2.ListUsersRequest(pattern="*", offset=1, limit=1))
+            self.assertEqual(list(response.usernames), [max(self.alice, self.bob)])
+        response = self.stubs[self.addresses[0]].ListUsers(
+            chat_pb2.ListUsersRequest(pattern="*", offset=0, limit=-1, local_only=True))
+        self.assertEqual(list(response.usernames), [self.alice])
+
+
+def run_shard(addresses: List[str], shard_id: int, ready, stop):
+    """Run one server in its own process until told to stop."""
+    port = int(addresses[shard_id].split(":")[1])
+    shards = addresses if len(addresses) > 1 else []
+    chat_server = ChatServer(ConnectionSettings(host="localhost", port=port, shards=shards, shard_id=shard_id,
+                                                cluster_secret=CLUSTER_SECRET))
+    grpc_server = chat_server.start_server()
+    ready.set()
+    stop.wait()
+    grpc_server.stop(None)
+
+
+def run_sender(addresses: List[str], username: str, recipients: List[str], count: int, start, results):
+    """Log in on the user's shard and send messages to random recipients as fast as possible."""
+    ring = HashRing(addresses)
+    with grpc.insecure_channel(ring.shard_for(username)) as channel:
+        stub = chat_pb2_grpc.ChatServiceStub(channel)
+        stub.Login(chat_pb2.LoginRequest(username=username, password="pw"))
+        rng = random.Random(username)
+        start.wait()
+        sent = 0
+        for i in range(count):
+            stub.SendMessage(chat_pb2.SendMessageRequest(receiver=rng.choice(recipients), content=f"message {i}"))
+            sent += 1
+        results.put(sent)
+
+
+class TestShardingBenchmark(unittest.TestCase):
+    """Message throughput of one server process against users sharded over several processes."""
+    SHARD_COUNTS = [1, 2, 4] if FULL_BENCHMARK else [1, 2]
+    SENDERS = bench_scale(8, 2)
+    MESSAGES = bench_scale(2000, 50)
+    USERS = 16
+
+    def run_deployment(self, num_shards: int) -> float:
+        mp = multiprocessing.get_context("spawn")  # gRPC doesn't survive a fork once it has been used
+        addresses = [f"localhost:{port}" for port in free_ports(num_shards)]
+        stop = mp.Event()
+        readies = [mp.Event() for _ in addresses]
+        shards = [mp.Process(target=run_shard, args=(addresses, i, readies[i], stop)) for i in range(num_shards)]
+        for p in shards:
+            p.start()
+        try:
+            for ready in readies:
+                self.assertTrue(ready.wait(30))
+            ring = HashRing(addresses)
+            users = [f"user{i}" for i in range(self.USERS)]
+            for user in users:
+                with grpc.insecure_channel(ring.shard_for(user)) as channel:
+                    chat_pb2_grpc.ChatServiceStub(channel).CreateAccount(
+                        chat_pb2.CreateAccountRequest(username=user, password="pw"))
+
+            start = mp.Event()
+            results = mp.Queue()
+            senders = [mp.Process(target=run_sender, args=(addresses, users[i], users, self.MESSAGES, start, results))
+                       for i in range(self.SENDERS)]
+            for p in senders:
+                p.start()
+            time.sleep(1)  # Let every sender connect and log in
+            begin = time.perf_counter()
+            start.set()
+            sent = sum(results.get(timeout=300) for _ in senders)
+            elapsed = time.perf_counter() - begin
+            for p in senders:
+                p.join()
+            self.assertEqual(sent, self.SENDERS * self.MESSAGES)
+            return sent / elapsed
+        finally:
+            stop.set()
+            for p in shards:
+                p.join(10)
+
+    def test_throughput(self):
+        rows = []
+        for num_shards in self.SHARD_COUNTS:
+            rows.append([num_shards, self.SENDERS, int(self.run_deployment(num_shards))])
+        print()
+        print(format_table(["shards", "senders", "messages/s"], rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
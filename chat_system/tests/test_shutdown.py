@@ -0,0 +1,112 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+import grpc
+
+from chat_system.common.config import ConnectionSettings
+from chat_system.proto import chat_pb2, chat_pb2_grpc
+from chat_system.server.server import ChatServer
+from chat_system.tests.benchmark import format_table, free_ports, start_loopback_server
+from chat_system.tests.test_replication import wait_until
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestGracefulShutdown(unittest.TestCase):
+    SENDERS = 4
+    GRACE = 5
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "server_data.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_no_accepted_message_lost(self):
+        chat_server, grpc_server = start_loopback_server(server_data_path=self.path, shutdown_grace=self.GRACE)
+        address = f"localhost:{chat_server.port}"
+        names = ["bob"] + [f"sender{i}" for i in range(self.SENDERS)]
+        channels = {name: grpc.insecure_channel(address, options=[("grpc.use_local_subchannel_pool", 1)])
+                    for name in names}
+        stubs = {name: chat_pb2_grpc.ChatServiceStub(channel) for name, channel in channels.items()}
+        for name, stub in stubs.items():
+            stub.CreateAccount(chat_pb2.CreateAccountRequest(username=name, password="pw"))
+            stub.Login(chat_pb2.LoginRequest(username=name, password="pw"))
+
+        received = []
+        def subscribe():
+            try:
+                for notification in stubs["bob"].SubscribeToMessages(chat_pb2.SubscribeRequest()):
+                    if not notification.heartbeat:
+                        received.append(notification.message.content)
+            except grpc.RpcError:
+                pass
+        subscriber = threading.Thread(target=subscribe)
+        subscriber.start()
+        self.assertTrue(wait_until(lambda: chat_server.get_session_stats()["open_streams"] == 1))
+
+        accepted = []
+        def send(name):
+            i = 0
+            try:
+                while True:
+                    content = f"{name} {i}"
+                    stubs[name].SendMessage(chat_pb2.SendMessageRequest(receiver="bob", content=content))
+                    accepted.append(content)
+                    i += 1
+            except grpc.RpcError:
+                pass  # Refused once the server stopped taking calls
+        senders = [threading.Thread(target=send, args=(f"sender{i}",)) for i in range(self.SENDERS)]
+        for sender in senders:
+            sender.start()
+        self.assertTrue(wait_until(lambda: len(accepted) >= 200))
+
+        timings = chat_server.shutdown(grpc_server)
+        for thread in senders + [subscriber]:
+            thread.join(10)
+        for channel in channels.values():
+            channel.close()
+
+        loaded = ChatServer(ConnectionSettings(server_data_path=self.path))
+        loaded.load_state()
+        bob = loaded.account_manager.get_user("bob")
+        saved = [m.content for m in bob.read_mailbox + bob.get_unread_messages()]
+        self.assertEqual(sorted(saved), sorted(accepted))
+        # bob was subscribed throughout, so every message was delivered to him as read, and the stream flushed
+        self.assertEqual(sorted(received), sorted(saved))
+        self.assertLess(timings["total_ms"], self.GRACE * 1000)
+        print()
+        print(f"{len(accepted)} messages accepted from {self.SENDERS} senders")
+        print(format_table(["step", "ms"], [[step, f"{ms:.1f}"] for step, ms in timings.items()]))
+
+    def test_sigterm(self):
+        port = free_ports(1)[0]
+        config_path = os.path.join(self.directory.name, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({"host": "localhost", "port": port, "server_data_path": self.path}, f)
+        process = subprocess.Popen([sys.executable, "-m", "chat_system.server", config_path], cwd=REPO_ROOT,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            with grpc.insecure_channel(f"localhost:{port}") as channel:
+                grpc.channel_ready_future(channel).result(timeout=30)
+                stub = chat_pb2_grpc.ChatServiceStub(channel)
+                stub.CreateAccount(chat_pb2.CreateAccountRequest(username="alice", password="pw"))
+            process.send_signal(signal.SIGTERM)
+            self.assertEqual(process.wait(timeout=30), 0)
+        finally:
+            if process.poll() is None:
+                process.kill()
+        loaded = ChatServer(ConnectionSettings(server_data_path=self.path))
+        loaded.load_state()
+        self.assertEqual(list(loaded.account_manager.accounts), ["alice"])
+
+
+if __name__ == '__main__':
+    unittest.main()
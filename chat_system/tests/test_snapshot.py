@@ -0,0 +1,167 @@
+import json
+import os
+import tempfile
+import unittest
+
+from chat_system.common.config import ConnectionSettings
+from chat_system.common.user import Message
+from chat_system.server.account_manager import AccountManager
+from chat_system.server.server import ChatServer
+from chat_system.server.snapshot import (SnapshotError, convert_json_state, decode_snapshot, encode_snapshot,
+                                         paused_gc)
+from chat_system.tests.benchmark import bench_scale, format_table, time_ns
+
+
+def make_account_manager() -> AccountManager:
+    am = AccountManager()
+    for name in ["alice", "bob", "zoë", "nobody"]:
+        am.add_account(name, os.urandom(32), os.urandom(16))
+    am.deliver_message("bob", Message(0, "alice", "hi bob ✓"), online=True)
+    am.record_sent_message("bob", Message(0, "alice", "hi bob ✓"))
+    am.deliver_message("bob", Message(1, "zoë", "with a \0 in it"), online=False)
+    am.deliver_message("alice", Message(2, "bob", ""), online=False)
+    am.record_sent_message("alice", Message(2, "bob", ""))
+    am.create_channel("general", "alice")
+    am.join_channel("general", "zoë")
+    am.post_channel_message("general", Message(3, "alice", "hello everyone"))
+    am.read_channel_messages("general", "zoë", 1)
+    am.create_channel("empty", "bob")
+    return am
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_round_trip(self):
+        am = make_account_manager()
+        loaded = AccountManager()
+        self.assertEqual(decode_snapshot(encode_snapshot(am, 4), loaded), 4)
+        self.assertEqual(loaded.get_state(), am.get_state())
+        self.assertEqual(loaded.get_channel_state(), am.get_channel_state())
+        self.assertEqual(loaded.list_channels("zoë"), am.list_channels("zoë"))
+        self.assertEqual(loaded.get_conversation("bob", "alice", 0, -1), am.get_conversation("bob", "alice", 0, -1))
+
+    def test_empty(self):
+        loaded = make_account_manager()
+        self.assertEqual(decode_snapshot(encode_snapshot(AccountManager(), 0), loaded), 0)
+        self.assertEqual(loaded.accounts, {})
+        self.assertEqual(loaded.channels, {})
+
+    def test_corruption_detected(self):
+        data = encode_snapshot(make_account_manager(), 4)
+        for bad in [data[:-1], data[:len(data) // 2], data[:-10] + bytes([data[-10] ^ 1]) + data[-9:],
+                    b"CHATSNAP" + bytes([2]) + data[9:]]:
+            with self.assertRaises(SnapshotError):
+                decode_snapshot(bad, AccountManager())
+
+    def test_smaller_than_json(self):
+        am = AccountManager()
+        for u in range(100):
+            am.add_account(f"user{u}", os.urandom(32), os.urandom(16))
+            for i in range(10):
+                am.deliver_message(f"user{u}", Message(u * 10 + i, f"user{i}", f"message {i}"), online=i % 2 == 0)
+        state = {"account_manager": am.get_state(), "channels": am.get_channel_state(), "next_message_id": 1000}
+        self.assertLess(len(encode_snapshot(am, 1000)), len(json.dumps(state)) / 1.5)
+
+
+class TestServerState(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.json_path = os.path.join(self.directory.name, "server_data.json")
+        self.am = make_account_manager()
+        with open(self.json_path, "w") as f:
+            json.dump({"account_manager": self.am.get_state(), "channels": self.am.get_channel_state(),
+                       "next_message_id": 4}, f)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def load(self, path: str) -> ChatServer:
+        server = ChatServer(ConnectionSettings(server_data_path=path))
+        server.load_state()
+        return server
+
+    def test_converts_json_in_place(self):
+        with open(self.json_path, "rb") as f:
+            saved = f.read()
+        server = self.load(self.json_path)
+        self.assertEqual(server.next_message_id, 4)
+        self.assertEqual(server.account_manager.get_state(), self.am.get_state())
+        with open(self.json_path, "rb") as f:
+            self.assertTrue(f.read().startswith(b"CHATSNAP"))
+        # The JSON is kept
+        with open(self.json_path + ".bak", "rb") as f:
+            self.assertEqual(f.read(), saved)
+        self.assertEqual(self.load(self.json_path).account_manager.get_state(), self.am.get_state())
+
+    def test_converts_json_at_old_default(self):
+        # Saved to server_data.json by an older version, the default is server_data.snapshot now
+        snapshot_path = os.path.join(self.directory.name, "server_data.snapshot")
+        server = self.load(snapshot_path)
+        self.assertEqual(server.next_message_id, 4)
+        self.assertEqual(server.account_manager.get_state(), self.am.get_state())
+        with open(snapshot_path, "rb") as f:
+            self.assertTrue(f.read().startswith(b"CHATSNAP"))
+        self.assertTrue(os.path.exists(self.json_path))
+        self.assertEqual(ConnectionSettings().server_data_path, "server_data.snapshot")
+
+    def test_nothing_saved(self):
+        server = self.load(os.path.join(self.directory.name, "other.snapshot"))
+        self.assertEqual(server.account_manager.accounts, {})
+
+    def test_convert(self):
+        snapshot_path = os.path.join(self.directory.name, "server_data.snapshot")
+        convert_json_state(self.json_path, snapshot_path)
+        server = self.load(snapshot_path)
+        self.assertEqual(server.next_message_id, 4)
+        self.assertEqual(server.account_manager.get_state(), self.am.get_state())
+        self.assertEqual(server.account_manager.get_channel_state(), self.am.get_channel_state())
+
+
+class TestSnapshotBenchmark(unittest.TestCase):
+    """Saving and loading the whole server state, as a snapshot against as JSON."""
+    USERS = bench_scale(100000, 10000)
+    MESSAGES = 10  # Per user, half of them read
+
+    def test_against_json(self):
+        am = AccountManager()
+        for u in range(self.USERS):
+            am.add_account(f"user{u}", os.urandom(32), os.urandom(16))
+            for i in range(self.MESSAGES):
+                am.deliver_message(f"user{u}", Message(u * self.MESSAGES + i, f"user{(u + i) % self.USERS}",
+                                                       f"message number {i}, with some more text"), i % 2 == 0)
+        next_message_id = self.USERS * self.MESSAGES
+
+        def save_json():
+            return json.dumps({"account_manager": am.get_state(), "channels": am.get_channel_state(),
+                               "next_message_id": next_message_id})
+
+        def load_json():
+            # The same as ChatServer.load_state did before snapshots
+            state = json.loads(saved_json)
+            loaded = AccountManager()
+            loaded.load_state(state["account_manager"])
+            loaded.load_channel_state(state["channels"])
+            return loaded
+
+        def load_snapshot():
+            loaded = AccountManager()
+            # The same as ChatServer.load_state does
+            with paused_gc(freeze=True):
+                decode_snapshot(saved_snapshot, loaded)
+            return loaded
+
+        saved_json = save_json()
+        saved_snapshot = encode_snapshot(am, next_message_id)
+        self.assertEqual(load_snapshot().get_state(), am.get_state())
+        rows = []
+        for name, save, load, size in [("JSON", save_json, load_json, len(saved_json)),
+                                       ("snapshot", lambda: encode_snapshot(am, next_message_id), load_snapshot,
+                                        len(saved_snapshot))]:
+            rows.append([name, f"{size / 2**20:.1f}", f"{time_ns(save) / 1e6:.0f}", f"{time_ns(load) / 1e6:.0f}"])
+        print()
+        print(f"{self.USERS} users with {self.MESSAGES} messages each")
+        print(format_table(["format", "size MiB", "save ms", "load ms"], rows))
+        self.assertLess(float(rows[1][1]), float(rows[0][1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
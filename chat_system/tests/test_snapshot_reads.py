@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+import unittest
+
+from chat_system.common.user import Message
+from chat_system.server.account_manager import AccountManager
+from chat_system.tests.benchmark import bench_scale, format_table, percentile
+
+
+def make_account_manager(num_users: int, num_messages: int) -> AccountManager:
+    account_manager = AccountManager()
+    for i in range(num_users):
+        # Skip the password hashing, it isn't what's being measured
+        account_manager.add_account(f"user{i}", b"hash", b"salt")
+        for j in range(num_messages):
+            account_manager.deliver_message(f"user{i}", Message(j, "sender", f"message {j}"), online=False)
+        account_manager.pop_unread_messages(f"user{i}", -1)
+    return account_manager
+
+
+class TestSnapshotReads(unittest.TestCase):
+    def test_readers_see_consistent_views(self):
+        """Readers never lock, yet never see a directory or mailbox in the middle of a change."""
+        account_manager = make_account_manager(10, 100)
+        stop = threading.Event()
+        errors = []
+
+        def writer():
+            next_id = 100
+            while not stop.is_set():
+                account_manager.add_account("temp", b"hash", b"salt")
+                account_manager.delete_account("temp")
+                # Add a message at the end and delete the oldest one, so the mailbox is always 100 increasing ids
+                with account_manager.mutation_lock:
+                    user = account_manager.get_user("user0")
+                    oldest = user.read_mailbox[0].id
+                    user.add_read_message(Message(next_id, "sender", "new"))
+                    user.delete_messages([oldest])
+                next_id += 1
+
+        def reader():
+            try:
+                for _ in range(2000):
+                    self.assertIn("user0", account_manager.list_usernames("user*"))
+                    ids = [m.id for m in account_manager.get_read_messages("user0", 0, -1)]
+                    self.assertIn(len(ids), (100, 101))
+                    self.assertEqual(ids, sorted(set(ids)))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads[1:]:
+            t.join()
+        stop.set()
+        threads[0].join()
+        self.assertEqual(errors, [])
+
+
+class TestSnapshotReadBenchmark(unittest.TestCase):
+    """Mixed workloads, with readers taking the writers' lock against reading snapshots without one."""
+    USERS = 100
+    MESSAGES = 100
+    THREADS = 4
+    OPS = bench_scale(50000, 5000)
+    READ_RATIOS = [0.9, 0.5]
+
+    def run_workload(self, read_ratio: float, locked_reads: bool):
+        account_manager = make_account_manager(self.USERS, self.MESSAGES)
+        lock = account_manager.mutation_lock
+        read_latencies = []
+        next_id = [self.MESSAGES]
+
+        def read(rng):
+            username = f"user{rng.randrange(self.USERS)}"
+            op = rng.randrange(3)
+            if op == 0:
+                account_manager.get_read_messages(username, 0, 20)
+            elif op == 1:
+                account_manager.get_number_of_read_messages(username)
+                account_manager.get_number_of_unread_messages(username)
+            else:
+                account_manager.list_usernames("user1*")
+
+        def worker(seed):
+            rng = random.Random(seed)
+            latencies = []
+            for _ in range(self.OPS // self.THREADS):
+                if rng.random() < read_ratio:
+                    start = time.perf_counter_ns()
+                    if locked_reads:
+                        with lock:
+                            read(rng)
+                    else:
+                        read(rng)
+                    latencies.append(time.perf_counter_ns() - start)
+                else:
+                    username = f"user{rng.randrange(self.USERS)}"
+                    with lock:
+                        next_id[0] += 1
+                        message_id = next_id[0]
+                    if rng.random() < 0.5:
+                        account_manager.deliver_message(username, Message(message_id, "sender", "hi"), online=True)
+                    else:
+                        account_manager.delete_messages(username, [message_id - self.USERS])
+            read_latencies.extend(latencies)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.THREADS)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        return self.OPS / elapsed, percentile(read_latencies, 50) / 1000, percentile(read_latencies, 99) / 1000
+
+    def test_mixed_workloads(self):
+        rows = []
+        for ratio in self.READ_RATIOS:
+            for locked in [True, False]:
+                throughput, p50, p99 = self.run_workload(ratio, locked)
+                rows.append([f"{int(ratio * 100)}/{int(round((1 - ratio) * 100))}",
+                             "locked" if locked else "snapshot", int(throughput), f"{p50:.1f}", f"{p99:.1f}"])
+        print()
+        print(format_table(["read/write", "reads", "ops/s", "read p50 us", "read p99 us"], rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,244 @@
+import gc
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import unittest
+
+from chat_system.common.config import ConnectionSettings
+from chat_system.common.message_batch import add_messages, messages_from_response
+from chat_system.common.protocol.custom_protocol import encode_message
+from chat_system.common.search import InvertedIndex, TokenTable
+from chat_system.common.segment import ColdMessage, SegmentStore
+from chat_system.common.user import MailboxLimits, Message, OverflowPolicy, User
+from chat_system.proto import chat_pb2
+from chat_system.server.server import ChatServer, ChatServicer
+from chat_system.tests.benchmark import bench_scale, format_table, percentile, time_ns
+from chat_system.tests.test_server import MockContext
+
+
+class TestSegmentStore(unittest.TestCase):
+    def test_records(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SegmentStore(directory, "bob", segment_size=64)
+            messages = [Message(i, "alice", f"message {i} ✓") for i in range(10)]
+            cold = store.append(messages[:5]) + store.append(messages[5:])
+            # Small segments, so the messages are spread over several files
+            self.assertGreater(len(store.segments), 1)
+            self.assertEqual([(m.id, m.sender, m.content) for m in cold],
+                             [(m.id, m.sender, m.content) for m in messages])
+            # The custom protocol's message encoding, with a length in front
+            segment = cold[3].segment
+            with open(segment.path, "rb") as f:
+                f.seek(cold[3].offset)
+                record = f.read(4 + len(encode_message(messages[3])))
+            self.assertEqual(record[4:], encode_message(messages[3]))
+
+            store.clear()
+            self.assertEqual(os.listdir(directory), [])
+
+
+class TestTieredUser(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_user(self, **limits):
+        limits = MailboxLimits(hot_read_messages=4, segment_dir=self.directory.name, **limits)
+        return User("bob", [], [], limits, index=InvertedIndex(TokenTable()))
+
+    def contents(self, messages):
+        return [m.content for m in messages]
+
+    def test_transparent_across_tiers(self):
+        user = self.make_user()
+        for i in range(20):
+            user.add_read_message(Message(i, "alice" if i % 2 else "carol", f"message {i}"))
+        self.assertGreaterEqual(user.cold_count, 15)
+        self.assertLessEqual(len(user.read_mailbox) - user.cold_count, 5)
+        self.assertIsInstance(user.read_mailbox[0], ColdMessage)
+        self.assertEqual(user.get_number_of_read_messages(), 20)
+        # Pages that are on disk, in memory and both
+        self.assertEqual(self.contents(user.get_read_messages(15, 3)), ["message 2", "message 3", "message 4"])
+        self.assertEqual(self.contents(user.get_read_messages(0, 2)), ["message 18", "message 19"])
+        self.assertEqual(self.contents(user.get_read_messages(-1, -1)), [f"message {i}" for i in range(20)])
+        self.assertEqual([m.id for m in user.search_messages("message 3", -1, 0)[0]], [3])
+        self.assertEqual(self.contents(user.get_conversation("alice", 9, 1)), ["message 1"])
+
+        user.delete_messages([1, 2, 19])
+        self.assertEqual(user.get_number_of_read_messages(), 17)
+        self.assertEqual(self.contents(user.get_read_messages(15, 2)), ["message 0", "message 3"])
+        self.assertEqual(self.contents(user.get_conversation("alice", 0, -1))[:2], ["message 3", "message 5"])
+        self.assertEqual(user.search_messages("message 2", -1, 0)[0], [])
+
+        user.discard_spill()
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_dropping_oldest(self):
+        user = self.make_user(max_read_messages=10, overflow_policy=OverflowPolicy.DROP_OLDEST)
+        for i in range(30):
+            user.add_read_message(Message(i, "alice", f"message {i}"))
+        self.assertEqual(self.contents(user.get_read_messages(0, -1)), [f"message {i}" for i in range(20, 30)])
+        self.assertEqual(user.cold_count, sum(isinstance(m, ColdMessage) for m in user.read_mailbox))
+
+    def test_saved_and_loaded(self):
+        user = self.make_user()
+        user.add_message(Message(0, "alice", "unread"))
+        for i in range(1, 10):
+            user.add_read_message(Message(i, "alice", f"message {i}"))
+        user.pop_unread_messages(-1)
+        saved = [(m.id, m.sender, m.content) for m in user.read_mailbox]
+        self.assertEqual(saved[-1], (0, "alice", "unread"))
+        # Saved state is loaded with everything in memory, then moved out again
+        loaded = User("bob", [], [Message(*m) for m in saved], user.limits)
+        self.assertGreater(loaded.cold_count, 0)
+        self.assertEqual([(m.id, m.sender, m.content) for m in loaded.get_read_messages(0, -1)], saved)
+
+
+class TestColdResponses(unittest.TestCase):
+    def test_pages_read_from_segments(self):
+        with tempfile.TemporaryDirectory() as directory:
+            server = ChatServer(ConnectionSettings(hot_read_messages=5, segment_dir=directory))
+            servicer = ChatServicer(server)
+            context = MockContext()
+            server.account_manager.add_account("bob", b"hash", b"salt")
+            expected = [Message(i, "zoë" if i % 3 else "alice", f"message {i} ✓") for i in range(50)]
+            for message in expected:
+                server.account_manager.deliver_message("bob", message, online=True)
+            with server.sessions_lock:
+                server.client_sessions[context.peer()] = "bob"
+            self.assertGreater(server.account_manager.get_user("bob").cold_count, 40)
+
+            for compact in [False, True]:
+                request = chat_pb2.GetReadMessagesRequest(offset=0, num_messages=-1, compact=compact)
+                response = servicer.GetReadMessages(request, context)
+                self.assertEqual(messages_from_response(response), expected)
+            response = servicer.SearchMessages(chat_pb2.SearchMessagesRequest(query="message 7", limit=-1), context)
+            self.assertEqual([m.sender for m in response.messages], ["zoë"])
+
+
+def _rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _measure_mailbox(messages: int, hot_read_messages: int, segment_dir: str, page: int, pages: int, results):
+    """Fill a read mailbox in a fresh process, then report its RSS and the latency of reading old pages."""
+    limits = MailboxLimits(hot_read_messages=hot_read_messages, segment_dir=segment_dir)
+    gc.collect()
+    before = _rss()
+    user = User("bob", [], [], limits)
+    for i in range(messages):
+        user.add_read_message(Message(i, f"user{i % 50}", f"message number {i}, with some more text to read"))
+    gc.collect()
+    rss = _rss() - before
+
+    rng = random.Random(0)
+    latencies = []
+    for _ in range(pages):
+        # Pages from the older 90% of the mailbox, which is on disk when it's tiered
+        offset = rng.randrange(messages // 10, messages - page)
+        start = time.perf_counter_ns()
+        response = chat_pb2.GetReadMessagesResponse()
+        add_messages(response.messages, user.get_read_messages(offset, page))
+        latencies.append(time.perf_counter_ns() - start)
+        assert len(response.messages) == page
+    disk = user.cold.size() if user.cold else 0
+    results.put((rss, disk, percentile(latencies, 50), percentile(latencies, 99)))
+    user.discard_spill()
+
+
+class TestTieredBenchmark(unittest.TestCase):
+    """Memory and old-page latency of one user's read mailbox, all in memory against tiered."""
+    MESSAGES = bench_scale(10000000, 200000)
+    HOT = 1000
+    PAGE = 50
+    PAGES = 200
+
+    def test_rss_and_cold_reads(self):
+        mp = multiprocessing.get_context("spawn")
+        rows = []
+        with tempfile.TemporaryDirectory() as directory:
+            for name, hot in [("in memory", 0), (f"newest {self.HOT} in memory", self.HOT)]:
+                # Each in its own process, so that one's freed memory doesn't hide the other's
+                results = mp.Queue()
+                process = mp.Process(target=_measure_mailbox,
+                                     args=(self.MESSAGES, hot, directory, self.PAGE, self.PAGES, results))
+                process.start()
+                rss, disk, p50, p99 = results.get(timeout=3600)
+                process.join()
+                rows.append([name, f"{rss / 2**20:.1f}", f"{rss / self.MESSAGES:.0f}", f"{disk / 2**20:.1f}",
+                             f"{p50 / 1000:.0f}", f"{p99 / 1000:.0f}"])
+        print()
+        print(f"{self.MESSAGES} read messages, pages of {self.PAGE} from the oldest 90%")
+        print(format_table(["storage", "RSS MiB", "bytes/message", "on disk MiB", "page p50 us", "page p99 us"],
+                           rows))
+        self.assertLess(float(rows[1][1]), float(rows[0][1]))
+
+
+class TestHistoryReadBenchmark(unittest.TestCase):
+    """Pages of history from segment files, against from the state file written by save_state."""
+    USERS = 20
+    MESSAGES = bench_scale(50000, 5000)  # Per user
+    PAGE = 50
+
+    def test_against_state_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = ConnectionSettings(server_data_path=os.path.join(directory, "server_data.json"),
+                                        hot_read_messages=self.PAGE, segment_dir=os.path.join(directory, "segments"))
+            server = ChatServer(config)
+            for u in range(self.USERS):
+                server.account_manager.add_account(f"user{u}", b"hash", b"salt")
+                for i in range(self.MESSAGES):
+                    server.account_manager.deliver_message(
+                        f"user{u}", Message(i, f"user{i % 50}", f"message number {i}, with some more text"), True)
+            server.save_state()
+            servicer = ChatServicer(server)
+            context = MockContext()
+            with server.sessions_lock:
+                server.client_sessions[context.peer()] = "user7"
+            offset = self.MESSAGES // 2
+            request = chat_pb2.GetReadMessagesRequest(offset=offset, num_messages=self.PAGE)
+
+            def from_segments():
+                return servicer.GetReadMessages(request, context)
+
+            def from_state_file():
+                # The only way into the saved history is to load all of it
+                loaded = ChatServer(ConnectionSettings(server_data_path=config.server_data_path))
+                loaded.load_state()
+                return ChatServicer(loaded)._messages_response(
+                    chat_pb2.GetReadMessagesResponse,
+                    loaded.account_manager.get_read_messages("user7", offset, self.PAGE), False)
+
+            def decode_each_field():
+                # What reading the records would cost through ColdMessage's attributes
+                return chat_pb2.GetReadMessagesResponse(messages=[
+                    chat_pb2.Message(id=m.id, sender=m.sender, content=m.content)
+                    for m in server.account_manager.get_read_messages("user7", offset, self.PAGE)
+                ])
+
+            self.assertEqual(from_segments(), from_state_file())
+            self.assertEqual(from_segments(), decode_each_field())
+            segments = time_ns(from_segments, 200)
+            decoded = time_ns(decode_each_field, 200)
+            saved_state = time_ns(from_state_file, 3)
+            rows = [
+                ["segment files, raw UTF-8", f"{segments / 1000:.0f}", "1.0"],
+                ["segment files, decoded to str", f"{decoded / 1000:.0f}", f"{decoded / segments:.1f}"],
+                ["state file", f"{saved_state / 1000:.0f}", f"{saved_state / segments:.0f}"],
+            ]
+            state_size = os.path.getsize(config.server_data_path)
+            print()
+            print(f"A page of {self.PAGE} from the middle of {self.MESSAGES} read messages, {self.USERS} users, "
+                  f"{state_size / 2**20:.1f} MiB state file")
+            print(format_table(["history from", "page us", "x"], rows))
+            for user in server.account_manager.accounts.values():
+                user.discard_spill()
+
+
+if __name__ == '__main__':
+    unittest.main()